@@ -0,0 +1,614 @@
+import functools
+import importlib
+import json
+import logging
+import os
+import socket
+import time
+import traceback
+from contextlib import contextmanager
+
+from werkzeug.utils import secure_filename
+
+import metrics
+from audio import get_profile
+from batch_translate import MAX_BATCH_TEXTS
+from job_queue import QueueFull, STATUS_DONE, STATUS_FAILED, STAGE_FAILED
+from metrics import span
+from pipeline import transcription_result
+from result_cache import result_cache
+from storage import storage, StorageFull, QuotaExceeded
+from transcription import get_transcriber
+from transcript_store import transcript_store, QueryError
+from translate import parse_languages
+from uploads import UploadError, OffsetMismatch, media_result_key
+
+# The HTTP API's logic, shared by server.py (Flask) and asgi.py (Starlette).
+#
+# Functions here take plain values (the query string or JSON body as a
+# mapping, ids, the app's job queues) and return (body, status, headers) for
+# the app to send as JSON, or raise ApiError for an error response. The apps
+# only read requests, move bytes and turn these into their own responses.
+# Everything is synchronous; asgi.py calls whatever touches SQLite or the
+# disk on a worker thread.
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Pipe uploads straight into FFmpeg instead of saving them first (overridable with ?stream=)
+STREAM_UPLOADS = os.getenv('STREAM_UPLOADS', '0')
+# Idle seconds between keepalive comments on /transcribe/stream
+SSE_KEEPALIVE_SECONDS = 15
+
+MAIL_QUEUE_MAXSIZE = int(os.getenv('MAIL_QUEUE_MAXSIZE', '100'))
+MAIL_QUEUE_DB = os.getenv('MAIL_QUEUE_DB', os.path.join(os.getcwd(), 'mail.sqlite3'))
+
+# Summaries longer than this (or any request with a transcript appendix) are laid out
+# page by page into a spooled file instead of being rendered whole in memory
+PDF_STREAM_THRESHOLD_CHARS = int(os.getenv('PDF_STREAM_THRESHOLD_CHARS', '50000'))
+
+# Imported on first use rather than at startup (together they take about a second to load).
+# preload_modules() imports them up front, e.g. once in a preloading gunicorn master.
+LAZY_MODULES = ['openai', 'pdf_generator', 'pdf_stream', 'sendgrid.helpers.mail']
+
+TRANSCRIPTION_STAGES = ['extract', 'vad', 'transcribe', 'summarize', 'translate']
+# Upload fields a transcription job carries in its payload
+JOB_PAYLOAD_KEYS = ('input_path', 'audio_path', 'filename', 'profile', 'languages', 'backend', 'media_key',
+                    'content_sha256', 'work_id', 'scratch_dir')
+
+
+class ApiError(Exception):
+    """An error to answer with: status code, JSON body and extra headers"""
+
+    def __init__(self, status, body, headers=None):
+        super().__init__(body.get('error'))
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+
+def bad_request(message):
+    return ApiError(400, {"error": message})
+
+
+def not_found(message):
+    return ApiError(404, {"error": message})
+
+
+def internal_error(step, error, include_traceback=True):
+    """500 for an unexpected exception, logged with its traceback"""
+    error_traceback = traceback.format_exc()
+    logger.error(f"Error: {str(error)}")
+    logger.error(f"Traceback: {error_traceback}")
+    body = {"error": str(error)}
+    if step:
+        body["step"] = step
+    if include_traceback:
+        body["traceback"] = error_traceback
+    return ApiError(500, body)
+
+
+def storage_error(error):
+    """413 for an upload over the per-job quota, 503 while temporary storage is full"""
+    logger.warning(str(error))
+    if isinstance(error, QuotaExceeded):
+        return ApiError(413, {"error": str(error), "step": "storage"})
+    return ApiError(503, {"error": str(error), "step": "storage"}, {'Retry-After': '60'})
+
+
+def upload_error(error):
+    body = {"error": str(error), "step": "upload"}
+    headers = None
+    if isinstance(error, OffsetMismatch):
+        # Tell the client where to resume from
+        body["offset"] = error.offset
+        headers = {'Upload-Offset': str(error.offset)}
+    return ApiError(error.status, body, headers)
+
+
+def preload_modules():
+    """Import LAZY_MODULES now, so the first requests that need them do not wait"""
+    start_time = time.time()
+    for name in LAZY_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning(f"Could not preload {name}: {str(e)}")
+    logger.info(f"Preloaded {len(LAZY_MODULES)} modules in {(time.time() - start_time):.2f}s")
+
+
+@functools.lru_cache(maxsize=None)
+def get_local_ip():
+    """Get the local IP address of the machine (looked up once; the UDP connect sends no packets but is not free)"""
+    try:
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.connect(("8.8.8.8", 80))
+        local_ip = s.getsockname()[0]
+        s.close()
+        return local_ip
+    except Exception:
+        return "127.0.0.1"
+
+
+def format_sse(event, data):
+    """Encode one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def int_arg(args, name, default):
+    """Integer query parameter, or default when it is missing or not a number (like Flask's type=int)"""
+    try:
+        return int(args[name])
+    except (KeyError, TypeError, ValueError):
+        return default
+
+
+def server_status(**fields):
+    """Body of /test"""
+    start_time = time.time()
+    return dict({
+        "status": "ok",
+        "message": "Server is running",
+        "local_ip": get_local_ip(),
+        "metrics": metrics.registry.snapshot(),
+    }, **fields, response_time_ms=int((time.time() - start_time) * 1000)), 200, None
+
+
+def readiness(jobs, mail_jobs):
+    """/readyz: 503 until the background workers run, and while the job queue or the disk is full"""
+    # Every check is in-process or a local disk stat, never a network call
+    checks = {
+        "job_workers": jobs.alive(),
+        "mail_workers": mail_jobs.alive(),
+        "job_queue_has_room": not jobs.full(),
+        "disk_has_room": storage.disk_has_room(),
+    }
+    ready = all(checks.values())
+    return {"status": "ready" if ready else "not ready", "checks": checks}, 200 if ready else 503, None
+
+
+def cache_stats():
+    from pdf_generator import pdf_cache_stats
+    return dict(result_cache.stats(), pdf=pdf_cache_stats()), 200, None
+
+
+def upload_options(args):
+    """Profile, backend and audio file extension of a /transcribe request; 400 for an unknown profile or backend"""
+    profile = args.get('profile') or None
+    backend = args.get('backend') or None
+    try:
+        extension = get_profile(profile)['extension']
+        get_transcriber(backend)
+    except ValueError as e:
+        raise bad_request(str(e))
+    return profile, backend, extension
+
+
+def upload_languages(args, form):
+    try:
+        return parse_languages(args.get('languages', form.get('languages')))
+    except ValueError as e:
+        raise bad_request(str(e))
+
+
+def admit_upload(content_length):
+    """Reserve space for an upload's work directory; 413 or 503 when there is none"""
+    try:
+        # The upload and everything derived from it live in one work directory
+        return storage.admit(int(content_length) if content_length else None)
+    except (StorageFull, QuotaExceeded) as e:
+        raise storage_error(e)
+
+
+def saved_upload(work, filename, profile, languages, extension):
+    """Paths for an upload about to be saved whole, and the upload record for it"""
+    logger.info(f"Received file: {filename}")
+    # Save file with a secure filename in the upload's own work directory
+    input_path = work.file(secure_filename(filename) or 'upload')
+    return {"input_path": input_path, "audio_path": work.file(f"audio{extension}", scratch=True),
+            "filename": filename, "profile": profile, "languages": languages, "extract_ms": None,
+            "work_id": work.id, "scratch_dir": work.scratch}
+
+
+def streamed_upload(work, filename, profile, languages, audio_path, extract_ms):
+    """The upload record for a body already piped through FFmpeg into audio_path"""
+    logger.info(f"Streamed {filename} into {audio_path} in {extract_ms / 1000:.2f}s")
+    metrics.STAGE_SECONDS.observe(extract_ms / 1000, stage='extract', status='ok')
+    return {"input_path": None, "audio_path": audio_path, "filename": filename,
+            "profile": profile, "languages": languages, "extract_ms": extract_ms,
+            "work_id": work.id, "scratch_dir": work.scratch}
+
+
+def remove_upload_files(upload):
+    """Delete an upload's work directory and give back its reserved space"""
+    # Jobs queued before work directories existed are left to the storage sweeper
+    if upload.get('work_id'):
+        storage.release(upload['work_id'])
+
+
+def queue_transcription(jobs, upload, **fields):
+    """Submit a received upload as a transcription job: 202 with its URLs, or 503 if the queue is full"""
+    stages = list(TRANSCRIPTION_STAGES)
+    if upload['extract_ms'] is not None:
+        stages[0] = {'name': 'extract', 'status': 'done', 'duration_ms': upload['extract_ms']}
+
+    try:
+        job = jobs.submit(
+            'transcribe',
+            dict({key: upload.get(key) for key in JOB_PAYLOAD_KEYS}, request_id=metrics.get_request_id()),
+            stages=stages
+        )
+    except QueueFull as e:
+        remove_upload_files(upload)
+        logger.warning(str(e))
+        raise ApiError(503, {"error": str(e), "step": "queue"}, {'Retry-After': '30'})
+
+    return dict({
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "result_url": f"/jobs/{job.id}/result"
+    }, **fields), 202, {'Location': f"/jobs/{job.id}"}
+
+
+@contextmanager
+def job_stage(job, name, work=None):
+    """Track a stage on the job and record it as a span in the stage metrics, then check the job's disk quota"""
+    with job.stage(name) as stage, span(name, stage=name, job_id=job.id):
+        yield stage
+        if work is not None:
+            work.check()
+
+
+def transcription_job_context(job):
+    """The pipeline context for a queued transcription job, and its work directory"""
+    # Worker threads are reused; tag this job's spans with the request that queued it
+    metrics.set_request_id(job.payload.get('request_id') or job.id)
+    ctx = {key: job.payload.get(key) for key in ('input_path', 'audio_path', 'profile', 'languages', 'backend',
+                                                 'work_id', 'scratch_dir')}
+    ctx['label'] = job.id
+    work = storage.get(ctx['work_id']) if ctx['work_id'] else None
+    return ctx, work
+
+
+def transcription_job_result(job, ctx, start_time):
+    """Cache and store what a transcription job produced, and return the job's result"""
+    result = transcription_result(ctx)
+    if job.payload.get('media_key') and not result['transcription']['fell_back']:
+        # Finalizing another upload of the same file with the same options returns this instead
+        result_cache.set('media', job.payload['media_key'], result)
+    transcript_id = transcript_store.add(result, title=job.payload.get('filename'), source='transcribe',
+                                         content_sha256=job.payload.get('content_sha256'),
+                                         profile=ctx['profile'])
+    return dict(
+        result,
+        transcript_id=transcript_id,
+        processing_time_ms=int((time.time() - start_time) * 1000),
+        queue_time_ms=int((start_time - job.created_at) * 1000)
+    )
+
+
+def finish_transcription_job(job, ctx):
+    """Clean up a transcription job's files whether or not processing succeeded"""
+    remove_upload_files(ctx)
+    logger.info(f"[{job.id}] Files cleaned up")
+
+
+def email_job_result(recipients, batches):
+    delivered = sum(batch['recipients'] for batch in batches if batch['status'] == 'sent')
+    return {
+        "recipients": len(recipients),
+        "delivered": delivered,
+        "failed": len(recipients) - delivered,
+        "batches": batches
+    }
+
+
+class StreamingRun:
+    """
+    Progress of one /transcribe/stream pipeline run, reported through emit(event, data).
+
+    Emits stage start/finish events with timings, transcript pieces as chunks
+    finish, summary tokens as the model produces them, translations of each
+    summary section as they complete, and a final done (or error) event. The
+    app runs TRANSCRIPTION on ctx with stage_events as its stage context, then
+    calls store() and done(), or failed(); emit(None, None) marks the end.
+    """
+
+    def __init__(self, upload, emit):
+        self.upload = upload
+        self.emit = emit
+        self.start_time = time.time()
+        self.stage = None
+        self.ctx = dict(
+            upload,
+            label='stream',
+            timings_ms={},
+            on_text=lambda text: emit('transcript', {"text": text}),
+            on_delta=lambda delta: emit('summary', {"delta": delta}),
+            on_translation_section=lambda language, index, text: emit(
+                'translation_section', {"language": language, "section": index, "text": text}
+            )
+        )
+        if not upload['input_path']:
+            # Extracted while the upload arrived
+            self.ctx['timings_ms']['extract'] = upload['extract_ms']
+            emit('stage', {"stage": "extract", "status": "done", "duration_ms": upload['extract_ms'],
+                           "elapsed_ms": self.elapsed_ms()})
+
+    def elapsed_ms(self):
+        return int((time.time() - self.start_time) * 1000)
+
+    @contextmanager
+    def stage_events(self, name):
+        self.stage = name
+        self.emit('stage', {"stage": name, "status": "started", "elapsed_ms": self.elapsed_ms()})
+        stage_start = time.time()
+        with span(name, stage=name):
+            yield
+        self.emit('stage', {"stage": name, "status": "done",
+                            "duration_ms": int((time.time() - stage_start) * 1000),
+                            "elapsed_ms": self.elapsed_ms()})
+
+    def store(self):
+        """Save the finished run to the transcript store; returns (result, transcript_id)"""
+        result = transcription_result(self.ctx)
+        return result, transcript_store.add(result, title=self.upload['filename'], source='transcribe/stream',
+                                            profile=self.upload['profile'])
+
+    def done(self, result, transcript_id):
+        for language, text in result['translations'].items():
+            self.emit('translation', {"language": language, "text": text})
+        self.emit('done', dict(result, transcript_id=transcript_id, timings_ms=self.ctx['timings_ms'],
+                               processing_time_ms=self.elapsed_ms()))
+
+    def failed(self, error):
+        logger.error(f"Error during streaming processing: {str(error)}")
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        self.emit('error', {"error": str(error), "step": self.stage or "processing",
+                            "timings_ms": self.ctx['timings_ms']})
+
+
+def upload_reply(upload, status=200, **headers):
+    return upload.to_dict(), status, dict(headers, **{'Upload-Offset': str(upload.offset)})
+
+
+def create_upload(uploads, data):
+    """Start a resumable upload of a file of the given size; its chunks are PUT to upload_url"""
+    if not data or 'size' not in data:
+        raise bad_request("Missing size")
+    try:
+        storage.ensure_room(data['size'] if isinstance(data['size'], int) else None)
+        upload = uploads.create(data.get('filename'), data['size'], data.get('sha256'))
+    except UploadError as e:
+        raise upload_error(e)
+    except (StorageFull, QuotaExceeded) as e:
+        raise storage_error(e)
+    return upload_reply(upload, 201, Location=f"/uploads/{upload.id}")
+
+
+def upload_status(uploads, upload_id):
+    """How much of the upload has arrived, i.e. where to resume"""
+    try:
+        return upload_reply(uploads.get(upload_id))
+    except UploadError as e:
+        raise upload_error(e)
+
+
+def chunk_offset(headers):
+    try:
+        return int(headers.get('Upload-Offset', ''))
+    except ValueError:
+        raise bad_request("Missing or invalid Upload-Offset header")
+
+
+def delete_upload(uploads, upload_id):
+    try:
+        uploads.get(upload_id)
+    except UploadError as e:
+        raise upload_error(e)
+    uploads.delete(upload_id)
+
+
+def finish_upload(uploads, upload_id, data, args):
+    """
+    Close a complete upload for /uploads/<id>/finalize, which processes it
+    like /transcribe. If a file with the same content was already processed
+    with the same profile, languages and backend, returns (None, reply) with
+    its result (200) and no job is needed. Otherwise moves the file into a
+    work directory and returns (upload, None) for queue_finished_upload().
+    """
+    data = data or {}
+    profile = data.get('profile') or args.get('profile') or None
+    backend = data.get('backend') or args.get('backend') or None
+    try:
+        extension = get_profile(profile)['extension']
+        transcriber = get_transcriber(backend)
+        languages = parse_languages(data.get('languages', args.get('languages')))
+        upload = uploads.finish(upload_id)
+    except UploadError as e:
+        raise upload_error(e)
+    except ValueError as e:
+        raise bad_request(str(e))
+
+    try:
+        media_key = media_result_key(upload.content_sha256, profile, languages, transcriber.name)
+        result = result_cache.get('media', media_key)
+        if result is not None:
+            uploads.delete(upload_id)
+            metrics.UPLOADS_FINALIZED.inc(outcome='duplicate')
+            logger.info(f"Upload {upload_id} ({upload.filename}) matches an already processed file")
+            return None, ({"status": STATUS_DONE, "duplicate": True, "content_sha256": upload.content_sha256,
+                           "result": result}, 200, None)
+
+        # The spooled file already counts against the quota; moving it needs no new reservation
+        work = storage.admit(0)
+        input_path = work.file(secure_filename(upload.filename) or 'upload')
+        try:
+            uploads.claim(upload_id, input_path)
+        except BaseException:
+            work.release()
+            raise
+        metrics.MEDIA_BYTES.observe(upload.size)
+        metrics.UPLOADS_FINALIZED.inc(outcome='queued')
+        logger.info(f"Upload {upload_id} complete; saved {upload.filename} to {input_path}")
+        return {
+            "input_path": input_path, "audio_path": work.file(f"audio{extension}", scratch=True),
+            "filename": upload.filename, "profile": profile, "languages": languages, "backend": backend,
+            "extract_ms": None, "media_key": media_key, "content_sha256": upload.content_sha256,
+            "work_id": work.id, "scratch_dir": work.scratch
+        }, None
+
+    except UploadError as e:
+        raise upload_error(e)
+    except (StorageFull, QuotaExceeded) as e:
+        raise storage_error(e)
+    except Exception as e:
+        raise internal_error('upload', e)
+
+
+def queue_finished_upload(jobs, upload):
+    """Queue an upload returned by finish_upload(): 202 like /transcribe, or 503 if the queue is full"""
+    return queue_transcription(jobs, upload, duplicate=False, content_sha256=upload['content_sha256'])
+
+
+def job_status(jobs, job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        raise not_found("Job not found")
+    data = job.to_dict()
+    data["queue_depth"] = jobs.depth()
+    return data, 200, None
+
+
+def job_result(jobs, job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        raise not_found("Job not found")
+    if job.status == STATUS_DONE:
+        return job.result, 200, None
+    if job.status == STATUS_FAILED:
+        failed = [s['name'] for s in job.stages if s['status'] == STAGE_FAILED]
+        return {"error": job.error, "step": failed[0] if failed else "processing"}, 500, None
+    # Not finished yet; tell the client to keep polling
+    return job.to_dict(), 202, {'Retry-After': '2'}
+
+
+def list_transcripts(args):
+    """Stored transcripts, newest first; pass next_cursor back as cursor for the next page"""
+    try:
+        items, next_cursor = transcript_store.list(limit=int_arg(args, 'limit', 20), cursor=args.get('cursor'))
+    except ValueError:
+        raise bad_request("Invalid cursor")
+    return {"transcripts": items, "next_cursor": next_cursor}, 200, None
+
+
+def search_transcripts(args):
+    """Ranked full-text search over stored transcripts, summaries and translations"""
+    query = args.get('q', '')
+    offset = int_arg(args, 'offset', 0)
+    try:
+        found = transcript_store.search(query, limit=int_arg(args, 'limit', 10), offset=offset)
+    except QueryError as e:
+        raise bad_request(str(e))
+    return dict(found, query=query, offset=offset), 200, None
+
+
+def get_transcript(transcript_id):
+    transcript = transcript_store.get(transcript_id)
+    if transcript is None:
+        raise not_found("Transcript not found")
+    return transcript, 200, None
+
+
+def delete_transcript(transcript_id):
+    if not transcript_store.delete(transcript_id):
+        raise not_found("Transcript not found")
+    return {"deleted": True, "transcript_id": transcript_id}, 200, None
+
+
+def translation_request(data):
+    """(text, target language) of a /translate body"""
+    if not data or 'text' not in data or 'targetLanguage' not in data:
+        raise bad_request("Missing text or target language")
+    logger.info(f"Translating text to {data['targetLanguage']}...")
+    return data['text'], data['targetLanguage']
+
+
+def batch_translation_request(data):
+    """(texts, target languages) of a /translate/batch body"""
+    if not data or not isinstance(data.get('texts'), list) or not data.get('targetLanguages'):
+        raise bad_request("Missing texts or target languages")
+    texts = data['texts']
+    if not all(isinstance(text, str) for text in texts):
+        raise bad_request("Every text must be a string")
+    if len(texts) > MAX_BATCH_TEXTS:
+        raise bad_request(f"At most {MAX_BATCH_TEXTS} texts per batch")
+    try:
+        languages = parse_languages(data['targetLanguages'])
+    except ValueError as e:
+        raise bad_request(str(e))
+    logger.info(f"Translating {len(texts)} texts to {', '.join(languages)}...")
+    return texts, languages
+
+
+def batch_translation_reply(result, translate_start):
+    logger.info(f"Batch translation completed in {(time.time() - translate_start):.2f}s "
+                f"with {result['stats']['requests']} requests")
+    result["processing_time_ms"] = int((time.time() - translate_start) * 1000)
+    return result, 200, None
+
+
+def pdf_request(data):
+    """(summary, translated summary, transcript, streamed) of a /generate-pdf body"""
+    if not data or 'summary' not in data:
+        raise bad_request("Missing summary")
+    summary = data['summary']
+    translated_summary = data.get('translatedSummary')  # Optional
+    transcript = data.get('transcript')  # Optional, added as an appendix
+    streamed = bool(transcript) or len(summary) + len(translated_summary or '') > PDF_STREAM_THRESHOLD_CHARS
+    return summary, translated_summary, transcript, streamed
+
+
+def pdf_error(error):
+    logger.error(f"Error generating PDF: {str(error)}")
+    return ApiError(500, {"error": str(error), "step": "pdf_generation"})
+
+
+def queue_email(mail_jobs, data):
+    """Validate a /send-email body and queue its delivery: 202 with the job's URL, or 503 if the queue is full"""
+    data = data or {}
+    recipients = data.get('recipients', [])
+    summary = data.get('summary')
+    if not recipients or not summary:
+        raise bad_request('Missing required fields')
+    if not isinstance(recipients, list) or not all(isinstance(r, str) and '@' in r for r in recipients):
+        raise bad_request('Recipients must be a list of email addresses')
+
+    # PDF rendering and delivery happen in the mail workers
+    try:
+        job = mail_jobs.submit('email', {
+            "recipients": list(dict.fromkeys(recipients)),
+            "summary": summary,
+            "translated_summary": data.get('translatedSummary'),
+            "request_id": metrics.get_request_id()
+        }, stages=['pdf', 'email'])
+    except QueueFull as e:
+        logger.warning(str(e))
+        raise ApiError(503, {'error': str(e)}, {'Retry-After': '30'})
+
+    return {
+        'message': 'Email queued',
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': f"/send-email/{job.id}"
+    }, 202, {'Location': f"/send-email/{job.id}"}
+
+
+def email_status(mail_jobs, job_id):
+    job = mail_jobs.get(job_id)
+    if job is None:
+        raise not_found("Email job not found")
+    data = job.to_dict(include_result=True)
+    data["queue_depth"] = mail_jobs.depth()
+    return data, 200, None
@@ -0,0 +1,591 @@
+from dotenv import load_dotenv
+
+# Load environment variables first: the modules below read their settings when imported
+load_dotenv()
+
+import asyncio
+import logging
+import os
+import shutil
+import time
+from contextlib import asynccontextmanager
+from logging.handlers import RotatingFileHandler
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    import multipart
+    from multipart.multipart import parse_options_header
+
+import api
+import metrics
+from api import MAIL_QUEUE_DB, MAIL_QUEUE_MAXSIZE, SSE_KEEPALIVE_SECONDS, STREAM_UPLOADS, format_sse, preload_modules
+from audio import PIPE_BLOCK_SIZE, AsyncFFmpegPipe, extract_audio_stream_async, stream_encode_args
+from batch_translate import translate_batch
+from email_handler import send_summary_email_async
+from job_queue import create_job_queue
+from metrics import span
+from pipeline import TRANSCRIPTION, chat_complete
+from translate import translate_text, translate_text_async
+from uploads import UploadStore, UploadError
+from storage import storage, QuotaExceeded
+
+# asyncio server mode: the HTTP API of server.py as an ASGI app, run with
+#
+#     uvicorn asgi:app --host 0.0.0.0 --port 8080
+#
+# OpenAI, SendGrid and FFmpeg calls are awaited instead of each holding a
+# thread, so one process keeps up to ASYNC_JOB_CONCURRENCY transcriptions in
+# flight. CPU-bound work (PDF rendering, batch packing) runs on worker threads.
+# What the routes answer is decided in api.py, shared with server.py.
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+os.makedirs('logs', exist_ok=True)
+file_handler = RotatingFileHandler('logs/asgi.log', maxBytes=10240000, backupCount=10, delay=True)
+file_handler.setFormatter(logging.Formatter(
+    '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
+))
+file_handler.setLevel(logging.INFO)
+logger.addHandler(file_handler)
+logging.getLogger('api').addHandler(file_handler)
+
+# Deliveries run at once; each renders its PDF on a worker thread first
+ASYNC_MAIL_CONCURRENCY = int(os.getenv('ASYNC_MAIL_CONCURRENCY', '20'))
+
+
+def respond(body, status=200, headers=None):
+    """A JSON response from what the api functions return"""
+    return JSONResponse(body, status, headers=headers)
+
+
+async def api_error(request, error):
+    return respond(error.body, error.status, error.headers)
+
+
+class RequestMetrics:
+    """ASGI middleware doing what server.py's before/after_request hooks do: request IDs and latency metrics"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        start = time.time()
+        headers = dict(scope['headers'])
+        request_id = headers.get(b'x-request-id', b'').decode('latin-1') or metrics.new_request_id()
+        metrics.set_request_id(request_id)
+        metrics.REQUESTS_IN_FLIGHT.inc()
+
+        async def send_with_metrics(message):
+            if message['type'] == 'http.response.start':
+                route = scope.get('route')
+                metrics.REQUEST_SECONDS.observe(time.time() - start, endpoint=route.path if route else 'unmatched',
+                                                method=scope['method'], status=message['status'])
+                message['headers'] = [*message.get('headers', []), (b'x-request-id', request_id.encode('latin-1'))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            metrics.REQUESTS_IN_FLIGHT.dec()
+
+
+async def test(request):
+    # The metrics snapshot reads the queue depth and storage gauges
+    return respond(*await asyncio.to_thread(api.server_status, mode='asgi'))
+
+
+async def healthz(request):
+    """Liveness: answers as long as the event loop does, without touching anything else"""
+    return JSONResponse({"status": "ok"})
+
+
+async def readyz(request):
+    """Readiness: 503 until the lifespan has started the job queues, and while the job queue or the disk is full"""
+    return respond(*await asyncio.to_thread(api.readiness, jobs, mail_jobs))
+
+
+async def prometheus_metrics(request):
+    # The queue depth and storage gauges query SQLite and walk the disk
+    return Response(await asyncio.to_thread(metrics.registry.render_prometheus),
+                    media_type='text/plain; version=0.0.4')
+
+
+async def cache_stats(request):
+    return respond(*await asyncio.to_thread(api.cache_stats))
+
+
+class MultipartEvents:
+    """
+    Push parser for multipart/form-data that queues what it finds.
+
+    Parsing is synchronous, but feeding FFmpeg is not, so the callbacks only
+    record ('headers', dict), ('data', bytes) and ('end', None) events for
+    the caller to act on after each write().
+    """
+
+    def __init__(self, boundary):
+        self.events = []
+        self._headers = {}
+        self._field = b''
+        self._value = b''
+        self.parser = multipart.MultipartParser(boundary, {
+            'on_part_begin': self._part_begin,
+            'on_header_field': self._header_field,
+            'on_header_value': self._header_value,
+            'on_header_end': self._header_end,
+            'on_headers_finished': lambda: self.events.append(('headers', self._headers)),
+            'on_part_data': lambda data, start, end: self.events.append(('data', data[start:end])),
+            'on_part_end': lambda: self.events.append(('end', None)),
+        })
+
+    def _part_begin(self):
+        self._headers = {}
+
+    def _header_field(self, data, start, end):
+        self._field += data[start:end]
+
+    def _header_value(self, data, start, end):
+        self._value += data[start:end]
+
+    def _header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field = b''
+        self._value = b''
+
+    def write(self, data):
+        self.parser.write(data)
+        events, self.events = self.events, []
+        return events
+
+
+async def stream_multipart_file(request, audio_path, encode_args):
+    """
+    Pipe the first file part of a multipart body through FFmpeg while it arrives.
+
+    Returns (filename, pipe, form): filename and pipe are None if no file part
+    was sent, and form holds the other text fields.
+    """
+    _, params = parse_options_header(request.headers['content-type'])
+    parser = MultipartEvents(params.get(b'boundary', b''))
+    pipe = filename = None
+    fields = {}
+    current = None
+    try:
+        async for chunk in request.stream():
+            for event, value in parser.write(chunk):
+                if event == 'headers':
+                    _, disposition = parse_options_header(value.get(b'content-disposition', b''))
+                    if b'filename' not in disposition:
+                        current = disposition.get(b'name', b'').decode('utf-8', 'replace')
+                        fields[current] = []
+                    elif pipe is None:
+                        filename = disposition[b'filename'].decode('utf-8', 'replace') or 'upload'
+                        pipe = await AsyncFFmpegPipe(audio_path, encode_args).start()
+                        current = pipe
+                    else:
+                        current = None  # only the first file is transcribed
+                elif event == 'data':
+                    if current is pipe and pipe is not None:
+                        await pipe.write(value)
+                    elif current is not None:
+                        fields[current].append(value)
+                else:
+                    current = None
+    except BaseException:
+        if pipe is not None:
+            await pipe.abort()
+        raise
+    form = {name: b''.join(parts).decode('utf-8', 'replace') for name, parts in fields.items()}
+    return filename, pipe, form
+
+
+async def receive_streamed_upload(request, audio_path, profile=None):
+    """
+    Pipe the request body straight into FFmpeg, writing only the extracted audio.
+
+    Accepts multipart/form-data (the first file part is streamed) or a raw body
+    with the original name in the X-Filename header, as server.py does.
+    Returns the original filename (None if no file was sent), the extraction
+    time in ms and any other form fields.
+    """
+    start_time = time.time()
+    encode_args = stream_encode_args(profile)
+    if request.headers.get('content-type', '').startswith('multipart/form-data'):
+        filename, pipe, form = await stream_multipart_file(request, audio_path, encode_args)
+        if pipe is None:
+            return None, 0, form
+        await pipe.finish()
+        metrics.MEDIA_BYTES.observe(pipe.bytes_in)
+    else:
+        form = {}
+        filename = request.headers.get('x-filename') or request.query_params.get('filename') or 'upload'
+        content_length = int(request.headers.get('content-length') or 0)
+        if not content_length and request.headers.get('transfer-encoding') != 'chunked':
+            return None, 0, form
+        await extract_audio_stream_async(request.stream(), audio_path, encode_args)
+        if content_length:
+            metrics.MEDIA_BYTES.observe(content_length)
+    return filename, int((time.time() - start_time) * 1000), form
+
+
+async def accept_upload(request):
+    """Receive a /transcribe upload, either saved to disk or piped through FFmpeg, like server.accept_upload()"""
+    profile, backend, extension = api.upload_options(request.query_params)
+    # Admission may wait for space
+    work = await asyncio.to_thread(api.admit_upload, request.headers.get('content-length'))
+    # Chunked bodies have no Content-Length to check up front: count them against the quota as they arrive
+    request = Request(request.scope, quota_receive(request.receive, work))
+    try:
+        with span('upload', stage='upload'):
+            upload = await receive_upload(request, profile, extension, work)
+        await asyncio.to_thread(work.check)
+    except QuotaExceeded as e:
+        await asyncio.to_thread(work.release)
+        raise api.storage_error(e)
+    except BaseException:
+        await asyncio.to_thread(work.release)
+        raise
+    upload['backend'] = backend
+    return upload
+
+
+def quota_receive(receive, work):
+    """An ASGI receive callable that counts request body bytes against the work directory's per-job quota"""
+    async def counted():
+        message = await receive()
+        if message['type'] == 'http.request':
+            work.count_received(len(message.get('body', b'')))
+        return message
+    return counted
+
+
+async def receive_upload(request, profile, extension, work):
+    if request.query_params.get('stream', STREAM_UPLOADS).lower() in ('1', 'true', 'yes'):
+        audio_path = work.file(f"audio{extension}", scratch=True)
+        filename, extract_ms, form = await receive_streamed_upload(request, audio_path, profile)
+        languages = api.upload_languages(request.query_params, form)
+        if filename is None:
+            raise api.bad_request("No file provided")
+        return api.streamed_upload(work, filename, profile, languages, audio_path, extract_ms)
+
+    form = await request.form()
+    try:
+        languages = api.upload_languages(request.query_params, form)
+        file = form.get('file')
+        if file is None or isinstance(file, str):
+            raise api.bad_request("No file provided")
+        if not file.filename:
+            raise api.bad_request("No file selected")
+
+        upload = api.saved_upload(work, file.filename, profile, languages, extension)
+        # The multipart parser has spooled the file; copying it is disk I/O, so keep it off the loop
+        with open(upload['input_path'], 'wb') as out:
+            await asyncio.to_thread(shutil.copyfileobj, file.file, out, PIPE_BLOCK_SIZE)
+    finally:
+        await form.close()
+    logger.info(f"Saved file to: {upload['input_path']}")
+    metrics.MEDIA_BYTES.observe(os.path.getsize(upload['input_path']))
+    return upload
+
+
+async def run_transcription_job(job):
+    """Run extraction, transcription, summary and translation for a queued upload"""
+    start_time = time.time()
+    ctx, work = api.transcription_job_context(job)
+    try:
+        await TRANSCRIPTION.arun(ctx, stage_context=lambda name: api.job_stage(job, name, work),
+                                 on_skip=job.skip_stage)
+        # Caches the result and stores the transcript, both in SQLite
+        return await asyncio.to_thread(api.transcription_job_result, job, ctx, start_time)
+    finally:
+        await asyncio.to_thread(api.finish_transcription_job, job, ctx)
+
+
+async def run_email_job(job):
+    """Render the summary PDF on a worker thread and deliver it to every recipient"""
+    metrics.set_request_id(job.payload.get('request_id') or job.id)
+    recipients = job.payload['recipients']
+    from pdf_generator import create_summary_pdf
+    with api.job_stage(job, 'pdf'):
+        pdf_data = await asyncio.to_thread(create_summary_pdf, job.payload['summary'],
+                                           job.payload.get('translated_summary'))
+    with api.job_stage(job, 'email'):
+        batches = await send_summary_email_async(recipients, job.payload['summary'], pdf_data,
+                                                 job.payload.get('translated_summary'))
+    return api.email_job_result(recipients, batches)
+
+
+jobs = create_job_queue(asynchronous=True)
+jobs.register('transcribe', run_transcription_job)
+metrics.QUEUE_DEPTH.set_callback(jobs.depth)
+
+mail_jobs = create_job_queue(workers=ASYNC_MAIL_CONCURRENCY, maxsize=MAIL_QUEUE_MAXSIZE, db_path=MAIL_QUEUE_DB,
+                             asynchronous=True)
+mail_jobs.register('email', run_email_job)
+metrics.MAIL_QUEUE_DEPTH.set_callback(mail_jobs.depth)
+metrics.STORAGE_USED_BYTES.set_callback(storage.used_bytes)
+
+
+async def transcribe(request):
+    try:
+        upload = await accept_upload(request)
+        return respond(*await asyncio.to_thread(api.queue_transcription, jobs, upload))
+    except api.ApiError:
+        raise
+    except Exception as e:
+        raise api.internal_error('upload', e)
+
+
+# Resumable chunked uploads; the store does blocking file I/O, so it is called on worker threads
+uploads = UploadStore()
+
+
+async def create_upload(request):
+    return respond(*await asyncio.to_thread(api.create_upload, uploads, await read_json(request)))
+
+
+async def upload_status(request):
+    return respond(*await asyncio.to_thread(api.upload_status, uploads, request.path_params['upload_id']))
+
+
+async def upload_chunk(request):
+    """Append the request body at Upload-Offset, checked against X-Chunk-SHA256 when given"""
+    offset = api.chunk_offset(request.headers)
+    try:
+        writer = await asyncio.to_thread(uploads.begin_chunk, request.path_params['upload_id'], offset,
+                                         request.headers.get('X-Chunk-SHA256'))
+        try:
+            async for block in request.stream():
+                if block:
+                    await asyncio.to_thread(writer.write, block)
+        except BaseException:
+            await asyncio.to_thread(writer.abort)
+            raise
+        upload = await asyncio.to_thread(writer.commit)
+    except UploadError as e:
+        raise api.upload_error(e)
+    return respond(*api.upload_reply(upload))
+
+
+async def delete_upload(request):
+    await asyncio.to_thread(api.delete_upload, uploads, request.path_params['upload_id'])
+    return Response(status_code=204)
+
+
+async def finalize_upload(request):
+    """Process a complete upload like /transcribe, or return the result of an identical earlier one"""
+    upload, reply = await asyncio.to_thread(api.finish_upload, uploads, request.path_params['upload_id'],
+                                            await read_json(request), request.query_params)
+    return respond(*(reply or await asyncio.to_thread(api.queue_finished_upload, jobs, upload)))
+
+
+async def run_streaming_pipeline(upload, emit):
+    """
+    Run the transcription pipeline for /transcribe/stream, reporting progress through emit(event, data).
+
+    The events are those of server.run_streaming_pipeline(). A client that
+    disconnects cancels the task running this coroutine, which stops any API
+    request or FFmpeg process in flight.
+    """
+    run = api.StreamingRun(upload, emit)
+    try:
+        await TRANSCRIPTION.arun(run.ctx, stage_context=run.stage_events)
+        run.done(*await asyncio.to_thread(run.store))
+    except Exception as e:
+        run.failed(e)
+    finally:
+        await asyncio.to_thread(api.remove_upload_files, upload)
+        emit(None, None)
+
+
+async def transcribe_stream(request):
+    try:
+        upload = await accept_upload(request)
+    except api.ApiError:
+        raise
+    except Exception as e:
+        logger.error(f"Error: {str(e)}")
+        return respond({"error": str(e), "step": "upload"}, 500)
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def emit(event, data):
+        # asyncio.Queue is not thread-safe, and callbacks may fire on worker threads
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    task = asyncio.create_task(run_streaming_pipeline(upload, emit))
+
+    async def generate():
+        try:
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(events.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    break
+                yield format_sse(event, data)
+        finally:
+            task.cancel()
+
+    return StreamingResponse(generate(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+async def job_status(request):
+    return respond(*await asyncio.to_thread(api.job_status, jobs, request.path_params['job_id']))
+
+
+async def job_result(request):
+    return respond(*await asyncio.to_thread(api.job_result, jobs, request.path_params['job_id']))
+
+
+async def list_transcripts(request):
+    return respond(*await asyncio.to_thread(api.list_transcripts, request.query_params))
+
+
+async def search_transcripts(request):
+    return respond(*await asyncio.to_thread(api.search_transcripts, request.query_params))
+
+
+async def get_transcript(request):
+    return respond(*await asyncio.to_thread(api.get_transcript, request.path_params['transcript_id']))
+
+
+async def delete_transcript(request):
+    return respond(*await asyncio.to_thread(api.delete_transcript, request.path_params['transcript_id']))
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def translate(request):
+    text, target_language = api.translation_request(await read_json(request))
+    try:
+        translate_start = time.time()
+        with span('translate', stage='translate', languages=1):
+            translated_text = await translate_text_async(text, target_language)
+        logger.info(f"Translation completed in {(time.time() - translate_start):.2f}s")
+    except Exception as e:
+        raise api.internal_error('translation', e)
+    return respond({"translatedText": translated_text})
+
+
+async def translate_batch_route(request):
+    texts, languages = api.batch_translation_request(await read_json(request))
+    try:
+        translate_start = time.time()
+        # Packing and its request pool are thread based; run the whole batch on a worker thread
+        with span('translate_batch', stage='translate', texts=len(texts), languages=len(languages)):
+            result = await asyncio.to_thread(translate_batch, texts, languages, translate_text, chat_complete)
+    except Exception as e:
+        raise api.internal_error('translation', e)
+    return respond(*api.batch_translation_reply(result, translate_start))
+
+
+async def generate_pdf(request):
+    summary, translated_summary, transcript, streamed = api.pdf_request(await read_json(request))
+    try:
+        # Layout is CPU-bound; render on a worker thread so the loop keeps serving
+        from pdf_generator import create_summary_pdf
+        from pdf_stream import spool_summary_pdf
+        headers = {'Content-Disposition': 'attachment; filename=meeting_summary.pdf'}
+        with span('pdf', stage='pdf', streamed=streamed):
+            if not streamed:
+                pdf_data = await asyncio.to_thread(create_summary_pdf, summary, translated_summary)
+                return Response(pdf_data, media_type='application/pdf', headers=headers)
+            pdf_file = await asyncio.to_thread(spool_summary_pdf, summary, translated_summary, transcript)
+    except Exception as e:
+        raise api.pdf_error(e)
+
+    return StreamingResponse(iter(lambda: pdf_file.read(PIPE_BLOCK_SIZE), b''), media_type='application/pdf',
+                             headers=headers, background=BackgroundTask(pdf_file.close))
+
+
+async def send_email(request):
+    try:
+        return respond(*await asyncio.to_thread(api.queue_email, mail_jobs, await read_json(request)))
+    except api.ApiError:
+        raise
+    except Exception as e:
+        logger.error(f"Error sending email: {str(e)}")
+        return respond({'error': str(e)}, 500)
+
+
+async def email_status(request):
+    return respond(*await asyncio.to_thread(api.email_status, mail_jobs, request.path_params['job_id']))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    jobs.start()
+    mail_jobs.start()
+    storage.start_sweeper()
+    # Serve at once; the lazily imported modules load on a thread meanwhile
+    preload = asyncio.create_task(asyncio.to_thread(preload_modules))
+    yield
+    await preload
+    storage.stop_sweeper()
+    await jobs.stop()
+    await mail_jobs.stop()
+
+
+app = Starlette(
+    routes=[
+        Route('/test', test, methods=['GET']),
+        Route('/healthz', healthz, methods=['GET']),
+        Route('/readyz', readyz, methods=['GET']),
+        Route('/metrics', prometheus_metrics, methods=['GET']),
+        Route('/cache/stats', cache_stats, methods=['GET']),
+        Route('/transcribe', transcribe, methods=['POST']),
+        Route('/transcribe/stream', transcribe_stream, methods=['POST']),
+        Route('/uploads', create_upload, methods=['POST']),
+        Route('/uploads/{upload_id}', upload_status, methods=['GET', 'HEAD']),
+        Route('/uploads/{upload_id}', upload_chunk, methods=['PUT']),
+        Route('/uploads/{upload_id}', delete_upload, methods=['DELETE']),
+        Route('/uploads/{upload_id}/finalize', finalize_upload, methods=['POST']),
+        Route('/jobs/{job_id}', job_status, methods=['GET']),
+        Route('/jobs/{job_id}/result', job_result, methods=['GET']),
+        Route('/transcripts', list_transcripts, methods=['GET']),
+        # Before /transcripts/{transcript_id}, which would match it too
+        Route('/transcripts/search', search_transcripts, methods=['GET']),
+        Route('/transcripts/{transcript_id}', get_transcript, methods=['GET']),
+        Route('/transcripts/{transcript_id}', delete_transcript, methods=['DELETE']),
+        Route('/translate', translate, methods=['POST']),
+        Route('/translate/batch', translate_batch_route, methods=['POST']),
+        Route('/generate-pdf', generate_pdf, methods=['POST']),
+        Route('/send-email', send_email, methods=['POST']),
+        Route('/send-email/{job_id}', email_status, methods=['GET']),
+    ],
+    middleware=[
+        Middleware(RequestMetrics),
+        # Same policy as server.py: any origin, preflight answered for every route
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
+                   allow_headers=['Content-Type', 'Authorization', 'Access-Control-Allow-Origin',
+                                  'Upload-Offset', 'X-Chunk-SHA256'],
+                   expose_headers=['Upload-Offset', 'Location'], allow_credentials=True),
+    ],
+    exception_handlers={api.ApiError: api_error},
+    lifespan=lifespan,
+)
@@ -0,0 +1,265 @@
+import asyncio
+import collections
+import logging
+import os
+import shutil
+import subprocess
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Size of the reads/writes between the request, FFmpeg and the output file
+PIPE_BLOCK_SIZE = 64 * 1024
+
+# Encoder settings for extracted audio. Whisper resamples everything to 16 kHz
+# mono internally, so "speech" loses nothing it would use and uploads are far
+# smaller than "archive", which keeps the original stereo high-quality MP3.
+AUDIO_PROFILES = {
+    'speech': {
+        'extension': '.ogg',
+        'format': 'ogg',
+        'args': ['-ac', '1', '-ar', '16000', '-c:a', 'libopus', '-b:a', '24k', '-application', 'voip'],
+    },
+    'speech-mp3': {
+        'extension': '.mp3',
+        'format': 'mp3',
+        'args': ['-ac', '1', '-ar', '16000', '-c:a', 'libmp3lame', '-b:a', '32k'],
+    },
+    'archive': {
+        'extension': '.mp3',
+        'format': 'mp3',
+        'args': ['-acodec', 'libmp3lame', '-q:a', '2'],
+    },
+}
+DEFAULT_PROFILE = os.getenv('AUDIO_PROFILE', 'archive')
+
+
+def get_profile(name=None):
+    """Look up an extraction profile by name, falling back to AUDIO_PROFILE"""
+    name = name or DEFAULT_PROFILE
+    if name not in AUDIO_PROFILES:
+        raise ValueError(f"Unknown audio profile '{name}'. Choose from: {', '.join(AUDIO_PROFILES)}")
+    return AUDIO_PROFILES[name]
+
+
+def extract_command(input_path, output_path, profile=None):
+    """FFmpeg command that extracts the audio track of input_path with the given profile"""
+    return [
+        'ffmpeg',
+        '-i', input_path,
+        '-vn',
+        *get_profile(profile)['args'],
+        '-y',
+        output_path
+    ]
+
+
+async def run_command_async(cmd):
+    """
+    Run an FFmpeg or ffprobe command without blocking the event loop.
+
+    Returns (returncode, stdout, stderr) as text. The process is killed if the
+    awaiting task is cancelled, so abandoned requests do not leave FFmpeg running.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    return process.returncode, stdout.decode('utf-8', 'replace'), stderr.decode('utf-8', 'replace')
+
+
+def stream_encode_args(profile=None):
+    """Encoder arguments for writing a profile to a pipe, where the format cannot be inferred"""
+    settings = get_profile(profile)
+    return [*settings['args'], '-f', settings['format']]
+
+
+class FFmpegPipe:
+    """
+    Writable file-like object that feeds FFmpeg's stdin.
+
+    A background thread copies the encoded audio from FFmpeg's stdout to
+    output_path while the caller is still writing input, so extraction overlaps
+    with the upload. Writes block when FFmpeg falls behind, which keeps memory
+    use constant regardless of input size. Containers that need seeking to be
+    decoded (e.g. MP4 with the moov atom at the end) cannot be read from a pipe
+    and will fail in finish().
+    """
+
+    def __init__(self, output_path, encode_args=None):
+        self.output_path = output_path
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._stderr = collections.deque(maxlen=50)
+        self._broken = False
+        ffmpeg_cmd = [
+            'ffmpeg', '-hide_banner', '-nostats',
+            '-i', 'pipe:0',
+            '-vn',
+            *(encode_args or stream_encode_args()),
+            '-y',
+            'pipe:1'
+        ]
+        self.process = subprocess.Popen(
+            ffmpeg_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        self._stdout_thread = threading.Thread(target=self._drain_stdout, daemon=True)
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._stdout_thread.start()
+        self._stderr_thread.start()
+
+    def _drain_stdout(self):
+        with open(self.output_path, 'wb') as out:
+            for block in iter(lambda: self.process.stdout.read(PIPE_BLOCK_SIZE), b''):
+                out.write(block)
+                self.bytes_out += len(block)
+
+    def _drain_stderr(self):
+        for line in self.process.stderr:
+            self._stderr.append(line.decode('utf-8', 'replace').rstrip())
+
+    def write(self, data):
+        if self._broken:
+            return len(data)
+        try:
+            self.process.stdin.write(data)
+        except (BrokenPipeError, ValueError):
+            # FFmpeg exited early; keep consuming the request and report in finish()
+            self._broken = True
+        self.bytes_in += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=0):
+        # The multipart parser rewinds finished file parts; a pipe cannot be rewound
+        return 0
+
+    def finish(self):
+        """Close FFmpeg's stdin, wait for encoding to finish and raise if it failed"""
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self.process.wait()
+        self._stdout_thread.join()
+        self._stderr_thread.join()
+        if returncode != 0:
+            stderr = '\n'.join(self._stderr)
+            raise Exception(f"Error extracting audio: {stderr}")
+        logger.info(f"Streamed {self.bytes_in} bytes through FFmpeg into {self.bytes_out} bytes of audio")
+        return self.bytes_out
+
+    def abort(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+    def close(self):
+        # Called by FileStorage cleanup; finish() does the real work
+        pass
+
+
+class AsyncFFmpegPipe:
+    """
+    FFmpegPipe for asyncio: fed with await write(), with FFmpeg's output copied
+    to output_path by a task instead of a thread. Create it with await start().
+    """
+
+    def __init__(self, output_path, encode_args=None):
+        self.output_path = output_path
+        self.encode_args = encode_args or stream_encode_args()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.process = None
+        self._stderr = collections.deque(maxlen=50)
+        self._broken = False
+        self._readers = []
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            'ffmpeg', '-hide_banner', '-nostats',
+            '-i', 'pipe:0',
+            '-vn',
+            *self.encode_args,
+            '-y',
+            'pipe:1',
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        self._readers = [asyncio.ensure_future(self._drain_stdout()), asyncio.ensure_future(self._drain_stderr())]
+        return self
+
+    async def _drain_stdout(self):
+        with open(self.output_path, 'wb') as out:
+            while True:
+                block = await self.process.stdout.read(PIPE_BLOCK_SIZE)
+                if not block:
+                    break
+                out.write(block)
+                self.bytes_out += len(block)
+
+    async def _drain_stderr(self):
+        async for line in self.process.stderr:
+            self._stderr.append(line.decode('utf-8', 'replace').rstrip())
+
+    async def write(self, data):
+        if not self._broken:
+            try:
+                self.process.stdin.write(data)
+                # Waits while FFmpeg falls behind, so memory use stays constant
+                await self.process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                # FFmpeg exited early; keep consuming the request and report in finish()
+                self._broken = True
+        self.bytes_in += len(data)
+
+    async def finish(self):
+        """Close FFmpeg's stdin, wait for encoding to finish and raise if it failed"""
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        returncode = await self.process.wait()
+        await asyncio.gather(*self._readers)
+        if returncode != 0:
+            stderr = '\n'.join(self._stderr)
+            raise Exception(f"Error extracting audio: {stderr}")
+        logger.info(f"Streamed {self.bytes_in} bytes through FFmpeg into {self.bytes_out} bytes of audio")
+        return self.bytes_out
+
+    async def abort(self):
+        for reader in self._readers:
+            reader.cancel()
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+            await self.process.wait()
+
+
+def extract_audio_stream(stream, output_path, encode_args=None):
+    """Pipe a readable stream through FFmpeg into output_path without buffering it on disk"""
+    pipe = FFmpegPipe(output_path, encode_args)
+    try:
+        shutil.copyfileobj(stream, pipe, PIPE_BLOCK_SIZE)
+    except Exception:
+        pipe.abort()
+        raise
+    return pipe.finish()
+
+
+async def extract_audio_stream_async(chunks, output_path, encode_args=None):
+    """extract_audio_stream() for an async iterable of bytes, such as an ASGI request body"""
+    pipe = await AsyncFFmpegPipe(output_path, encode_args).start()
+    try:
+        async for chunk in chunks:
+            if chunk:
+                await pipe.write(chunk)
+    except BaseException:
+        # Includes cancellation when the client disconnects mid-upload
+        await pipe.abort()
+        raise
+    return await pipe.finish()
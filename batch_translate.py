@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from result_cache import result_cache
+from summarizer import estimate_tokens
+from translate import translation_cache_key
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_TEXTS = int(os.getenv('BATCH_TRANSLATE_MAX_TEXTS', '100'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_TRANSLATE_CONCURRENCY', '4'))
+# Texts up to SMALL_TEXT_TOKENS are packed together, up to PACK_TOKENS per request
+SMALL_TEXT_TOKENS = int(os.getenv('BATCH_TRANSLATE_SMALL_TEXT_TOKENS', '300'))
+PACK_TOKENS = int(os.getenv('BATCH_TRANSLATE_PACK_TOKENS', '1500'))
+PACK_MAX_ITEMS = 20
+
+PACK_PROMPT = (
+    "You are a helpful translator. You will receive a JSON array of texts. Translate every text to "
+    "{language}, maintaining the same formatting including markdown and bullet points. Reply with "
+    "only a JSON array of the translated strings, in the same order and with the same length."
+)
+
+
+def plan_requests(texts, languages):
+    """
+    Group unique (text, language) pairs into requests.
+
+    Returns a list of (language, [text, ...]) where lists with more than one
+    text are packed into a single prompt.
+    """
+    requests = []
+    for language in languages:
+        pack, pack_tokens = [], 0
+        for text in texts:
+            tokens = estimate_tokens(text)
+            if tokens > SMALL_TEXT_TOKENS:
+                requests.append((language, [text]))
+                continue
+            if pack and (pack_tokens + tokens > PACK_TOKENS or len(pack) >= PACK_MAX_ITEMS):
+                requests.append((language, pack))
+                pack, pack_tokens = [], 0
+            pack.append(text)
+            pack_tokens += tokens
+        if pack:
+            requests.append((language, pack))
+    return requests
+
+
+def translate_pack(texts, language, complete_fn):
+    """Translate several short texts with one chat request; returns None if the reply is unusable"""
+    messages = [
+        {"role": "system", "content": PACK_PROMPT.format(language=language)},
+        {"role": "user", "content": json.dumps(texts, ensure_ascii=False)}
+    ]
+    reply = complete_fn(messages).strip()
+    if reply.startswith('```'):
+        reply = reply.strip('`').split('\n', 1)[-1]
+    try:
+        translated = json.loads(reply)
+    except ValueError:
+        return None
+    if not isinstance(translated, list) or len(translated) != len(texts) \
+            or not all(isinstance(t, str) for t in translated):
+        return None
+    return translated
+
+
+def translate_batch(texts, languages, translate_fn, complete_fn, max_workers=BATCH_CONCURRENCY):
+    """
+    Translate every text into every language.
+
+    Identical (text, language) pairs are translated once, cached translations
+    are reused, and short texts are packed into shared prompts. Up to
+    max_workers requests run concurrently. Rate limiting is left to the OpenAI
+    client that translate_fn and complete_fn call through: its request and
+    token buckets are the authoritative limit for the API key in use, shared
+    with every other caller in the process. Returns one result per input
+    text, in input order, with per-language translations and errors.
+    """
+    translated = {}
+    errors = {}
+
+    # Deduplicate and answer what we can from the cache
+    unique_texts = list(dict.fromkeys(texts))
+    pending = {language: [] for language in languages}
+    for language in languages:
+        for text in unique_texts:
+            if not text.strip():
+                translated[(text, language)] = text
+                continue
+            cached = result_cache.get('translate', translation_cache_key(text, language))
+            if cached is not None:
+                translated[(text, language)] = cached
+            else:
+                pending[language].append(text)
+
+    planned = []
+    for language in languages:
+        planned.extend(plan_requests(pending[language], [language]))
+
+    def run(request):
+        language, group = request
+        if len(group) > 1:
+            try:
+                results = translate_pack(group, language, complete_fn)
+            except Exception as e:
+                logger.error(f"Packed translation to {language} failed: {str(e)}")
+                results = None
+            if results is not None:
+                for text, result in zip(group, results):
+                    translated[(text, language)] = result
+                    result_cache.set('translate', translation_cache_key(text, language), result)
+                return
+            logger.info(f"Packed reply unusable; translating {len(group)} texts to {language} one by one")
+        for text in group:
+            try:
+                translated[(text, language)] = translate_fn(text, language)
+            except Exception as e:
+                errors[(text, language)] = str(e)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch-translate') as executor:
+        list(executor.map(run, planned))
+
+    results = []
+    for index, text in enumerate(texts):
+        item = {"index": index, "translations": {}, "errors": {}}
+        for language in languages:
+            if (text, language) in translated:
+                item["translations"][language] = translated[(text, language)]
+            else:
+                item["errors"][language] = errors.get((text, language), "Translation failed")
+        results.append(item)
+
+    return {
+        "results": results,
+        "stats": {
+            "pairs": len(texts) * len(languages),
+            "unique_pairs": len(unique_texts) * len(languages),
+            "requests": len(planned),
+            "packed_requests": sum(1 for _, group in planned if len(group) > 1),
+            "failed": sum(1 for item in results for _ in item["errors"]),
+        }
+    }
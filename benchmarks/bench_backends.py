@@ -0,0 +1,205 @@
+"""
+Compare transcription backends on speed and accuracy.
+
+Every recording given is transcribed by every engine, the way the pipeline
+does it (long files are split into chunks), after one untimed warm-up file:
+
+    rtf         real-time factor, seconds spent per second of audio; below 1
+                is faster than real time
+    wer         word error rate against a reference transcript, the words
+                substituted, deleted and inserted over the reference's words
+                (case and punctuation ignored); the corpus figure weights each
+                file by its length
+    throughput  seconds of audio transcribed per wall-clock second with
+                --parallel files in flight
+    model_mb    resident memory the local model added once loaded
+
+An engine is `openai` (the API, or OPENAI_BASE_URL; needs OPENAI_API_KEY) or
+`local:<model>[:<compute type>]`, e.g. local:small:int8 or local:base:float32,
+with --workers, --threads, --batch-size and --beam-size as for the server
+(LOCAL_WHISPER_*). Local engines need faster-whisper and download their
+model on first use unless LOCAL_WHISPER_MODEL names a local directory.
+
+References are read from a .txt file next to each recording (talk.mp3 ->
+talk.txt); recordings without one get no WER. Public test sets such as
+LibriSpeech test-clean come with references in that shape after a little
+conversion.
+
+Usage:
+    python benchmarks/bench_backends.py --media talk.mp3 [talk2.wav ...]
+                                        [--engines openai local:small:int8 local:small:float32]
+                                        [--parallel 1] [--workers 1] [--threads 0] [--batch-size 8]
+                                        [--beam-size 1] [--json report.json]
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from dotenv import load_dotenv  # noqa: E402
+
+load_dotenv()
+
+from chunking import probe_duration, transcribe_long_audio  # noqa: E402
+from transcription import (LOCAL_WHISPER_BATCH_SIZE, LOCAL_WHISPER_BEAM_SIZE, LOCAL_WHISPER_MODEL,  # noqa: E402
+                           LOCAL_WHISPER_THREADS, LOCAL_WHISPER_WORKERS, LocalWhisperTranscriber,
+                           OpenAITranscriber)
+
+DEFAULT_ENGINES = ['openai', f'local:{LOCAL_WHISPER_MODEL}:int8', f'local:{LOCAL_WHISPER_MODEL}:float32']
+
+
+def words(text):
+    return re.sub(r"[^\w\s']", ' ', text.lower()).split()
+
+
+def word_errors(reference, hypothesis):
+    """Substitutions + deletions + insertions turning reference into hypothesis (word-level edit distance)"""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1]
+
+
+def current_rss_bytes():
+    """Resident set size of this process now (Linux only; None elsewhere)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return None
+
+
+def make_engine(spec, args):
+    """A transcriber for an engine spec, and how long loading it took and the memory it added"""
+    name, *options = spec.split(':')
+    if name == 'openai':
+        if not os.getenv('OPENAI_API_KEY'):
+            raise Exception("OPENAI_API_KEY is not set")
+        return OpenAITranscriber(), {}
+    if name != 'local' or len(options) > 2:
+        raise ValueError(f"Unknown engine '{spec}'; use openai or local:<model>[:<compute type>]")
+    transcriber = LocalWhisperTranscriber(model=options[0] if options else LOCAL_WHISPER_MODEL,
+                                          compute_type=options[1] if len(options) > 1 else 'int8',
+                                          workers=args.workers,
+                                          threads=args.threads or max(1, os.cpu_count() // args.workers),
+                                          batch_size=args.batch_size, beam_size=args.beam_size)
+    rss_before = current_rss_bytes()
+    start = time.perf_counter()
+    transcriber.engine
+    load_s = time.perf_counter() - start
+    rss_after = current_rss_bytes()
+    model_mb = round((rss_after - rss_before) / 2 ** 20, 1) if rss_before is not None else None
+    return transcriber, {'load_s': round(load_s, 2), 'model_mb': model_mb}
+
+
+def transcribe_one(transcriber, sample):
+    start = time.perf_counter()
+    text = transcribe_long_audio(sample['path'], transcriber.transcribe)
+    elapsed = time.perf_counter() - start
+    row = {'media': os.path.basename(sample['path']), 'audio_s': round(sample['duration'], 1),
+           'elapsed_s': round(elapsed, 2), 'rtf': round(elapsed / sample['duration'], 3)}
+    if sample['reference'] is not None:
+        errors = word_errors(sample['reference'], words(text))
+        row.update(ref_words=len(sample['reference']), errors=errors,
+                   wer=round(errors / max(len(sample['reference']), 1), 3))
+    return row
+
+
+def run_engine(spec, samples, args):
+    try:
+        transcriber, load = make_engine(spec, args)
+    except Exception as e:
+        print(f"[skip] {spec}: {str(e)}")
+        return {'engine': spec, 'error': str(e)}, []
+
+    transcribe_one(transcriber, samples[0])
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+        rows = list(executor.map(lambda sample: transcribe_one(transcriber, sample), samples))
+    wall = time.perf_counter() - start
+    for row in rows:
+        row['engine'] = spec
+
+    audio_s = sum(sample['duration'] for sample in samples)
+    summary = dict({'engine': spec, 'files': len(rows), 'audio_s': round(audio_s, 1),
+                    'rtf': round(sum(row['elapsed_s'] for row in rows) / audio_s, 3),
+                    'throughput': round(audio_s / wall, 2)}, **load)
+    scored = [row for row in rows if 'wer' in row]
+    if scored:
+        summary['wer'] = round(sum(row['errors'] for row in scored) / max(sum(row['ref_words'] for row in scored), 1),
+                               3)
+    return summary, rows
+
+
+def load_samples(paths):
+    samples = []
+    for path in paths:
+        reference_path = os.path.splitext(path)[0] + '.txt'
+        reference = None
+        if os.path.exists(reference_path):
+            with open(reference_path, encoding='utf-8') as f:
+                reference = words(f.read())
+        samples.append({'path': path, 'duration': probe_duration(path), 'reference': reference})
+    return samples
+
+
+def print_table(rows, columns):
+    print(' '.join(f"{c:>22}" for c in columns))
+    for row in rows:
+        print(' '.join(f"{str(row.get(c, '-')):>22}" for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--media', nargs='+', required=True, help='recordings, each with an optional .txt reference')
+    parser.add_argument('--engines', nargs='+', default=DEFAULT_ENGINES, help='openai or local:<model>[:<compute>]')
+    parser.add_argument('--parallel', type=int, default=1, help='files transcribed at once per engine')
+    parser.add_argument('--workers', type=int, default=LOCAL_WHISPER_WORKERS, help='local files decoded at once')
+    parser.add_argument('--threads', type=int, default=LOCAL_WHISPER_THREADS,
+                        help='CPU threads per local decode (0: the cores split between workers)')
+    parser.add_argument('--batch-size', type=int, default=LOCAL_WHISPER_BATCH_SIZE,
+                        help='30-second windows decoded together by a local engine')
+    parser.add_argument('--beam-size', type=int, default=LOCAL_WHISPER_BEAM_SIZE, help='local beam width')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    samples = load_samples(args.media)
+    summaries, files = [], []
+    for spec in args.engines:
+        summary, rows = run_engine(spec, samples, args)
+        summaries.append(summary)
+        files.extend(rows)
+
+    print_table(files, ['engine', 'media', 'audio_s', 'elapsed_s', 'rtf', 'wer'])
+    print()
+    print_table([summary for summary in summaries if 'error' not in summary],
+                ['engine', 'files', 'audio_s', 'rtf', 'wer', 'throughput', 'load_s', 'model_mb'])
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'cpus': os.cpu_count(),
+                'parallel': args.parallel,
+                'workers': args.workers,
+                'batch_size': args.batch_size,
+                'beam_size': args.beam_size,
+                'engines': summaries,
+                'files': files,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
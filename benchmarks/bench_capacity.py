@@ -0,0 +1,224 @@
+"""
+Compare how many concurrent requests one server process can carry in the
+threaded mode (server.py under gunicorn's gthread worker) and the asyncio mode
+(asgi.py under uvicorn).
+
+Both run against benchmarks/stub_servers.py, so every request spends its time
+waiting on the stubbed OpenAI API, as in production. For each mode, scenario
+and concurrency level a fresh server is started and driven by that many
+concurrent clients:
+
+    translate    each client sends --rounds POST /translate requests in turn
+    transcribe   each client uploads a sample recording to /transcribe and
+                 polls the job until it finishes
+
+Reported per run: completed requests, errors, throughput, p50/p95 latency,
+the highest number of Whisper/chat requests the stub saw at once (how much
+work the server really kept in flight) and the peak RSS of the server's
+process tree.
+
+Usage:
+    python benchmarks/bench_capacity.py [--modes threaded asyncio] [--scenarios translate transcribe]
+                                        [--levels 10 50 100 200 400] [--threads 32] [--job-workers 32]
+                                        [--whisper-latency 2] [--chat-latency 1] [--json report.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_profiles import generate_sample  # noqa: E402
+from loadtest import AppServer, peak_rss_bytes, percentile  # noqa: E402
+from stub_servers import SUMMARY, StubServer, add_stub_arguments, config_from_args  # noqa: E402
+
+MODES = ('threaded', 'asyncio')
+SCENARIOS = ('translate', 'transcribe')
+JOB_POLL_SECONDS = 0.5
+# Longer than a pooled client connection sits idle, so the server never closes one as it is reused
+KEEP_ALIVE_SECONDS = 75
+
+
+class ModeServer(AppServer):
+    """The app in one worker process of the given serving mode"""
+
+    def __init__(self, mode, stub_url, work_dir, args, level):
+        env = {
+            # Let the stub, not the client-side limits, be what requests wait on
+            'OPENAI_RPM': '1000000', 'OPENAI_TPM': '1000000000', 'OPENAI_AUDIO_RPM': '1000000',
+            'OPENAI_POOL_SIZE': str(max(20, level)), 'OPENAI_ASYNC_POOL_SIZE': str(max(20, level)),
+            'JOB_QUEUE_MAXSIZE': str(level * 2 + 100),
+            'JOB_WORKERS': str(args.job_workers),
+            'ASYNC_JOB_CONCURRENCY': str(args.async_jobs),
+        }
+        super().__init__(stub_url, work_dir, env=env)
+        self.mode = mode
+        self.threads = args.threads
+
+    def command(self):
+        if self.mode == 'threaded':
+            return [sys.executable, '-m', 'gunicorn', 'server:app', '--bind', f'127.0.0.1:{self.port}',
+                    '--workers', '1', '--worker-class', 'gthread', '--threads', str(self.threads),
+                    '--timeout', '600', '--keep-alive', str(KEEP_ALIVE_SECONDS), '--backlog', '2048']
+        return [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(self.port),
+                '--log-level', 'warning', '--timeout-keep-alive', str(KEEP_ALIVE_SECONDS), '--backlog', '2048']
+
+
+def process_tree(pid):
+    """pid and all of its descendants (Linux only)"""
+    pids = [pid]
+    for child_pid in pids:
+        try:
+            for task in os.listdir(f'/proc/{child_pid}/task'):
+                with open(f'/proc/{child_pid}/task/{task}/children') as f:
+                    pids.extend(int(p) for p in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def tree_peak_rss_bytes(pid):
+    """Sum of the peak RSS of a process and its children, e.g. a gunicorn master and its worker"""
+    peaks = [peak_rss_bytes(p) for p in process_tree(pid)]
+    peaks = [peak for peak in peaks if peak]
+    return sum(peaks) if peaks else None
+
+
+async def translate_client(client, url, index, rounds, latencies, errors):
+    for round_index in range(rounds):
+        start = time.perf_counter()
+        try:
+            response = await client.post(f"{url}/translate", json={
+                "text": f"{SUMMARY}\n\nClient {index}, request {round_index}", "targetLanguage": "Spanish"
+            })
+            response.raise_for_status()
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {str(e)[:200]}")
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+async def transcribe_client(client, url, media_path, latencies, errors):
+    start = time.perf_counter()
+    try:
+        with open(media_path, 'rb') as f:
+            data = f.read()
+        response = await client.post(f"{url}/transcribe", files={'file': (os.path.basename(media_path), data)})
+        response.raise_for_status()
+        status_url = f"{url}/jobs/{response.json()['job_id']}"
+        while True:
+            job = (await client.get(status_url)).json()
+            if job['status'] in ('done', 'failed'):
+                break
+            await asyncio.sleep(JOB_POLL_SECONDS)
+        if job['status'] == 'failed':
+            raise Exception(job.get('error') or 'job failed')
+    except Exception as e:
+        errors.append(f"{type(e).__name__}: {str(e)[:200]}")
+        return
+    latencies.append((time.perf_counter() - start) * 1000)
+
+
+async def drive(scenario, url, level, media_path, args):
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=level + 10, max_keepalive_connections=level + 10)
+    async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+        if scenario == 'translate':
+            clients = [translate_client(client, url, i, args.rounds, latencies, errors) for i in range(level)]
+        else:
+            clients = [transcribe_client(client, url, media_path, latencies, errors) for _ in range(level)]
+        start = time.perf_counter()
+        await asyncio.gather(*clients)
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def run_level(mode, scenario, level, stub, work_dir, media_path, args):
+    stub.reset()
+    server = ModeServer(mode, stub.url, work_dir, args, level).start(timeout=60)
+    try:
+        latencies, errors, elapsed = asyncio.run(drive(scenario, server.url, level, media_path, args))
+        rss = tree_peak_rss_bytes(server.process.pid)
+    finally:
+        server.stop()
+    api = 'whisper' if scenario == 'transcribe' else 'chat'
+    return {
+        'mode': mode,
+        'scenario': scenario,
+        'level': level,
+        'ok': len(latencies),
+        'errors': len(errors),
+        'error_samples': sorted(set(errors))[:3],
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 50), 1) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95), 1) if latencies else None,
+        'peak_api_in_flight': stub.peak_in_flight.get(api, 0),
+        'peak_rss_mb': round(rss / 2 ** 20, 1) if rss else None,
+        'stub_requests': dict(stub.counts),
+    }
+
+
+def print_table(results):
+    columns = ['mode', 'scenario', 'level', 'ok', 'errors', 'throughput_rps', 'p50_ms', 'p95_ms',
+               'peak_api_in_flight', 'peak_rss_mb']
+    print(' '.join(f"{c:>18}" for c in columns))
+    for row in results:
+        print(' '.join(f"{str(row[c]):>18}" for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='*', default=list(MODES), choices=MODES)
+    parser.add_argument('--scenarios', nargs='*', default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument('--levels', nargs='*', type=int, default=[10, 50, 100, 200, 400],
+                        help='concurrent clients per run')
+    parser.add_argument('--rounds', type=int, default=3, help='/translate requests per client')
+    parser.add_argument('--duration', type=int, default=10, help='seconds of generated sample media')
+    parser.add_argument('--media', help='media file to upload instead of a generated sample')
+    parser.add_argument('--threads', type=int, default=32, help='gunicorn threads in threaded mode')
+    parser.add_argument('--job-workers', type=int, default=32, help='JOB_WORKERS in threaded mode')
+    parser.add_argument('--async-jobs', type=int, default=500, help='ASYNC_JOB_CONCURRENCY in asyncio mode')
+    parser.add_argument('--timeout', type=float, default=600, help='client timeout per request, seconds')
+    parser.add_argument('--json', help='write the report to this file')
+    add_stub_arguments(parser)
+    parser.set_defaults(whisper_latency=2.0, chat_latency=1.0, chat_token_interval=0.0, jitter=0.1)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='capacity_') as work_dir, \
+            StubServer(config_from_args(args)) as stub:
+        media_path = args.media
+        if not media_path and 'transcribe' in args.scenarios:
+            media_path = os.path.join(work_dir, f"sample_{args.duration}s.mp4")
+            generate_sample(media_path, args.duration)
+        for scenario in args.scenarios:
+            for level in args.levels:
+                for mode in args.modes:
+                    result = run_level(mode, scenario, level, stub, work_dir, media_path, args)
+                    results.append(result)
+                    print_table([result])
+
+    print()
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'cpus': os.cpu_count(),
+                'config': {key: value for key, value in vars(args).items() if key != 'json'},
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Benchmark summary PDF rendering.
+
+For summaries of roughly 1, 10 and 100 pages (plus a translated copy in a
+non-Latin script) this measures:
+
+    cold_ms     uncached render with the fonts not parsed yet, as in a fresh worker
+    warm_ms     best uncached render over --repeat runs, fonts already parsed
+    cached_ms   create_summary_pdf() when the same content was rendered before
+    bytes       output size (fonts are subset, so only used glyphs are embedded)
+    stream_ms   best pdf_stream.write_summary_pdf() run, laying out page by page
+    stream_bytes  output size of the streamed rendering
+
+Usage:
+    python benchmarks/bench_pdf.py [--pages 1 10 100] [--repeat 3] [--json report.json]
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pdf_generator  # noqa: E402
+from pdf_generator import SummaryDocument, create_summary_pdf, get_fonts, render_summary_pdf  # noqa: E402
+from pdf_stream import write_summary_pdf  # noqa: E402
+
+SECTION = """## Key Decisions
+- The **budget** for the next quarter was approved as proposed, with a review in six weeks.
+- The release ships before the end of the month; the freeze starts two weeks earlier.
+
+## Action Items
+1. Marketing prepares the launch plan and shares a draft by Friday.
+2. Support updates the documentation and the internal FAQ.
+3. Engineering triages the remaining bugs and reports daily.
+
+## Timeline
+- Code freeze in two weeks, release at the end of the month.
+
+"""
+
+TRANSLATED_SECTION = """## Ключевые решения
+- **Бюджет** на следующий квартал утверждён; пересмотр через шесть недель.
+- Релиз выходит до конца месяца, заморозка кода начинается на две недели раньше.
+
+## Задачи
+1. Маркетинг готовит план запуска к пятнице.
+2. Поддержка обновляет документацию.
+
+"""
+
+
+def page_count(summary, translated_summary):
+    pdf = SummaryDocument(get_fonts())
+    pdf.section('Meeting Summary', summary)
+    if translated_summary:
+        pdf.section('Translated Summary', translated_summary)
+    return pdf.page_no()
+
+
+def build_summary(pages):
+    """Repeat the sample sections until the document is about the given number of pages"""
+    one = page_count(SECTION, TRANSLATED_SECTION)
+    copies = max(1, round(pages / one))
+    while True:
+        summary, translated = SECTION * copies, TRANSLATED_SECTION * copies
+        count = page_count(summary, translated)
+        if count >= pages or copies > pages * 10:
+            return summary, translated, count
+        copies = max(copies + 1, int(copies * pages / count))
+
+
+def clear_cache():
+    pdf_generator._cache = pdf_generator.LRUCache(pdf_generator.PDF_CACHE_BYTES)
+
+
+def forget_fonts():
+    """Drop the parsed fonts, so the next render parses them again like the first one in a process"""
+    with pdf_generator._parsed_lock:
+        pdf_generator._parsed.clear()
+
+
+def run(pages_list, repeat):
+    results = []
+    for pages in pages_list:
+        summary, translated, count = build_summary(pages)
+        clear_cache()
+        forget_fonts()
+
+        start = time.perf_counter()
+        create_summary_pdf(summary, translated)
+        cold_ms = (time.perf_counter() - start) * 1000
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = render_summary_pdf(summary, translated)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        create_summary_pdf(summary, translated)
+        cached_ms = (time.perf_counter() - start) * 1000
+
+        stream_timings = []
+        for _ in range(repeat):
+            streamed = io.BytesIO()
+            start = time.perf_counter()
+            write_summary_pdf(streamed, summary, translated)
+            stream_timings.append((time.perf_counter() - start) * 1000)
+
+        results.append({
+            'target_pages': pages,
+            'pages': count,
+            'input_chars': len(summary) + len(translated),
+            'cold_ms': round(cold_ms, 1),
+            'warm_ms': round(min(timings), 1),
+            'cached_ms': round(cached_ms, 3),
+            'bytes': len(output),
+            'stream_ms': round(min(stream_timings), 1),
+            'stream_bytes': len(streamed.getvalue()),
+        })
+    return results
+
+
+def print_table(results):
+    columns = ['pages', 'input_chars', 'cold_ms', 'warm_ms', 'cached_ms', 'bytes', 'stream_ms', 'stream_bytes']
+    print(' '.join(f"{c:>12}" for c in columns))
+    for row in results:
+        print(' '.join(f"{str(row[c]):>12}" for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', nargs='*', type=int, default=[1, 10, 100])
+    parser.add_argument('--repeat', type=int, default=3, help='uncached renders per size; the best is reported')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    fonts = get_fonts()
+    print(f"Font: {fonts.regular or 'core Helvetica (Latin-1 only)'}")
+    results = run(args.pages, args.repeat)
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'font': fonts.regular, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Compare audio extraction profiles.
+
+For every sample file and every profile in audio.AUDIO_PROFILES this measures
+FFmpeg extraction time and output size and, with --transcribe, the Whisper
+round-trip time for the extracted audio (needs OPENAI_API_KEY).
+
+Usage:
+    python benchmarks/bench_profiles.py [--media FILE ...] [--durations 60 300]
+                                        [--transcribe] [--json report.json]
+
+Without --media, sample recordings of the given durations are generated with
+FFmpeg (a 640x360 test pattern with a modulated tone and pink noise standing in
+for speech), so the numbers are reproducible on any machine.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio import AUDIO_PROFILES, extract_command  # noqa: E402
+
+
+def generate_sample(path, duration):
+    """Create a synthetic video with an audio track of the given duration"""
+    ffmpeg_cmd = [
+        'ffmpeg', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc=duration={duration}:size=640x360:rate=25',
+        '-f', 'lavfi', '-i', f'sine=frequency=220:beep_factor=4:duration={duration}',
+        '-f', 'lavfi', '-i', f'anoisesrc=color=pink:amplitude=0.05:duration={duration}',
+        '-filter_complex', '[1:a][2:a]amix=inputs=2[a]',
+        '-map', '0:v', '-map', '[a]',
+        '-c:v', 'libx264', '-preset', 'ultrafast',
+        '-c:a', 'aac', '-ac', '2', '-ar', '44100',
+        '-y', path
+    ]
+    subprocess.run(ffmpeg_cmd, check=True)
+
+
+def time_transcription(audio_path):
+    from dotenv import load_dotenv
+    load_dotenv()
+    from openai_client import openai_client
+    start = time.perf_counter()
+    with open(audio_path, 'rb') as audio_file:
+        openai_client.transcribe(audio_file, "whisper-1")
+    return time.perf_counter() - start
+
+
+def run(media, transcribe, repeat):
+    results = []
+    with tempfile.TemporaryDirectory(prefix='bench_profiles_') as temp_dir:
+        for media_path in media:
+            for name, profile in AUDIO_PROFILES.items():
+                output_path = os.path.join(temp_dir, f"{name}{profile['extension']}")
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    subprocess.run(extract_command(media_path, output_path, name), check=True, capture_output=True)
+                    timings.append(time.perf_counter() - start)
+                row = {
+                    'media': os.path.basename(media_path),
+                    'media_bytes': os.path.getsize(media_path),
+                    'profile': name,
+                    'extract_s': round(min(timings), 3),
+                    'output_bytes': os.path.getsize(output_path),
+                }
+                if transcribe:
+                    row['transcribe_s'] = round(time_transcription(output_path), 3)
+                results.append(row)
+    return results
+
+
+def print_table(results):
+    columns = ['media', 'profile', 'extract_s', 'output_bytes', 'transcribe_s']
+    print(' '.join(f"{c:>14}" for c in columns))
+    for row in results:
+        print(' '.join(f"{str(row.get(c, '-')):>14}" for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--media', nargs='*', help='media files to benchmark instead of generated samples')
+    parser.add_argument('--durations', nargs='*', type=int, default=[60, 300, 900],
+                        help='durations in seconds of generated samples')
+    parser.add_argument('--transcribe', action='store_true', help='also time a Whisper round-trip per profile')
+    parser.add_argument('--repeat', type=int, default=3, help='extraction runs per profile; the best is reported')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench_media_') as media_dir:
+        media = args.media
+        if not media:
+            media = []
+            for duration in args.durations:
+                path = os.path.join(media_dir, f"sample_{duration}s.mp4")
+                generate_sample(path, duration)
+                media.append(path)
+        results = run(media, args.transcribe, args.repeat)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Benchmark the transcript store's full-text search on a large synthetic corpus.
+
+Fills a fresh store with --meetings generated meetings (a title, a summary
+and a transcript of --words words drawn from a Zipf-distributed vocabulary,
+with topic phrases planted in a known share of them), through the same
+queue and writer thread the server uses, then times:
+
+    index       transcripts stored per second, and the database size
+    search      p50/p95/p99 latency of each query class over --repeat runs
+    list        the first page and a deep page of the newest-first listing
+    get         reading one whole transcript with its segments
+
+Query classes run from rare (a phrase planted in 0.1% of meetings) to
+words in nearly every meeting, and again with the candidate limit lifted
+(--no-limit) to show what ranking every match would cost.
+
+Usage:
+    python benchmarks/bench_search.py [--meetings 100000] [--words 800] [--repeat 50]
+                                      [--db corpus.sqlite3] [--keep] [--json report.json]
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from loadtest import percentile  # noqa: E402
+from transcript_store import SEARCH_CANDIDATES, TranscriptStore  # noqa: E402
+
+VOCABULARY_SIZE = 20000
+SENTENCE_WORDS = 14
+# (phrase, share of meetings it is planted in)
+TOPICS = [
+    ('quarterly budget review', 0.01),
+    ('hiring plan', 0.05),
+    ('customer churn', 0.2),
+    ('incident postmortem', 0.001),
+]
+ADD_BATCH = 1000
+
+
+def vocabulary(rng):
+    letters = 'abcdefghijklmnoprstuvwy'
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        words.add(''.join(rng.choice(letters) for _ in range(rng.randint(3, 9))))
+    words = sorted(words)
+    rng.shuffle(words)
+    # Zipf: the n-th most common word turns up about 1/n as often as the first
+    weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    return words, weights
+
+
+def sentences(rng, words, weights, count):
+    drawn = rng.choices(words, cum_weights=weights, k=count)
+    return ' '.join(
+        ' '.join(drawn[i:i + SENTENCE_WORDS]).capitalize() + '.' for i in range(0, count, SENTENCE_WORDS)
+    )
+
+
+def meeting(rng, index, words, weights, length):
+    transcript = sentences(rng, words, weights, length)
+    summary = sentences(rng, words, weights, 80)
+    for phrase, share in TOPICS:
+        if rng.random() < share:
+            # Somewhere in the transcript, and in the summary of every other one
+            position = rng.randint(0, len(transcript))
+            transcript = f"{transcript[:position]} {phrase} {transcript[position:]}"
+            if index % 2:
+                summary = f"{summary} Discussed the {phrase}."
+    duration = length / 2.5
+    vad = {'applied': False, 'original_seconds': duration, 'speech_seconds': duration}
+    return {'transcript': transcript, 'summary': summary, 'translations': {}, 'vad': vad}
+
+
+def fill(store, count, length, seed):
+    rng = random.Random(seed)
+    words, weights = vocabulary(rng)
+    start = time.perf_counter()
+    for index in range(count):
+        store.add(meeting(rng, index, words, weights, length), title=f"Meeting {index}", source='benchmark')
+        if index % ADD_BATCH == ADD_BATCH - 1:
+            store.flush()
+            print(f"  {index + 1} meetings stored ({time.perf_counter() - start:.0f}s)", flush=True)
+    store.flush()
+    common = words[:3]
+    return time.perf_counter() - start, common
+
+
+def timed(fn, repeat):
+    latencies = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return latencies, result
+
+
+def row(name, latencies, **extra):
+    return dict({
+        'query': name,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+    }, **extra)
+
+
+def run_queries(store, common, repeat, label):
+    queries = [
+        ('rare phrase', '"incident postmortem"'),
+        ('1% phrase', '"quarterly budget review"'),
+        ('5% words', 'hiring plan'),
+        ('20% words', 'customer churn'),
+        ('prefix', 'budg*'),
+        ('common word', common[0]),
+        ('two common words', f"{common[1]} {common[2]}"),
+    ]
+    results = []
+    for name, query in queries:
+        latencies, found = timed(lambda: store.search(query, limit=10), repeat)
+        results.append(row(name, latencies, mode=label, hits=len(found['results']), ranking=found['ranking']))
+    latencies, found = timed(lambda: store.search('customer churn', limit=10, offset=50), repeat)
+    results.append(row('20% words, page 6', latencies, mode=label, hits=len(found['results']),
+                       ranking=found['ranking']))
+    return results
+
+
+def print_table(results):
+    columns = ['mode', 'query', 'hits', 'ranking', 'p50_ms', 'p95_ms', 'p99_ms']
+    print(' '.join(f"{c:>20}" for c in columns))
+    for result in results:
+        print(' '.join(f"{str(result.get(c, '')):>20}" for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--meetings', type=int, default=100000)
+    parser.add_argument('--words', type=int, default=800, help='transcript words per meeting')
+    parser.add_argument('--repeat', type=int, default=50, help='runs of each query')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--db', help='database path (reused if it exists, so a corpus is only built once)')
+    parser.add_argument('--keep', action='store_true', help='keep the generated database')
+    parser.add_argument('--no-limit', action='store_true', help='also rank every match, without the candidate limit')
+    parser.add_argument('--json', help='write the report to this file')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='search_')
+    path = args.db or os.path.join(work_dir, 'transcripts.sqlite3')
+    store = TranscriptStore(path)
+    report = {'meetings': args.meetings, 'words': args.words}
+    if os.path.exists(path) and store.stats()['transcripts'] >= args.meetings:
+        print(f"Reusing {path}")
+        common = vocabulary(random.Random(args.seed))[0][:3]
+    else:
+        print(f"Indexing {args.meetings} meetings of {args.words} words into {path}")
+        elapsed, common = fill(store, args.meetings, args.words, args.seed)
+        report['index_seconds'] = round(elapsed, 1)
+        report['index_per_second'] = round(args.meetings / elapsed, 1)
+    report['db_mb'] = round(sum(os.path.getsize(f"{path}{suffix}") for suffix in ('', '-wal')
+                                if os.path.exists(f"{path}{suffix}")) / 2 ** 20, 1)
+    report.update(store.stats())
+
+    results = run_queries(store, common, args.repeat, f'top {SEARCH_CANDIDATES}')
+    if args.no_limit:
+        unlimited = TranscriptStore(path, candidates=-1)
+        results += run_queries(unlimited, common, max(3, args.repeat // 10), 'all matches')
+
+    items, cursor = store.list(limit=20)
+    latencies, _ = timed(lambda: store.list(limit=20), args.repeat)
+    results.append(row('list first page', latencies, mode='list', hits=len(items)))
+    deep = str(store.stats()['transcripts'] // 2)
+    latencies, _ = timed(lambda: store.list(limit=20, cursor=deep), args.repeat)
+    results.append(row('list deep page', latencies, mode='list', hits=20))
+    latencies, _ = timed(lambda: store.get(items[0]['transcript_id']), args.repeat)
+    results.append(row('get transcript', latencies, mode='get', hits=1))
+
+    print()
+    print(json.dumps(report))
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(report, started_at=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                           python=platform.python_version(), results=results), f, indent=2)
+    if not args.keep and not args.db:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(f"{path}{suffix}"):
+                os.remove(f"{path}{suffix}")
+        os.rmdir(work_dir)
+
+
+if __name__ == '__main__':
+    main()
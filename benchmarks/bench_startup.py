@@ -0,0 +1,218 @@
+"""
+Track cold-start time: how long the server modules take to import and how
+long a server takes from launch to serving its first request.
+
+    import      seconds to import server, asgi and process_file in a fresh
+                interpreter, over --repeat runs, and how long
+                api.preload_modules() then takes to load the modules
+                requests import on first use
+    modules     the slowest imports under `import server`, from python -X importtime
+    boot        per serving mode, seconds from launch to the first /test response
+                and to /readyz reporting ready, the latency of the first
+                /generate-pdf (which needs the lazily imported PDF modules),
+                and the RSS and PSS of the whole process tree once every
+                worker is up; PSS splits shared pages between the processes
+                sharing them, so it shows what a preloading master saves
+
+Modes: gunicorn with gunicorn.conf.py and preload_app (the Procfile), the
+same with PRELOAD_APP=0 (every worker imports the app itself), and uvicorn
+running asgi:app. Nothing here talks to OpenAI or SendGrid, so no stub
+servers are needed.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat 10] [--workers 4] [--top 15]
+                                       [--modes preload no-preload uvicorn] [--json report.json]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_capacity import process_tree  # noqa: E402
+from loadtest import REPO_DIR, AppServer, percentile  # noqa: E402
+
+MODULES = ('server', 'asgi', 'process_file')
+MODES = ('preload', 'no-preload', 'uvicorn')
+# Never contacted; the servers only need somewhere to point their clients
+UNUSED_URL = 'http://127.0.0.1:9'
+
+
+class BootServer(AppServer):
+    """server:app under gunicorn.conf.py, or asgi:app under uvicorn"""
+
+    def __init__(self, mode, work_dir, workers):
+        super().__init__(UNUSED_URL, work_dir, env={'PRELOAD_APP': '0' if mode == 'no-preload' else '1'})
+        self.mode = mode
+        self.workers = workers
+
+    def command(self):
+        if self.mode == 'uvicorn':
+            return [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(self.port),
+                    '--log-level', 'warning']
+        return [sys.executable, '-m', 'gunicorn', 'server:app', '--config', os.path.join(REPO_DIR, 'gunicorn.conf.py'),
+                '--bind', f'127.0.0.1:{self.port}', '--workers', str(self.workers)]
+
+    def expected_processes(self):
+        return 1 if self.mode == 'uvicorn' else self.workers + 1
+
+
+def smaps_bytes(pid, field):
+    """A field of /proc/<pid>/smaps_rollup, e.g. 'Rss' or 'Pss' (Linux 4.14+; None elsewhere)"""
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith(f'{field}:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def tree_bytes(pid, field):
+    sizes = [smaps_bytes(p, field) for p in process_tree(pid)]
+    sizes = [size for size in sizes if size is not None]
+    return sum(sizes) if sizes else None
+
+
+def run_python(code, work_dir, *options):
+    """Run code in a fresh interpreter started in work_dir, with the repository importable"""
+    env = dict(os.environ, PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    return subprocess.run([sys.executable, *options, '-c', code], cwd=work_dir, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def time_import(module, work_dir, repeat):
+    """Seconds to import module in a fresh interpreter, once per run"""
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    return sorted(float(run_python(code, work_dir).stdout.split()[-1]) for _ in range(repeat))
+
+
+def time_preload(work_dir, repeat):
+    code = ("import server, api, time; start = time.perf_counter(); api.preload_modules(); "
+            "print(time.perf_counter() - start)")
+    return sorted(float(run_python(code, work_dir).stdout.split()[-1]) for _ in range(repeat))
+
+
+def slowest_imports(work_dir, top):
+    """(cumulative ms, self ms, module) of the slowest imports under `import server`"""
+    result = run_python('import server', work_dir, '-X', 'importtime')
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us) / 1000, int(self_us) / 1000, name.rstrip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def wait_for(url, timeout, ok=lambda response: True):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            response = requests.get(url, timeout=1)
+            if ok(response):
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.02)
+    raise Exception(f"{url} not ready within {timeout}s")
+
+
+def boot(mode, work_dir, workers, timeout=60):
+    server = BootServer(mode, work_dir, workers)
+    start = time.perf_counter()
+    server.start(timeout)
+    try:
+        first_response = time.perf_counter() - start
+        wait_for(f"{server.url}/readyz", timeout, lambda response: response.status_code == 200)
+        ready = time.perf_counter() - start
+        # Let every worker finish booting before the tree is measured
+        deadline = time.time() + timeout
+        while len(process_tree(server.process.pid)) < server.expected_processes() and time.time() < deadline:
+            time.sleep(0.05)
+        time.sleep(1)
+        pdf_start = time.perf_counter()
+        requests.post(f"{server.url}/generate-pdf", json={'summary': '# Summary\n\n- one point'},
+                      timeout=timeout).raise_for_status()
+        first_pdf = time.perf_counter() - pdf_start
+        pid = server.process.pid
+        return {
+            'mode': mode,
+            'processes': len(process_tree(pid)),
+            'first_response_s': round(first_response, 3),
+            'ready_s': round(ready, 3),
+            'first_pdf_ms': round(first_pdf * 1000, 1),
+            'rss_mb': round((tree_bytes(pid, 'Rss') or 0) / 2 ** 20, 1),
+            'pss_mb': round((tree_bytes(pid, 'Pss') or 0) / 2 ** 20, 1),
+        }
+    finally:
+        server.stop()
+
+
+def print_table(rows, columns):
+    print(' '.join(f"{c:>18}" for c in columns))
+    for row in rows:
+        print(' '.join(f"{str(row.get(c, '')):>18}" for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=10, help='fresh interpreters per import measurement')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--top', type=int, default=15, help='slowest imports to list')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--json', help='write the report to this file')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='startup_')
+    try:
+        imports = []
+        for module in MODULES:
+            seconds = time_import(module, work_dir, args.repeat)
+            imports.append({'import': module, 'median_s': round(statistics.median(seconds), 3),
+                            'p95_s': round(percentile(seconds, 95), 3)})
+        seconds = time_preload(work_dir, args.repeat)
+        imports.append({'import': 'preload_modules()', 'median_s': round(statistics.median(seconds), 3),
+                        'p95_s': round(percentile(seconds, 95), 3)})
+        print_table(imports, ['import', 'median_s', 'p95_s'])
+
+        modules = slowest_imports(work_dir, args.top)
+        print()
+        print(f"{'cumulative_ms':>14} {'self_ms':>10}  module")
+        for cumulative, own, name in modules:
+            print(f"{cumulative:>14.1f} {own:>10.1f}  {name}")
+
+        boots = [boot(mode, work_dir, args.workers) for mode in args.modes]
+        print()
+        print_table(boots, ['mode', 'processes', 'first_response_s', 'ready_s', 'first_pdf_ms', 'rss_mb', 'pss_mb'])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'repeat': args.repeat,
+                'workers': args.workers,
+                'imports': imports,
+                'slowest_imports': [{'module': name.strip(), 'cumulative_ms': cumulative, 'self_ms': own}
+                                    for cumulative, own, name in modules],
+                'boot': boots,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
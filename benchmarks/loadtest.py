@@ -0,0 +1,301 @@
+"""
+Load-test the Flask app against stubbed OpenAI and SendGrid APIs.
+
+Starts benchmarks/stub_servers.py in-process, runs server.app in a separate
+process pointed at it (OPENAI_BASE_URL / SENDGRID_HOST), generates sample
+media with FFmpeg and drives each endpoint at a fixed concurrency:
+
+    transcribe   POST /transcribe, then poll the job until it finishes
+    translate    POST /translate
+    pdf          POST /generate-pdf
+    email        POST /send-email, then poll the delivery status
+
+For each scenario the report has throughput, p50/p95/p99 latency, error
+count and the server's peak RSS, plus the server's own /test metrics
+snapshot. The result cache is off unless --cache is given, so repeated media
+is really processed every time.
+
+Usage:
+    python benchmarks/loadtest.py [--scenarios transcribe translate pdf email]
+                                  [--requests 20] [--concurrency 4] [--durations 30 120]
+                                  [--whisper-latency 1.0] [--fail-rate 0.05] [--json report.json]
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_profiles import generate_sample  # noqa: E402
+from stub_servers import SUMMARY, StubServer, add_stub_arguments, config_from_args  # noqa: E402
+
+SCENARIOS = ('transcribe', 'translate', 'pdf', 'email')
+JOB_POLL_SECONDS = 0.2
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def peak_rss_bytes(pid):
+    """Peak resident set size of a process (Linux only; None elsewhere)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class AppServer:
+    """server.app running in its own process, so its memory is measured on its own"""
+
+    def __init__(self, stub_url, work_dir, cache=False, env=None):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.work_dir = work_dir
+        self.env = dict(
+            os.environ,
+            PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''),
+            OPENAI_API_KEY='sk-stub',
+            OPENAI_BASE_URL=f"{stub_url}/v1",
+            SENDGRID_API_KEY='SG.stub',
+            SENDGRID_FROM_EMAIL='bench@example.com',
+            SENDGRID_HOST=stub_url,
+            JOB_QUEUE_BACKEND='memory',
+            RESULT_CACHE_BACKEND=os.environ.get('RESULT_CACHE_BACKEND', 'sqlite') if cache else 'off',
+            **(env or {})
+        )
+        self.process = None
+
+    def command(self):
+        """How to run the server; subclasses start it under gunicorn or uvicorn instead"""
+        code = f"import server; server.app.run(host='127.0.0.1', port={self.port}, threaded=True)"
+        return [sys.executable, '-c', code]
+
+    def start(self, timeout=30):
+        log = open(os.path.join(self.work_dir, 'server.out'), 'w')
+        self.process = subprocess.Popen(self.command(), cwd=self.work_dir, env=self.env,
+                                        stdout=log, stderr=subprocess.STDOUT)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise Exception(f"Server exited; see {log.name}")
+            try:
+                requests.get(f"{self.url}/test", timeout=1)
+                return self
+            except requests.RequestException:
+                time.sleep(0.2)
+        raise Exception(f"Server did not start within {timeout}s")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait(10)
+
+
+_sessions = threading.local()
+
+
+def session():
+    if not hasattr(_sessions, 'session'):
+        _sessions.session = requests.Session()
+    return _sessions.session
+
+
+def post_transcribe(app_url, media_path, args):
+    """Upload one file and wait for its job; returns extra per-request fields"""
+    params = {}
+    if args.stream_uploads:
+        params['stream'] = '1'
+    if args.languages:
+        params['languages'] = ','.join(args.languages)
+    with open(media_path, 'rb') as f:
+        start = time.perf_counter()
+        response = session().post(f"{app_url}/transcribe", params=params,
+                                  files={'file': (os.path.basename(media_path), f)}, timeout=600)
+    accepted_ms = (time.perf_counter() - start) * 1000
+    response.raise_for_status()
+    wait_for_job(f"{app_url}/jobs/{response.json()['job_id']}")
+    return {'accept_ms': accepted_ms}
+
+
+def post_email(app_url, payload):
+    """Queue one email and wait until it has been delivered"""
+    start = time.perf_counter()
+    response = session().post(f"{app_url}/send-email", json=payload, timeout=60)
+    accepted_ms = (time.perf_counter() - start) * 1000
+    response.raise_for_status()
+    wait_for_job(app_url + response.json()['status_url'])
+    return {'accept_ms': accepted_ms}
+
+
+def wait_for_job(status_url):
+    while True:
+        job = session().get(status_url, timeout=30).json()
+        if job['status'] in ('done', 'failed'):
+            break
+        time.sleep(JOB_POLL_SECONDS)
+    if job['status'] == 'failed':
+        raise Exception(job.get('error') or 'job failed')
+
+
+def post_json(url, payload):
+    response = session().post(url, json=payload, timeout=600)
+    response.raise_for_status()
+    return {}
+
+
+def scenario_request(name, app_url, media, args):
+    """Return a function(i) performing request i of the scenario"""
+    if name == 'transcribe':
+        return lambda i: post_transcribe(app_url, media[i % len(media)], args)
+    if name == 'translate':
+        return lambda i: post_json(f"{app_url}/translate",
+                                   {"text": f"{SUMMARY}\n\nRequest {i}", "targetLanguage": "Spanish"})
+    if name == 'pdf':
+        summary = '\n\n'.join([SUMMARY] * args.summary_repeat)
+        return lambda i: post_json(f"{app_url}/generate-pdf", {"summary": summary, "translatedSummary": summary})
+    if name == 'email':
+        recipients = [f"user{n}@example.com" for n in range(args.recipients)]
+        return lambda i: post_email(app_url, {"recipients": recipients, "summary": SUMMARY})
+    raise ValueError(f"Unknown scenario {name}")
+
+
+def run_scenario(name, app, media, args):
+    request_fn = scenario_request(name, app.url, media, args)
+    latencies, extras, errors = [], [], []
+
+    def run(i):
+        start = time.perf_counter()
+        try:
+            extra = request_fn(i)
+        except Exception as e:
+            errors.append(str(e))
+            return
+        latencies.append((time.perf_counter() - start) * 1000)
+        extras.append(extra)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(run, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    result = {
+        'scenario': name,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'ok': len(latencies),
+        'errors': len(errors),
+        'error_samples': sorted(set(errors))[:5],
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 3) if elapsed else None,
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies) if latencies else None,
+        },
+        'server_peak_rss_bytes': peak_rss_bytes(app.process.pid),
+    }
+    accept = [extra['accept_ms'] for extra in extras if 'accept_ms' in extra]
+    if accept:
+        result['accept_latency_ms'] = {'p50': percentile(accept, 50), 'p95': percentile(accept, 95),
+                                       'p99': percentile(accept, 99)}
+    for key in ('latency_ms', 'accept_latency_ms'):
+        if key in result:
+            result[key] = {q: round(v, 1) if v is not None else None for q, v in result[key].items()}
+    return result
+
+
+def print_table(results):
+    columns = ['scenario', 'ok', 'errors', 'throughput_rps', 'p50', 'p95', 'p99', 'peak_rss_mb']
+    print(' '.join(f"{c:>14}" for c in columns))
+    for row in results:
+        rss = row['server_peak_rss_bytes']
+        values = [row['scenario'], row['ok'], row['errors'], row['throughput_rps'],
+                  row['latency_ms']['p50'], row['latency_ms']['p95'], row['latency_ms']['p99'],
+                  round(rss / 2 ** 20, 1) if rss else '-']
+        print(' '.join(f"{str(v):>14}" for v in values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='*', default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument('--requests', type=int, default=20, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4, help='requests in flight at once')
+    parser.add_argument('--durations', nargs='*', type=int, default=[30, 120],
+                        help='durations in seconds of generated media')
+    parser.add_argument('--media', nargs='*', help='media files to upload instead of generated samples')
+    parser.add_argument('--languages', nargs='*', default=[], help='translation languages for /transcribe')
+    parser.add_argument('--stream-uploads', action='store_true', help='upload with ?stream=1')
+    parser.add_argument('--summary-repeat', type=int, default=5, help='summary copies per PDF, to scale page count')
+    parser.add_argument('--recipients', type=int, default=3, help='recipients per email')
+    parser.add_argument('--workers', type=int, help='JOB_WORKERS for the server')
+    parser.add_argument('--cache', action='store_true', help='leave the result cache on')
+    parser.add_argument('--json', help='write the report to this file')
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    env = {'JOB_WORKERS': str(args.workers)} if args.workers else {}
+    with tempfile.TemporaryDirectory(prefix='loadtest_') as work_dir, \
+            StubServer(config_from_args(args)) as stub:
+        media = args.media
+        if not media and 'transcribe' in args.scenarios:
+            media = []
+            for duration in args.durations:
+                path = os.path.join(work_dir, f"sample_{duration}s.mp4")
+                generate_sample(path, duration)
+                media.append(path)
+
+        app = AppServer(stub.url, work_dir, cache=args.cache, env=env).start()
+        try:
+            results = [run_scenario(name, app, media, args) for name in args.scenarios]
+            server_metrics = requests.get(f"{app.url}/test", timeout=10).json().get('metrics')
+        finally:
+            app.stop()
+
+        report = {
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'config': {key: value for key, value in vars(args).items() if key != 'json'},
+            'media': [{'name': os.path.basename(p), 'bytes': os.path.getsize(p)} for p in media or []],
+            'stub_requests': stub.counts,
+            'results': results,
+            'server_metrics': server_metrics,
+        }
+
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""
+Local stand-ins for the OpenAI and SendGrid APIs.
+
+One threaded HTTP server answers:
+
+    POST /v1/audio/transcriptions   Whisper: {"text": ...}
+    POST /v1/chat/completions       ChatCompletion, plain or streamed (SSE)
+    POST /v3/mail/send              SendGrid: 202 with an empty body
+
+Point the app at it with OPENAI_BASE_URL=<url>/v1 and SENDGRID_HOST=<url>.
+Latency and failures are injected per API so queueing and retry behaviour
+can be measured without network access or API spend.
+
+Run standalone with:
+    python benchmarks/stub_servers.py --port 9000 --whisper-latency 2 --fail-rate 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "the budget for the next quarter was approved and the team agreed to ship the release "
+    "before the end of the month while marketing prepares the launch plan and support "
+    "updates the documentation action items were assigned to each owner with a deadline"
+).split()
+
+SUMMARY = """# Meeting Summary
+
+## Key Decisions
+- The budget for the next quarter was approved.
+- The release ships before the end of the month.
+
+## Action Items
+- Marketing prepares the launch plan.
+- Support updates the documentation.
+
+## Timeline
+- Release at the end of the month.
+
+## Budget
+- Approved as proposed."""
+
+
+class StubConfig:
+    """Latency (seconds) and failure injection for each stubbed API"""
+
+    def __init__(self, whisper_latency=1.0, whisper_seconds_per_mb=0.5, chat_latency=0.5,
+                 chat_token_interval=0.01, sendgrid_latency=0.2, jitter=0.2,
+                 fail_rate=0.0, fail_status=503, words_per_mb=1500):
+        self.whisper_latency = whisper_latency
+        self.whisper_seconds_per_mb = whisper_seconds_per_mb
+        self.chat_latency = chat_latency
+        self.chat_token_interval = chat_token_interval
+        self.sendgrid_latency = sendgrid_latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.words_per_mb = words_per_mb
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Capacity tests open hundreds of connections at once; the default backlog of 5 would drop them
+    request_queue_size = 1024
+
+
+class StubServer:
+    """Run the stand-in APIs on a background thread; use as a context manager"""
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        self.config = config or StubConfig()
+        self.counts = {}
+        self.in_flight = {}
+        self.peak_in_flight = {}
+        self._lock = threading.Lock()
+        self._server = _HTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    @contextmanager
+    def track(self, name):
+        """Count a request as in flight for the block, keeping the highest concurrency seen"""
+        with self._lock:
+            self.in_flight[name] = self.in_flight.get(name, 0) + 1
+            self.peak_in_flight[name] = max(self.peak_in_flight.get(name, 0), self.in_flight[name])
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight[name] -= 1
+
+    def reset(self):
+        """Clear the request counters and concurrency peaks between measurements"""
+        with self._lock:
+            self.counts = {}
+            self.peak_in_flight = {}
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _sleep(self, seconds):
+                jitter = stub.config.jitter
+                time.sleep(max(0.0, seconds * random.uniform(1 - jitter, 1 + jitter)))
+
+            def _send(self, status, body=b'', content_type='application/json', headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_json(self, status, data, headers=None):
+                self._send(status, json.dumps(data).encode(), headers=headers)
+
+            def _maybe_fail(self, api):
+                if random.random() >= stub.config.fail_rate:
+                    return False
+                stub.count(f"{api}_failed")
+                status = stub.config.fail_status
+                headers = {'Retry-After': '1'} if status == 429 else None
+                self._send_json(status, {"error": {"message": f"Injected {status}", "type": "stub"}}, headers)
+                return True
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                path = self.path.split('?')[0]
+                if path.endswith('/audio/transcriptions'):
+                    with stub.track('whisper'):
+                        self.transcription(body)
+                elif path.endswith('/chat/completions'):
+                    with stub.track('chat'):
+                        self.chat(json.loads(body or b'{}'))
+                elif path.endswith('/mail/send'):
+                    with stub.track('sendgrid'):
+                        self.mail()
+                else:
+                    self._send_json(404, {"error": {"message": f"No stub for {path}"}})
+
+            def transcription(self, body):
+                stub.count('whisper')
+                megabytes = len(body) / 1e6
+                self._sleep(stub.config.whisper_latency + stub.config.whisper_seconds_per_mb * megabytes)
+                if self._maybe_fail('whisper'):
+                    return
+                words = max(10, int(megabytes * stub.config.words_per_mb))
+                text = ' '.join(WORDS[i % len(WORDS)] for i in range(words)) + '.'
+                self._send_json(200, {"text": text})
+
+            def chat(self, request):
+                stub.count('chat')
+                self._sleep(stub.config.chat_latency)
+                if self._maybe_fail('chat'):
+                    return
+                messages = request.get('messages', [])
+                prompt = ' '.join(m.get('content', '') for m in messages)
+                if 'translator' in prompt and messages:
+                    reply = messages[-1].get('content', '')
+                else:
+                    reply = SUMMARY
+                usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(reply) // 4,
+                         "total_tokens": (len(prompt) + len(reply)) // 4}
+                base = {"id": "chatcmpl-stub", "created": int(time.time()), "model": request.get('model', 'stub')}
+                if not request.get('stream'):
+                    self._send_json(200, dict(base, object="chat.completion", usage=usage, choices=[
+                        {"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}
+                    ]))
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+                for token in reply.split(' '):
+                    chunk = dict(base, object="chat.completion.chunk", choices=[
+                        {"index": 0, "delta": {"content": token + ' '}, "finish_reason": None}
+                    ])
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                    time.sleep(stub.config.chat_token_interval)
+                if (request.get('stream_options') or {}).get('include_usage'):
+                    chunk = dict(base, object="chat.completion.chunk", choices=[], usage=usage)
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.write(b"data: [DONE]\n\n")
+
+            def mail(self):
+                stub.count('sendgrid')
+                self._sleep(stub.config.sendgrid_latency)
+                if self._maybe_fail('sendgrid'):
+                    return
+                self._send(202, headers={'X-Message-Id': 'stub'})
+
+        return Handler
+
+
+def add_stub_arguments(parser):
+    """Command-line options for StubConfig, shared with the load test"""
+    parser.add_argument('--whisper-latency', type=float, default=1.0, help='seconds per transcription request')
+    parser.add_argument('--whisper-seconds-per-mb', type=float, default=0.5,
+                        help='extra transcription seconds per MB of audio')
+    parser.add_argument('--chat-latency', type=float, default=0.5, help='seconds before a chat reply starts')
+    parser.add_argument('--chat-token-interval', type=float, default=0.01, help='seconds between streamed tokens')
+    parser.add_argument('--sendgrid-latency', type=float, default=0.2, help='seconds per SendGrid request')
+    parser.add_argument('--jitter', type=float, default=0.2, help='relative +/- jitter applied to latencies')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of API requests that fail')
+    parser.add_argument('--fail-status', type=int, default=503, help='status code of injected failures')
+
+
+def config_from_args(args):
+    return StubConfig(
+        whisper_latency=args.whisper_latency,
+        whisper_seconds_per_mb=args.whisper_seconds_per_mb,
+        chat_latency=args.chat_latency,
+        chat_token_interval=args.chat_token_interval,
+        sendgrid_latency=args.sendgrid_latency,
+        jitter=args.jitter,
+        fail_rate=args.fail_rate,
+        fail_status=args.fail_status,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=9000)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    stub = StubServer(config_from_args(args), port=args.port).start()
+    print(f"Stub APIs listening on {stub.url}")
+    print(f"  OPENAI_BASE_URL={stub.url}/v1 SENDGRID_HOST={stub.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
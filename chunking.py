@@ -0,0 +1,352 @@
+import asyncio
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from audio import run_command_async
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Whisper rejects uploads over 25 MB; keep a little headroom
+MAX_UPLOAD_BYTES = 24 * 1024 * 1024
+CHUNK_SECONDS = float(os.getenv('TRANSCRIBE_CHUNK_SECONDS', '600'))
+CHUNK_OVERLAP_SECONDS = float(os.getenv('TRANSCRIBE_CHUNK_OVERLAP_SECONDS', '2'))
+SILENCE_SEARCH_SECONDS = float(os.getenv('TRANSCRIBE_SILENCE_SEARCH_SECONDS', '30'))
+MAX_CONCURRENCY = int(os.getenv('TRANSCRIBE_CONCURRENCY', '4'))
+
+_SILENCE_START = re.compile(r'silence_start: (-?[\d.]+)')
+_SILENCE_END = re.compile(r'silence_end: (-?[\d.]+)')
+
+
+class Chunk:
+    """A slice of the source audio written to its own file"""
+
+    def __init__(self, index, path, start, end):
+        self.index = index
+        self.path = path
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f"Chunk({self.index}, {self.start:.1f}-{self.end:.1f}s)"
+
+
+def _probe_command(audio_path):
+    return ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+            '-of', 'default=noprint_wrappers=1:nokey=1', audio_path]
+
+
+def probe_duration(audio_path):
+    """Return the duration of a media file in seconds using ffprobe"""
+    try:
+        result = subprocess.run(_probe_command(audio_path), check=True, capture_output=True, text=True)
+        return float(result.stdout.strip())
+    except (subprocess.CalledProcessError, ValueError) as e:
+        raise Exception(f"Error probing audio duration: {str(e)}")
+
+
+async def probe_duration_async(audio_path):
+    """probe_duration() without blocking the event loop"""
+    returncode, stdout, stderr = await run_command_async(_probe_command(audio_path))
+    try:
+        if returncode != 0:
+            raise ValueError(stderr.strip())
+        return float(stdout.strip())
+    except ValueError as e:
+        raise Exception(f"Error probing audio duration: {str(e)}")
+
+
+def _silence_command(audio_path, noise_db, min_silence):
+    return [
+        'ffmpeg', '-hide_banner', '-nostats',
+        '-i', audio_path,
+        '-af', f'silencedetect=noise={noise_db}dB:d={min_silence}',
+        '-f', 'null', '-'
+    ]
+
+
+def detect_silences(audio_path, noise_db=-35, min_silence=0.4):
+    """Return (start, end) pairs for silent stretches found by FFmpeg's silencedetect filter"""
+    try:
+        result = subprocess.run(_silence_command(audio_path, noise_db, min_silence),
+                                check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"Error detecting silence: {e.stderr}")
+    return _parse_silences(result.stderr)
+
+
+async def detect_silences_async(audio_path, noise_db=-35, min_silence=0.4):
+    returncode, _, stderr = await run_command_async(_silence_command(audio_path, noise_db, min_silence))
+    if returncode != 0:
+        raise Exception(f"Error detecting silence: {stderr}")
+    return _parse_silences(stderr)
+
+
+def _parse_silences(stderr):
+    silences = []
+    start = None
+    for line in stderr.splitlines():
+        match = _SILENCE_START.search(line)
+        if match:
+            start = max(0.0, float(match.group(1)))
+            continue
+        match = _SILENCE_END.search(line)
+        if match and start is not None:
+            silences.append((start, float(match.group(1))))
+            start = None
+    return silences
+
+
+def plan_chunks(duration, silences, chunk_seconds=CHUNK_SECONDS,
+                overlap=CHUNK_OVERLAP_SECONDS, search_window=SILENCE_SEARCH_SECONDS):
+    """
+    Choose (start, end) boundaries of at most chunk_seconds each.
+
+    Each cut is placed in the middle of the latest silence within search_window
+    seconds before the target boundary. When no silence is available the cut is
+    made at the boundary and the chunk is extended by overlap seconds so the
+    split word appears in both chunks and can be merged when stitching.
+    """
+    bounds = []
+    start = 0.0
+    while duration - start > chunk_seconds:
+        target = start + chunk_seconds
+        candidates = [
+            (s + e) / 2 for s, e in silences
+            if target - search_window <= (s + e) / 2 <= target and (s + e) / 2 > start
+        ]
+        if candidates:
+            cut = max(candidates)
+            bounds.append((start, cut))
+        else:
+            cut = target
+            bounds.append((start, min(duration, cut + overlap)))
+        start = cut
+    bounds.append((start, duration))
+    return bounds
+
+
+def _split_command(audio_path, start, end, chunk_path):
+    return [
+        'ffmpeg', '-hide_banner',
+        '-ss', f'{start:.3f}',
+        '-t', f'{end - start:.3f}',
+        '-i', audio_path,
+        '-c', 'copy',
+        '-y',
+        chunk_path
+    ]
+
+
+def _chunk_plan(audio_path, out_dir, duration, silences, chunk_seconds, overlap):
+    """(Chunk, FFmpeg command) for every chunk of the file, in order"""
+    ext = os.path.splitext(audio_path)[1] or '.mp3'
+    plan = []
+    for index, (start, end) in enumerate(plan_chunks(duration, silences, chunk_seconds, overlap)):
+        chunk_path = os.path.join(out_dir, f"chunk_{index:04d}{ext}")
+        plan.append((Chunk(index, chunk_path, start, end), _split_command(audio_path, start, end, chunk_path)))
+    return plan
+
+
+def _check_chunk_size(chunk):
+    if os.path.getsize(chunk.path) > MAX_UPLOAD_BYTES:
+        raise Exception(
+            f"Audio chunk {chunk.index} is larger than {MAX_UPLOAD_BYTES} bytes; "
+            f"lower TRANSCRIBE_CHUNK_SECONDS"
+        )
+
+
+def split_audio(audio_path, out_dir, chunk_seconds=CHUNK_SECONDS, overlap=CHUNK_OVERLAP_SECONDS):
+    """Split audio into chunk files at silence boundaries and return the chunks in order"""
+    duration = probe_duration(audio_path)
+    silences = detect_silences(audio_path) if duration > chunk_seconds else []
+
+    chunks = []
+    for chunk, ffmpeg_cmd in _chunk_plan(audio_path, out_dir, duration, silences, chunk_seconds, overlap):
+        try:
+            subprocess.run(ffmpeg_cmd, check=True, capture_output=True, text=True)
+        except subprocess.CalledProcessError as e:
+            raise Exception(f"Error splitting audio: {e.stderr}")
+        _check_chunk_size(chunk)
+        chunks.append(chunk)
+
+    logger.info(f"Split {duration:.1f}s of audio into {len(chunks)} chunks")
+    return chunks
+
+
+async def split_audio_async(audio_path, out_dir, chunk_seconds=CHUNK_SECONDS, overlap=CHUNK_OVERLAP_SECONDS):
+    """split_audio() without blocking the event loop"""
+    duration = await probe_duration_async(audio_path)
+    silences = await detect_silences_async(audio_path) if duration > chunk_seconds else []
+
+    chunks = []
+    for chunk, ffmpeg_cmd in _chunk_plan(audio_path, out_dir, duration, silences, chunk_seconds, overlap):
+        returncode, _, stderr = await run_command_async(ffmpeg_cmd)
+        if returncode != 0:
+            raise Exception(f"Error splitting audio: {stderr}")
+        _check_chunk_size(chunk)
+        chunks.append(chunk)
+
+    logger.info(f"Split {duration:.1f}s of audio into {len(chunks)} chunks")
+    return chunks
+
+
+def transcribe_chunks(chunks, transcribe_fn, max_workers=MAX_CONCURRENCY, on_chunk=None):
+    """
+    Transcribe chunks concurrently with transcribe_fn(path) and return texts in chunk order.
+
+    on_chunk(index, text) is called from the worker thread as each chunk finishes.
+    """
+    def run(chunk):
+        text = transcribe_fn(chunk.path)
+        if on_chunk:
+            on_chunk(chunk.index, text)
+        return text
+
+    if len(chunks) == 1:
+        return [run(chunks[0])]
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='whisper') as executor:
+        return list(executor.map(run, chunks))
+
+
+async def transcribe_chunks_async(chunks, transcribe_fn, max_workers=MAX_CONCURRENCY, on_chunk=None):
+    """transcribe_chunks() for a coroutine function transcribe_fn, bounded by a semaphore instead of a pool"""
+    slots = asyncio.Semaphore(max_workers)
+
+    async def run(chunk):
+        async with slots:
+            text = await transcribe_fn(chunk.path)
+        if on_chunk:
+            on_chunk(chunk.index, text)
+        return text
+
+    return await asyncio.gather(*(run(chunk) for chunk in chunks))
+
+
+def _normalize(word):
+    return word.lower().strip(".,!?;:\"'()[]")
+
+
+def _new_words(merged, words, max_overlap_words=30, min_overlap_words=2):
+    """Words of the next chunk that are not a repeat of the end of merged"""
+    if not merged:
+        return words
+    tail = [_normalize(w) for w in merged[-max_overlap_words:]]
+    head = [_normalize(w) for w in words[:max_overlap_words]]
+    for size in range(min(len(tail), len(head)), min_overlap_words - 1, -1):
+        if tail[-size:] == head[:size]:
+            return words[size:]
+    return words
+
+
+def overlapping_seams(chunks):
+    """For each chunk, whether it overlaps the one before (a cut made without a silence to cut at)"""
+    return [index > 0 and chunks[index - 1].end > chunk.start for index, chunk in enumerate(chunks)]
+
+
+def stitch_transcripts(texts, overlaps=None, max_overlap_words=30, min_overlap_words=2):
+    """
+    Join chunk transcripts in order, dropping words repeated across a seam.
+
+    overlaps (see overlapping_seams) limits that to the seams where the audio
+    overlaps; at a silence cut a phrase said twice on either side is kept.
+    """
+    merged = []
+    for index, text in enumerate(texts):
+        words = text.split()
+        if overlaps is None or overlaps[index]:
+            words = _new_words(merged, words, max_overlap_words, min_overlap_words)
+        merged.extend(words)
+    return ' '.join(merged)
+
+
+class OrderedStitcher:
+    """
+    Stitch chunk transcripts as they finish, in any order.
+
+    Text is released to on_text only once every earlier chunk is in, so the
+    pieces it receives concatenate (with spaces) to the final transcript.
+    overlaps is as for stitch_transcripts().
+    """
+
+    def __init__(self, on_text, overlaps=None):
+        self.on_text = on_text
+        self.overlaps = overlaps
+        self._merged = []
+        self._pending = {}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def add(self, index, text):
+        with self._lock:
+            self._pending[index] = text
+            while self._next in self._pending:
+                words = self._pending.pop(self._next).split()
+                if self.overlaps is None or self.overlaps[self._next]:
+                    words = _new_words(self._merged, words)
+                self._merged.extend(words)
+                self._next += 1
+                if words:
+                    self.on_text(' '.join(words))
+
+
+def _fit_chunk_seconds(size, duration, chunk_seconds):
+    """Chunk length for a file that needs splitting, shrunk so each chunk stays under the upload limit"""
+    if size > MAX_UPLOAD_BYTES:
+        bytes_per_second = size / max(duration, 1.0)
+        chunk_seconds = min(chunk_seconds, MAX_UPLOAD_BYTES * 0.9 / bytes_per_second)
+    return chunk_seconds
+
+
+def transcribe_long_audio(audio_path, transcribe_fn, chunk_seconds=CHUNK_SECONDS,
+                          overlap=CHUNK_OVERLAP_SECONDS, max_workers=MAX_CONCURRENCY, on_text=None, temp_dir=None):
+    """
+    Transcribe audio of any length.
+
+    Short files go to transcribe_fn(path) in one call. Longer files are split at
+    silence boundaries, transcribed concurrently through a bounded thread pool
+    and stitched back together in order. If given, on_text(text) receives the
+    transcript in order, piece by piece, as soon as each piece is known. Chunk
+    files are written under temp_dir (the system temp directory by default).
+    """
+    size = os.path.getsize(audio_path)
+    duration = probe_duration(audio_path)
+    if duration <= chunk_seconds and size <= MAX_UPLOAD_BYTES:
+        text = transcribe_fn(audio_path)
+        if on_text:
+            on_text(text)
+        return text
+
+    chunk_seconds = _fit_chunk_seconds(size, duration, chunk_seconds)
+    with tempfile.TemporaryDirectory(prefix='chunks_', dir=temp_dir) as temp_dir:
+        chunks = split_audio(audio_path, temp_dir, chunk_seconds, overlap)
+        overlaps = overlapping_seams(chunks)
+        stitcher = OrderedStitcher(on_text, overlaps) if on_text else None
+        texts = transcribe_chunks(chunks, transcribe_fn, max_workers, stitcher.add if stitcher else None)
+    return stitch_transcripts(texts, overlaps)
+
+
+async def transcribe_long_audio_async(audio_path, transcribe_fn, chunk_seconds=CHUNK_SECONDS,
+                                      overlap=CHUNK_OVERLAP_SECONDS, max_workers=MAX_CONCURRENCY, on_text=None,
+                                      temp_dir=None):
+    """transcribe_long_audio() for a coroutine function transcribe_fn, with FFmpeg run as subprocesses of the loop"""
+    size = os.path.getsize(audio_path)
+    duration = await probe_duration_async(audio_path)
+    if duration <= chunk_seconds and size <= MAX_UPLOAD_BYTES:
+        text = await transcribe_fn(audio_path)
+        if on_text:
+            on_text(text)
+        return text
+
+    chunk_seconds = _fit_chunk_seconds(size, duration, chunk_seconds)
+    with tempfile.TemporaryDirectory(prefix='chunks_', dir=temp_dir) as temp_dir:
+        chunks = await split_audio_async(audio_path, temp_dir, chunk_seconds, overlap)
+        overlaps = overlapping_seams(chunks)
+        stitcher = OrderedStitcher(on_text, overlaps) if on_text else None
+        texts = await transcribe_chunks_async(chunks, transcribe_fn, max_workers, stitcher.add if stitcher else None)
+    return stitch_transcripts(texts, overlaps)
@@ -1,46 +1,53 @@
+import asyncio
 import os
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import (
-    Mail, Attachment, FileContent, FileName,
-    FileType, Disposition, ContentId
-)
+import random
+import smtplib
+import threading
+import time
+import uuid
+from email.message import EmailMessage
 import base64
-from dotenv import load_dotenv
 import logging
 import certifi
-import ssl
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
+# Overridable so tests and benchmarks can point at a local stand-in
+SENDGRID_HOST = os.getenv('SENDGRID_HOST', 'https://api.sendgrid.com')
+# sendgrid (default), file (write .eml files to MAIL_SINK_DIR) or smtp (e.g. a local SMTP sink)
+MAIL_TRANSPORT = os.getenv('MAIL_TRANSPORT', 'sendgrid')
+MAIL_SINK_DIR = os.getenv('MAIL_SINK_DIR', os.path.join(os.getcwd(), 'sent_mail'))
+SMTP_HOST = os.getenv('SMTP_HOST', 'localhost')
+SMTP_PORT = int(os.getenv('SMTP_PORT', '1025'))
 
-def send_summary_email(recipients, summary, pdf_data, translated_summary=None):
-    """
-    Send meeting summary via email with PDF attachment using SendGrid
-    
-    Args:
-        recipients (list): List of email addresses
-        summary (str): Meeting summary text
-        pdf_data (bytes): PDF file data
-        translated_summary (str, optional): Translated summary text
-    """
-    try:
-        # SendGrid configuration
-        sendgrid_api_key = os.getenv('SENDGRID_API_KEY')
-        sender_email = os.getenv('SENDGRID_FROM_EMAIL')  # Verified sender email in SendGrid
-        
-        if not sendgrid_api_key or not sender_email:
-            raise ValueError("SendGrid API key or sender email not configured")
-
-        logger.info(f"Using SendGrid API key: {sendgrid_api_key[:5]}...")
-        logger.info(f"Using sender email: {sender_email}")
-
-        # Create email content
-        preview = summary[:500] + "..." if len(summary) > 500 else summary
-        body = f"""
+# SendGrid accepts at most 1000 personalizations per request
+MAX_RECIPIENTS_PER_MESSAGE = 1000
+MAIL_TIMEOUT_SECONDS = float(os.getenv('MAIL_TIMEOUT_SECONDS', '30'))
+MAIL_POOL_SIZE = int(os.getenv('MAIL_POOL_SIZE', '4'))
+MAX_RETRIES = int(os.getenv('MAIL_MAX_RETRIES', '4'))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+PDF_FILENAME = 'meeting_summary.pdf'
+
+
+class TransientMailError(Exception):
+    """A delivery failure worth retrying (rate limiting, provider outage, network error)"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def build_summary_email(summary, pdf_data, translated_summary=None):
+    """Subject, plain-text body and PDF attachment of a meeting summary email"""
+    # Create email content
+    preview = summary[:500] + "..." if len(summary) > 500 else summary
+    body = f"""
         Hello,
 
         Here's your meeting summary:
@@ -53,60 +60,315 @@ def send_summary_email(recipients, summary, pdf_data, translated_summary=None):
         AutoScribe
         """
 
-        if translated_summary:
-            body += "\n\nTranslated Summary Preview:\n"
-            translated_preview = translated_summary[:500] + "..." if len(translated_summary) > 500 else translated_summary
-            body += translated_preview
+    if translated_summary:
+        body += "\n\nTranslated Summary Preview:\n"
+        translated_preview = translated_summary[:500] + "..." if len(translated_summary) > 500 else translated_summary
+        body += translated_preview
+
+    return {
+        "subject": 'Meeting Summary - AutoScribe',
+        "body": body,
+        "pdf_data": pdf_data,
+    }
+
 
-        # Create the email
+def _sender():
+    sender_email = os.getenv('SENDGRID_FROM_EMAIL')  # Verified sender email in SendGrid
+    if not sender_email:
+        raise ValueError("Sender email not configured")
+    return sender_email
+
+
+class SendGridTransport:
+    """
+    Send through the SendGrid v3 API over one pooled HTTPS session.
+
+    Each recipient gets their own personalization, so recipients do not see
+    each other's addresses and up to MAX_RECIPIENTS_PER_MESSAGE of them share
+    one API call.
+    """
+
+    name = 'sendgrid'
+
+    def __init__(self, api_key=None, host=SENDGRID_HOST):
+        self.api_key = api_key or os.getenv('SENDGRID_API_KEY')
+        self.host = host.rstrip('/')
+        if not self.api_key:
+            raise ValueError("SendGrid API key not configured")
+        self.headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json',
+        }
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAIL_POOL_SIZE)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.verify = certifi.where()
+        self.session.headers.update(self.headers)
+        self._async_client = None
+
+    @property
+    def async_client(self):
+        # Created on first use from the event loop that will drive it
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                headers=self.headers, verify=certifi.where(), timeout=MAIL_TIMEOUT_SECONDS,
+                limits=httpx.Limits(max_connections=MAIL_POOL_SIZE)
+            )
+        return self._async_client
+
+    def _message(self, email, recipients):
+        # Only this transport needs the sendgrid package, so the others never load it
+        from sendgrid.helpers.mail import (
+            Mail, Attachment, FileContent, FileName,
+            FileType, Disposition, ContentId, Personalization, To
+        )
         message = Mail(
-            from_email=sender_email,
-            to_emails=recipients,
-            subject='Meeting Summary - AutoScribe',
-            plain_text_content=body
+            from_email=_sender(),
+            subject=email['subject'],
+            plain_text_content=email['body']
         )
+        for recipient in recipients:
+            personalization = Personalization()
+            personalization.add_to(To(recipient))
+            message.add_personalization(personalization)
 
         # Attach PDF
-        encoded_pdf = base64.b64encode(pdf_data).decode()
         attachment = Attachment()
-        attachment.file_content = FileContent(encoded_pdf)
+        attachment.file_content = FileContent(base64.b64encode(email['pdf_data']).decode())
         attachment.file_type = FileType('application/pdf')
-        attachment.file_name = FileName('meeting_summary.pdf')
+        attachment.file_name = FileName(PDF_FILENAME)
         attachment.disposition = Disposition('attachment')
         attachment.content_id = ContentId('Meeting Summary')
         message.attachment = attachment
+        return message.get()
+
+    def send(self, email, recipients):
+        try:
+            response = self.session.post(f"{self.host}/v3/mail/send", json=self._message(email, recipients),
+                                         timeout=MAIL_TIMEOUT_SECONDS)
+        except requests.RequestException as e:
+            raise TransientMailError(f"SendGrid request failed: {str(e)}")
+        return self._result(response)
+
+    async def send_async(self, email, recipients):
+        """send() over an httpx.AsyncClient, for the asyncio server"""
+        try:
+            response = await self.async_client.post(f"{self.host}/v3/mail/send", json=self._message(email, recipients))
+        except httpx.HTTPError as e:
+            raise TransientMailError(f"SendGrid request failed: {str(e)}")
+        return self._result(response)
+
+    def _result(self, response):
+        if response.status_code == 429 or response.status_code >= 500:
+            retry_after = response.headers.get('Retry-After')
+            raise TransientMailError(
+                f"SendGrid returned {response.status_code}",
+                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None
+            )
+        if response.status_code != 202:
+            logger.error(f"SendGrid response body: {response.text}")
+            raise Exception(f"Failed to send email. Status code: {response.status_code}")
+        return {"status_code": response.status_code, "message_id": response.headers.get('X-Message-Id')}
+
+
+def _mime_message(email, recipients):
+    """
+    The message as MIME. Recipients go in Bcc only, so none of them sees the
+    others' addresses: SMTP sends to them from the envelope and drops the
+    header, and the file sink keeps it as the record of who it was sent to.
+    """
+    message = EmailMessage()
+    message['From'] = _sender()
+    message['To'] = 'undisclosed-recipients:;'
+    message['Bcc'] = ', '.join(recipients)
+    message['Subject'] = email['subject']
+    message['Message-ID'] = f"<{uuid.uuid4().hex}@autoscribe>"
+    message.set_content(email['body'])
+    message.add_attachment(email['pdf_data'], maintype='application', subtype='pdf', filename=PDF_FILENAME)
+    return message
+
+
+class FileTransport:
+    """Write each message as an .eml file instead of sending it; for tests and local development"""
+
+    name = 'file'
+
+    def __init__(self, directory=MAIL_SINK_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, email, recipients):
+        message = _mime_message(email, recipients)
+        message_id = message['Message-ID'].strip('<>')
+        with open(os.path.join(self.directory, f"{message_id}.eml"), 'wb') as f:
+            f.write(message.as_bytes())
+        return {"status_code": 250, "message_id": message_id}
+
+
+class SMTPTransport:
+    """Send over SMTP, reusing one connection; pairs with a local sink such as MailHog"""
 
-        # Create SSL context with proper certificate verification
-        ssl_context = ssl.create_default_context(cafile=certifi.where())
-        ssl_context.verify_mode = ssl.CERT_REQUIRED
-        ssl_context.check_hostname = True
-
-        # Create SendGrid client with proper SSL configuration
-        sg = SendGridAPIClient(api_key=sendgrid_api_key)
-        sg.client.verify_ssl_certs = True
-        sg.client.ssl_context = ssl_context
-        
-        # Send the email and log the response
-        logger.info(f"Attempting to send email to {recipients}")
+    name = 'smtp'
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT):
+        self.host = host
+        self.port = port
+        self._smtp = None
+        self._lock = threading.Lock()
+
+    def send(self, email, recipients):
+        message = _mime_message(email, recipients)
+        with self._lock:
+            try:
+                if self._smtp is None:
+                    self._smtp = smtplib.SMTP(self.host, self.port, timeout=MAIL_TIMEOUT_SECONDS)
+                self._smtp.send_message(message, to_addrs=recipients)
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError) as e:
+                self._smtp = None
+                raise TransientMailError(f"SMTP connection failed: {str(e)}")
+            except smtplib.SMTPResponseException as e:
+                if 400 <= e.smtp_code < 500:
+                    raise TransientMailError(f"SMTP server returned {e.smtp_code}")
+                raise
+        return {"status_code": 250, "message_id": message['Message-ID'].strip('<>')}
+
+
+TRANSPORTS = {
+    'sendgrid': SendGridTransport,
+    'file': FileTransport,
+    'smtp': SMTPTransport,
+}
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """The process-wide transport selected by MAIL_TRANSPORT, created on first use"""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            if MAIL_TRANSPORT not in TRANSPORTS:
+                raise ValueError(f"Unknown mail transport '{MAIL_TRANSPORT}'")
+            _transport = TRANSPORTS[MAIL_TRANSPORT]()
+        return _transport
+
+
+def _retry_delay(error, attempt):
+    """Seconds to wait before retrying a transient failure, or None once retries are used up"""
+    if attempt > MAX_RETRIES:
+        return None
+    delay = error.retry_after
+    if delay is None:
+        delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+    logger.warning(f"Email delivery failed ({str(error)}); retry {attempt}/{MAX_RETRIES} in {delay:.1f}s")
+    return delay
+
+
+def _send_batch(transport, email, recipients):
+    attempt = 0
+    while True:
+        attempt += 1
         try:
-            response = sg.send(message)
-            logger.info(f"SendGrid Response Status Code: {response.status_code}")
-            logger.info(f"SendGrid Response Headers: {response.headers}")
-            logger.info(f"SendGrid Response Body: {response.body}")
-            
-            if response.status_code == 202:
-                logger.info(f"Email sent successfully to {len(recipients)} recipients")
-                return True
+            result = transport.send(email, recipients)
+            return dict(result, status='sent', attempts=attempt)
+        except TransientMailError as e:
+            delay = _retry_delay(e, attempt)
+            if delay is None:
+                return {"status": "failed", "attempts": attempt, "error": str(e)}
+            time.sleep(delay)
+        except Exception as e:
+            return {"status": "failed", "attempts": attempt, "error": str(e)}
+
+
+async def _send_batch_async(transport, email, recipients):
+    # Transports without a native async send (file, SMTP) run on a worker thread
+    send = getattr(transport, 'send_async', None)
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            if send is not None:
+                result = await send(email, recipients)
             else:
-                logger.error(f"Failed to send email. Status code: {response.status_code}")
-                logger.error(f"Response body: {response.body}")
-                raise Exception(f"Failed to send email. Status code: {response.status_code}")
+                result = await asyncio.to_thread(transport.send, email, recipients)
+            return dict(result, status='sent', attempts=attempt)
+        except TransientMailError as e:
+            delay = _retry_delay(e, attempt)
+            if delay is None:
+                return {"status": "failed", "attempts": attempt, "error": str(e)}
+            await asyncio.sleep(delay)
         except Exception as e:
-            logger.error(f"SendGrid API Error: {str(e)}")
-            if hasattr(e, 'body'):
-                logger.error(f"Error body: {e.body}")
-            raise
+            return {"status": "failed", "attempts": attempt, "error": str(e)}
+
+
+def deliver_email(recipients, email, transport=None):
+    """
+    Send an email to any number of recipients.
+
+    Recipients are split into batches of MAX_RECIPIENTS_PER_MESSAGE; each batch
+    is one provider call, retried with backoff on transient failures. Returns
+    the delivery status of every batch.
+    """
+    transport = transport or get_transport()
+    batches = []
+    for i in range(0, len(recipients), MAX_RECIPIENTS_PER_MESSAGE):
+        group = recipients[i:i + MAX_RECIPIENTS_PER_MESSAGE]
+        batches.append(_batch_status(_send_batch(transport, email, group), group, transport))
+    return batches
+
+
+async def deliver_email_async(recipients, email, transport=None):
+    """deliver_email() for the asyncio server"""
+    transport = transport or get_transport()
+    batches = []
+    for i in range(0, len(recipients), MAX_RECIPIENTS_PER_MESSAGE):
+        group = recipients[i:i + MAX_RECIPIENTS_PER_MESSAGE]
+        batches.append(_batch_status(await _send_batch_async(transport, email, group), group, transport))
+    return batches
+
+
+def _batch_status(result, group, transport):
+    batch = dict(result, recipients=len(group), transport=transport.name)
+    if batch['status'] == 'sent':
+        logger.info(f"Email sent to {len(group)} recipients via {transport.name}")
+    else:
+        logger.error(f"Email to {len(group)} recipients failed: {batch['error']}")
+    return batch
+
+
+def send_summary_email(recipients, summary, pdf_data, translated_summary=None):
+    """
+    Send meeting summary via email with PDF attachment
+
+    Args:
+        recipients (list): List of email addresses
+        summary (str): Meeting summary text
+        pdf_data (bytes): PDF file data
+        translated_summary (str, optional): Translated summary text
+
+    Returns the per-batch delivery status; raises if no batch was delivered.
+    """
+    try:
+        batches = deliver_email(recipients, build_summary_email(summary, pdf_data, translated_summary))
+        if not any(batch['status'] == 'sent' for batch in batches):
+            raise Exception(batches[0]['error'] if batches else "No recipients")
+        return batches
+
+    except Exception as e:
+        logger.error(f"Error sending email: {str(e)}")
+        raise
+
+
+async def send_summary_email_async(recipients, summary, pdf_data, translated_summary=None):
+    """send_summary_email() for the asyncio server"""
+    try:
+        batches = await deliver_email_async(recipients, build_summary_email(summary, pdf_data, translated_summary))
+        if not any(batch['status'] == 'sent' for batch in batches):
+            raise Exception(batches[0]['error'] if batches else "No recipients")
+        return batches
 
     except Exception as e:
         logger.error(f"Error sending email: {str(e)}")
-        raise 
\ No newline at end of file
+        raise
@@ -0,0 +1,57 @@
+"""
+gunicorn settings for server:app (see Procfile).
+
+With preload_app the master imports the app, and preload_modules() loads the
+modules requests would otherwise import on first use, once, before forking.
+Workers then start without importing anything and share those pages with the
+master copy-on-write instead of each holding its own copy. Threads do not
+survive a fork, so the job workers and the storage sweeper are started in
+each worker by post_fork rather than at import.
+
+PRELOAD_APP=0 goes back to every worker importing the app itself, e.g. to
+pick up code changes with a HUP (a preloaded master must be restarted).
+
+Workers are threaded (gthread): a /transcribe/stream response holds a
+thread, not a whole worker, for as long as its pipeline runs, and timeout
+only catches a worker whose main loop is stuck, so long recordings are not
+killed mid-stream. WEB_CONCURRENCY x GUNICORN_THREADS requests are served
+at once.
+
+Jobs are polled with separate requests that any worker may serve, so with
+more than one worker the job queues default to the SQLite backend, which
+every worker shares; an explicit JOB_QUEUE_BACKEND=memory is refused.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '4'))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '16'))
+timeout = 120
+preload_app = os.getenv('PRELOAD_APP', '1').lower() not in ('0', 'false', 'no')
+
+if workers > 1:
+    os.environ.setdefault('JOB_QUEUE_BACKEND', 'sqlite')
+
+if preload_app:
+    # Read by server.py when the master imports it
+    os.environ['DEFER_WORKERS'] = '1'
+
+
+def on_starting(server):
+    if server.cfg.workers > 1 and os.getenv('JOB_QUEUE_BACKEND', 'memory') == 'memory':
+        # gunicorn prints a RuntimeError and exits
+        raise RuntimeError(f"JOB_QUEUE_BACKEND=memory keeps jobs in one worker's memory, so polls served by the "
+                           f"other {server.cfg.workers - 1} workers would 404; use JOB_QUEUE_BACKEND=sqlite")
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        from api import preload_modules
+        preload_modules()
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from server import start_workers
+        start_workers()
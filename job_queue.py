@@ -0,0 +1,553 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+STAGE_PENDING = 'pending'
+STAGE_RUNNING = 'running'
+STAGE_DONE = 'done'
+STAGE_FAILED = 'failed'
+STAGE_SKIPPED = 'skipped'
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted to a queue that is at capacity"""
+
+
+class Job:
+    """A unit of work plus its per-stage progress"""
+
+    def __init__(self, kind, payload, stages=None, job_id=None, status=STATUS_QUEUED,
+                 result=None, error=None, created_at=None, updated_at=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.payload = payload or {}
+        self.status = status
+        self.result = result
+        self.error = error
+        self.created_at = created_at or time.time()
+        self.updated_at = updated_at or self.created_at
+        # Stages may be given as names or as already-populated stage dicts
+        self.stages = [
+            {'name': stage, 'status': STAGE_PENDING} if isinstance(stage, str) else stage
+            for stage in (stages or [])
+        ]
+        self._on_change = None
+
+    def _stage(self, name):
+        for stage in self.stages:
+            if stage['name'] == name:
+                return stage
+        stage = {'name': name, 'status': STAGE_PENDING}
+        self.stages.append(stage)
+        return stage
+
+    def _changed(self):
+        self.updated_at = time.time()
+        if self._on_change:
+            self._on_change(self)
+
+    @contextmanager
+    def stage(self, name):
+        """Mark a stage as running for the duration of the block and record its timing"""
+        stage = self._stage(name)
+        stage['status'] = STAGE_RUNNING
+        stage['started_at'] = time.time()
+        self._changed()
+        try:
+            yield stage
+        except Exception as e:
+            stage['status'] = STAGE_FAILED
+            stage['error'] = str(e)
+            stage['duration_ms'] = int((time.time() - stage['started_at']) * 1000)
+            self._changed()
+            raise
+        stage['status'] = STAGE_DONE
+        stage['duration_ms'] = int((time.time() - stage['started_at']) * 1000)
+        self._changed()
+
+    def skip_stage(self, name):
+        """Mark a stage as not applicable to this job; stages that already ran are left as they are"""
+        stage = self._stage(name)
+        if stage['status'] != STAGE_PENDING:
+            return
+        stage['status'] = STAGE_SKIPPED
+        self._changed()
+
+    def progress(self):
+        """Fraction of stages that have finished"""
+        if not self.stages:
+            return 1.0 if self.status == STATUS_DONE else 0.0
+        finished = sum(1 for s in self.stages if s['status'] in (STAGE_DONE, STAGE_SKIPPED))
+        return round(finished / len(self.stages), 3)
+
+    def to_dict(self, include_result=False):
+        data = {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress(),
+            'stages': self.stages,
+            'error': self.error,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+        }
+        if include_result:
+            data['result'] = self.result
+        return data
+
+
+class MemoryBackend:
+    """In-process job store; jobs are lost when the process exits"""
+
+    def __init__(self, maxsize=100):
+        self.maxsize = maxsize
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def put(self, job):
+        with self._lock:
+            if self.maxsize and self._queue.qsize() >= self.maxsize:
+                raise QueueFull(f"Job queue is full ({self.maxsize} jobs waiting)")
+            self._jobs[job.id] = job
+        self._queue.put(job.id)
+
+    def claim(self, timeout=1.0):
+        try:
+            job_id = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        job = self._jobs.get(job_id)
+        if job is not None:
+            job.status = STATUS_RUNNING
+            job.updated_at = time.time()
+        return job
+
+    def save(self, job):
+        with self._lock:
+            self._jobs[job.id] = job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def prune(self, max_age):
+        """Forget finished jobs older than max_age seconds"""
+        cutoff = time.time() - max_age
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job.status in (STATUS_DONE, STATUS_FAILED) and job.updated_at < cutoff:
+                    del self._jobs[job_id]
+
+
+class SQLiteBackend:
+    """Job store backed by SQLite so queued jobs survive a restart and are shared between processes"""
+
+    def __init__(self, path, maxsize=100, poll_interval=0.5):
+        self.path = path
+        self.maxsize = maxsize
+        self.poll_interval = poll_interval
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                ' id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL,'
+                ' payload TEXT, stages TEXT, result TEXT, error TEXT,'
+                ' owner_pid INTEGER, created_at REAL, updated_at REAL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)')
+        # Jobs this PID left running belong to an earlier process that had the same PID
+        self._requeue_orphans(own_pid_dead=True)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _requeue_orphans(self, own_pid_dead=False):
+        """Put jobs whose worker process has died back on the queue"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT id, owner_pid FROM jobs WHERE status = ?', (STATUS_RUNNING,)
+            ).fetchall()
+            for row in rows:
+                if row['owner_pid'] == os.getpid() and not own_pid_dead:
+                    continue
+                if row['owner_pid'] and _pid_alive(row['owner_pid']):
+                    continue
+                logger.info(f"Re-queueing interrupted job {row['id']}")
+                conn.execute(
+                    'UPDATE jobs SET status = ?, owner_pid = NULL, updated_at = ? WHERE id = ?',
+                    (STATUS_QUEUED, time.time(), row['id'])
+                )
+
+    def _row_to_job(self, row):
+        return Job(
+            row['kind'],
+            json.loads(row['payload'] or '{}'),
+            stages=json.loads(row['stages'] or '[]'),
+            job_id=row['id'],
+            status=row['status'],
+            result=json.loads(row['result']) if row['result'] else None,
+            error=row['error'],
+            created_at=row['created_at'],
+            updated_at=row['updated_at'],
+        )
+
+    def put(self, job):
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            waiting = conn.execute(
+                'SELECT COUNT(*) FROM jobs WHERE status = ?', (STATUS_QUEUED,)
+            ).fetchone()[0]
+            if self.maxsize and waiting >= self.maxsize:
+                conn.execute('ROLLBACK')
+                raise QueueFull(f"Job queue is full ({self.maxsize} jobs waiting)")
+            conn.execute(
+                'INSERT INTO jobs (id, kind, status, payload, stages, result, error, owner_pid, created_at, updated_at)'
+                ' VALUES (?, ?, ?, ?, ?, NULL, NULL, NULL, ?, ?)',
+                (job.id, job.kind, job.status, json.dumps(job.payload), json.dumps(job.stages),
+                 job.created_at, job.updated_at)
+            )
+            conn.execute('COMMIT')
+
+    def claim(self, timeout=1.0):
+        deadline = time.time() + timeout
+        while True:
+            with self._connect() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                row = conn.execute(
+                    'SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1', (STATUS_QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    now = time.time()
+                    conn.execute(
+                        'UPDATE jobs SET status = ?, owner_pid = ?, updated_at = ? WHERE id = ?',
+                        (STATUS_RUNNING, os.getpid(), now, row['id'])
+                    )
+                    conn.execute('COMMIT')
+                    job = self._row_to_job(row)
+                    job.status = STATUS_RUNNING
+                    job.updated_at = now
+                    return job
+                conn.execute('COMMIT')
+            if time.time() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def save(self, job):
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, stages = ?, result = ?, error = ?, updated_at = ? WHERE id = ?',
+                (job.status, json.dumps(job.stages),
+                 json.dumps(job.result) if job.result is not None else None,
+                 job.error, job.updated_at, job.id)
+            )
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def depth(self):
+        with self._connect() as conn:
+            return conn.execute(
+                'SELECT COUNT(*) FROM jobs WHERE status = ?', (STATUS_QUEUED,)
+            ).fetchone()[0]
+
+    def prune(self, max_age):
+        """Delete finished jobs older than max_age seconds and re-queue jobs of workers that have died since"""
+        with self._connect() as conn:
+            conn.execute(
+                'DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?',
+                (STATUS_DONE, STATUS_FAILED, time.time() - max_age)
+            )
+        self._requeue_orphans()
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """Bounded job queue drained by a pool of local worker threads"""
+
+    def __init__(self, backend, workers=2, result_ttl=3600):
+        self.backend = backend
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self._handlers = {}
+        self._threads = []
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def register(self, kind, handler):
+        """Register handler(job) for jobs of the given kind"""
+        self._handlers[kind] = handler
+
+    def start(self):
+        """Start the worker pool; safe to call more than once and after a fork"""
+        with self._lock:
+            if self._pid == os.getpid() and self._threads:
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"Started {self.workers} job workers")
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def alive(self):
+        """True while this process has worker threads running (threads started before a fork do not count)"""
+        return self._pid == os.getpid() and any(thread.is_alive() for thread in self._threads)
+
+    def full(self):
+        """True when submit() would raise QueueFull"""
+        return bool(self.backend.maxsize) and self.backend.depth() >= self.backend.maxsize
+
+    def submit(self, kind, payload, stages=None):
+        """Queue a job and return it immediately; raises QueueFull when at capacity"""
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+        self.start()
+        job = Job(kind, payload, stages=stages)
+        self.backend.put(job)
+        logger.info(f"Queued {kind} job {job.id} (depth {self.backend.depth()})")
+        return job
+
+    def get(self, job_id):
+        return self.backend.get(job_id)
+
+    def depth(self):
+        return self.backend.depth()
+
+    def _work(self):
+        last_prune = time.time()
+        while not self._stop.is_set():
+            if time.time() - last_prune > 60:
+                self.backend.prune(self.result_ttl)
+                last_prune = time.time()
+            job = self.backend.claim(timeout=1.0)
+            if job is None:
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        handler = self._handlers.get(job.kind)
+        job._on_change = self.backend.save
+        started = time.time()
+        try:
+            if handler is None:
+                raise ValueError(f"No handler registered for job kind '{job.kind}'")
+            job.result = handler(job)
+            job.status = STATUS_DONE
+            logger.info(f"Job {job.id} finished in {(time.time() - started):.2f}s")
+        except Exception as e:
+            job.status = STATUS_FAILED
+            job.error = str(e)
+            logger.error(f"Job {job.id} failed: {str(e)}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+        finally:
+            job._on_change = None
+            job.updated_at = time.time()
+            self.backend.save(job)
+
+
+class AsyncJobQueue:
+    """
+    JobQueue for the asyncio server: handlers are coroutine functions run as
+    tasks on the event loop instead of on worker threads.
+
+    Up to `concurrency` jobs run at once, so hundreds of transcriptions can be
+    waiting on the API without a thread each. Jobs beyond that wait in the
+    backend, which still bounds the queue and, with SQLiteBackend, keeps them
+    across restarts. Call start() from the running loop to pick those up.
+
+    Backend calls block (SQLite, or a lock shared with worker threads), so
+    the queue makes its own claims and saves on one I/O thread, in order, and
+    submit(), get() and depth() may be called from any thread; the app calls
+    them with asyncio.to_thread().
+    """
+
+    def __init__(self, backend, concurrency=200, result_ttl=3600):
+        self.backend = backend
+        self.concurrency = concurrency
+        self.result_ttl = result_ttl
+        self._handlers = {}
+        self._tasks = set()
+        self._started = False
+        self._stopping = False
+        self._last_prune = time.time()
+        self._loop = None
+        self._io = None
+        self._filling = None
+        self._refill = False
+
+    def register(self, kind, handler):
+        """Register the coroutine function handler(job) for jobs of the given kind"""
+        self._handlers[kind] = handler
+
+    def start(self):
+        """Start the jobs already waiting in the backend, e.g. left by an earlier process"""
+        self._loop = asyncio.get_running_loop()
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix='job-queue-io')
+        self._started = True
+        self._dispatch()
+        logger.info(f"Started async job queue ({self.concurrency} concurrent jobs)")
+
+    async def stop(self):
+        """Cancel running jobs; with SQLiteBackend the next process picks them up again"""
+        self._stopping = True
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._io is not None:
+            # Let the saves already handed to the I/O thread finish
+            await asyncio.to_thread(self._io.shutdown)
+
+    def alive(self):
+        """True between start() and stop()"""
+        return self._started and not self._stopping
+
+    def full(self):
+        """True when submit() would raise QueueFull"""
+        return bool(self.backend.maxsize) and self.backend.depth() >= self.backend.maxsize
+
+    def submit(self, kind, payload, stages=None):
+        """Queue a job and return it immediately; raises QueueFull when at capacity"""
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+        job = Job(kind, payload, stages=stages)
+        self.backend.put(job)
+        self._dispatch()
+        logger.info(f"Queued {kind} job {job.id} (depth {self.backend.depth()})")
+        return job
+
+    def get(self, job_id):
+        return self.backend.get(job_id)
+
+    def depth(self):
+        return self.backend.depth()
+
+    def _dispatch(self):
+        """Have the loop start queued jobs while fewer than `concurrency` are running (from any thread)"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        if self._filling is None or self._filling.done():
+            self._filling = self._loop.create_task(self._fill())
+        else:
+            # A claim is in flight; look again once it returns
+            self._refill = True
+
+    async def _fill(self):
+        while True:
+            self._refill = False
+            if time.time() - self._last_prune > 60:
+                self._last_prune = time.time()
+                await self._loop.run_in_executor(self._io, self.backend.prune, self.result_ttl)
+            while not self._stopping and len(self._tasks) < self.concurrency:
+                job = await self._loop.run_in_executor(self._io, self.backend.claim, 0)
+                if job is None:
+                    break
+                task = self._loop.create_task(self._run(job))
+                self._tasks.add(task)
+                task.add_done_callback(self._finished)
+            if not self._refill:
+                return
+
+    def _finished(self, task):
+        self._tasks.discard(task)
+        self._dispatch()
+
+    def _save_soon(self, job):
+        """Stage progress, saved on the I/O thread without waiting for it"""
+        self._io.submit(self.backend.save, job)
+
+    async def _run(self, job):
+        handler = self._handlers.get(job.kind)
+        job._on_change = self._save_soon
+        started = time.time()
+        try:
+            if handler is None:
+                raise ValueError(f"No handler registered for job kind '{job.kind}'")
+            job.result = await handler(job)
+            job.status = STATUS_DONE
+            logger.info(f"Job {job.id} finished in {(time.time() - started):.2f}s")
+        except Exception as e:
+            job.status = STATUS_FAILED
+            job.error = str(e)
+            logger.error(f"Job {job.id} failed: {str(e)}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+        finally:
+            job._on_change = None
+            job.updated_at = time.time()
+            await asyncio.shield(self._loop.run_in_executor(self._io, self.backend.save, job))
+
+
+def create_job_queue(backend=None, workers=None, maxsize=None, db_path=None, asynchronous=False):
+    """
+    Build a JobQueue from arguments or JOB_QUEUE_* environment variables.
+
+    With asynchronous=True this is an AsyncJobQueue, and workers is the number
+    of jobs run at once (ASYNC_JOB_CONCURRENCY by default).
+    """
+    backend = backend or os.getenv('JOB_QUEUE_BACKEND', 'memory')
+    if asynchronous:
+        workers = workers or int(os.getenv('ASYNC_JOB_CONCURRENCY', '200'))
+    else:
+        workers = workers or int(os.getenv('JOB_WORKERS', '2'))
+    maxsize = maxsize if maxsize is not None else int(os.getenv('JOB_QUEUE_MAXSIZE', '20'))
+    if backend == 'sqlite':
+        db_path = db_path or os.getenv('JOB_QUEUE_DB', os.path.join(os.getcwd(), 'jobs.sqlite3'))
+        store = SQLiteBackend(db_path, maxsize=maxsize)
+    elif backend == 'memory':
+        store = MemoryBackend(maxsize=maxsize)
+    else:
+        raise ValueError(f"Unknown job queue backend '{backend}'")
+    if asynchronous:
+        return AsyncJobQueue(store, concurrency=workers)
+    return JobQueue(store, workers=workers)
@@ -0,0 +1,269 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Seconds; spans the ~50 ms of a cache hit up to a long Whisper job
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+MEDIA_SECONDS_BUCKETS = (30, 60, 300, 600, 1200, 1800, 3600, 7200, 14400)
+MEDIA_BYTES_BUCKETS = (1e6, 1e7, 5e7, 1e8, 5e8, 1e9, 2e9, 5e9)
+SEARCH_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+
+def _label_key(label_names, labels):
+    return tuple(str(labels.get(name, '')) for name in label_names)
+
+
+def _format_labels(label_names, key, extra=None):
+    pairs = list(zip(label_names, key)) + list((extra or {}).items())
+    if not pairs:
+        return ''
+    escaped = ','.join(f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                       for name, value in pairs)
+    return '{' + escaped + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, {}, value) for key, value in self._values.items()]
+
+    def snapshot(self):
+        with self._lock:
+            return {','.join(key) or 'total': value for key, value in self._values.items()}
+
+
+class Gauge(Counter):
+    """A value that goes up and down, or is read from a callback at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, label_names=(), callback=None):
+        super().__init__(name, help_text, label_names)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(self.label_names, labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_callback(self, callback):
+        self.callback = callback
+
+    def samples(self):
+        if self.callback is not None:
+            try:
+                return [(self.name, (), {}, self.callback())]
+            except Exception as e:
+                logger.error(f"Gauge {self.name} callback failed: {str(e)}")
+                return []
+        return super().samples()
+
+    def snapshot(self):
+        if self.callback is not None:
+            samples = self.samples()
+            return samples[0][3] if samples else None
+        return super().snapshot()
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", key, {'le': f"{bound:g}"}, bucket_count))
+                samples.append((f"{self.name}_bucket", key, {'le': '+Inf'}, count))
+                samples.append((f"{self.name}_sum", key, {}, total))
+                samples.append((f"{self.name}_count", key, {}, count))
+        return samples
+
+    def _quantile(self, counts, count, q):
+        """Upper bound of the bucket holding the q-th observation"""
+        rank = q * count
+        for bound, bucket_count in zip(self.buckets, counts):
+            if bucket_count >= rank:
+                return bound
+        return '+Inf'
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                ','.join(key) or 'total': {
+                    'count': count,
+                    'sum': round(total, 3),
+                    'mean': round(total / count, 3) if count else 0,
+                    'p50': self._quantile(counts, count, 0.5),
+                    'p95': self._quantile(counts, count, 0.95),
+                    'p99': self._quantile(counts, count, 0.99),
+                }
+                for key, (counts, total, count) in self._values.items()
+            }
+
+
+class Registry:
+    """
+    Metrics for one process.
+
+    Under gunicorn each worker has its own registry, so a scrape reports the
+    worker that served it; scrape every worker or run one worker per container
+    for a complete picture.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self._add(Counter(name, help_text, label_names))
+
+    def gauge(self, name, help_text, label_names=(), callback=None):
+        return self._add(Gauge(name, help_text, label_names, callback))
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, label_names, buckets))
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, extra, value in metric.samples():
+                lines.append(f"{name}{_format_labels(metric.label_names, key, extra)} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """All metrics as a JSON-friendly dict"""
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    'autoscribe_stage_duration_seconds', 'Time spent in each pipeline stage', ['stage', 'status'])
+REQUEST_SECONDS = registry.histogram(
+    'autoscribe_http_request_duration_seconds', 'HTTP request latency', ['endpoint', 'method', 'status'])
+REQUESTS_IN_FLIGHT = registry.gauge(
+    'autoscribe_http_requests_in_flight', 'HTTP requests currently being handled')
+QUEUE_DEPTH = registry.gauge(
+    'autoscribe_job_queue_depth', 'Jobs waiting for a worker')
+MAIL_QUEUE_DEPTH = registry.gauge(
+    'autoscribe_mail_queue_depth', 'Emails waiting for a mail worker')
+STORAGE_USED_BYTES = registry.gauge(
+    'autoscribe_storage_used_bytes', 'Bytes of temporary upload storage in use or reserved')
+VAD_REMOVED_SECONDS = registry.counter(
+    'autoscribe_vad_removed_seconds_total', 'Seconds of non-speech audio not sent for transcription')
+MEDIA_SECONDS = registry.histogram(
+    'autoscribe_media_duration_seconds', 'Duration of uploaded media', buckets=MEDIA_SECONDS_BUCKETS)
+MEDIA_BYTES = registry.histogram(
+    'autoscribe_media_bytes', 'Size of uploaded media', buckets=MEDIA_BYTES_BUCKETS)
+UPLOADS_FINALIZED = registry.counter(
+    'autoscribe_uploads_finalized_total', 'Resumable uploads finalized, by whether processing was needed',
+    ['outcome'])
+TRANSCRIPTS_STORED = registry.counter(
+    'autoscribe_transcripts_stored_total', 'Transcripts written to the transcript store, by outcome', ['outcome'])
+TRANSCRIPT_SEARCH_SECONDS = registry.histogram(
+    'autoscribe_transcript_search_duration_seconds', 'Transcript search query latency', buckets=SEARCH_BUCKETS)
+TRANSCRIBE_FALLBACKS = registry.counter(
+    'autoscribe_transcribe_fallbacks_total', 'Files transcribed by the fallback backend, by why the primary failed',
+    ['backend', 'reason'])
+OPENAI_SECONDS = registry.histogram(
+    'autoscribe_openai_request_duration_seconds', 'OpenAI API call latency', ['operation', 'outcome'])
+OPENAI_TOKENS = registry.counter(
+    'autoscribe_openai_tokens_total', 'OpenAI tokens used', ['model', 'type'])
+
+
+# Request ID of the work currently running in this thread or task
+_request_id = contextvars.ContextVar('request_id', default=None)
+
+
+def new_request_id():
+    return uuid.uuid4().hex[:16]
+
+
+def set_request_id(request_id):
+    _request_id.set(request_id)
+
+
+def get_request_id():
+    return _request_id.get()
+
+
+@contextmanager
+def span(name, stage=None, **attributes):
+    """
+    Time a block of work and log it as a structured span tagged with the request ID.
+
+    If stage is given the duration is also recorded in the per-stage histogram.
+    """
+    start = time.time()
+    status = 'ok'
+    try:
+        yield
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        duration = time.time() - start
+        if stage:
+            STAGE_SECONDS.observe(duration, stage=stage, status=status)
+        logger.info(json.dumps({
+            'span': name,
+            'request_id': get_request_id(),
+            'start': round(start, 3),
+            'duration_ms': int(duration * 1000),
+            'status': status,
+            **attributes,
+        }))
+
+
+def record_token_usage(model, usage):
+    """Count the prompt/completion tokens reported by an OpenAI response"""
+    if usage is None:
+        return
+    OPENAI_TOKENS.inc(getattr(usage, 'prompt_tokens', 0) or 0, model=model, type='prompt')
+    OPENAI_TOKENS.inc(getattr(usage, 'completion_tokens', 0) or 0, model=model, type='completion')
@@ -0,0 +1,406 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+
+import httpx
+
+from metrics import OPENAI_SECONDS, record_token_usage
+from summarizer import prompt_tokens
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+TIMEOUT_SECONDS = float(os.getenv('OPENAI_TIMEOUT_SECONDS', '120'))
+TRANSCRIBE_TIMEOUT_SECONDS = float(os.getenv('OPENAI_TRANSCRIBE_TIMEOUT_SECONDS', '600'))
+CONNECT_TIMEOUT_SECONDS = 10.0
+POOL_SIZE = int(os.getenv('OPENAI_POOL_SIZE', '20'))
+# The asyncio server keeps far more requests in flight than there are threads
+ASYNC_POOL_SIZE = int(os.getenv('OPENAI_ASYNC_POOL_SIZE', '200'))
+
+MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '4'))
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30.0
+
+# Account limits; keep a little below what the OpenAI dashboard shows
+REQUESTS_PER_MINUTE = float(os.getenv('OPENAI_RPM', '500'))
+TOKENS_PER_MINUTE = float(os.getenv('OPENAI_TPM', '160000'))
+AUDIO_REQUESTS_PER_MINUTE = float(os.getenv('OPENAI_AUDIO_RPM', '50'))
+# Completion tokens assumed per chat request when charging the token bucket
+EXPECTED_COMPLETION_TOKENS = 500
+
+BREAKER_FAILURES = int(os.getenv('OPENAI_BREAKER_FAILURES', '5'))
+BREAKER_RESET_SECONDS = float(os.getenv('OPENAI_BREAKER_RESET_SECONDS', '30'))
+
+
+class CircuitOpen(Exception):
+    """Raised without calling the API while the circuit breaker is open"""
+
+
+class RateLimited(Exception):
+    """Raised instead of waiting for a rate limit, by calls made with wait_out_rate_limits=False"""
+
+
+class TokenBucket:
+    """Blocking token bucket: allows `rate` units per `per` seconds with bursts up to `capacity`"""
+
+    def __init__(self, rate, per=60.0, capacity=None):
+        self.rate = rate / per
+        self.capacity = capacity or max(1.0, rate / 10)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self, amount):
+        """Take amount tokens if there are enough; otherwise return the seconds to wait for them"""
+        # A single request larger than the burst size still has to get through eventually
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0
+            return (amount - self.tokens) / self.rate
+
+    def try_acquire(self, amount=1.0):
+        """Take amount tokens if they are there now; never waits"""
+        return not self._take(amount)
+
+    def acquire(self, amount=1.0):
+        while True:
+            wait = self._take(amount)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, amount=1.0):
+        """acquire() for coroutines: waits without blocking the event loop"""
+        while True:
+            wait = self._take(amount)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Stop calling a failing dependency for a while.
+
+    After `threshold` consecutive failed attempts the breaker opens and calls fail
+    immediately with CircuitOpen. Once `reset_seconds` have passed one trial
+    call is let through; success closes the breaker, failure re-opens it.
+    A trial that ends any other way (the request was rejected, rate limited
+    or cancelled) leaves the breaker half-open for the next call to try.
+    """
+
+    def __init__(self, threshold=BREAKER_FAILURES, reset_seconds=BREAKER_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """Raise CircuitOpen unless a call may go ahead; True if that call is the half-open trial"""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return False
+            if state == 'half-open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            retry_in = max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+            raise CircuitOpen(f"OpenAI is failing; not calling it for another {retry_in:.0f}s")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def end_trial(self):
+        """Called once the trial call is over, however it ended"""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.failures >= self.threshold or self.opened_at is not None:
+                if self.opened_at is None:
+                    logger.error(f"Opening OpenAI circuit breaker after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+
+def _is_transient(error):
+    """429s, 5xx responses, timeouts and connection errors are worth retrying"""
+    import openai
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def _is_rate_limited(error):
+    import openai
+    return isinstance(error, openai.APIStatusError) and error.status_code == 429
+
+
+def is_unavailable(error):
+    """True for errors meaning the API is rate limiting us or down, rather than rejecting the request itself"""
+    return isinstance(error, (CircuitOpen, RateLimited)) or _is_transient(error)
+
+
+def _retry_after(error):
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class OpenAIClient:
+    """
+    Process-wide OpenAI client.
+
+    Shares one pooled HTTP connection pool across threads, applies per-call
+    timeouts, rate-limits requests and tokens per minute, retries transient
+    failures with exponential backoff and full jitter, and fails fast through a
+    circuit breaker when the API is down.
+
+    The a-prefixed methods are the asyncio versions used by the ASGI server.
+    They run on their own httpx.AsyncClient pool but share the rate limits and
+    the breaker, so both modes in one process stay within the same budget.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+        self.breaker = CircuitBreaker()
+        self.request_bucket = TokenBucket(REQUESTS_PER_MINUTE)
+        self.token_bucket = TokenBucket(TOKENS_PER_MINUTE)
+        self.audio_bucket = TokenBucket(AUDIO_REQUESTS_PER_MINUTE)
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    # Imported on first use: the package alone takes about half a second to load
+                    import openai
+                    http_client = httpx.Client(
+                        limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+                        timeout=httpx.Timeout(TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+                    )
+                    self._client = openai.OpenAI(
+                        api_key=os.getenv('OPENAI_API_KEY'),
+                        base_url=os.getenv('OPENAI_BASE_URL') or None,
+                        max_retries=0,  # retries are handled here, with jitter and the breaker
+                        http_client=http_client,
+                    )
+        return self._client
+
+    @property
+    def async_client(self):
+        # Created on first use from the event loop that will drive it
+        if self._async_client is None:
+            import openai
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=ASYNC_POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+                timeout=httpx.Timeout(TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+            )
+            self._async_client = openai.AsyncOpenAI(
+                api_key=os.getenv('OPENAI_API_KEY'),
+                base_url=os.getenv('OPENAI_BASE_URL') or None,
+                max_retries=0,
+                http_client=http_client,
+            )
+        return self._async_client
+
+    def _retry_delay(self, error, attempt, start, description, operation, wait_out_rate_limits=True):
+        """Record a failed attempt; return the seconds to wait before the next one, or None to give up"""
+        if isinstance(error, RateLimited) or (not wait_out_rate_limits and _is_rate_limited(error)):
+            OPENAI_SECONDS.observe(time.time() - start, operation=operation, outcome='rate_limited')
+            return None
+        if not _is_transient(error):
+            OPENAI_SECONDS.observe(time.time() - start, operation=operation, outcome='error')
+            return None
+        self.breaker.record_failure()
+        if attempt >= MAX_RETRIES:
+            OPENAI_SECONDS.observe(time.time() - start, operation=operation, outcome='error')
+            return None
+        OPENAI_SECONDS.observe(time.time() - start, operation=operation, outcome='retry')
+        delay = _retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+        logger.warning(f"{description} failed ({str(error)}); retry {attempt + 1}/{MAX_RETRIES} in {delay:.1f}s")
+        return delay
+
+    def _succeeded(self, start, operation):
+        OPENAI_SECONDS.observe(time.time() - start, operation=operation, outcome='ok')
+        self.breaker.record_success()
+
+    def _call(self, fn, description, operation, wait_out_rate_limits=True):
+        attempt = 0
+        while True:
+            trial = self.breaker.allow()
+            start = time.time()
+            try:
+                result = fn()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, start, description, operation, wait_out_rate_limits)
+                if delay is None:
+                    raise
+            else:
+                self._succeeded(start, operation)
+                return result
+            finally:
+                if trial:
+                    self.breaker.end_trial()
+            attempt += 1
+            time.sleep(delay)
+
+    async def _acall(self, fn, description, operation, wait_out_rate_limits=True):
+        """_call() for a coroutine function fn"""
+        attempt = 0
+        while True:
+            trial = self.breaker.allow()
+            start = time.time()
+            try:
+                result = await fn()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, start, description, operation, wait_out_rate_limits)
+                if delay is None:
+                    raise
+            else:
+                self._succeeded(start, operation)
+                return result
+            finally:
+                # Also reached when the task is cancelled mid-call (CancelledError is not an Exception)
+                if trial:
+                    self.breaker.end_trial()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _acquire_audio(self, wait_out_rate_limits):
+        if wait_out_rate_limits:
+            self.audio_bucket.acquire()
+        elif not self.audio_bucket.try_acquire():
+            raise RateLimited(f"Over the {AUDIO_REQUESTS_PER_MINUTE:.0f} audio requests per minute limit")
+
+    def transcribe(self, audio_file, model="whisper-1", wait_out_rate_limits=True, **kwargs):
+        """
+        Transcribe an open audio file and return the text.
+
+        With wait_out_rate_limits=False a call that would have to wait for the
+        audio rate limit, or that the API answers with 429, fails at once
+        (RateLimited or the API error) so the caller can go elsewhere.
+        """
+        def call():
+            audio_file.seek(0)
+            self._acquire_audio(wait_out_rate_limits)
+            return self.client.audio.transcriptions.create(
+                model=model, file=audio_file, timeout=TRANSCRIBE_TIMEOUT_SECONDS, **kwargs
+            )
+        return self._call(call, "Transcription", 'transcribe', wait_out_rate_limits).text
+
+    async def atranscribe(self, audio_file, model="whisper-1", wait_out_rate_limits=True, **kwargs):
+        async def call():
+            audio_file.seek(0)
+            if wait_out_rate_limits:
+                await self.audio_bucket.acquire_async()
+            else:
+                self._acquire_audio(False)
+            return await self.async_client.audio.transcriptions.create(
+                model=model, file=audio_file, timeout=TRANSCRIBE_TIMEOUT_SECONDS, **kwargs
+            )
+        return (await self._acall(call, "Transcription", 'transcribe', wait_out_rate_limits)).text
+
+    def _acquire_chat(self, messages):
+        self.request_bucket.acquire()
+        self.token_bucket.acquire(prompt_tokens(messages) + EXPECTED_COMPLETION_TOKENS)
+
+    async def _acquire_chat_async(self, messages):
+        await self.request_bucket.acquire_async()
+        await self.token_bucket.acquire_async(prompt_tokens(messages) + EXPECTED_COMPLETION_TOKENS)
+
+    def chat(self, messages, model="gpt-3.5-turbo", **kwargs):
+        """Send a chat request and return the reply text"""
+        def call():
+            self._acquire_chat(messages)
+            return self.client.chat.completions.create(model=model, messages=messages, **kwargs)
+        response = self._call(call, "Chat completion", 'chat')
+        record_token_usage(model, getattr(response, 'usage', None))
+        return response.choices[0].message.content
+
+    async def achat(self, messages, model="gpt-3.5-turbo", **kwargs):
+        async def call():
+            await self._acquire_chat_async(messages)
+            return await self.async_client.chat.completions.create(model=model, messages=messages, **kwargs)
+        response = await self._acall(call, "Chat completion", 'chat')
+        record_token_usage(model, getattr(response, 'usage', None))
+        return response.choices[0].message.content
+
+    def _stream_request(self, messages, model, **kwargs):
+        # Ask for a final usage chunk so streamed tokens are counted too
+        return dict(model=model, messages=messages, stream=True,
+                    extra_body={"stream_options": {"include_usage": True}}, **kwargs)
+
+    def _stream_chunk(self, chunk, model, parts, on_delta):
+        record_token_usage(model, getattr(chunk, 'usage', None))
+        if not chunk.choices:
+            return
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            on_delta(delta)
+
+    def chat_stream(self, messages, on_delta, model="gpt-3.5-turbo", **kwargs):
+        """
+        Send a chat request in streaming mode, passing each content delta to on_delta.
+
+        Only opening the stream is retried; once tokens have been delivered a
+        failure is raised to the caller.
+        """
+        def call():
+            self._acquire_chat(messages)
+            return self.client.chat.completions.create(**self._stream_request(messages, model, **kwargs))
+
+        stream = self._call(call, "Streaming chat completion", 'chat_stream')
+        parts = []
+        for chunk in stream:
+            self._stream_chunk(chunk, model, parts, on_delta)
+        return ''.join(parts)
+
+    async def achat_stream(self, messages, on_delta, model="gpt-3.5-turbo", **kwargs):
+        async def call():
+            await self._acquire_chat_async(messages)
+            return await self.async_client.chat.completions.create(**self._stream_request(messages, model, **kwargs))
+
+        stream = await self._acall(call, "Streaming chat completion", 'chat_stream')
+        parts = []
+        async for chunk in stream:
+            self._stream_chunk(chunk, model, parts, on_delta)
+        return ''.join(parts)
+
+
+# Shared by every module in the process so the pool, limits and breaker are too
+openai_client = OpenAIClient()
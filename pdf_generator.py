@@ -1,31 +1,310 @@
 from fpdf import FPDF
-import io
+from fpdf.fonts import SubsetMap
+from fontTools.ttLib import TTFont
+import copy
+import logging
+import os
+import re
+import threading
+import time
+from result_cache import LRUCache, hash_text, make_key
 
-def create_summary_pdf(summary, translated_summary=None):
-    """Create a PDF from the summary and translated summary"""
-    pdf = FPDF()
-    pdf.add_page()
-    
-    # Set font for English text
-    pdf.set_font('Arial', '', 12)
-    
-    # Add title
-    pdf.set_font('Arial', 'B', 16)
-    pdf.cell(0, 10, 'Meeting Summary', ln=True, align='C')
-    pdf.ln(10)
-    
-    # Add original summary
-    pdf.set_font('Arial', '', 12)
-    pdf.multi_cell(0, 10, summary)
-    
-    # Add translated summary if available
+# Configure logging
+logger = logging.getLogger(__name__)
+
+FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts')
+# (regular, bold) Unicode TrueType fonts, first match wins; PDF_FONT / PDF_FONT_BOLD override
+FONT_CANDIDATES = [
+    (os.path.join(FONT_DIR, 'DejaVuSans.ttf'), os.path.join(FONT_DIR, 'DejaVuSans-Bold.ttf')),
+    ('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'),
+    ('/usr/share/fonts/dejavu/DejaVuSans.ttf', '/usr/share/fonts/dejavu/DejaVuSans-Bold.ttf'),
+    ('/usr/share/fonts/TTF/DejaVuSans.ttf', '/usr/share/fonts/TTF/DejaVuSans-Bold.ttf'),
+    ('/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf', '/usr/share/fonts/truetype/noto/NotoSans-Bold.ttf'),
+    ('/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf',
+     '/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf'),
+    ('/Library/Fonts/Arial Unicode.ttf', None),
+    ('C:\\Windows\\Fonts\\arial.ttf', 'C:\\Windows\\Fonts\\arialbd.ttf'),
+]
+# Extra fonts tried for glyphs the main font lacks (e.g. a Noto CJK .ttf), separated by os.pathsep
+FALLBACK_FONTS = [path for path in os.getenv('PDF_FALLBACK_FONTS', '').split(os.pathsep) if path]
+
+PDF_CACHE_BYTES = int(os.getenv('PDF_CACHE_BYTES', str(64 * 1024 * 1024)))
+# Bump when the layout changes so cached renderings from the old template are not reused
+PDF_TEMPLATE_VERSION = 1
+
+TITLE_SIZE = 16
+BODY_SIZE = 11
+HEADING_SIZES = {1: 14, 2: 13, 3: 12}
+LINE_HEIGHT = 6
+BULLET_INDENT = 6
+
+# Replacements for common characters outside Latin-1 when only the core font is available
+_LATIN1_FALLBACK = str.maketrans({
+    '\u2018': "'", '\u2019': "'", '\u201c': '"', '\u201d': '"',
+    '\u2013': '-', '\u2014': '-', '\u2022': '-', '\u2026': '...', '\u00a0': ' ',
+})
+
+_HEADING = re.compile(r'^(#{1,6})\s+(.*)$')
+_BULLET = re.compile(r'^(\s*)([-*\u2022]|\d+[.)])\s+(.*)$')
+
+
+class PDFFonts:
+    """Font files for summary PDFs, resolved and parsed once per process"""
+
+    def __init__(self, regular=None, bold=None, fallbacks=()):
+        self.regular = regular
+        self.bold = bold
+        self.fallbacks = list(fallbacks)
+        self.unicode = regular is not None
+        self.family = 'SummarySans' if self.unicode else 'Helvetica'
+        self.has_bold = bold is not None or not self.unicode
+        # Part of the render cache key: the same text renders differently with other fonts
+        self.key = '|'.join([regular or 'core', bold or '', *self.fallbacks])
+
+    def register(self, pdf):
+        if not self.unicode:
+            return
+        add_parsed_font(pdf, self.family, '', self.regular)
+        if self.bold:
+            add_parsed_font(pdf, self.family, 'B', self.bold)
+        if self.fallbacks:
+            names = []
+            for i, path in enumerate(self.fallbacks):
+                add_parsed_font(pdf, f'Fallback{i}', '', path)
+                names.append(f'Fallback{i}')
+            pdf.set_fallback_fonts(names)
+
+    def text(self, text):
+        """Text as it can be drawn with these fonts"""
+        if self.unicode:
+            return text
+        return text.translate(_LATIN1_FALLBACK).encode('latin-1', 'replace').decode('latin-1')
+
+
+_fonts = None
+_fonts_lock = threading.Lock()
+# fpdf2 font objects parsed once per process, by (family, style, path); None where they cannot be shared
+_parsed = {}
+_parsed_lock = threading.Lock()
+
+
+def _document_font(parsed, pdf):
+    """
+    A copy of a parsed fpdf2 font for one document. Metrics and the character
+    map are shared; the font number, used-glyph subset and the fontTools font
+    (which output() subsets in place) are the document's own. Opening that
+    lazily only reads the table directory.
+    """
+    font = copy.copy(parsed)
+    font.i = len(pdf.fonts) + 1
+    font.ttfont = TTFont(parsed.ttffile, recalcTimestamp=False, lazy=True,
+                         fontNumber=getattr(parsed, 'collection_font_number', 0))
+    font.subset = SubsetMap(font)
+    font.missing_glyphs = []
+    font.biggest_size_pt = 0
+    font._hbfont = None
+    return font
+
+
+def _parse_font(family, style, path):
+    key = (family, style, path)
+    with _parsed_lock:
+        if key not in _parsed:
+            template = FPDF()
+            template.add_font(family, style, path)
+            parsed = template.fonts[f'{family.lower()}{style}']
+            source = TTFont(path, lazy=True)
+            try:
+                # Color fonts and fonts patched while loading (a missing .notdef) need a fresh parse
+                if parsed.color_font is not None or '.notdef' not in source.getGlyphOrder():
+                    parsed = None
+                else:
+                    _document_font(parsed, FPDF())
+                    # Documents open their own; the decompiled tables would only take up memory
+                    parsed.ttfont = None
+            except (AttributeError, TypeError) as e:
+                logger.warning(f"Cannot share the parsed font {path} between PDFs ({str(e)}); "
+                               f"it will be parsed for every document")
+                parsed = None
+            finally:
+                source.close()
+            _parsed[key] = parsed
+        return _parsed[key]
+
+
+def add_parsed_font(pdf, family, style, path):
+    """pdf.add_font(), but the TrueType file is parsed only the first time in the process"""
+    parsed = _parse_font(family, style, path)
+    if parsed is None:
+        pdf.add_font(family, style, path)
+        return
+    pdf.fonts[parsed.fontkey] = _document_font(parsed, pdf)
+
+
+def get_fonts():
+    """Find the Unicode fonts once; fall back to the Latin-1 core font if none are installed"""
+    global _fonts
+    with _fonts_lock:
+        if _fonts is None:
+            candidates = FONT_CANDIDATES
+            if os.getenv('PDF_FONT'):
+                candidates = [(os.getenv('PDF_FONT'), os.getenv('PDF_FONT_BOLD'))]
+            fallbacks = [path for path in FALLBACK_FONTS if os.path.exists(path)]
+            for regular, bold in candidates:
+                if regular and os.path.exists(regular):
+                    _fonts = PDFFonts(regular, bold if bold and os.path.exists(bold) else None, fallbacks)
+                    logger.info(f"Using PDF font {regular}")
+                    break
+            else:
+                logger.warning("No Unicode font found for PDFs; non-Latin text will not render. "
+                               "Install DejaVu Sans or set PDF_FONT.")
+                _fonts = PDFFonts()
+        return _fonts
+
+
+def parse_blocks(text):
+    """
+    Split Markdown-style summary text into blocks.
+
+    Returns (kind, level, text, marker) tuples where kind is 'heading',
+    'bullet' or 'paragraph'. Consecutive plain lines form one paragraph.
+    """
+    blocks = []
+    paragraph = []
+
+    def flush():
+        if paragraph:
+            blocks.append(('paragraph', 0, ' '.join(paragraph), None))
+            paragraph.clear()
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            flush()
+            continue
+        match = _HEADING.match(stripped)
+        if match:
+            flush()
+            blocks.append(('heading', len(match.group(1)), match.group(2).strip('*').strip(), None))
+            continue
+        match = _BULLET.match(line)
+        if match:
+            flush()
+            indent = len(match.group(1).expandtabs(4))
+            marker = match.group(2) if match.group(2)[0].isdigit() else None
+            blocks.append(('bullet', indent // 2, match.group(3), marker))
+            continue
+        paragraph.append(stripped)
+    flush()
+    return blocks
+
+
+class SummaryDocument(FPDF):
+    """Page template for summary PDFs: running header, numbered footer and Markdown sections"""
+
+    def __init__(self, fonts, title='Meeting Summary'):
+        super().__init__()
+        self.font_set = fonts
+        self.doc_title = title
+        fonts.register(self)
+        self.set_auto_page_break(True, margin=15)
+        self.set_title(title)
+        self.set_creator('AutoScribe')
+
+    def header(self):
+        if self.page_no() > 1:
+            self.set_font(self.font_set.family, '', 8)
+            self.set_text_color(128)
+            self.cell(0, 6, self.font_set.text(self.doc_title), align='R')
+            self.ln(8)
+            self.set_text_color(0)
+
+    def footer(self):
+        self.set_y(-12)
+        self.set_font(self.font_set.family, '', 8)
+        self.set_text_color(128)
+        self.cell(0, 6, f'{self.page_no()}/{{nb}}', align='C')
+        self.set_text_color(0)
+
+    def write_inline(self, text, size):
+        """Write a wrapped line of text, rendering **bold** spans in the bold face"""
+        text = self.font_set.text(text)
+        parts = text.split('**') if text.count('**') % 2 == 0 else [text]
+        for i, part in enumerate(parts):
+            if not part:
+                continue
+            bold = i % 2 == 1 and self.font_set.has_bold
+            self.set_font(self.font_set.family, 'B' if bold else '', size)
+            self.write(LINE_HEIGHT, part)
+        self.ln(LINE_HEIGHT)
+
+    def section(self, heading, text):
+        """Start a page with a centered heading followed by the rendered text"""
+        self.add_page()
+        self.set_font(self.font_set.family, 'B' if self.font_set.has_bold else '', TITLE_SIZE)
+        self.cell(0, 10, self.font_set.text(heading), align='C')
+        self.ln(14)
+        for kind, level, block, marker in parse_blocks(text):
+            if kind == 'heading':
+                self.ln(2)
+                style = 'B' if self.font_set.has_bold else ''
+                self.set_font(self.font_set.family, style, HEADING_SIZES.get(level, 12))
+                self.multi_cell(0, LINE_HEIGHT + 1, self.font_set.text(block))
+                self.ln(1)
+            elif kind == 'bullet':
+                indent = BULLET_INDENT * (level + 1)
+                bullet = marker or ('\u2022' if self.font_set.unicode else '-')
+                self.set_font(self.font_set.family, '', BODY_SIZE)
+                self.set_x(self.l_margin + indent - 4)
+                self.cell(4, LINE_HEIGHT, bullet)
+                margin = self.l_margin
+                self.set_left_margin(margin + indent + (2 if marker else 0))
+                self.write_inline(block, BODY_SIZE)
+                self.set_left_margin(margin)
+            else:
+                self.write_inline(block, BODY_SIZE)
+                self.ln(2)
+
+
+def render_summary_pdf(summary, translated_summary=None, translated_title='Translated Summary'):
+    """Lay out the summary, and the translation on its own pages, and return the PDF bytes"""
+    pdf = SummaryDocument(get_fonts())
+    pdf.section('Meeting Summary', summary)
     if translated_summary:
-        pdf.add_page()
-        pdf.set_font('Arial', 'B', 16)
-        pdf.cell(0, 10, 'Translated Summary', ln=True, align='C')
-        pdf.ln(10)
-        pdf.set_font('Arial', '', 12)
-        pdf.multi_cell(0, 10, translated_summary)
-    
-    # Return the PDF bytes directly without additional encoding
-    return pdf.output(dest='S') 
\ No newline at end of file
+        pdf.section(translated_title, translated_summary)
+    return bytes(pdf.output())
+
+
+_cache = LRUCache(PDF_CACHE_BYTES)
+_stats = {'hits': 0, 'misses': 0, 'render_ms': 0}
+_stats_lock = threading.Lock()
+
+
+def create_summary_pdf(summary, translated_summary=None):
+    """Create a PDF from the summary and translated summary, reusing a recent rendering of the same text"""
+    key = make_key(hash_text(summary), hash_text(translated_summary or ''), PDF_TEMPLATE_VERSION, get_fonts().key)
+    found = _cache.get(key)
+    if found is not None:
+        with _stats_lock:
+            _stats['hits'] += 1
+        return found[0]
+
+    start = time.time()
+    pdf_bytes = render_summary_pdf(summary, translated_summary)
+    render_ms = int((time.time() - start) * 1000)
+    _cache.set(key, pdf_bytes, len(pdf_bytes))
+    with _stats_lock:
+        _stats['misses'] += 1
+        _stats['render_ms'] += render_ms
+    return pdf_bytes
+
+
+def pdf_cache_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+    stats['entries'] = len(_cache)
+    stats['bytes'] = _cache.size
+    stats['unicode_font'] = get_fonts().regular
+    return stats
@@ -0,0 +1,512 @@
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+import zlib
+
+from fontTools import subset as ft_subset
+from fontTools.ttLib import TTFont
+from fpdf.fonts import CORE_FONTS_CHARWIDTHS
+
+from pdf_generator import get_fonts, parse_blocks
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Rendered PDFs stay in memory up to this size, then spill to a temporary file
+PDF_SPOOL_BYTES = int(os.getenv('PDF_SPOOL_BYTES', str(4 * 1024 * 1024)))
+
+MM = 72 / 25.4
+PAGE_WIDTH = 210 * MM
+PAGE_HEIGHT = 297 * MM
+MARGIN = 10 * MM
+BOTTOM_MARGIN = 15 * MM
+
+TITLE_SIZE = 16
+BODY_SIZE = 11
+APPENDIX_SIZE = 9
+HEADING_SIZES = {1: 14, 2: 13, 3: 12}
+LINE_SPACING = 1.35
+BULLET_INDENT = 6 * MM
+
+_WORD = re.compile(r'\S+|\n[ \t]*\n')
+
+
+def _escape_literal(data):
+    return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def _pdf_string(text):
+    """A PDF text string (for document info) in PDFDocEncoding or UTF-16"""
+    try:
+        return _escape_literal(text.encode('latin-1'))
+    except UnicodeEncodeError:
+        return b'<feff' + text.encode('utf-16-be').hex().encode() + b'>'
+
+
+class PDFStreamWriter:
+    """
+    Minimal PDF writer that appends objects to a file object as they are produced.
+
+    Only object offsets and page references are kept in memory, so finished
+    pages cost nothing until the cross-reference table is written by close().
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.position = 0
+        self.offsets = {}
+        self.page_refs = []
+        self._next = 1
+        self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self.catalog_ref = self.reserve()
+        self.pages_ref = self.reserve()
+
+    def _write(self, data):
+        self.out.write(data)
+        self.position += len(data)
+
+    def reserve(self):
+        """Allocate an object number to be written later"""
+        number = self._next
+        self._next += 1
+        return number
+
+    def write_object(self, number, body):
+        self.offsets[number] = self.position
+        self._write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+
+    def write_stream(self, number, data, entries=b''):
+        compressed = zlib.compress(data)
+        self.write_object(
+            number,
+            b'<< /Length %d /Filter /FlateDecode %s>>\nstream\n' % (len(compressed), entries)
+            + compressed + b'\nendstream'
+        )
+
+    def add_page(self, content, resources_ref):
+        content_ref = self.reserve()
+        self.write_stream(content_ref, content)
+        page_ref = self.reserve()
+        self.write_object(page_ref, (
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.2f %.2f] /Resources %d 0 R /Contents %d 0 R >>'
+            % (self.pages_ref, PAGE_WIDTH, PAGE_HEIGHT, resources_ref, content_ref)
+        ))
+        self.page_refs.append(page_ref)
+
+    def close(self, title=None):
+        kids = b' '.join(b'%d 0 R' % ref for ref in self.page_refs)
+        self.write_object(self.pages_ref, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self.page_refs)))
+        self.write_object(self.catalog_ref, b'<< /Type /Catalog /Pages %d 0 R >>' % self.pages_ref)
+        info_ref = self.reserve()
+        info = b'/Producer (AutoScribe)'
+        if title:
+            info += b' /Title ' + _pdf_string(title)
+        self.write_object(info_ref, b'<< %s >>' % info)
+
+        xref_offset = self.position
+        lines = [b'xref\n0 %d\n' % self._next, b'0000000000 65535 f \n']
+        for number in range(1, self._next):
+            lines.append(b'%010d 00000 n \n' % self.offsets[number])
+        self._write(b''.join(lines))
+        self._write(b'trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+                    % (self._next, self.catalog_ref, info_ref, xref_offset))
+
+
+class CoreFont:
+    """One of the 14 standard PDF fonts; Latin-1 text only, nothing embedded"""
+
+    def __init__(self, base_font, metrics_key):
+        self.base_font = base_font
+        self.widths = CORE_FONTS_CHARWIDTHS[metrics_key]
+
+    def width(self, text, size):
+        return sum(self.widths.get(char, 500) for char in text) * size / 1000
+
+    def encode(self, text):
+        return _escape_literal(text.encode('latin-1', 'replace'))
+
+    def write(self, writer, number):
+        writer.write_object(number, (
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>'
+            % self.base_font.encode()
+        ))
+
+
+class TrueTypeMetrics:
+    """Character map and advance widths of a TrueType font, read once per process"""
+
+    def __init__(self, path):
+        font = TTFont(path, lazy=True)
+        self.path = path
+        self.units = font['head'].unitsPerEm
+        glyph_ids = {name: i for i, name in enumerate(font.getGlyphOrder())}
+        self.cmap = {code: glyph_ids[name] for code, name in font.getBestCmap().items()}
+        hmtx = font['hmtx']
+        self.advances = [hmtx[name][0] for name in font.getGlyphOrder()]
+        head = font['head']
+        scale = 1000 / self.units
+        self.bbox = [int(v * scale) for v in (head.xMin, head.yMin, head.xMax, head.yMax)]
+        self.ascent = int(font['hhea'].ascent * scale)
+        self.descent = int(font['hhea'].descent * scale)
+        os2 = font['OS/2'] if 'OS/2' in font else None
+        self.cap_height = int(getattr(os2, 'sCapHeight', 0) * scale) or self.ascent
+        name = font['name'].getDebugName(6) or os.path.splitext(os.path.basename(path))[0]
+        self.ps_name = re.sub(r'[^A-Za-z0-9+-]', '', name)
+        font.close()
+
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def load_metrics(path):
+    with _metrics_lock:
+        if path not in _metrics:
+            _metrics[path] = TrueTypeMetrics(path)
+        return _metrics[path]
+
+
+class TrueTypeFont:
+    """
+    A TrueType font embedded as a CID font for one document.
+
+    Text is written as glyph IDs; the glyphs actually used are recorded and
+    the font is subset to them when the document is closed.
+    """
+
+    def __init__(self, metrics, tag):
+        self.metrics = metrics
+        self.tag = tag
+        self.used = {}
+        # Per-character hex glyph codes and per-word widths (in font units); transcripts repeat words a lot
+        self._codes = {}
+        self._widths = {}
+
+    def width(self, text, size):
+        units = self._widths.get(text)
+        if units is None:
+            cmap, advances = self.metrics.cmap, self.metrics.advances
+            units = sum(advances[cmap.get(ord(char), 0)] for char in text)
+            if len(self._widths) > 50000:
+                self._widths.clear()
+            self._widths[text] = units
+        return units * size / self.metrics.units
+
+    def _code(self, char):
+        glyph = self.metrics.cmap.get(ord(char), 0)
+        self.used.setdefault(glyph, ord(char))
+        code = self._codes[char] = f'{glyph:04x}'
+        return code
+
+    def encode(self, text):
+        codes = self._codes
+        return b'<' + ''.join([codes.get(char) or self._code(char) for char in text]).encode() + b'>'
+
+    def _font_file(self):
+        options = ft_subset.Options()
+        options.retain_gids = True
+        options.notdef_outline = True
+        options.name_IDs = ['*']
+        options.drop_tables += ['GSUB', 'GPOS', 'GDEF', 'kern', 'FFTM']
+        font = TTFont(self.metrics.path)
+        subsetter = ft_subset.Subsetter(options)
+        subsetter.populate(gids=sorted(set(self.used) | {0}))
+        subsetter.subset(font)
+        buffer = io.BytesIO()
+        font.save(buffer)
+        return buffer.getvalue()
+
+    def write(self, writer, number):
+        metrics = self.metrics
+        name = f'{self.tag}+{metrics.ps_name}'.encode()
+        scale = 1000 / metrics.units
+
+        font_file = self._font_file()
+        file_ref = writer.reserve()
+        writer.write_stream(file_ref, font_file, b'/Length1 %d ' % len(font_file))
+
+        descriptor_ref = writer.reserve()
+        writer.write_object(descriptor_ref, (
+            b'<< /Type /FontDescriptor /FontName /%s /Flags 32 /FontBBox [%d %d %d %d] /ItalicAngle 0'
+            b' /Ascent %d /Descent %d /CapHeight %d /StemV 80 /FontFile2 %d 0 R >>'
+            % (name, *metrics.bbox, metrics.ascent, metrics.descent, metrics.cap_height, file_ref)
+        ))
+
+        widths = b' '.join(b'%d [%d]' % (glyph, round(metrics.advances[glyph] * scale))
+                           for glyph in sorted(self.used))
+        cid_ref = writer.reserve()
+        writer.write_object(cid_ref, (
+            b'<< /Type /Font /Subtype /CIDFontType2 /BaseFont /%s'
+            b' /CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >>'
+            b' /FontDescriptor %d 0 R /CIDToGIDMap /Identity /W [%s] >>' % (name, descriptor_ref, widths)
+        ))
+
+        mappings = ''.join(f'<{glyph:04x}> <{code:04x}>\n' if code < 0x10000
+                           else f'<{glyph:04x}> <{chr(code).encode("utf-16-be").hex()}>\n'
+                           for glyph, code in sorted(self.used.items()) if glyph)
+        cmap = (
+            '/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n'
+            '/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n'
+            '/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n'
+            '1 begincodespacerange\n<0000> <ffff>\nendcodespacerange\n'
+            f'{len(self.used) - (0 in self.used)} beginbfchar\n{mappings}endbfchar\n'
+            'endcmap\nCMapName currentdict /CMap defineresource pop\nend\nend'
+        ).encode()
+        unicode_ref = writer.reserve()
+        writer.write_stream(unicode_ref, cmap)
+
+        writer.write_object(number, (
+            b'<< /Type /Font /Subtype /Type0 /BaseFont /%s /Encoding /Identity-H'
+            b' /DescendantFonts [%d 0 R] /ToUnicode %d 0 R >>' % (name, cid_ref, unicode_ref)
+        ))
+
+
+def iter_words(source):
+    """
+    Yield the words of a text, with '\\n' marking paragraph breaks.
+
+    source may be a string, a readable text file or any iterable of text
+    chunks; it is consumed incrementally, so it is never split into one
+    big list.
+    """
+    if isinstance(source, str):
+        chunks = [source]
+    elif hasattr(source, 'read'):
+        chunks = iter(lambda: source.read(64 * 1024), '')
+    else:
+        chunks = source
+    carry = ''
+    for chunk in chunks:
+        text = carry + chunk
+        # Hold back a trailing partial word (or blank-line run) until the next chunk
+        cut = len(text)
+        while cut > 0 and not text[cut - 1].isspace():
+            cut -= 1
+        if cut and text[:cut].endswith('\n'):
+            cut = len(text[:cut].rstrip())
+        carry = text[cut:]
+        for match in _WORD.finditer(text, 0, cut):
+            yield '\n' if match.group().startswith('\n') else match.group()
+    for match in _WORD.finditer(carry):
+        yield '\n' if match.group().startswith('\n') else match.group()
+
+
+def _runs(text):
+    """(word, bold) pairs for a line of Markdown text with **bold** spans"""
+    parts = text.split('**') if text.count('**') % 2 == 0 else [text]
+    for i, part in enumerate(parts):
+        for word in part.split():
+            yield word, i % 2 == 1
+
+
+class StreamingSummaryPDF:
+    """
+    Lay out summary PDFs line by line, writing each page out as soon as it is full.
+
+    Uses the same fonts as pdf_generator (embedded and subset TrueType when a
+    Unicode font is installed, core Helvetica otherwise). Memory use stays flat
+    however long the text is: only the current page's content is buffered.
+    """
+
+    def __init__(self, out, title='Meeting Summary', fonts=None):
+        self.font_set = fonts or get_fonts()
+        self.title = title
+        self.writer = PDFStreamWriter(out)
+        if self.font_set.unicode:
+            regular = TrueTypeFont(load_metrics(self.font_set.regular), 'AAAAAA')
+            bold = TrueTypeFont(load_metrics(self.font_set.bold), 'AAAAAB') if self.font_set.bold else regular
+        else:
+            regular = CoreFont('Helvetica', 'helvetica')
+            bold = CoreFont('Helvetica-Bold', 'helveticaB')
+        self.fonts = {b'F1': regular, b'F2': bold}
+        self.resources_ref = self.writer.reserve()
+        # Without a bold face both names share the regular font's object
+        self.font_refs = {b'F1': self.writer.reserve()}
+        self.font_refs[b'F2'] = self.font_refs[b'F1'] if bold is regular else self.writer.reserve()
+        self.page_number = 0
+        self._ops = None
+        self.y = 0
+
+    def _font(self, bold):
+        return b'F2' if bold else b'F1'
+
+    def _text(self, text):
+        return self.font_set.text(text)
+
+    def _draw(self, x, y, runs, size, gray=0):
+        """Draw (text, bold) runs starting at x on baseline y"""
+        ops = [b'BT', b'%.2f g' % gray if gray else b'0 g', b'%.2f %.2f Td' % (x, y)]
+        for text, bold in runs:
+            key = self._font(bold)
+            ops.append(b'/%s %g Tf %s Tj' % (key, size, self.fonts[key].encode(text)))
+        ops.append(b'ET')
+        self._ops.append(b' '.join(ops))
+
+    def _finish_page(self):
+        if self._ops is not None:
+            self.writer.add_page(b'\n'.join(self._ops), self.resources_ref)
+            self._ops = None
+
+    def new_page(self):
+        self._finish_page()
+        self._ops = []
+        self.page_number += 1
+        self.y = PAGE_HEIGHT - MARGIN
+        if self.page_number > 1:
+            title = self._text(self.title)
+            width = self.fonts[b'F1'].width(title, 8)
+            self._draw(PAGE_WIDTH - MARGIN - width, self.y - 8, [(title, False)], 8, gray=0.5)
+            self.y -= 8 * LINE_SPACING + 4
+        number = str(self.page_number)
+        self._draw((PAGE_WIDTH - self.fonts[b'F1'].width(number, 8)) / 2, 8 * MM, [(number, False)], 8, gray=0.5)
+
+    def _line_space(self, size):
+        height = size * LINE_SPACING
+        if self._ops is None or self.y - height < BOTTOM_MARGIN:
+            self.new_page()
+        self.y -= height
+
+    def _wrap(self, runs, size, left, bullet=None):
+        """Lay out (word, bold) runs as wrapped lines between left and the right margin"""
+        max_width = PAGE_WIDTH - MARGIN - left
+        space = self.fonts[b'F1'].width(' ', size)
+        line, line_width = [], 0.0
+        first = True
+
+        def flush():
+            nonlocal line, line_width, first
+            self._line_space(size)
+            if first and bullet:
+                self._draw(left - self.fonts[b'F1'].width(bullet + ' ', size), self.y, [(bullet, False)], size)
+            merged = []
+            for word, bold in line:
+                if merged and merged[-1][1] == bold:
+                    merged[-1] = (merged[-1][0] + ' ' + word, bold)
+                else:
+                    merged.append((' ' + word if merged else word, bold))
+            self._draw(left, self.y, merged, size)
+            line, line_width, first = [], 0.0, False
+
+        for word, bold in runs:
+            word = self._text(word)
+            font = self.fonts[self._font(bold)]
+            width = font.width(word, size)
+            while width > max_width:
+                # A single word wider than the line: break it by characters
+                if line:
+                    flush()
+                cut = len(word)
+                while cut > 1 and font.width(word[:cut], size) > max_width:
+                    cut -= 1
+                line, line_width = [(word[:cut], bold)], max_width
+                flush()
+                word = word[cut:]
+                width = font.width(word, size)
+            if not word:
+                continue
+            if line and line_width + space + width > max_width:
+                flush()
+            line_width += (space if line else 0) + width
+            line.append((word, bold))
+        if line:
+            flush()
+
+    def heading(self, text, size, centered=False):
+        text = self._text(text)
+        self._line_space(size)
+        x = (PAGE_WIDTH - self.fonts[b'F2'].width(text, size)) / 2 if centered else MARGIN
+        if centered and x < MARGIN:
+            self.y += size * LINE_SPACING
+            self._wrap(((word, True) for word in text.split()), size, MARGIN)
+            return
+        self._draw(x, self.y, [(text, True)], size)
+
+    def section(self, heading, text):
+        """Start a page with a centered heading followed by the summary's Markdown blocks"""
+        self.new_page()
+        self.heading(heading, TITLE_SIZE, centered=True)
+        self.y -= 10
+        for kind, level, block, marker in parse_blocks(text):
+            if kind == 'heading':
+                self.y -= 4
+                self.heading(block, HEADING_SIZES.get(level, 12))
+                self.y -= 2
+            elif kind == 'bullet':
+                bullet = marker or ('•' if self.font_set.unicode else '-')
+                self._wrap(_runs(block), BODY_SIZE, MARGIN + BULLET_INDENT * (level + 1), bullet=bullet)
+            else:
+                self._wrap(_runs(block), BODY_SIZE, MARGIN)
+                self.y -= 4
+
+    def appendix(self, heading, source):
+        """Add the full text of source (see iter_words) on new pages, one paragraph at a time"""
+        self.new_page()
+        self.heading(heading, TITLE_SIZE, centered=True)
+        self.y -= 10
+        paragraph = []
+
+        def words():
+            for word in iter_words(source):
+                if word == '\n':
+                    yield None
+                else:
+                    yield word
+
+        # Paragraphs are laid out as they end; a runaway paragraph is flushed every 2000 words
+        for word in words():
+            if word is not None:
+                paragraph.append((word, False))
+                if len(paragraph) < 2000:
+                    continue
+            if paragraph:
+                self._wrap(paragraph, APPENDIX_SIZE, MARGIN)
+                paragraph = []
+            if word is None:
+                self.y -= 3
+        if paragraph:
+            self._wrap(paragraph, APPENDIX_SIZE, MARGIN)
+
+    def close(self):
+        """Write the last page, the fonts (subset to the glyphs used) and the document trailer"""
+        if self._ops is None and not self.writer.page_refs:
+            self.new_page()
+        self._finish_page()
+        self.fonts[b'F1'].write(self.writer, self.font_refs[b'F1'])
+        if self.fonts[b'F2'] is not self.fonts[b'F1']:
+            self.fonts[b'F2'].write(self.writer, self.font_refs[b'F2'])
+        fonts = b' '.join(b'/%s %d 0 R' % (key, ref) for key, ref in self.font_refs.items())
+        self.writer.write_object(self.resources_ref, b'<< /Font << %s >> >>' % fonts)
+        self.writer.close(self.title)
+        return self.page_number
+
+
+def write_summary_pdf(out, summary, translated_summary=None, transcript=None,
+                      translated_title='Translated Summary'):
+    """
+    Write a summary PDF to the binary file object out, page by page.
+
+    transcript, if given, is added as an appendix; it may be a string, a text
+    file or an iterable of text chunks. Returns the number of pages.
+    """
+    pdf = StreamingSummaryPDF(out)
+    pdf.section('Meeting Summary', summary)
+    if translated_summary:
+        pdf.section(translated_title, translated_summary)
+    if transcript:
+        pdf.appendix('Transcript', transcript)
+    return pdf.close()
+
+
+def spool_summary_pdf(summary, translated_summary=None, transcript=None):
+    """Render into a spooled temporary file (memory up to PDF_SPOOL_BYTES, then disk), rewound for reading"""
+    spooled = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_BYTES)
+    try:
+        write_summary_pdf(spooled, summary, translated_summary, transcript)
+    except Exception:
+        spooled.close()
+        raise
+    spooled.seek(0)
+    return spooled
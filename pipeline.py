@@ -0,0 +1,490 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from audio import extract_command, run_command_async
+from chunking import probe_duration, probe_duration_async, transcribe_long_audio, transcribe_long_audio_async
+from metrics import span
+from openai_client import openai_client
+from result_cache import result_cache, hash_file, hash_text, make_key
+from summarizer import summarize_transcript, summarize_transcript_async
+from transcription import OPENAI_TRANSCRIBE_MODEL, get_transcriber
+from translate import AsyncSectionTranslator, SectionTranslator, translate_text
+from vad import VAD_ENABLED, strip_silence
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+TRANSCRIBE_MODEL = OPENAI_TRANSCRIBE_MODEL
+CHAT_MODEL = "gpt-3.5-turbo"
+# Bump when a prompt changes so cached results from the old prompt are not reused
+TRANSCRIBE_PROMPT_VERSION = 1
+SUMMARY_PROMPT_VERSION = 1
+
+# Pipelines run at once by submit(), and stages without a coroutine version run by arun()
+PIPELINE_WORKERS = int(os.getenv('PIPELINE_WORKERS', '8'))
+# How often a coroutine waiting for a stage's concurrency slot checks again
+SLOT_POLL_SECONDS = 0.05
+
+
+class Cancelled(Exception):
+    """Raised between stages when the caller no longer wants the result"""
+
+
+def extract_audio(input_path, output_path, profile=None):
+    """Extract audio using FFmpeg with the given extraction profile"""
+    try:
+        ffmpeg_cmd = extract_command(input_path, output_path, profile)
+        subprocess.run(ffmpeg_cmd, check=True, capture_output=True, text=True)
+        return True
+    except subprocess.CalledProcessError as e:
+        logger.error(f"FFmpeg error: {e.stderr}")
+        # The last lines of FFmpeg's output carry the actual error, after the version banner
+        raise Exception(f"Error extracting audio: {' '.join(e.stderr.splitlines()[-3:])}")
+
+
+async def extract_audio_async(input_path, output_path, profile=None):
+    """extract_audio() as a subprocess of the event loop"""
+    returncode, _, stderr = await run_command_async(extract_command(input_path, output_path, profile))
+    if returncode != 0:
+        logger.error(f"FFmpeg error: {stderr}")
+        raise Exception(f"Error extracting audio: {' '.join(stderr.splitlines()[-3:])}")
+    return True
+
+
+def transcribe_audio(audio_path, on_text=None, temp_dir=None, backend=None, used=None):
+    """
+    Transcribe audio with the named backend (TRANSCRIBE_BACKEND by default), in
+    parallel chunks (written under temp_dir) for long recordings. The name of
+    the backend that transcribed each file or chunk is appended to used, which
+    stays empty on a cache hit.
+    """
+    try:
+        transcriber = get_transcriber(backend)
+        key = make_key(hash_file(audio_path), transcriber.cache_id, TRANSCRIBE_PROMPT_VERSION)
+        used = [] if used is None else used
+
+        def compute():
+            return transcribe_long_audio(audio_path, functools.partial(transcriber.transcribe, used=used),
+                                         on_text=on_text, temp_dir=temp_dir)
+
+        # Only cache what the requested backend produced, not what a fallback stood in with
+        transcript = result_cache.get_or_compute('transcribe', key, compute,
+                                                 cacheable=lambda _: set(used) == {transcriber.name})
+        if on_text and not used:
+            # Cache hit: hand over the whole transcript at once
+            on_text(transcript)
+        return transcript
+    except Exception as e:
+        logger.error(f"Transcription error: {str(e)}")
+        raise Exception(f"Error transcribing audio: {str(e)}")
+
+
+async def transcribe_audio_async(audio_path, on_text=None, temp_dir=None, backend=None, used=None):
+    """transcribe_audio() for the asyncio server"""
+    try:
+        transcriber = get_transcriber(backend)
+        # Hashing reads the whole file; keep it off the event loop
+        key = make_key(await asyncio.to_thread(hash_file, audio_path), transcriber.cache_id,
+                       TRANSCRIBE_PROMPT_VERSION)
+        used = [] if used is None else used
+
+        async def compute():
+            return await transcribe_long_audio_async(audio_path, functools.partial(transcriber.atranscribe, used=used),
+                                                     on_text=on_text, temp_dir=temp_dir)
+
+        transcript = await result_cache.aget_or_compute('transcribe', key, compute,
+                                                        cacheable=lambda _: set(used) == {transcriber.name})
+        if on_text and not used:
+            on_text(transcript)
+        return transcript
+    except Exception as e:
+        logger.error(f"Transcription error: {str(e)}")
+        raise Exception(f"Error transcribing audio: {str(e)}")
+
+
+def transcription_report(backend, used):
+    """Which backend a run asked for, and how many files or chunks each backend transcribed (none if cached)"""
+    transcriber = get_transcriber(backend)
+    return {
+        "backend": transcriber.name,
+        "model": transcriber.cache_id,
+        "cached": not used,
+        "transcribed_by": {name: used.count(name) for name in sorted(set(used))},
+        "fell_back": any(name != transcriber.name for name in used),
+    }
+
+
+def stream_chat(messages, on_delta):
+    """Send a chat request in streaming mode, passing each content delta to on_delta"""
+    return openai_client.chat_stream(messages, on_delta, model=CHAT_MODEL)
+
+
+def chat_complete(messages):
+    """Send one chat request to GPT-3.5 and return the reply"""
+    return openai_client.chat(messages, model=CHAT_MODEL)
+
+
+async def chat_complete_async(messages):
+    return await openai_client.achat(messages, model=CHAT_MODEL)
+
+
+def generate_summary(transcript, on_delta=None):
+    """Generate summary using GPT-3.5, optionally streaming the final summary's tokens to on_delta"""
+    try:
+        key = make_key(hash_text(transcript), CHAT_MODEL, SUMMARY_PROMPT_VERSION)
+        computed = []
+
+        def compute():
+            computed.append(True)
+            final = (lambda messages: stream_chat(messages, on_delta)) if on_delta else None
+            return summarize_transcript(transcript, chat_complete, final_fn=final)
+
+        summary = result_cache.get_or_compute('summary', key, compute)
+        if on_delta and not computed:
+            on_delta(summary)
+        return summary
+    except Exception as e:
+        logger.error(f"Summary generation error: {str(e)}")
+        raise Exception(f"Error generating summary: {str(e)}")
+
+
+async def generate_summary_async(transcript, on_delta=None):
+    """generate_summary() for the asyncio server"""
+    try:
+        key = make_key(hash_text(transcript), CHAT_MODEL, SUMMARY_PROMPT_VERSION)
+        computed = []
+
+        async def stream_final(messages):
+            return await openai_client.achat_stream(messages, on_delta, model=CHAT_MODEL)
+
+        async def compute():
+            computed.append(True)
+            return await summarize_transcript_async(transcript, chat_complete_async,
+                                                    final_fn=stream_final if on_delta else None)
+
+        summary = await result_cache.aget_or_compute('summary', key, compute)
+        if on_delta and not computed:
+            on_delta(summary)
+        return summary
+    except Exception as e:
+        logger.error(f"Summary generation error: {str(e)}")
+        raise Exception(f"Error generating summary: {str(e)}")
+
+
+def observe_media(audio_path):
+    """Record the duration of extracted audio; a probe failure only costs the data point"""
+    try:
+        metrics.MEDIA_SECONDS.observe(probe_duration(audio_path))
+    except Exception as e:
+        logger.warning(f"Could not probe media duration: {str(e)}")
+
+
+async def observe_media_async(audio_path):
+    try:
+        metrics.MEDIA_SECONDS.observe(await probe_duration_async(audio_path))
+    except Exception as e:
+        logger.warning(f"Could not probe media duration: {str(e)}")
+
+
+def _concurrency(name):
+    return int(os.getenv(f'PIPELINE_{name.upper()}_CONCURRENCY', '0'))
+
+
+class Stage:
+    """
+    One timed unit of a pipeline.
+
+    fn(ctx) receives the run's context dict and returns a dict of values to
+    add to it; afn(ctx), if given, is a coroutine function doing the same
+    that Pipeline.arun() awaits instead of running fn on a thread. when(ctx),
+    if given, decides whether the stage applies to a run. concurrency caps how
+    many runs in the process are inside this stage at once, whichever pipeline
+    or execution mode they come from (0 means no limit; the default comes from
+    PIPELINE_<NAME>_CONCURRENCY).
+    """
+
+    def __init__(self, name, fn, when=None, concurrency=None, afn=None):
+        self.name = name
+        self.fn = fn
+        self.afn = afn
+        self.when = when
+        self.concurrency = _concurrency(name) if concurrency is None else concurrency
+        self._slots = threading.BoundedSemaphore(self.concurrency) if self.concurrency else None
+
+    def applies(self, ctx):
+        return self.when is None or self.when(ctx)
+
+    def run(self, ctx):
+        if self._slots is None:
+            return self.fn(ctx) or {}
+        with self._slots:
+            return self.fn(ctx) or {}
+
+    async def arun(self, ctx):
+        if self._slots is None:
+            return await self.afn(ctx) or {}
+        # The cap is shared with threaded runs, so poll for a slot rather than block the loop
+        while not self._slots.acquire(blocking=False):
+            await asyncio.sleep(SLOT_POLL_SECONDS)
+        try:
+            return await self.afn(ctx) or {}
+        finally:
+            self._slots.release()
+
+
+def default_stage_context(name):
+    return span(name, stage=name)
+
+
+class Pipeline:
+    """
+    A sequence of stages run over a context dict.
+
+    run() executes the stages in the calling thread, submit() on a shared
+    thread pool (returning a Future) and arun() from asyncio without blocking
+    the event loop, awaiting stages that have a coroutine version and running
+    the rest on the shared pool. Each stage runs inside stage_context(name), a context
+    manager that defaults to a metrics span, so callers can attach their own
+    progress tracking; on_skip(name) is called for stages that do not apply.
+    Stage durations are collected in ctx['timings_ms'], and callables in
+    ctx['cleanup'] run when the pipeline finishes, whether or not it succeeded.
+    """
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+
+    def _run_stage(self, stage, ctx, stage_context, cancelled):
+        self._check(cancelled)
+        start = time.time()
+        with (stage_context or default_stage_context)(stage.name):
+            ctx.update(stage.run(ctx))
+        self._finished(stage, ctx, start)
+
+    async def _arun_stage(self, stage, ctx, stage_context, cancelled):
+        self._check(cancelled)
+        start = time.time()
+        with (stage_context or default_stage_context)(stage.name):
+            ctx.update(await stage.arun(ctx))
+        self._finished(stage, ctx, start)
+
+    def _check(self, cancelled):
+        if cancelled is not None and cancelled.is_set():
+            raise Cancelled("Client disconnected")
+
+    def _finished(self, stage, ctx, start):
+        ctx['timings_ms'][stage.name] = int((time.time() - start) * 1000)
+        logger.info(f"[{ctx.get('label', 'pipeline')}] {stage.name} finished in "
+                    f"{ctx['timings_ms'][stage.name] / 1000:.2f}s")
+
+    def _skip(self, stage, ctx, on_skip):
+        if stage.applies(ctx):
+            return False
+        if on_skip:
+            on_skip(stage.name)
+        return True
+
+    def _close(self, ctx):
+        for cleanup in ctx.pop('cleanup', []):
+            try:
+                cleanup()
+            except Exception as e:
+                logger.warning(f"Pipeline cleanup failed: {str(e)}")
+
+    def run(self, ctx, stage_context=None, on_skip=None, cancelled=None):
+        """Run every stage in order in this thread and return the context"""
+        ctx.setdefault('timings_ms', {})
+        try:
+            for stage in self.stages:
+                if not self._skip(stage, ctx, on_skip):
+                    self._run_stage(stage, ctx, stage_context, cancelled)
+            return ctx
+        finally:
+            self._close(ctx)
+
+    def submit(self, ctx, executor=None, **options):
+        """
+        Run on a thread pool (the shared pipeline pool by default) in a copy of
+        the caller's context, so spans keep the request ID. Returns a Future of ctx.
+        """
+        return (executor or get_executor()).submit(contextvars.copy_context().run, self.run, ctx, **options)
+
+    async def arun(self, ctx, stage_context=None, on_skip=None, cancelled=None):
+        """Run from a coroutine; stages without a coroutine version run on the shared thread pool"""
+        loop = asyncio.get_running_loop()
+        ctx.setdefault('timings_ms', {})
+        try:
+            for stage in self.stages:
+                if self._skip(stage, ctx, on_skip):
+                    continue
+                if stage.afn is not None:
+                    await self._arun_stage(stage, ctx, stage_context, cancelled)
+                else:
+                    await loop.run_in_executor(get_executor(), contextvars.copy_context().run,
+                                               self._run_stage, stage, ctx, stage_context, cancelled)
+            return ctx
+        finally:
+            self._close(ctx)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix='pipeline')
+        return _executor
+
+
+def _extract(ctx):
+    extract_audio(ctx['input_path'], ctx['audio_path'], ctx.get('profile'))
+
+
+def _speech_path(ctx):
+    """Path for the VAD stage's speech-only audio, removed when the pipeline finishes"""
+    base, extension = os.path.splitext(ctx['audio_path'])
+    speech_path = f"{base}_speech{extension}"
+
+    def remove_speech_audio():
+        if os.path.exists(speech_path):
+            os.remove(speech_path)
+
+    ctx.setdefault('cleanup', []).append(remove_speech_audio)
+    return speech_path
+
+
+def _vad_result(speech_path, report, time_map):
+    if time_map is None:
+        return {'vad': report}
+    metrics.VAD_REMOVED_SECONDS.inc(report['removed_seconds'])
+    report['time_map'] = time_map.to_list()
+    return {'vad': report, 'speech_path': speech_path, 'time_map': time_map}
+
+
+def _vad(ctx):
+    speech_path = _speech_path(ctx)
+    return _vad_result(speech_path, *strip_silence(ctx['audio_path'], speech_path, ctx.get('profile')))
+
+
+def _transcribe(ctx):
+    observe_media(ctx['audio_path'])
+    # Whisper gets the speech-only audio when the VAD stage cut anything
+    used = []
+    transcript = transcribe_audio(ctx.get('speech_path') or ctx['audio_path'], on_text=ctx.get('on_text'),
+                                  temp_dir=ctx.get('scratch_dir'), backend=ctx.get('backend'), used=used)
+    return {'transcript': transcript, 'transcription': transcription_report(ctx.get('backend'), used)}
+
+
+def _summarize(ctx):
+    # Translation of each section starts as soon as the summary has produced it
+    languages = ctx.get('languages') or []
+    translator = None
+    if languages:
+        translator = SectionTranslator(languages, translate_text, on_section=ctx.get('on_translation_section'))
+        ctx.setdefault('cleanup', []).append(translator.close)
+    return {'summary': generate_summary(ctx['transcript'], on_delta=_summary_feed(ctx, translator)),
+            'translator': translator}
+
+
+def _summary_feed(ctx, translator):
+    """Callback passing summary deltas to ctx['on_delta'] and the translator, or None if neither wants them"""
+    on_delta = ctx.get('on_delta')
+    if translator and on_delta:
+        def feed(delta):
+            on_delta(delta)
+            translator.feed(delta)
+        return feed
+    return translator.feed if translator else on_delta
+
+
+def _translate(ctx):
+    translations, timing = ctx['translator'].finish()
+    return {'translations': translations, 'translation_timing': timing}
+
+
+async def _extract_async(ctx):
+    await extract_audio_async(ctx['input_path'], ctx['audio_path'], ctx.get('profile'))
+
+
+async def _vad_async(ctx):
+    # NumPy number crunching: run it on a thread, but keep the stage itself (and its events) on the loop
+    speech_path = _speech_path(ctx)
+    return _vad_result(speech_path, *await asyncio.to_thread(strip_silence, ctx['audio_path'], speech_path,
+                                                             ctx.get('profile')))
+
+
+async def _transcribe_async(ctx):
+    await observe_media_async(ctx['audio_path'])
+    used = []
+    transcript = await transcribe_audio_async(ctx.get('speech_path') or ctx['audio_path'], on_text=ctx.get('on_text'),
+                                              temp_dir=ctx.get('scratch_dir'), backend=ctx.get('backend'), used=used)
+    return {'transcript': transcript, 'transcription': transcription_report(ctx.get('backend'), used)}
+
+
+async def _summarize_async(ctx):
+    languages = ctx.get('languages') or []
+    translator = None
+    if languages:
+        translator = AsyncSectionTranslator(languages, on_section=ctx.get('on_translation_section'))
+        ctx.setdefault('cleanup', []).append(translator.close)
+    return {'summary': await generate_summary_async(ctx['transcript'], on_delta=_summary_feed(ctx, translator)),
+            'translator': translator}
+
+
+async def _translate_async(ctx):
+    translations, timing = await ctx['translator'].finish()
+    return {'translations': translations, 'translation_timing': timing}
+
+
+# Stages of the recording pipeline. A run's context needs audio_path, plus
+# input_path when the audio still has to be extracted (streamed uploads are
+# extracted on arrival). Optional: profile, languages, backend (a transcription
+# backend name), scratch_dir for chunk files, and the callbacks
+# on_text(text), on_delta(delta) and on_translation_section(language, index, text).
+# Every stage has a coroutine version, so arun() reports stage progress from
+# the event loop.
+EXTRACT = Stage('extract', _extract, when=lambda ctx: bool(ctx.get('input_path')), afn=_extract_async)
+VAD = Stage('vad', _vad, when=lambda ctx: VAD_ENABLED, afn=_vad_async)
+TRANSCRIBE = Stage('transcribe', _transcribe, afn=_transcribe_async)
+SUMMARIZE = Stage('summarize', _summarize, afn=_summarize_async)
+TRANSLATE = Stage('translate', _translate, when=lambda ctx: ctx.get('translator') is not None, afn=_translate_async)
+
+TRANSCRIPTION = Pipeline([EXTRACT, VAD, TRANSCRIBE, SUMMARIZE, TRANSLATE])
+
+
+def transcription_result(ctx):
+    """The public result of a TRANSCRIPTION run"""
+    translations = ctx.get('translations') or {}
+    languages = ctx.get('languages') or []
+    return {
+        "transcript": ctx['transcript'],
+        "summary": ctx['summary'],
+        "translations": translations,
+        "translated_summary": translations.get(languages[0]) if languages else None,
+        "translation_timing": ctx.get('translation_timing'),
+        "vad": vad_report(ctx),
+        "transcription": ctx.get('transcription'),
+    }
+
+
+def vad_report(ctx):
+    """
+    The VAD stage's report, plus the transcription time the removed audio
+    would have cost, assuming that time scales with audio length
+    """
+    report = ctx.get('vad')
+    transcribe_ms = ctx.get('timings_ms', {}).get('transcribe')
+    if not report or not report['applied'] or not transcribe_ms or not report['speech_seconds']:
+        return report
+    return dict(report, transcribe_ms_saved_estimate=int(
+        transcribe_ms * report['removed_seconds'] / report['speech_seconds']))
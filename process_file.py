@@ -1,84 +1,371 @@
+from dotenv import load_dotenv
+
+# Load environment variables first: the modules below read their settings when imported
+load_dotenv()
+
 import os
 import sys
-import subprocess
-import openai
-from dotenv import load_dotenv
 import tempfile
 import json
+import argparse
+import glob
+import shutil
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from audio import get_profile
+from pipeline import (CHAT_MODEL, EXTRACT, SUMMARIZE, TRANSCRIBE, TRANSCRIPTION, VAD, Pipeline,
+                      default_stage_context)
+from result_cache import hash_file
+from transcription import get_transcriber
+from transcript_store import transcript_store
+
+# What batch mode picks up when given a directory
+MEDIA_EXTENSIONS = {'.mp4', '.mov', '.mkv', '.avi', '.webm', '.m4v', '.mp3', '.m4a', '.wav', '.ogg', '.flac', '.aac'}
+MANIFEST_NAME = 'manifest.jsonl'
+WORK_DIR_NAME = '.work'
+
+# Progress shown by the single-file mode
+STAGE_MESSAGES = {
+    'extract': "Extracting audio...",
+    'vad': "Detecting speech...",
+    'transcribe': "Transcribing audio...",
+    'summarize': "Generating summary...",
+}
+
+# Batch mode runs the stages separately: extraction in worker processes, the rest on API threads
+EXTRACT_ONLY = Pipeline([EXTRACT])
+TRANSCRIBE_ONLY = Pipeline([VAD, TRANSCRIBE])
+SUMMARIZE_ONLY = Pipeline([SUMMARIZE])
 
-def process_video(video_path):
+def process_video(video_path, profile=None, backend=None):
     print(f"Processing video: {video_path}")
-    
+    current = {}
+
+    @contextmanager
+    def announce(name):
+        current['stage'] = name
+        print(STAGE_MESSAGES[name])
+        with default_stage_context(name):
+            yield
+
     # Create a temporary directory for processing
     with tempfile.TemporaryDirectory() as temp_dir:
-        # Extract audio using FFmpeg
-        print("Extracting audio...")
-        audio_path = os.path.join(temp_dir, "audio.mp3")
-        ffmpeg_cmd = [
-            'ffmpeg',
-            '-i', video_path,
-            '-vn',  # No video
-            '-acodec', 'libmp3lame',  # Use MP3 codec
-            '-q:a', '2',  # High quality
-            '-y',  # Overwrite output file if it exists
-            audio_path
-        ]
-        
+        ctx = {
+            'input_path': video_path,
+            'audio_path': os.path.join(temp_dir, f"audio{get_profile(profile)['extension']}"),
+            'profile': profile,
+            'backend': backend,
+            'label': os.path.basename(video_path),
+        }
         try:
-            subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
-        except subprocess.CalledProcessError as e:
-            print(f"Error extracting audio: {e.stderr.decode()}")
+            TRANSCRIPTION.run(ctx, stage_context=announce)
+        except Exception as e:
+            if current.get('stage') != 'extract':
+                raise
+            print(str(e))
             return None
-        
-        # Transcribe audio
-        print("Transcribing audio...")
-        with open(audio_path, "rb") as audio_file:
-            transcript_obj = openai.Audio.transcribe("whisper-1", audio_file)
-            transcript_text = transcript_obj.text
-        
-        # Generate summary
-        print("Generating summary...")
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that creates meeting summaries."},
-                {"role": "user", "content": f"Please create a summary of this meeting transcript with bullet points for key decisions, action items, timeline, and budget:\n\n{transcript_text}"}
-            ]
-        )
-        
-        summary = response.choices[0].message.content
-        
-        return {
-            "transcript": transcript_text,
-            "summary": summary
+
+        result = {
+            "transcript": ctx['transcript'],
+            "summary": ctx['summary'],
+            "vad": ctx.get('vad'),
+            "transcription": ctx.get('transcription'),
         }
+        result["transcript_id"] = transcript_store.add(result, title=os.path.basename(video_path),
+                                                       source='process_file', profile=profile)
+        return result
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python process_file.py <video_file_path>")
-        sys.exit(1)
-    
-    # Load environment variables
-    load_dotenv()
-    openai.api_key = os.getenv("OPENAI_API_KEY")
-    
+def find_inputs(patterns):
+    """Expand files, directories (recursively, media files only) and glob patterns into a sorted list of files"""
+    found = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                found.update(os.path.join(root, name) for name in files
+                             if os.path.splitext(name)[1].lower() in MEDIA_EXTENSIONS)
+        elif os.path.isfile(pattern):
+            found.add(pattern)
+        else:
+            found.update(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+    return sorted(os.path.abspath(path) for path in found)
+
+def ignore_interrupts():
+    """Pool worker initializer: Ctrl-C is handled once, by the main process"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def extract_in_worker(ctx):
+    """Run the extract stage; called in a worker process of the extraction pool"""
+    return EXTRACT_ONLY.run(ctx)['timings_ms']
+
+def write_atomic(path, text):
+    """Write a file so that a crash leaves either the old or the new version, never half of one"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+class Manifest:
+    """
+    Append-only record of batch progress, one JSON object per line.
+
+    The last line for a content hash is its current state ('transcribed',
+    'done' or 'failed'), so an interrupted run is resumed by reading it back.
+    A line torn by a crash is ignored.
+    """
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[entry['sha256']] = entry
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def get(self, sha256):
+        return self.entries.get(sha256)
+
+    def record(self, sha256, source, status, **fields):
+        entry = {'sha256': sha256, 'source': source, 'status': status,
+                 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), **fields}
+        self.entries[sha256] = entry
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+class BatchProcessor:
+    """
+    Process many recordings with separate limits for local and remote work.
+
+    Hashing and FFmpeg extraction run in a process pool (extract_workers);
+    transcription and summary requests run in a thread pool (api_workers).
+    Extraction only runs a little ahead of the API workers, so extracted audio
+    never piles up on disk. Each finished file gets <name>.<hash>.json and
+    .txt in output_dir; files whose content hash the manifest already lists as
+    done are skipped, and a transcript is checkpointed as soon as it exists so
+    a resumed run only redoes the summary.
+    """
+
+    def __init__(self, output_dir, profile=None, extract_workers=2, api_workers=4, force=False, backend=None):
+        self.output_dir = output_dir
+        self.profile = profile
+        self.backend = backend
+        self.extract_workers = extract_workers
+        self.api_workers = api_workers
+        self.force = force
+        self.audio_dir = os.path.join(output_dir, WORK_DIR_NAME, 'audio')
+        self.transcript_dir = os.path.join(output_dir, WORK_DIR_NAME, 'transcripts')
+        self.counts = {'done': 0, 'skipped': 0, 'failed': 0}
+
+    def _outputs(self, item):
+        base = os.path.join(self.output_dir, f"{item['name']}.{item['sha256'][:12]}")
+        return f"{base}.json", f"{base}.txt"
+
+    def _checkpoint(self, item):
+        return os.path.join(self.transcript_dir, f"{item['sha256']}.txt")
+
+    def _is_done(self, item):
+        entry = self.manifest.get(item['sha256'])
+        return (not self.force and entry is not None and entry['status'] == 'done'
+                and all(os.path.exists(path) for path in entry.get('outputs', [])))
+
+    def _fail(self, item, stage, error):
+        print(f"[failed] {item['source']} ({stage}): {error}")
+        if 'sha256' in item:
+            self.manifest.record(item['sha256'], item['source'], 'failed', stage=stage, error=str(error))
+        self.counts['failed'] += 1
+
+    def _finish(self, item):
+        summary = item['summary']
+        json_path, text_path = self._outputs(item)
+        result = {
+            'source': item['source'],
+            'sha256': item['sha256'],
+            'profile': self.profile or None,
+            'transcribe_model': get_transcriber(self.backend).cache_id,
+            # None when a resumed run reused the checkpointed transcript
+            'transcription': item.get('transcription'),
+            'chat_model': CHAT_MODEL,
+            'transcript': item['transcript'],
+            'summary': summary,
+            'vad': item.get('vad'),
+            'timings_ms': item['timings_ms'],
+            'processed_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        result['transcript_id'] = transcript_store.add(result, title=os.path.basename(item['source']),
+                                                       source='process_file', content_sha256=item['sha256'],
+                                                       profile=self.profile or None)
+        write_atomic(json_path, json.dumps(result, indent=2, ensure_ascii=False))
+        write_atomic(text_path, f"Summary\n=======\n\n{summary}\n\nTranscript\n==========\n\n{item['transcript']}\n")
+        self.manifest.record(item['sha256'], item['source'], 'done', outputs=[json_path, text_path],
+                             timings_ms=item['timings_ms'])
+        if os.path.exists(self._checkpoint(item)):
+            os.remove(self._checkpoint(item))
+        self.counts['done'] += 1
+        print(f"[done] {item['source']} -> {os.path.basename(json_path)}")
+
+    def run(self, paths):
+        os.makedirs(self.transcript_dir, exist_ok=True)
+        # Audio left behind by an interrupted run is incomplete or unneeded; start clean
+        shutil.rmtree(self.audio_dir, ignore_errors=True)
+        os.makedirs(self.audio_dir)
+        self.manifest = Manifest(self.output_dir)
+        extension = get_profile(self.profile)['extension']
+        processes = ProcessPoolExecutor(max_workers=self.extract_workers, initializer=ignore_interrupts)
+        threads = ThreadPoolExecutor(max_workers=self.api_workers, thread_name_prefix='batch-api')
+        futures = {}
+        waiting = []  # hashed items waiting for an extraction slot
+        seen = set()
+
+        def track(future, stage, item):
+            futures[future] = (stage, item)
+
+        def extracting():
+            # Extractions running, plus audio extracted but not yet transcribed
+            return sum(1 for stage, _ in futures.values() if stage in ('extract', 'transcribe'))
+
+        try:
+            for path in paths:
+                item = {'source': path, 'name': os.path.splitext(os.path.basename(path))[0], 'timings_ms': {},
+                        'input_path': path, 'profile': self.profile, 'backend': self.backend,
+                        'label': os.path.basename(path)}
+                track(processes.submit(hash_file, path), 'hash', item)
+
+            while futures or waiting:
+                while waiting and extracting() < self.extract_workers + self.api_workers:
+                    item = waiting.pop(0)
+                    item['audio_path'] = os.path.join(self.audio_dir, f"{item['sha256']}{extension}")
+                    ctx = {key: item[key] for key in ('input_path', 'audio_path', 'profile', 'label')}
+                    track(processes.submit(extract_in_worker, ctx), 'extract', item)
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, item = futures.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        if item.get('audio_path') and os.path.exists(item['audio_path']):
+                            os.remove(item['audio_path'])
+                        self._fail(item, stage, e)
+                        continue
+
+                    if stage == 'hash':
+                        item['sha256'] = result
+                        if result in seen or self._is_done(item):
+                            print(f"[skip] {item['source']} (already processed)")
+                            self.counts['skipped'] += 1
+                            continue
+                        seen.add(result)
+                        entry = self.manifest.get(result)
+                        if entry and entry['status'] == 'transcribed' and os.path.exists(self._checkpoint(item)):
+                            # Resume after the transcript was saved: only the summary is left to do
+                            with open(self._checkpoint(item), encoding='utf-8') as f:
+                                item['transcript'] = f.read()
+                            item['timings_ms'] = dict(entry.get('timings_ms', {}))
+                            track(SUMMARIZE_ONLY.submit(item, executor=threads), 'summarize', item)
+                        else:
+                            waiting.append(item)
+                    elif stage == 'extract':
+                        item['timings_ms'].update(result)
+                        track(TRANSCRIBE_ONLY.submit(item, executor=threads), 'transcribe', item)
+                    elif stage == 'transcribe':
+                        os.remove(item['audio_path'])
+                        write_atomic(self._checkpoint(item), item['transcript'])
+                        self.manifest.record(item['sha256'], item['source'], 'transcribed',
+                                             timings_ms=item['timings_ms'])
+                        track(SUMMARIZE_ONLY.submit(item, executor=threads), 'summarize', item)
+                    else:
+                        self._finish(item)
+        except KeyboardInterrupt:
+            print(f"\nInterrupted; waiting for requests in flight. Finished work is recorded in "
+                  f"{self.manifest.path}; run the same command again to resume.")
+            raise
+        finally:
+            processes.shutdown(cancel_futures=True)
+            threads.shutdown(cancel_futures=True)
+            self.manifest.close()
+            shutil.rmtree(self.audio_dir, ignore_errors=True)
+        return self.counts
+
+def run_single(video_path, profile=None, backend=None):
+    """Original single-file mode: print the results and write transcript.txt / summary.txt here"""
     # Process the video
-    result = process_video(sys.argv[1])
-    
+    result = process_video(video_path, profile, backend)
+
     if result:
         # Print results
         print("\nTranscript:")
         print(result["transcript"])
         print("\nSummary:")
         print(result["summary"])
-        
+        if result["vad"] and result["vad"]["applied"]:
+            print(f"\nSkipped {result['vad']['removed_seconds']:.0f}s of {result['vad']['original_seconds']:.0f}s "
+                  f"of non-speech audio")
+
         # Save results to files
         with open("transcript.txt", "w") as f:
             f.write(result["transcript"])
-        
+
         with open("summary.txt", "w") as f:
             f.write(result["summary"])
-        
+
         print("\nResults saved to transcript.txt and summary.txt")
     else:
-        print("Failed to process video.") 
\ No newline at end of file
+        print("Failed to process video.")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Transcribe and summarize recordings. With one file and no --output-dir, results are "
+                    "written to transcript.txt and summary.txt; otherwise every file gets its own outputs and "
+                    "progress is kept in a manifest so interrupted runs can be resumed."
+    )
+    parser.add_argument('inputs', nargs='+', help='media files, directories or glob patterns (quote them)')
+    parser.add_argument('-o', '--output-dir', help='batch output directory (default: ./batch_output)')
+    parser.add_argument('--profile', help='audio extraction profile (see audio.AUDIO_PROFILES)')
+    parser.add_argument('--backend', help='transcription backend: openai or local (default: $TRANSCRIBE_BACKEND)')
+    parser.add_argument('--extract-workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help='FFmpeg processes at once')
+    parser.add_argument('--api-workers', type=int, default=4, help='files being transcribed/summarized at once')
+    parser.add_argument('--force', action='store_true', help='reprocess files the manifest lists as done')
+    args = parser.parse_args()
+
+    try:
+        get_transcriber(args.backend)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if len(args.inputs) == 1 and os.path.isfile(args.inputs[0]) and not args.output_dir:
+        run_single(args.inputs[0], args.profile, args.backend)
+        return
+
+    paths = find_inputs(args.inputs)
+    if not paths:
+        print("No media files found.")
+        sys.exit(1)
+    output_dir = args.output_dir or os.path.join(os.getcwd(), 'batch_output')
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"Processing {len(paths)} files into {output_dir}")
+    processor = BatchProcessor(output_dir, args.profile, args.extract_workers, args.api_workers, args.force,
+                               args.backend)
+    try:
+        counts = processor.run(paths)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    print(f"\n{counts['done']} processed, {counts['skipped']} skipped, {counts['failed']} failed")
+    if counts['failed']:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
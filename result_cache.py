@@ -0,0 +1,316 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def hash_file(path, block_size=1024 * 1024):
+    """SHA-256 of a file's contents, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_text(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+# accessed_at only orders disk evictions, so reads note it in memory and write
+# it in batches: on the next set(), or on a read once this many seconds passed
+TOUCH_FLUSH_SECONDS = 60
+
+
+def make_key(*parts):
+    """Combine key parts (hashes, model names, versions) into one cache key"""
+    return hashlib.sha256('\x1f'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU bounded by the total size of its values"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, size, expires_at, meta = entry
+            if expires_at and expires_at < time.time():
+                del self._entries[key]
+                self.size -= size
+                return None
+            self._entries.move_to_end(key)
+            return value, meta
+
+    def set(self, key, value, size, expires_at=None, meta=None):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[key] = (value, size, expires_at, meta)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted[1]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """Disk tier: SQLite table with TTLs and least-recently-used eviction by total size"""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._initialized = False
+        self._lock = threading.Lock()
+        # Keys read since the last flush, with when they were read
+        self._touched = {}
+        self._flushed_at = time.time()
+
+    @contextmanager
+    def _connect(self):
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                    conn = sqlite3.connect(self.path, timeout=30)
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    conn.execute(
+                        'CREATE TABLE IF NOT EXISTS entries ('
+                        ' key TEXT PRIMARY KEY, namespace TEXT, value TEXT, size INTEGER,'
+                        ' compute_ms INTEGER, expires_at REAL, accessed_at REAL)'
+                    )
+                    conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)')
+                    conn.commit()
+                    conn.close()
+                    self._initialized = True
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT value, compute_ms, expires_at FROM entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, compute_ms, expires_at = row
+            if expires_at and expires_at < now:
+                conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                return None
+            with self._lock:
+                self._touched[key] = now
+                due = now - self._flushed_at >= TOUCH_FLUSH_SECONDS
+            if due:
+                self._flush_touched(conn)
+        return value, {'compute_ms': compute_ms, 'expires_at': expires_at}
+
+    def set(self, key, namespace, value, size, compute_ms, expires_at):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO entries (key, namespace, value, size, compute_ms, expires_at, accessed_at)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, namespace, value, size, compute_ms, expires_at, time.time())
+            )
+            self._flush_touched(conn)
+            self._evict(conn)
+
+    def _flush_touched(self, conn):
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            self._flushed_at = time.time()
+        if touched:
+            conn.executemany('UPDATE entries SET accessed_at = MAX(accessed_at, ?) WHERE key = ?',
+                             [(accessed_at, key) for key, accessed_at in touched.items()])
+
+    def _evict(self, conn):
+        conn.execute('DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at < ?', (time.time(),))
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used entries until we are back under budget
+        excess = total - self.max_bytes
+        rows = conn.execute('SELECT key, size FROM entries ORDER BY accessed_at').fetchall()
+        doomed = []
+        for key, size in rows:
+            if excess <= 0:
+                break
+            doomed.append((key,))
+            excess -= size
+        conn.executemany('DELETE FROM entries WHERE key = ?', doomed)
+        logger.info(f"Evicted {len(doomed)} entries from result cache")
+
+
+class ResultCache:
+    """Two-tier content-addressed cache for expensive API results"""
+
+    def __init__(self, memory_bytes, disk=None, ttl=None):
+        self.memory = LRUCache(memory_bytes)
+        self.disk = disk
+        self.ttl = ttl
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def _record(self, namespace, field, saved_ms=0):
+        with self._stats_lock:
+            stats = self._stats.setdefault(namespace, {
+                'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'saved_ms': 0, 'compute_ms': 0
+            })
+            stats[field] += 1
+            stats['saved_ms'] += saved_ms
+
+    def get(self, namespace, key):
+        """Return the cached value or None, updating hit/miss counters"""
+        key = f"{namespace}:{key}"
+        found = self.memory.get(key)
+        if found is not None:
+            value, meta = found
+            self._record(namespace, 'memory_hits', meta.get('compute_ms', 0))
+            return value
+        if self.disk is not None:
+            try:
+                found = self.disk.get(key)
+            except sqlite3.Error as e:
+                logger.error(f"Result cache read error: {str(e)}")
+                found = None
+            if found is not None:
+                raw, meta = found
+                value = json.loads(raw)
+                # Expires from memory when the stored entry does, not a full TTL after this read
+                self.memory.set(key, value, len(raw), meta['expires_at'], meta)
+                self._record(namespace, 'disk_hits', meta.get('compute_ms') or 0)
+                return value
+        self._record(namespace, 'misses')
+        return None
+
+    def set(self, namespace, key, value, compute_ms=0):
+        key = f"{namespace}:{key}"
+        raw = json.dumps(value)
+        expires_at = self._expires_at()
+        meta = {'compute_ms': compute_ms}
+        self.memory.set(key, value, len(raw), expires_at, meta)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, namespace, raw, len(raw), compute_ms, expires_at)
+            except sqlite3.Error as e:
+                logger.error(f"Result cache write error: {str(e)}")
+
+    def get_or_compute(self, namespace, key, compute, cacheable=None):
+        """
+        Return the cached value for key, or call compute() and cache its
+        result, unless cacheable(result) says it should not be kept
+        """
+        value = self.get(namespace, key)
+        if value is not None:
+            return value
+        start = time.time()
+        value = compute()
+        self._computed(namespace, key, value, start, cacheable)
+        return value
+
+    async def aget_or_compute(self, namespace, key, compute, cacheable=None):
+        """get_or_compute() for a coroutine function compute; the SQLite tier is used from a worker thread"""
+        if self.disk is None:
+            value = self.get(namespace, key)
+        else:
+            value = await asyncio.to_thread(self.get, namespace, key)
+        if value is not None:
+            return value
+        start = time.time()
+        value = await compute()
+        if self.disk is None:
+            self._computed(namespace, key, value, start, cacheable)
+        else:
+            await asyncio.to_thread(self._computed, namespace, key, value, start, cacheable)
+        return value
+
+    def _computed(self, namespace, key, value, start, cacheable=None):
+        compute_ms = int((time.time() - start) * 1000)
+        with self._stats_lock:
+            self._stats[namespace]['compute_ms'] += compute_ms
+        if cacheable is None or cacheable(value):
+            self.set(namespace, key, value, compute_ms)
+
+    def _expires_at(self):
+        return time.time() + self.ttl if self.ttl else None
+
+    def stats(self):
+        """Hit/miss counters and latency saved, per namespace"""
+        with self._stats_lock:
+            namespaces = {name: dict(values) for name, values in self._stats.items()}
+        for values in namespaces.values():
+            lookups = values['memory_hits'] + values['disk_hits'] + values['misses']
+            values['hit_rate'] = round((lookups - values['misses']) / lookups, 3) if lookups else 0.0
+            # Every hit is an OpenAI round-trip we did not pay for
+            values['api_calls_saved'] = values['memory_hits'] + values['disk_hits']
+        return {
+            'memory_entries': len(self.memory),
+            'memory_bytes': self.memory.size,
+            'namespaces': namespaces,
+        }
+
+
+class NullCache:
+    """Drop-in replacement used when caching is disabled"""
+
+    def get_or_compute(self, namespace, key, compute, cacheable=None):
+        return compute()
+
+    async def aget_or_compute(self, namespace, key, compute, cacheable=None):
+        return await compute()
+
+    def get(self, namespace, key):
+        return None
+
+    def set(self, namespace, key, value, compute_ms=0):
+        pass
+
+    def stats(self):
+        return {'enabled': False}
+
+
+def create_result_cache():
+    """Build the shared cache from RESULT_CACHE_* environment variables"""
+    backend = os.getenv('RESULT_CACHE_BACKEND', 'sqlite')
+    if backend == 'off':
+        return NullCache()
+    memory_bytes = int(os.getenv('RESULT_CACHE_MEMORY_BYTES', str(32 * 1024 * 1024)))
+    ttl = int(os.getenv('RESULT_CACHE_TTL_SECONDS', str(30 * 24 * 3600))) or None
+    disk = None
+    if backend == 'sqlite':
+        disk = SQLiteCache(
+            os.getenv('RESULT_CACHE_DB', os.path.join(os.getcwd(), 'cache', 'results.sqlite3')),
+            int(os.getenv('RESULT_CACHE_DISK_BYTES', str(512 * 1024 * 1024)))
+        )
+    elif backend != 'memory':
+        raise ValueError(f"Unknown result cache backend '{backend}'")
+    return ResultCache(memory_bytes, disk=disk, ttl=ttl)
+
+
+# Shared by every module in the process so hits and stats are pooled
+result_cache = create_result_cache()
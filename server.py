@@ -1,20 +1,32 @@
-from flask import Flask, request, jsonify, send_file, make_response
+from dotenv import load_dotenv
+
+# Load environment variables first: the modules below read their settings when imported
+load_dotenv()
+
+from flask import Flask, Response, request, jsonify, send_file, make_response, g
 from flask_cors import CORS
 import os
-import subprocess
-import openai
-from dotenv import load_dotenv
-import tempfile
-from werkzeug.utils import secure_filename
-import traceback
-import socket
+from werkzeug.formparser import parse_form_data, default_stream_factory
 import time
 import logging
 from logging.handlers import RotatingFileHandler
 from translate import translate_text
-from pdf_generator import create_summary_pdf
+from batch_translate import translate_batch
 import io
+import queue
+import threading
+import contextvars
 from email_handler import send_summary_email
+from audio import FFmpegPipe, extract_audio_stream, stream_encode_args
+from job_queue import create_job_queue
+import metrics
+from metrics import span
+from pipeline import TRANSCRIPTION, chat_complete
+from uploads import UploadStore, UploadError
+from storage import storage, QuotaExceeded, QuotaReader
+import api
+from api import (STREAM_UPLOADS, SSE_KEEPALIVE_SECONDS, MAIL_QUEUE_MAXSIZE, MAIL_QUEUE_DB,
+                 format_sse, get_local_ip)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -23,107 +35,66 @@ logger = logging.getLogger(__name__)
 # Create logs directory if it doesn't exist
 os.makedirs('logs', exist_ok=True)
 
-# Add file handler for production logging
-file_handler = RotatingFileHandler('logs/server.log', maxBytes=10240000, backupCount=10)
+# Add file handler for production logging (the file is opened by the first record, not at import)
+file_handler = RotatingFileHandler('logs/server.log', maxBytes=10240000, backupCount=10, delay=True)
 file_handler.setFormatter(logging.Formatter(
     '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
 ))
 file_handler.setLevel(logging.INFO)
 logger.addHandler(file_handler)
-
-# Load environment variables
-logger.info("Loading environment variables...")
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+logging.getLogger('api').addHandler(file_handler)
 
 app = Flask(__name__)
 # Allow all origins and methods with more permissive CORS
 CORS(app, resources={
     r"/*": {
         "origins": "*",
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization", "Access-Control-Allow-Origin"],
+        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        "allow_headers": ["Content-Type", "Authorization", "Access-Control-Allow-Origin",
+                          "Upload-Offset", "X-Chunk-SHA256"],
+        "expose_headers": ["Upload-Offset", "Location"],
         "supports_credentials": True
     }
 })
 
-# Create a temp directory that persists between requests
-UPLOAD_FOLDER = os.path.join(os.getcwd(), 'temp_uploads')
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Outbound email has its own queue so deliveries never wait behind transcriptions
+MAIL_WORKERS = int(os.getenv('MAIL_WORKERS', '2'))
 
-def get_local_ip():
-    """Get the local IP address of the machine"""
-    try:
-        # Get local IP address
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        local_ip = s.getsockname()[0]
-        s.close()
-        return local_ip
-    except Exception:
-        return "127.0.0.1"
-
-def extract_audio(input_path, output_path):
-    """Extract audio using FFmpeg"""
-    try:
-        ffmpeg_cmd = [
-            'ffmpeg',
-            '-i', input_path,
-            '-vn',
-            '-acodec', 'libmp3lame',
-            '-q:a', '2',
-            '-y',
-            output_path
-        ]
-        result = subprocess.run(ffmpeg_cmd, check=True, capture_output=True, text=True)
-        print(f"FFmpeg output: {result.stdout}")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"FFmpeg error: {e.stderr}")
-        raise Exception(f"Error extracting audio: {e.stderr}")
-
-def transcribe_audio(audio_path):
-    """Transcribe audio using Whisper"""
-    try:
-        with open(audio_path, "rb") as audio_file:
-            print(f"Transcribing file: {audio_path}")
-            # Using the older OpenAI API format
-            transcript_obj = openai.Audio.transcribe("whisper-1", audio_file)
-            print(f"Transcription result: {transcript_obj}")
-            return transcript_obj.text
-    except Exception as e:
-        print(f"Transcription error: {str(e)}")
-        raise Exception(f"Error transcribing audio: {str(e)}")
+# Set by gunicorn.conf.py when the app is preloaded; its post_fork hook calls start_workers()
+DEFER_WORKERS = os.getenv('DEFER_WORKERS', '0') == '1'
 
-def generate_summary(transcript):
-    """Generate summary using GPT-3.5"""
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that creates meeting summaries."},
-                {"role": "user", "content": f"Please create a summary of this meeting transcript with bullet points for key decisions, action items, timeline, and budget:\n\n{transcript}"}
-            ]
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        print(f"Summary generation error: {str(e)}")
-        raise Exception(f"Error generating summary: {str(e)}")
+def respond(body, status=200, headers=None):
+    """A JSON response from what the api functions return"""
+    response = jsonify(body)
+    for name, value in (headers or {}).items():
+        response.headers.add(name, value)
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response, status
 
-def translate_text(text, target_language):
-    """Translate text using GPT-3.5"""
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": f"You are a helpful translator. Translate the following text to {target_language}. Maintain the same formatting including markdown and bullet points."},
-                {"role": "user", "content": text}
-            ]
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        print(f"Translation error: {str(e)}")
-        raise Exception(f"Error translating text: {str(e)}")
+@app.errorhandler(api.ApiError)
+def api_error(error):
+    return respond(error.body, error.status, error.headers)
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.time()
+    g.request_id = request.headers.get('X-Request-ID') or metrics.new_request_id()
+    metrics.set_request_id(g.request_id)
+    metrics.REQUESTS_IN_FLIGHT.inc()
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_start' in g:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.REQUEST_SECONDS.observe(time.time() - g.request_start, endpoint=endpoint,
+                                        method=request.method, status=response.status_code)
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    if 'request_start' in g:
+        metrics.REQUESTS_IN_FLIGHT.dec()
 
 def handle_options_request():
     """Handle CORS preflight requests"""
@@ -133,221 +104,370 @@ def handle_options_request():
     response.headers.add('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
     return response
 
+def handle_post_preflight():
+    """CORS preflight of the POST-only routes"""
+    response = jsonify({'status': 'ok'})
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+    response.headers.add('Access-Control-Allow-Methods', 'POST')
+    return response
+
 @app.route('/test', methods=['GET'])
 def test():
+    return respond(*api.server_status())
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: answers as long as the process can serve requests, without touching anything else"""
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    return respond(*api.readiness(jobs, mail_jobs))
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.registry.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return respond(*api.cache_stats())
+
+def receive_streamed_upload(audio_path, profile=None):
+    """
+    Pipe the request body straight into FFmpeg, writing only the extracted audio.
+
+    Accepts either multipart/form-data (the first file part is streamed) or a
+    raw body with the original name in the X-Filename header. Returns the
+    original filename (None if no file was sent), the extraction time in ms
+    and any other form fields.
+    """
     start_time = time.time()
-    response = jsonify({
-        "status": "ok", 
-        "message": "Server is running",
-        "local_ip": get_local_ip(),
-        "response_time_ms": int((time.time() - start_time) * 1000)
-    })
-    return response
+    if request.mimetype == 'multipart/form-data':
+        pipes = []
+
+        def stream_factory(total_content_length, content_type, filename, content_length=None):
+            if pipes:
+                return default_stream_factory(total_content_length, content_type, filename, content_length)
+            pipes.append(FFmpegPipe(audio_path, stream_encode_args(profile)))
+            return pipes[0]
+
+        try:
+            _, form, files = parse_form_data(request.environ, stream_factory=stream_factory)
+        except Exception:
+            for pipe in pipes:
+                pipe.abort()
+            raise
+        if not pipes:
+            return None, 0, form
+        filename = files['file'].filename if 'file' in files else 'upload'
+        pipes[0].finish()
+        metrics.MEDIA_BYTES.observe(pipes[0].bytes_in)
+    else:
+        form = {}
+        filename = request.headers.get('X-Filename') or request.args.get('filename') or 'upload'
+        if not request.content_length and request.headers.get('Transfer-Encoding') != 'chunked':
+            return None, 0, form
+        extract_audio_stream(request.stream, audio_path, stream_encode_args(profile))
+        if request.content_length:
+            metrics.MEDIA_BYTES.observe(request.content_length)
+    return filename, int((time.time() - start_time) * 1000), form
+
+def run_transcription_job(job):
+    """Run extraction, transcription, summary and translation for a queued upload"""
+    start_time = time.time()
+    ctx, work = api.transcription_job_context(job)
+    try:
+        TRANSCRIPTION.run(ctx, stage_context=lambda name: api.job_stage(job, name, work), on_skip=job.skip_stage)
+        return api.transcription_job_result(job, ctx, start_time)
+    finally:
+        api.finish_transcription_job(job, ctx)
+
+# Background workers that drain /transcribe jobs
+jobs = create_job_queue()
+jobs.register('transcribe', run_transcription_job)
+metrics.QUEUE_DEPTH.set_callback(jobs.depth)
+
+def run_email_job(job):
+    """Render the summary PDF and deliver it to every recipient"""
+    metrics.set_request_id(job.payload.get('request_id') or job.id)
+    recipients = job.payload['recipients']
+    from pdf_generator import create_summary_pdf
+    with api.job_stage(job, 'pdf'):
+        pdf_data = create_summary_pdf(job.payload['summary'], job.payload.get('translated_summary'))
+    with api.job_stage(job, 'email'):
+        batches = send_summary_email(recipients, job.payload['summary'], pdf_data,
+                                     job.payload.get('translated_summary'))
+    return api.email_job_result(recipients, batches)
+
+# Background workers that deliver /send-email requests
+mail_jobs = create_job_queue(workers=MAIL_WORKERS, maxsize=MAIL_QUEUE_MAXSIZE, db_path=MAIL_QUEUE_DB)
+mail_jobs.register('email', run_email_job)
+metrics.MAIL_QUEUE_DEPTH.set_callback(mail_jobs.depth)
+
+# Resumable chunked uploads, finalized into the same job queue
+uploads = UploadStore()
+
+metrics.STORAGE_USED_BYTES.set_callback(storage.used_bytes)
+
+def start_workers():
+    """Start the job workers and the storage sweeper, which reclaims work directories of crashed workers"""
+    jobs.start()
+    mail_jobs.start()
+    storage.start_sweeper()
+
+# Threads do not survive a fork, so a preloading gunicorn master leaves this to each worker
+if not DEFER_WORKERS:
+    start_workers()
+
+def accept_upload():
+    """
+    Receive a /transcribe upload, either saved to disk or piped through FFmpeg.
+
+    Returns the upload: its file paths, original filename, extraction
+    profile, transcription backend and, in streaming mode, how long
+    extraction took. Raises ApiError when the request is invalid.
+    """
+    profile, backend, extension = api.upload_options(request.args)
+    work = api.admit_upload(request.content_length)
+    # Chunked bodies have no Content-Length to check up front: count them against the quota as they are read
+    request.environ['wsgi.input'] = QuotaReader(request.environ['wsgi.input'], work)
+    try:
+        with span('upload', stage='upload'):
+            upload = receive_upload(profile, extension, work)
+        work.check()
+    except QuotaExceeded as e:
+        work.release()
+        raise api.storage_error(e)
+    except BaseException:
+        work.release()
+        raise
+    upload['backend'] = backend
+    return upload
+
+def receive_upload(profile, extension, work):
+    """Body of accept_upload once the profile is known and space is reserved, timed as the upload stage"""
+    if request.args.get('stream', STREAM_UPLOADS).lower() in ('1', 'true', 'yes'):
+        # Streaming mode: extraction runs while the upload is still arriving
+        audio_path = work.file(f"audio{extension}", scratch=True)
+        filename, extract_ms, form = receive_streamed_upload(audio_path, profile)
+        languages = api.upload_languages(request.args, form)
+        if filename is None:
+            raise api.bad_request("No file provided")
+        return api.streamed_upload(work, filename, profile, languages, audio_path, extract_ms)
+
+    languages = api.upload_languages(request.args, request.form)
+    if 'file' not in request.files:
+        raise api.bad_request("No file provided")
+    file = request.files['file']
+    if file.filename == '':
+        raise api.bad_request("No file selected")
+
+    upload = api.saved_upload(work, file.filename, profile, languages, extension)
+    file.save(upload['input_path'])
+    logger.info(f"Saved file to: {upload['input_path']}")
+    metrics.MEDIA_BYTES.observe(os.path.getsize(upload['input_path']))
+    return upload
 
 @app.route('/transcribe', methods=['POST', 'OPTIONS'])
 def transcribe():
-    start_time = time.time()
-    
     if request.method == 'OPTIONS':
-        response = jsonify({'status': 'ok'})
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
-        response.headers.add('Access-Control-Allow-Methods', 'POST')
-        return response
-        
+        return handle_post_preflight()
     try:
-        if 'file' not in request.files:
-            return jsonify({"error": "No file provided"}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({"error": "No file selected"}), 400
-
-        logger.info(f"Received file: {file.filename}")
-        
-        # Save file with secure filename
-        filename = secure_filename(file.filename)
-        input_path = os.path.join(UPLOAD_FOLDER, filename)
-        audio_path = os.path.join(UPLOAD_FOLDER, f"{filename}_audio.mp3")
-        
-        # Save uploaded file
-        file.save(input_path)
-        logger.info(f"Saved file to: {input_path}")
-        
-        try:
-            # Step 1: Extract audio
-            logger.info("Extracting audio...")
-            extract_start = time.time()
-            extract_audio(input_path, audio_path)
-            logger.info(f"Audio extracted in {(time.time() - extract_start):.2f}s")
-            
-            # Step 2: Transcribe
-            logger.info("Transcribing audio...")
-            transcribe_start = time.time()
-            transcript = transcribe_audio(audio_path)
-            logger.info(f"Transcription completed in {(time.time() - transcribe_start):.2f}s")
-            
-            # Step 3: Generate summary
-            logger.info("Generating summary...")
-            summary_start = time.time()
-            summary = generate_summary(transcript)
-            logger.info(f"Summary generated in {(time.time() - summary_start):.2f}s")
-            
-            # Step 4: Translate summary
-            logger.info("Translating summary...")
-            translate_start = time.time()
-            translated_summary = translate_text(summary, "Spanish")
-            logger.info(f"Translation completed in {(time.time() - translate_start):.2f}s")
-            
-            # Clean up files
-            os.remove(input_path)
-            os.remove(audio_path)
-            logger.info("Files cleaned up")
-            
-            total_time = time.time() - start_time
-            response = jsonify({
-                "transcript": transcript,
-                "summary": summary,
-                "translated_summary": translated_summary,
-                "processing_time_ms": int(total_time * 1000)
-            })
-            response.headers.add('Access-Control-Allow-Origin', '*')
-            return response
-            
-        except Exception as e:
-            # Clean up files on error
-            logger.error(f"Error during processing: {str(e)}")
-            if os.path.exists(input_path):
-                os.remove(input_path)
-            if os.path.exists(audio_path):
-                os.remove(audio_path)
-            raise e
-            
+        return respond(*api.queue_transcription(jobs, accept_upload()))
+    except api.ApiError:
+        raise
+    except Exception as e:
+        raise api.internal_error('upload', e)
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    return respond(*api.create_upload(uploads, request.get_json(silent=True)))
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    return respond(*api.upload_status(uploads, upload_id))
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """
+    Append the request body at the Upload-Offset header's offset.
+
+    The chunk is checked against X-Chunk-SHA256 (hex) when given; a chunk that
+    fails the check, or whose connection drops, is discarded and can be sent
+    again from the same offset.
+    """
+    offset = api.chunk_offset(request.headers)
+    try:
+        upload = uploads.write_chunk(upload_id, offset, request.stream, request.headers.get('X-Chunk-SHA256'))
+    except UploadError as e:
+        raise api.upload_error(e)
+    return respond(*api.upload_reply(upload))
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def delete_upload(upload_id):
+    api.delete_upload(uploads, upload_id)
+    return '', 204
+
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    """Process a complete upload like /transcribe, or return the result of an identical earlier one"""
+    upload, reply = api.finish_upload(uploads, upload_id, request.get_json(silent=True), request.args)
+    return respond(*(reply or api.queue_finished_upload(jobs, upload)))
+
+def run_streaming_pipeline(upload, emit, cancelled):
+    """Run the transcription pipeline for /transcribe/stream, reporting progress through emit(event, data)"""
+    run = api.StreamingRun(upload, emit)
+    try:
+        TRANSCRIPTION.run(run.ctx, stage_context=run.stage_events, cancelled=cancelled)
+        run.done(*run.store())
+    except Exception as e:
+        run.failed(e)
+    finally:
+        api.remove_upload_files(upload)
+        emit(None, None)
+
+@app.route('/transcribe/stream', methods=['POST', 'OPTIONS'])
+def transcribe_stream():
+    if request.method == 'OPTIONS':
+        return handle_post_preflight()
+    try:
+        upload = accept_upload()
+    except api.ApiError:
+        raise
     except Exception as e:
-        error_traceback = traceback.format_exc()
         logger.error(f"Error: {str(e)}")
-        logger.error(f"Traceback: {error_traceback}")
-        response = jsonify({
-            "error": str(e),
-            "step": "processing",
-            "traceback": error_traceback
-        })
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        return response, 500
+        return respond({"error": str(e), "step": "upload"}, 500)
+
+    events = queue.Queue()
+    cancelled = threading.Event()
+    # Run in a copy of this request's context so the pipeline's spans carry its request ID
+    worker = threading.Thread(
+        target=contextvars.copy_context().run,
+        args=(run_streaming_pipeline, upload, lambda event, data: events.put((event, data)), cancelled),
+        daemon=True
+    )
+    worker.start()
+
+    def generate():
+        try:
+            while True:
+                try:
+                    event, data = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    break
+                yield format_sse(event, data)
+        finally:
+            cancelled.set()
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers.add('Cache-Control', 'no-cache')
+    response.headers.add('X-Accel-Buffering', 'no')
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    return respond(*api.job_status(jobs, job_id))
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    return respond(*api.job_result(jobs, job_id))
+
+@app.route('/transcripts', methods=['GET'])
+def list_transcripts():
+    return respond(*api.list_transcripts(request.args))
+
+@app.route('/transcripts/search', methods=['GET'])
+def search_transcripts():
+    return respond(*api.search_transcripts(request.args))
+
+@app.route('/transcripts/<transcript_id>', methods=['GET'])
+def get_transcript(transcript_id):
+    return respond(*api.get_transcript(transcript_id))
+
+@app.route('/transcripts/<transcript_id>', methods=['DELETE'])
+def delete_transcript(transcript_id):
+    return respond(*api.delete_transcript(transcript_id))
 
 @app.route('/translate', methods=['POST', 'OPTIONS'])
 def translate():
     if request.method == 'OPTIONS':
-        response = jsonify({'status': 'ok'})
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
-        response.headers.add('Access-Control-Allow-Methods', 'POST')
-        return response
-    
+        return handle_post_preflight()
+    text, target_language = api.translation_request(request.get_json(silent=True))
     try:
-        data = request.json
-        if not data or 'text' not in data or 'targetLanguage' not in data:
-            return jsonify({"error": "Missing text or target language"}), 400
-        
-        text = data['text']
-        target_language = data['targetLanguage']
-        
-        logger.info(f"Translating text to {target_language}...")
         translate_start = time.time()
-        translated_text = translate_text(text, target_language)
+        with span('translate', stage='translate', languages=1):
+            translated_text = translate_text(text, target_language)
         logger.info(f"Translation completed in {(time.time() - translate_start):.2f}s")
-        
-        return jsonify({
-            "translatedText": translated_text
-        })
-        
     except Exception as e:
-        error_traceback = traceback.format_exc()
-        logger.error(f"Error: {str(e)}")
-        logger.error(f"Traceback: {error_traceback}")
-        response = jsonify({
-            "error": str(e),
-            "step": "translation",
-            "traceback": error_traceback
-        })
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        return response, 500
+        raise api.internal_error('translation', e)
+    return respond({"translatedText": translated_text})
+
+@app.route('/translate/batch', methods=['POST', 'OPTIONS'])
+def translate_batch_route():
+    if request.method == 'OPTIONS':
+        return handle_post_preflight()
+    texts, languages = api.batch_translation_request(request.get_json(silent=True))
+    try:
+        translate_start = time.time()
+        with span('translate_batch', stage='translate', texts=len(texts), languages=len(languages)):
+            result = translate_batch(texts, languages, translate_text, chat_complete)
+    except Exception as e:
+        raise api.internal_error('translation', e)
+    return respond(*api.batch_translation_reply(result, translate_start))
 
 @app.route('/generate-pdf', methods=['POST', 'OPTIONS'])
 def generate_pdf():
     if request.method == 'OPTIONS':
-        response = jsonify({'status': 'ok'})
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
-        response.headers.add('Access-Control-Allow-Methods', 'POST')
-        return response
-    
+        return handle_post_preflight()
+    summary, translated_summary, transcript, streamed = api.pdf_request(request.get_json(silent=True))
     try:
-        data = request.json
-        if not data or 'summary' not in data:
-            return jsonify({"error": "Missing summary"}), 400
-        
-        summary = data['summary']
-        translated_summary = data.get('translatedSummary')  # Optional
-        
-        # Generate PDF
-        pdf_content = create_summary_pdf(summary, translated_summary)
-        
-        # Create response with PDF file
-        response = send_file(
-            io.BytesIO(pdf_content),
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name='meeting_summary.pdf'
-        )
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        return response
-        
+        from pdf_generator import create_summary_pdf
+        from pdf_stream import spool_summary_pdf
+        with span('pdf', stage='pdf', streamed=streamed):
+            if streamed:
+                pdf_file = spool_summary_pdf(summary, translated_summary, transcript)
+            else:
+                pdf_file = io.BytesIO(create_summary_pdf(summary, translated_summary))
     except Exception as e:
-        logger.error(f"Error generating PDF: {str(e)}")
-        response = jsonify({
-            "error": str(e),
-            "step": "pdf_generation"
-        })
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        return response, 500
+        raise api.pdf_error(e)
+
+    response = send_file(
+        pdf_file,
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name='meeting_summary.pdf'
+    )
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
 
 @app.route('/send-email', methods=['POST', 'OPTIONS'])
 def send_email():
     if request.method == 'OPTIONS':
         return handle_options_request()
-    
     try:
-        data = request.get_json()
-        recipients = data.get('recipients', [])
-        summary = data.get('summary')
-        translated_summary = data.get('translatedSummary')
-        
-        if not recipients or not summary:
-            return jsonify({'error': 'Missing required fields'}), 400
-            
-        # Generate PDF
-        pdf_data = create_summary_pdf(summary, translated_summary)
-        
-        # Send email
-        send_summary_email(recipients, summary, pdf_data, translated_summary)
-        
-        response = jsonify({'message': 'Email sent successfully'})
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        return response, 200
-        
+        return respond(*api.queue_email(mail_jobs, request.get_json(silent=True)))
+    except api.ApiError:
+        raise
     except Exception as e:
         logger.error(f"Error sending email: {str(e)}")
-        response = jsonify({'error': str(e)})
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        return response, 500
+        return respond({'error': str(e)}, 500)
+
+@app.route('/send-email/<job_id>', methods=['GET'])
+def email_status(job_id):
+    return respond(*api.email_status(mail_jobs, job_id))
 
 if __name__ == '__main__':
     # This block only runs when starting the development server
     local_ip = get_local_ip()
     port = 8080
     logger.info(f"Starting development server on {local_ip}:{port}...")
-    logger.info(f"You can access the server at:")
+    logger.info("You can access the server at:")
     logger.info(f"  http://localhost:{port}")
     logger.info(f"  http://{local_ip}:{port}")
     
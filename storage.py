@@ -0,0 +1,435 @@
+import fcntl
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Every upload gets its own work directory under STORAGE_ROOT/jobs, removed as a
+# whole when the job ends. Admission reserves the bytes a job is expected to
+# need and refuses (or waits, up to STORAGE_ADMISSION_WAIT_SECONDS) when the
+# global quota or the disk's free-space floor would be crossed. Intermediates
+# (extracted audio, chunks) go to a scratch directory on STORAGE_HOT_DIR, e.g.
+# a tmpfs, while that tier has room, and spill to the work directory otherwise.
+STORAGE_ROOT = os.getenv('STORAGE_ROOT', os.path.join(os.getcwd(), 'temp_uploads'))
+STORAGE_QUOTA_BYTES = int(os.getenv('STORAGE_QUOTA_BYTES', str(20 * 1024 ** 3)))
+JOB_QUOTA_BYTES = int(os.getenv('STORAGE_JOB_QUOTA_BYTES', str(4 * 1024 ** 3)))
+# Admission keeps at least this much of the disk free for everything else
+MIN_FREE_BYTES = int(os.getenv('STORAGE_MIN_FREE_BYTES', str(1024 ** 3)))
+# Reserved for an upload whose size is not known in advance (no Content-Length)
+DEFAULT_RESERVATION_BYTES = int(os.getenv('STORAGE_DEFAULT_RESERVATION_BYTES', str(512 * 1024 * 1024)))
+# 0 rejects uploads at once when space is short; otherwise they wait this long for space
+ADMISSION_WAIT_SECONDS = float(os.getenv('STORAGE_ADMISSION_WAIT_SECONDS', '0'))
+HOT_DIR = os.getenv('STORAGE_HOT_DIR', '')
+HOT_QUOTA_BYTES = int(os.getenv('STORAGE_HOT_BYTES', str(1024 ** 3)))
+# Hot space reserved per job: extracted audio is far smaller than the video it comes from
+HOT_JOB_BYTES = int(os.getenv('STORAGE_HOT_JOB_BYTES', str(128 * 1024 * 1024)))
+# Work directories untouched for this long belong to a crashed or killed worker
+ORPHAN_MAX_AGE_SECONDS = int(os.getenv('STORAGE_ORPHAN_MAX_AGE_SECONDS', str(6 * 3600)))
+SWEEP_INTERVAL_SECONDS = int(os.getenv('STORAGE_SWEEP_INTERVAL_SECONDS', '300'))
+# Every worker process shares the root, so the bookkeeping lives on disk. Each
+# work directory holds "<bytes> <hot bytes>" charged to it: its reservation,
+# raised when its files outgrow it. The ledger in the root holds the totals
+# ("<bytes> <hot bytes> <other bytes>"), updated with every admission, charge
+# and release under the admission lock, so admitting an upload reads one small
+# file however much is stored. The sweeper reconciles the ledger with the
+# disk, including files under the root that are not in work directories.
+RESERVATION_FILE = '.reserved'
+LEDGER_FILE = '.usage'
+ADMISSION_LOCK_FILE = '.admission.lock'
+
+
+class StorageFull(Exception):
+    """Raised when there is not enough space to admit an upload"""
+
+
+class QuotaExceeded(Exception):
+    """Raised when a job's files grow past its per-job quota"""
+
+
+def directory_bytes(path):
+    """Total size of the files under path (0 if it does not exist)"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def read_numbers(path, count):
+    """The count integers in a bookkeeping file, or None if it is missing or unreadable"""
+    try:
+        with open(path) as f:
+            numbers = [int(n) for n in f.read().split()]
+    except (OSError, ValueError):
+        return None
+    return numbers if len(numbers) == count else None
+
+
+def write_numbers(path, *numbers):
+    """Replace a bookkeeping file whole, as other processes read it without the lock"""
+    with open(path + '.tmp', 'w') as f:
+        f.write(' '.join(str(n) for n in numbers))
+    os.replace(path + '.tmp', path)
+
+
+def read_reservation(work_path):
+    """(bytes, hot bytes) charged to a work directory, (0, 0) if it has no record"""
+    return tuple(read_numbers(os.path.join(work_path, RESERVATION_FILE), 2) or (0, 0))
+
+
+def latest_mtime(path):
+    """Most recent modification time of path or anything under it"""
+    latest = os.lstat(path).st_mtime
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                latest = max(latest, os.lstat(os.path.join(root, name)).st_mtime)
+            except OSError:
+                pass
+    return latest
+
+
+class WorkDir:
+    """A job's isolated directories: path for the upload itself, scratch for intermediates"""
+
+    def __init__(self, manager, work_id, hot=False):
+        self.manager = manager
+        self.id = work_id
+        self.path = os.path.join(manager.jobs_dir, work_id)
+        self.hot = hot
+        self.scratch = os.path.join(manager.hot_jobs_dir, work_id) if hot else self.path
+        self.received = 0
+
+    def file(self, name, scratch=False):
+        """Path for a file of this job, in the scratch directory for intermediates"""
+        return os.path.join(self.scratch if scratch else self.path, name)
+
+    def usage(self):
+        used = directory_bytes(self.path)
+        if self.hot:
+            used += directory_bytes(self.scratch)
+        return used
+
+    def count_received(self, nbytes):
+        """Count upload bytes as they arrive; raises QuotaExceeded as soon as they pass the per-job quota"""
+        self.received += nbytes
+        if self.received > self.manager.job_quota:
+            raise QuotaExceeded(f"Upload is over the {self.manager.job_quota} byte per-job quota")
+
+    def check(self):
+        """Raise QuotaExceeded if the job's files outgrew the per-job quota, and charge what they use"""
+        used = directory_bytes(self.path)
+        hot_used = directory_bytes(self.scratch) if self.hot else 0
+        if used + hot_used > self.manager.job_quota:
+            raise QuotaExceeded(f"Job files use {used + hot_used} bytes, "
+                                f"over the {self.manager.job_quota} byte per-job quota")
+        self.manager.charge(self.id, used, hot_used)
+        # Keep the sweeper off directories of jobs that are still running
+        for path in {self.path, self.scratch}:
+            if os.path.isdir(path):
+                os.utime(path)
+
+    def release(self):
+        self.manager.release(self.id)
+
+
+class QuotaReader:
+    """A request body stream that counts what is read from it against a work directory's per-job quota"""
+
+    def __init__(self, stream, work):
+        self.stream = stream
+        self.work = work
+
+    def read(self, *args):
+        data = self.stream.read(*args)
+        self.work.count_received(len(data))
+        return data
+
+    def readline(self, *args):
+        line = self.stream.readline(*args)
+        self.work.count_received(len(line))
+        return line
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class StorageManager:
+    """Quota-checked work directories on disk, with an optional hot (tmpfs) tier and an orphan sweeper"""
+
+    def __init__(self, root=STORAGE_ROOT, quota=STORAGE_QUOTA_BYTES, job_quota=JOB_QUOTA_BYTES,
+                 min_free=MIN_FREE_BYTES, hot_dir=HOT_DIR, hot_quota=HOT_QUOTA_BYTES,
+                 max_age=ORPHAN_MAX_AGE_SECONDS):
+        self.root = root
+        self.jobs_dir = os.path.join(root, 'jobs')
+        self.quota = quota
+        self.job_quota = job_quota
+        self.min_free = min_free
+        self.hot_dir = hot_dir or None
+        self.hot_jobs_dir = os.path.join(hot_dir, 'jobs') if hot_dir else None
+        self.hot_quota = hot_quota
+        self.max_age = max_age
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        if self.hot_jobs_dir:
+            os.makedirs(self.hot_jobs_dir, exist_ok=True)
+        self.admission_lock = os.path.join(root, ADMISSION_LOCK_FILE)
+        self.ledger = os.path.join(root, LEDGER_FILE)
+        # Work directories admitted by this process and not yet released
+        self._active = set()
+        self._space = threading.Condition()
+        self._sweeper = None
+        self._stop = threading.Event()
+
+    @contextmanager
+    def _locked(self):
+        """The admission lock, an flock, so it holds between worker processes as well as threads"""
+        with open(self.admission_lock, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _totals(self):
+        """[work directory bytes, hot bytes, other bytes] from the ledger; call with the lock held"""
+        totals = read_numbers(self.ledger, 3)
+        if totals is None:
+            # First use of this root: count once what is already there
+            totals = self._recount(self._other_bytes())
+        return totals
+
+    def _recount(self, other):
+        """Rebuild the ledger from the work directories' charges; call with the lock held"""
+        totals = [0, 0, other]
+        for entry in os.scandir(self.jobs_dir):
+            charged, hot = read_reservation(entry.path)
+            totals[0] += charged
+            totals[1] += hot
+        write_numbers(self.ledger, *totals)
+        return totals
+
+    def _other_bytes(self):
+        """Bytes under the root outside the work directories, e.g. resumable uploads"""
+        other = 0
+        for entry in os.scandir(self.root):
+            if entry.path == self.jobs_dir or entry.name.startswith((ADMISSION_LOCK_FILE, LEDGER_FILE)):
+                continue
+            other += directory_bytes(entry.path) if entry.is_dir(follow_symlinks=False) else entry.stat().st_size
+        return other
+
+    def admit(self, expected_bytes=None, wait=ADMISSION_WAIT_SECONDS):
+        """
+        Reserve space for a new job and create its work directory.
+
+        expected_bytes is what the job will write, e.g. its upload size (None
+        if unknown). Raises QuotaExceeded if that alone is over the per-job
+        quota, and StorageFull if there is no room within wait seconds.
+        """
+        self._check_job_size(expected_bytes)
+        reservation = DEFAULT_RESERVATION_BYTES if expected_bytes is None else expected_bytes
+        hot_reservation = min(reservation, HOT_JOB_BYTES)
+        deadline = time.time() + (wait or 0)
+        with self._space:
+            while True:
+                # Other workers admit into the same root: check and record the reservation under the lock
+                with self._locked():
+                    totals = self._totals()
+                    problem = self._shortage(reservation, totals)
+                    if problem is None:
+                        work_id = uuid.uuid4().hex
+                        hot = self._hot_room(hot_reservation, totals)
+                        hot_charge = hot_reservation if hot else 0
+                        work = WorkDir(self, work_id, hot)
+                        os.makedirs(work.path, exist_ok=True)
+                        if hot:
+                            os.makedirs(work.scratch, exist_ok=True)
+                        write_numbers(os.path.join(work.path, RESERVATION_FILE), reservation, hot_charge)
+                        write_numbers(self.ledger, totals[0] + reservation, totals[1] + hot_charge, totals[2])
+                        self._active.add(work_id)
+                        return work
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise StorageFull(problem)
+                # Released here or, by another worker, noticed on the next poll
+                self._space.wait(min(remaining, 5))
+
+    def ensure_room(self, expected_bytes):
+        """Raise QuotaExceeded or StorageFull unless expected_bytes would be admitted now, without reserving them"""
+        self._check_job_size(expected_bytes)
+        problem = self._shortage(expected_bytes, self._read_totals())
+        if problem is not None:
+            raise StorageFull(problem)
+
+    def disk_has_room(self):
+        """True while the disk under root has more than min_free bytes free; one statvfs call, no directory walk"""
+        return shutil.disk_usage(self.root).free >= self.min_free
+
+    def _check_job_size(self, expected_bytes):
+        if expected_bytes is not None and expected_bytes > self.job_quota:
+            raise QuotaExceeded(f"Upload of {expected_bytes} bytes is over the {self.job_quota} byte per-job quota")
+
+    def _shortage(self, reservation, totals):
+        """Why a reservation of this size cannot be admitted now, or None if it can"""
+        used = totals[0] + totals[2]
+        if used + reservation > self.quota:
+            return f"Temporary storage is full ({used} of {self.quota} bytes in use)"
+        free = shutil.disk_usage(self.root).free
+        if free - reservation < self.min_free:
+            return f"Not enough free disk space ({free} bytes free)"
+        return None
+
+    def _hot_room(self, reservation, totals):
+        if not self.hot_jobs_dir or totals[1] + reservation > self.hot_quota:
+            return False
+        return shutil.disk_usage(self.hot_jobs_dir).free > reservation
+
+    def _read_totals(self):
+        # The ledger is replaced whole, so reading it needs no lock unless it has to be built
+        totals = read_numbers(self.ledger, 3)
+        if totals is None:
+            with self._locked():
+                totals = self._totals()
+        return totals
+
+    def used_bytes(self):
+        """
+        Bytes in use under the root, counting each work directory as at least
+        what it reserved, whichever worker admitted it, so admissions that
+        have not written their files yet are not handed out twice. Read from
+        the ledger; no directory walk.
+        """
+        charged, _, other = self._read_totals()
+        return charged + other
+
+    def charge(self, work_id, used, hot_used=0):
+        """Raise a work directory's charge to what its files use, once they outgrow its reservation"""
+        path = os.path.join(self.jobs_dir, work_id)
+        with self._locked():
+            charged, hot = read_reservation(path)
+            if (used <= charged and hot_used <= hot) or not os.path.isdir(path):
+                return
+            totals = self._totals()
+            used, hot_used = max(used, charged), max(hot_used, hot)
+            write_numbers(os.path.join(path, RESERVATION_FILE), used, hot_used)
+            write_numbers(self.ledger, totals[0] + used - charged, totals[1] + hot_used - hot, totals[2])
+
+    def _uncharge(self, work_id):
+        """Take a work directory's charge off the ledger before it is deleted"""
+        path = os.path.join(self.jobs_dir, work_id)
+        with self._locked():
+            charged, hot = read_reservation(path)
+            if not charged and not hot:
+                return
+            totals = self._totals()
+            # The record goes first, so a recount cannot count the directory again
+            os.remove(os.path.join(path, RESERVATION_FILE))
+            write_numbers(self.ledger, max(totals[0] - charged, 0), max(totals[1] - hot, 0), totals[2])
+
+    def get(self, work_id):
+        """The work directory of a job admitted earlier, possibly by another process"""
+        hot = bool(self.hot_jobs_dir) and os.path.isdir(os.path.join(self.hot_jobs_dir, work_id))
+        return WorkDir(self, work_id, hot)
+
+    def release(self, work_id):
+        """Delete a job's directories and return its reservation"""
+        self._uncharge(work_id)
+        for path in (os.path.join(self.jobs_dir, work_id),
+                     os.path.join(self.hot_jobs_dir, work_id) if self.hot_jobs_dir else None):
+            if path:
+                shutil.rmtree(path, ignore_errors=True)
+        with self._space:
+            self._active.discard(work_id)
+            self._space.notify_all()
+
+    def sweep(self):
+        """
+        Remove work directories (and stray files in the root) that have not
+        been touched for max_age, then reconcile the ledger with the disk
+        """
+        cutoff = time.time() - self.max_age
+        removed = 0
+        with self._space:
+            active = set(self._active)
+        for parent in (self.jobs_dir, self.hot_jobs_dir, self.root):
+            if not parent:
+                continue
+            for entry in os.scandir(parent):
+                if entry.name in active or entry.path in (self.jobs_dir, self.hot_dir):
+                    continue
+                if parent == self.root and (entry.is_dir(follow_symlinks=False) or
+                                            entry.name.startswith((ADMISSION_LOCK_FILE, LEDGER_FILE))):
+                    # Other stores under the root (resumable uploads) expire their own files
+                    continue
+                try:
+                    if latest_mtime(entry.path) >= cutoff:
+                        continue
+                    if parent == self.jobs_dir:
+                        self._uncharge(entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path)
+                    else:
+                        os.remove(entry.path)
+                    removed += 1
+                except OSError as e:
+                    logger.warning(f"Could not remove orphaned {entry.path}: {str(e)}")
+        self.reconcile()
+        if removed:
+            logger.info(f"Storage sweeper removed {removed} orphaned uploads")
+            with self._space:
+                self._space.notify_all()
+        return removed
+
+    def reconcile(self):
+        """
+        Charge every work directory what its files use and rebuild the ledger.
+        The directory walks happen outside the lock, so admissions do not wait on them.
+        """
+        other = self._other_bytes()
+        for entry in os.scandir(self.jobs_dir):
+            hot_path = os.path.join(self.hot_jobs_dir, entry.name) if self.hot_jobs_dir else None
+            self.charge(entry.name, directory_bytes(entry.path), directory_bytes(hot_path) if hot_path else 0)
+        with self._locked():
+            self._recount(other)
+
+    def start_sweeper(self, interval=SWEEP_INTERVAL_SECONDS):
+        """Sweep in a daemon thread every interval seconds, starting now"""
+        if self._sweeper is not None or not interval:
+            return
+
+        def run():
+            while True:
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logger.error(f"Storage sweep failed: {str(e)}")
+                if self._stop.wait(interval):
+                    return
+
+        self._sweeper = threading.Thread(target=run, name='storage-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._stop.set()
+
+    def stats(self):
+        charged, hot, other = self._read_totals()
+        return {
+            'used_bytes': charged + other,
+            'quota_bytes': self.quota,
+            'free_bytes': shutil.disk_usage(self.root).free,
+            'reserved_bytes': charged,
+            'active_jobs': sum(1 for _ in os.scandir(self.jobs_dir)),
+            'hot_dir': self.hot_dir,
+            'hot_jobs': sum(1 for _ in os.scandir(self.hot_jobs_dir)) if self.hot_jobs_dir else 0,
+            'hot_used_bytes': hot,
+        }
+
+
+# Shared by the server modules, like result_cache
+storage = StorageManager()
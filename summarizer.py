@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import math
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+# tiktoken gives exact counts when installed; otherwise fall back to a heuristic
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = "You are a helpful assistant that creates meeting summaries."
+SUMMARY_PROMPT = "Please create a summary of this meeting transcript with bullet points for key decisions, action items, timeline, and budget:"
+PARTIAL_PROMPT = (
+    "This is part {part} of {total} of a meeting transcript. List its key decisions, action items, "
+    "timeline and budget points as bullet points. Keep names, dates and figures exactly as stated:"
+)
+REDUCE_PROMPT = (
+    "These are notes taken from consecutive parts of one meeting. Merge them into a single summary "
+    "of the meeting with bullet points for key decisions, action items, timeline, and budget. "
+    "Remove duplicates and keep names, dates and figures exactly as stated:"
+)
+
+# gpt-3.5-turbo context window, and room reserved for the completion
+CONTEXT_TOKENS = int(os.getenv('SUMMARY_CONTEXT_TOKENS', '16385'))
+RESPONSE_TOKENS = int(os.getenv('SUMMARY_RESPONSE_TOKENS', '1500'))
+# Smaller parts summarize faster and in parallel, at the cost of more calls
+CHUNK_TOKENS = int(os.getenv('SUMMARY_CHUNK_TOKENS', '6000'))
+MAX_CONCURRENCY = int(os.getenv('SUMMARY_CONCURRENCY', '4'))
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+_encoding = None
+
+
+def estimate_tokens(text):
+    """Estimate the number of tokens text will use in a gpt-3.5-turbo prompt"""
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        return len(_encoding.encode(text))
+    # Roughly 4 characters or 0.75 words per token for English; take the larger
+    return max(math.ceil(len(text) / 4), math.ceil(len(text.split()) * 4 / 3))
+
+
+def prompt_tokens(messages):
+    """Estimate the prompt size of a chat request, including per-message overhead"""
+    return sum(estimate_tokens(m['content']) + 4 for m in messages) + 3
+
+
+def fits_in_context(messages, response_tokens=RESPONSE_TOKENS, context_tokens=CONTEXT_TOKENS):
+    return prompt_tokens(messages) + response_tokens <= context_tokens
+
+
+def split_text(text, max_tokens):
+    """Split text into pieces of at most max_tokens, breaking between sentences where possible"""
+    pieces = []
+    current = []
+    current_tokens = 0
+    for sentence in _SENTENCE_END.split(text.strip()):
+        tokens = estimate_tokens(sentence)
+        if tokens > max_tokens:
+            # A single run-on "sentence" (common in raw transcripts): break it by words
+            words = sentence.split()
+            step = max(1, int(len(words) * max_tokens / tokens))
+            sub_sentences = [' '.join(words[i:i + step]) for i in range(0, len(words), step)]
+        else:
+            sub_sentences = [sentence]
+        for piece in sub_sentences:
+            piece_tokens = estimate_tokens(piece)
+            if current and current_tokens + piece_tokens > max_tokens:
+                pieces.append(' '.join(current))
+                current = []
+                current_tokens = 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        pieces.append(' '.join(current))
+    return pieces
+
+
+def _messages(instructions, text):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"{instructions}\n\n{text}"}
+    ]
+
+
+def summary_messages(transcript):
+    """Chat messages for summarizing a transcript in a single call"""
+    return _messages(SUMMARY_PROMPT, transcript)
+
+
+def summarize_transcript(transcript, complete_fn, chunk_tokens=CHUNK_TOKENS, max_workers=MAX_CONCURRENCY,
+                         final_fn=None):
+    """
+    Summarize a transcript of any length.
+
+    complete_fn(messages) sends one chat request and returns the reply text.
+    Transcripts that fit the context window use the original single prompt.
+    Longer ones are split into token-bounded parts, summarized in parallel
+    through a bounded thread pool, and the partial notes are merged by a reduce
+    pass (repeated hierarchically if the notes themselves are too long).
+    final_fn, if given, is used instead of complete_fn for the request that
+    produces the final summary, e.g. to stream its tokens.
+    """
+    final_fn = final_fn or complete_fn
+    messages = summary_messages(transcript)
+    if fits_in_context(messages):
+        return final_fn(messages)
+
+    parts = split_text(transcript, chunk_tokens)
+    logger.info(f"Transcript too long for one prompt; summarizing {len(parts)} parts")
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='summary') as executor:
+        notes = list(executor.map(complete_fn, _partial_messages(parts)))
+        return reduce_notes(notes, complete_fn, executor, chunk_tokens, final_fn)
+
+
+async def summarize_transcript_async(transcript, complete_fn, chunk_tokens=CHUNK_TOKENS,
+                                     max_workers=MAX_CONCURRENCY, final_fn=None):
+    """summarize_transcript() where complete_fn and final_fn are coroutine functions"""
+    final_fn = final_fn or complete_fn
+    messages = summary_messages(transcript)
+    if fits_in_context(messages):
+        return await final_fn(messages)
+
+    parts = split_text(transcript, chunk_tokens)
+    logger.info(f"Transcript too long for one prompt; summarizing {len(parts)} parts")
+    slots = asyncio.Semaphore(max_workers)
+
+    async def complete(request):
+        async with slots:
+            return await complete_fn(request)
+
+    notes = await asyncio.gather(*(complete(request) for request in _partial_messages(parts)))
+    while True:
+        messages, groups = _reduce_round(notes, chunk_tokens)
+        if groups is None:
+            return await final_fn(messages)
+        notes = await asyncio.gather(*(complete(_messages(REDUCE_PROMPT, group)) for group in groups))
+
+
+def _partial_messages(parts):
+    return [_messages(PARTIAL_PROMPT.format(part=i + 1, total=len(parts)), part) for i, part in enumerate(parts)]
+
+
+def _reduce_round(notes, chunk_tokens):
+    """
+    The final reduce request for notes, and None if it fits one prompt;
+    otherwise None and the groups of neighbouring notes to merge first.
+    """
+    combined = '\n\n'.join(f"Part {i + 1}:\n{note}" for i, note in enumerate(notes))
+    messages = _messages(REDUCE_PROMPT, combined)
+    if fits_in_context(messages):
+        return messages, None
+    # A note too long to merge with anything is cut up and its pieces summarized on their own
+    notes = [piece for note in notes
+             for piece in (split_text(note, chunk_tokens) if estimate_tokens(note) > chunk_tokens else [note])]
+    if len(notes) == 1:
+        return messages, None
+    # Too many notes for one prompt: merge neighbouring groups first
+    groups = []
+    for note in notes:
+        if groups and estimate_tokens(groups[-1]) + estimate_tokens(note) <= chunk_tokens:
+            groups[-1] = f"{groups[-1]}\n\n{note}"
+        else:
+            groups.append(note)
+    if len(groups) == len(notes):
+        # No two neighbours fit together; pair them up anyway so the round still shrinks
+        groups = ['\n\n'.join(notes[i:i + 2]) for i in range(0, len(notes), 2)]
+    logger.info(f"Reducing {len(notes)} partial summaries in {len(groups)} groups")
+    return None, groups
+
+
+def reduce_notes(notes, complete_fn, executor, chunk_tokens=CHUNK_TOKENS, final_fn=None):
+    """Merge partial notes into the final summary, in several rounds if they do not fit one prompt"""
+    while True:
+        messages, groups = _reduce_round(notes, chunk_tokens)
+        if groups is None:
+            return (final_fn or complete_fn)(messages)
+        notes = list(executor.map(lambda group: complete_fn(_messages(REDUCE_PROMPT, group)), groups))
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# The modules live at the top of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Some modules create their stores when imported, by default under the working directory
+_state = tempfile.mkdtemp(prefix='autoscribe-tests-')
+for name, default in (('STORAGE_ROOT', 'temp_uploads'), ('TRANSCRIPT_DB', 'transcripts.sqlite3'),
+                      ('JOB_QUEUE_DB', 'jobs.sqlite3'), ('MAIL_QUEUE_DB', 'mail.sqlite3'),
+                      ('RESULT_CACHE_DB', 'results.sqlite3'), ('MAIL_SINK_DIR', 'sent_mail')):
+    os.environ.setdefault(name, os.path.join(_state, default))
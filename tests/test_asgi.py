@@ -0,0 +1,59 @@
+import io
+
+import pytest
+from starlette.testclient import TestClient
+
+import asgi
+import server
+import storage
+from pipeline import Pipeline, Stage
+from test_sse import events, summarize, transcribe
+
+
+@pytest.fixture
+def client():
+    return TestClient(asgi.app)
+
+
+def test_api_errors_match_the_flask_server(client):
+    flask = server.app.test_client()
+    for path, body in (('/translate', 'not json'), ('/translate', '{"text": "hola"}'), ('/generate-pdf', '{}'),
+                       ('/transcribe?profile=lossless', '')):
+        expected = flask.post(path, data=body, content_type='application/json')
+        response = client.post(path, content=body, headers={'Content-Type': 'application/json'})
+        assert (response.status_code, response.json()) == (expected.status_code, expected.get_json())
+        assert response.headers['X-Request-ID']
+
+
+def test_readiness_follows_the_lifespan():
+    assert TestClient(asgi.app).get('/readyz').status_code == 503
+    with TestClient(asgi.app) as client:
+        response = client.get('/readyz')
+        assert response.status_code == 200
+        assert response.json()['checks']['job_workers'] is True
+    assert client.get('/test').json()['mode'] == 'asgi'
+
+
+def test_stream_reports_stages_from_the_event_loop(client, monkeypatch):
+    monkeypatch.setattr(asgi, 'TRANSCRIPTION', Pipeline([Stage('transcribe', transcribe, concurrency=0),
+                                                         Stage('summarize', summarize, concurrency=0)]))
+    response = client.post('/transcribe/stream?stream=0', files={'file': ('meeting.mp3', io.BytesIO(b'audio'))})
+    assert response.headers['content-type'].startswith('text/event-stream')
+    received = events(response.text)
+    assert [data['stage'] for event, data in received if event == 'stage'] == [
+        'transcribe', 'transcribe', 'summarize', 'summarize']
+    assert received[-1] == ('done', received[-1][1])
+    assert received[-1][1]['summary'] == '- Ship in May'
+
+
+def test_chunked_uploads_stop_at_the_job_quota(client, monkeypatch):
+    monkeypatch.setattr(storage, 'DEFAULT_RESERVATION_BYTES', 1024)
+    monkeypatch.setattr(storage.storage, 'job_quota', 64 * 1024)
+
+    def body():
+        for _ in range(16):
+            yield b'\0' * 8192
+
+    response = client.post('/transcribe?stream=1', content=body(), headers={'X-Filename': 'meeting.mp3'})
+    assert response.status_code == 413
+    assert 'quota' in response.json()['error']
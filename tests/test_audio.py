@@ -0,0 +1,95 @@
+import asyncio
+import io
+import re
+import shutil
+import subprocess
+
+import pytest
+
+import api
+from audio import extract_audio_stream, extract_audio_stream_async, extract_command, get_profile, stream_encode_args
+
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='needs ffmpeg')
+
+
+@pytest.fixture
+def recording(tmp_path):
+    """Two seconds of a stereo 44.1 kHz tone, as an uploaded WAV file"""
+    path = tmp_path / 'meeting.wav'
+    subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-f', 'lavfi',
+                    '-i', 'sine=frequency=440:duration=2', '-ac', '2', '-ar', '44100', str(path)], check=True)
+    return path
+
+
+def probe(path):
+    """(duration in seconds, channel layout, sample rate) of an audio file, as ffmpeg reports them"""
+    stderr = subprocess.run(['ffmpeg', '-hide_banner', '-i', str(path)], capture_output=True, text=True).stderr
+    hours, minutes, seconds = re.search(r'Duration: (\d+):(\d+):([\d.]+)', stderr).groups()
+    rate, layout = re.search(r'Audio: .*?(\d+) Hz, (\w+)', stderr).groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds), layout, int(rate)
+
+
+class FailingStream(io.BytesIO):
+    """A request body whose client goes away halfway through"""
+
+    def read(self, *args):
+        if self.tell() > 1024:
+            raise ConnectionResetError('client went away')
+        return super().read(1024)
+
+
+def test_stream_is_extracted_while_it_is_read(recording, tmp_path):
+    output = tmp_path / 'audio.mp3'
+    with open(recording, 'rb') as f:
+        written = extract_audio_stream(f, str(output), stream_encode_args('archive'))
+    assert written == output.stat().st_size > 0
+    duration, _, _ = probe(output)
+    assert duration == pytest.approx(2, abs=0.1)
+
+
+def test_async_stream_is_extracted_from_body_chunks(recording, tmp_path):
+    output = tmp_path / 'audio.mp3'
+    data = recording.read_bytes()
+
+    async def body():
+        for start in range(0, len(data), 4096):
+            yield data[start:start + 4096]
+
+    written = asyncio.run(extract_audio_stream_async(body(), str(output), stream_encode_args('archive')))
+    assert written == output.stat().st_size > 0
+    assert probe(output)[0] == pytest.approx(2, abs=0.1)
+
+
+def test_input_ffmpeg_cannot_decode_is_reported(tmp_path):
+    with pytest.raises(Exception, match='Error extracting audio'):
+        extract_audio_stream(io.BytesIO(b'not audio at all' * 100), str(tmp_path / 'audio.mp3'))
+
+
+def test_interrupted_upload_stops_ffmpeg(recording, tmp_path):
+    with pytest.raises(ConnectionResetError):
+        extract_audio_stream(FailingStream(recording.read_bytes()), str(tmp_path / 'audio.mp3'))
+
+
+# Opus always decodes at 48 kHz, whatever rate it was encoded from
+@pytest.mark.parametrize('profile, extension, rate', [('speech', '.ogg', 48000), ('speech-mp3', '.mp3', 16000)])
+def test_speech_profiles_extract_small_mono_audio(recording, tmp_path, profile, extension, rate):
+    speech = tmp_path / f"speech{extension}"
+    archive = tmp_path / 'archive.mp3'
+    subprocess.run(extract_command(str(recording), str(speech), profile), capture_output=True, check=True)
+    subprocess.run(extract_command(str(recording), str(archive), 'archive'), capture_output=True, check=True)
+    assert probe(speech)[1:] == ('mono', rate)
+    assert speech.stat().st_size < archive.stat().st_size
+
+
+def test_speech_profile_streams_through_a_pipe(recording, tmp_path):
+    output = tmp_path / f"audio{get_profile('speech-mp3')['extension']}"
+    with open(recording, 'rb') as f:
+        extract_audio_stream(f, str(output), stream_encode_args('speech-mp3'))
+    assert probe(output)[1:] == ('mono', 16000)
+
+
+def test_unknown_profile_is_a_bad_request():
+    with pytest.raises(api.ApiError) as error:
+        api.upload_options({'profile': 'lossless'})
+    assert error.value.status == 400
+    assert 'speech' in error.value.body['error']
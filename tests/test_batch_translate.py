@@ -0,0 +1,48 @@
+import json
+import time
+from types import SimpleNamespace
+
+import batch_translate
+from openai_client import OpenAIClient, TokenBucket
+from result_cache import NullCache
+from translate import translation_messages
+
+LONG_TEXT = 'The launch budget was approved after a long discussion of the options. ' * 40
+
+
+class CountingBucket(TokenBucket):
+    def __init__(self, rate):
+        super().__init__(rate)
+        self.acquired = 0
+
+    def acquire(self, amount=1.0):
+        self.acquired += 1
+        super().acquire(amount)
+
+
+class FakeCompletions:
+    """Answers packed prompts with a JSON array and single translations with the text itself"""
+
+    def create(self, model, messages, **kwargs):
+        text = messages[-1]['content']
+        reply = json.dumps(json.loads(text)) if 'JSON array' in messages[0]['content'] else text
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))], usage=None)
+
+
+def test_batches_are_limited_by_the_openai_client_only(monkeypatch):
+    monkeypatch.setattr(batch_translate, 'result_cache', NullCache())
+    client = OpenAIClient()
+    client._client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+    client.request_bucket = CountingBucket(6000)
+    client.token_bucket = TokenBucket(10 ** 7)
+
+    texts = ['hello', 'goodbye'] + [f"{i}. {LONG_TEXT}" for i in range(10)]
+    start = time.monotonic()
+    result = batch_translate.translate_batch(
+        texts, ['es', 'fr'], lambda text, language: client.chat(translation_messages(text, language)), client.chat)
+
+    # 11 requests per language, charged once each, without a second limiter holding them back
+    assert result['stats']['requests'] == 22
+    assert client.request_bucket.acquired == 22
+    assert time.monotonic() - start < 2
+    assert [item['translations']['es'] for item in result['results']] == texts
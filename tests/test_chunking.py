@@ -0,0 +1,55 @@
+import random
+import time
+
+from chunking import (Chunk, OrderedStitcher, overlapping_seams, plan_chunks, stitch_transcripts,
+                      transcribe_chunks)
+
+
+def test_cuts_in_the_latest_silence_before_the_boundary():
+    silences = [(80.0, 82.0), (95.0, 97.0), (180.0, 182.0)]
+    assert plan_chunks(250, silences, chunk_seconds=100, overlap=2, search_window=30) == [
+        (0.0, 96.0), (96.0, 181.0), (181.0, 250)]
+
+
+def test_cut_without_silence_overlaps_the_next_chunk():
+    assert plan_chunks(250, [(10.0, 12.0)], chunk_seconds=100, overlap=2, search_window=30) == [
+        (0.0, 102.0), (100.0, 202.0), (200.0, 250)]
+
+
+def test_short_audio_is_one_chunk():
+    assert plan_chunks(60, [], chunk_seconds=100) == [(0.0, 60)]
+
+
+def test_repeats_are_dropped_only_at_overlapping_seams():
+    chunks = [Chunk(0, 'a', 0, 102), Chunk(1, 'b', 100, 150), Chunk(2, 'c', 150, 200)]
+    overlaps = overlapping_seams(chunks)
+    assert overlaps == [False, True, False]
+    texts = ['we said the word', 'the word, again and again', 'again and again.']
+    assert stitch_transcripts(texts, overlaps) == 'we said the word again and again again and again.'
+
+
+def test_stitcher_releases_text_in_order_as_chunks_finish():
+    chunks = [Chunk(index, f'chunk_{index}', index * 100, index * 100 + 102) for index in range(6)]
+    texts = {chunk.path: f'part {chunk.index} ends here' for chunk in chunks}
+
+    def transcribe(path):
+        # Stub transcriber: finishes chunks out of order
+        time.sleep(random.random() / 50)
+        return texts[path]
+
+    pieces = []
+    overlaps = overlapping_seams(chunks)
+    stitcher = OrderedStitcher(pieces.append, overlaps)
+    result = transcribe_chunks(chunks, transcribe, max_workers=4, on_chunk=stitcher.add)
+    assert result == [texts[chunk.path] for chunk in chunks]
+    assert ' '.join(pieces) == stitch_transcripts(result, overlaps)
+    assert pieces == [texts[chunk.path] for chunk in chunks]
+
+
+def test_stitcher_drops_the_repeat_at_an_overlapping_seam():
+    pieces = []
+    stitcher = OrderedStitcher(pieces.append, [False, True])
+    stitcher.add(1, 'the word, and more')
+    assert pieces == []
+    stitcher.add(0, 'we said the word')
+    assert pieces == ['we said the word', 'and more']
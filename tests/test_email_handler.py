@@ -0,0 +1,98 @@
+import asyncio
+import email
+import smtplib
+
+import pytest
+
+import email_handler
+from email_handler import FileTransport, SMTPTransport
+
+RECIPIENTS = ['ana@example.com', 'ben@example.com']
+EMAIL = {'subject': 'Meeting summary', 'body': 'Summary', 'pdf_data': b'%PDF-'}
+
+
+class RecordingSMTP(smtplib.SMTP):
+    """An SMTP client that records what it would send instead of connecting"""
+
+    sent = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+
+    def ehlo_or_helo_if_needed(self):
+        pass
+
+    def sendmail(self, from_addr, to_addrs, msg, *args, **kwargs):
+        self.sent.append((to_addrs, msg))
+        return {}
+
+
+@pytest.fixture(autouse=True)
+def sender(monkeypatch):
+    monkeypatch.setenv('SENDGRID_FROM_EMAIL', 'summaries@example.com')
+
+
+def test_smtp_recipients_are_only_in_the_envelope(monkeypatch):
+    monkeypatch.setattr(email_handler.smtplib, 'SMTP', RecordingSMTP)
+    SMTPTransport().send(EMAIL, RECIPIENTS)
+    (to_addrs, raw), = RecordingSMTP.sent
+    assert to_addrs == RECIPIENTS
+    message = email.message_from_bytes(raw)
+    assert message['Bcc'] is None
+    assert not any(recipient in raw.decode() for recipient in RECIPIENTS)
+
+
+def test_file_sink_hides_recipients_from_each_other(tmp_path):
+    result = FileTransport(str(tmp_path)).send(EMAIL, RECIPIENTS)
+    with open(tmp_path / f"{result['message_id']}.eml", 'rb') as f:
+        message = email.message_from_bytes(f.read())
+    assert message['To'] == 'undisclosed-recipients:;'
+    assert message['Bcc'] == ', '.join(RECIPIENTS)
+
+
+class FlakyTransport:
+    """Fails the first `failures` sends with a transient error, then accepts everything"""
+
+    name = 'flaky'
+
+    def __init__(self, failures=0, retry_after=0):
+        self.failures = failures
+        self.retry_after = retry_after
+        self.batches = []
+
+    def send(self, email, recipients):
+        self.batches.append(len(recipients))
+        if len(self.batches) <= self.failures:
+            raise email_handler.TransientMailError('429 Too Many Requests', retry_after=self.retry_after)
+        return {'status_code': 202, 'message_id': f"message-{len(self.batches)}"}
+
+
+def test_large_recipient_lists_are_sent_in_batches(monkeypatch):
+    monkeypatch.setattr(email_handler, 'MAX_RECIPIENTS_PER_MESSAGE', 2)
+    transport = FlakyTransport()
+    batches = email_handler.deliver_email([f"user{i}@example.com" for i in range(5)], EMAIL, transport)
+    assert transport.batches == [2, 2, 1]
+    assert [(batch['status'], batch['recipients']) for batch in batches] == [('sent', 2), ('sent', 2), ('sent', 1)]
+
+
+def test_transient_failures_are_retried():
+    transport = FlakyTransport(failures=2)
+    batch, = email_handler.deliver_email(RECIPIENTS, EMAIL, transport)
+    assert batch['status'] == 'sent'
+    assert batch['attempts'] == 3
+
+
+def test_delivery_gives_up_after_the_last_retry(monkeypatch):
+    monkeypatch.setattr(email_handler, 'MAX_RETRIES', 1)
+    batch, = email_handler.deliver_email(RECIPIENTS, EMAIL, FlakyTransport(failures=5))
+    assert batch['status'] == 'failed'
+    assert batch['attempts'] == 2
+    monkeypatch.setattr(email_handler, 'get_transport', lambda: FlakyTransport(failures=5))
+    with pytest.raises(Exception, match='429'):
+        email_handler.send_summary_email(RECIPIENTS, 'Summary', b'%PDF-')
+
+
+def test_async_delivery_retries_like_the_threaded_one():
+    transport = FlakyTransport(failures=1)
+    batch, = asyncio.run(email_handler.deliver_email_async(RECIPIENTS, EMAIL, transport))
+    assert (batch['status'], batch['attempts'], batch['transport']) == ('sent', 2, 'flaky')
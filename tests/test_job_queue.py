@@ -0,0 +1,81 @@
+import asyncio
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from job_queue import STATUS_DONE, STATUS_QUEUED, STATUS_RUNNING, AsyncJobQueue, Job, MemoryBackend, SQLiteBackend
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteBackend(str(tmp_path / 'jobs.sqlite3'), poll_interval=0.01)
+    return MemoryBackend()
+
+
+async def wait_for_status(jobs, job_id, status):
+    for _ in range(200):
+        job = await asyncio.to_thread(jobs.get, job_id)
+        if job.status == status:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} is {job.status}, not {status}")
+
+
+def test_jobs_submitted_from_worker_threads_run_on_the_loop(backend):
+    async def main():
+        jobs = AsyncJobQueue(backend, concurrency=2)
+        loop = asyncio.get_running_loop()
+
+        async def handler(job):
+            assert asyncio.get_running_loop() is loop
+            with job.stage('work'):
+                await asyncio.sleep(0.01)
+            return {'n': job.payload['n']}
+
+        jobs.register('test', handler)
+        jobs.start()
+        submitted = await asyncio.gather(*(asyncio.to_thread(jobs.submit, 'test', {'n': n}, ['work'])
+                                           for n in range(5)))
+        done = [await wait_for_status(jobs, job.id, STATUS_DONE) for job in submitted]
+        await jobs.stop()
+        return done
+
+    done = asyncio.run(main())
+    assert [job.result for job in done] == [{'n': n} for n in range(5)]
+    assert all(job.stages[0]['status'] == 'done' for job in done)
+
+
+def test_jobs_waiting_before_start_are_picked_up(backend):
+    async def main():
+        jobs = AsyncJobQueue(backend)
+
+        async def handler(job):
+            return 'ok'
+
+        jobs.register('test', handler)
+        job = jobs.submit('test', {})
+        jobs.start()
+        done = await wait_for_status(jobs, job.id, STATUS_DONE)
+        await jobs.stop()
+        return done
+
+    assert asyncio.run(main()).result == 'ok'
+
+
+def test_jobs_of_workers_that_died_are_requeued_while_running(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    backend = SQLiteBackend(path, poll_interval=0.01)
+    for _ in range(2):
+        backend.put(Job('test', {}))
+    orphan, own = backend.claim(), backend.claim()
+    # A worker process that has since exited
+    worker = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+    with sqlite3.connect(path) as conn:
+        conn.execute('UPDATE jobs SET owner_pid = ? WHERE id = ?', (int(worker.stdout), orphan.id))
+
+    backend.prune(3600)
+    assert backend.get(orphan.id).status == STATUS_QUEUED
+    assert backend.get(own.id).status == STATUS_RUNNING
@@ -0,0 +1,58 @@
+import io
+
+import pytest
+import requests
+
+from benchmarks.loadtest import percentile
+from benchmarks.stub_servers import SUMMARY, StubConfig, StubServer
+from email_handler import SendGridTransport, TransientMailError
+from openai_client import OpenAIClient
+
+INSTANT = dict(whisper_latency=0, whisper_seconds_per_mb=0, chat_latency=0, chat_token_interval=0,
+               sendgrid_latency=0, jitter=0)
+MESSAGES = [{"role": "user", "content": "Summarize the meeting"}]
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    with StubServer(StubConfig(**INSTANT)) as server:
+        monkeypatch.setenv('OPENAI_BASE_URL', f"{server.url}/v1")
+        monkeypatch.setenv('OPENAI_API_KEY', 'sk-stub')
+        yield server
+
+
+def test_stub_answers_the_openai_sdk(stub):
+    client = OpenAIClient()
+    assert client.chat(MESSAGES) == SUMMARY
+    deltas = []
+    assert client.chat_stream(MESSAGES, deltas.append).strip() == SUMMARY
+    assert len(deltas) > 1
+    audio = io.BytesIO(b'\0' * 1000)
+    audio.name = 'meeting.mp3'
+    assert client.transcribe(audio).startswith('the budget')
+    assert stub.counts == {'chat': 2, 'whisper': 1}
+
+
+def test_stub_answers_sendgrid(stub, monkeypatch):
+    monkeypatch.setenv('SENDGRID_FROM_EMAIL', 'summaries@example.com')
+    transport = SendGridTransport(api_key='SG.stub', host=stub.url)
+    result = transport.send({'subject': 'Summary', 'body': 'Summary', 'pdf_data': b'%PDF-'}, ['ana@example.com'])
+    assert result == {'status_code': 202, 'message_id': 'stub'}
+
+
+def test_injected_failures_carry_their_status():
+    with StubServer(StubConfig(**INSTANT, fail_rate=1.0, fail_status=429)) as stub:
+        response = requests.post(f"{stub.url}/v3/mail/send", json={})
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '1'
+        with pytest.raises(TransientMailError):
+            SendGridTransport(api_key='SG.stub', host=stub.url)._result(response)
+        assert stub.counts == {'sendgrid': 1, 'sendgrid_failed': 1}
+
+
+def test_percentiles_use_the_nearest_rank():
+    latencies = [0.4, 0.1, 0.3, 0.2, 1.0]
+    assert percentile(latencies, 50) == 0.3
+    assert percentile(latencies, 95) == 1.0
+    assert percentile(latencies, 1) == 0.1
+    assert percentile([], 50) is None
@@ -0,0 +1,81 @@
+import pytest
+
+import metrics
+import server
+from metrics import Registry, span
+
+
+def lines(registry):
+    return registry.render_prometheus().splitlines()
+
+
+def test_counters_and_gauges_render_with_help_type_and_labels():
+    registry = Registry()
+    requests = registry.counter('test_requests_total', 'Requests served', ['endpoint', 'status'])
+    requests.inc(endpoint='/transcribe', status=202)
+    requests.inc(2, endpoint='/transcribe', status=202)
+    requests.inc(endpoint='/say "hi"\\', status=200)
+    registry.gauge('test_queue_depth', 'Jobs waiting').set(4)
+
+    assert lines(registry) == [
+        '# HELP test_requests_total Requests served',
+        '# TYPE test_requests_total counter',
+        'test_requests_total{endpoint="/transcribe",status="202"} 3',
+        'test_requests_total{endpoint="/say \\"hi\\"\\\\",status="200"} 1',
+        '# HELP test_queue_depth Jobs waiting',
+        '# TYPE test_queue_depth gauge',
+        'test_queue_depth 4',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram('test_seconds', 'Latency', ['stage'], buckets=(0.1, 1, 10))
+    for value in (0.05, 0.5, 0.5, 20):
+        latency.observe(value, stage='transcribe')
+
+    assert lines(registry)[2:] == [
+        'test_seconds_bucket{stage="transcribe",le="0.1"} 1',
+        'test_seconds_bucket{stage="transcribe",le="1"} 3',
+        'test_seconds_bucket{stage="transcribe",le="10"} 3',
+        'test_seconds_bucket{stage="transcribe",le="+Inf"} 4',
+        'test_seconds_sum{stage="transcribe"} 21.05',
+        'test_seconds_count{stage="transcribe"} 4',
+    ]
+    assert latency.snapshot()['transcribe']['p50'] == 1
+
+
+def test_gauge_callbacks_are_read_at_scrape_time():
+    registry = Registry()
+    used = [10]
+    registry.gauge('test_used_bytes', 'Bytes in use', callback=lambda: used[0])
+    failing = registry.gauge('test_broken', 'Broken')
+    failing.set_callback(lambda: 1 / 0)
+
+    used[0] = 25
+    assert 'test_used_bytes 25' in lines(registry)
+    # A failing callback drops its sample, not the scrape
+    assert not any(line.startswith('test_broken ') for line in lines(registry))
+
+
+def test_spans_record_stage_durations_by_outcome():
+    def count(status):
+        return metrics.STAGE_SECONDS.snapshot().get(f"test-stage,{status}", {}).get('count', 0)
+
+    before_ok, before_error = count('ok'), count('error')
+    with span('work', stage='test-stage'):
+        pass
+    with pytest.raises(ValueError):
+        with span('work', stage='test-stage'):
+            raise ValueError('failed')
+    assert (count('ok'), count('error')) == (before_ok + 1, before_error + 1)
+
+
+def test_metrics_endpoint_reports_requests_it_served():
+    client = server.app.test_client()
+    assert client.get('/test').status_code == 200
+    response = client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    assert 'autoscribe_http_request_duration_seconds_count{endpoint="/test",method="GET",status="200"}' in body
+    assert '# TYPE autoscribe_storage_used_bytes gauge' in body
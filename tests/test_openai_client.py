@@ -0,0 +1,79 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from openai_client import CircuitBreaker, CircuitOpen, OpenAIClient, RateLimited
+
+
+def api_error(status_code):
+    request = httpx.Request('POST', 'https://api.openai.com/v1/audio/transcriptions')
+    response = httpx.Response(status_code, request=request)
+    return openai.APIStatusError(f"Error code: {status_code}", response=response, body=None)
+
+
+@pytest.fixture
+def client():
+    client = OpenAIClient()
+    # Opens on the first failure and goes half-open straight away
+    client.breaker = CircuitBreaker(threshold=1, reset_seconds=0)
+    client.breaker.record_failure()
+    assert client.breaker.state == 'half-open'
+    return client
+
+
+def fail_with(error):
+    def call():
+        raise error
+    return call
+
+
+def succeed():
+    return 'ok'
+
+
+def test_rejected_trial_leaves_breaker_half_open(client):
+    with pytest.raises(openai.APIStatusError):
+        client._call(fail_with(api_error(400)), "Test", 'test')
+    assert client.breaker.state == 'half-open'
+    assert client._call(succeed, "Test", 'test') == 'ok'
+    assert client.breaker.state == 'closed'
+
+
+def test_rate_limited_trial_leaves_breaker_half_open(client):
+    with pytest.raises(RateLimited):
+        client._call(fail_with(RateLimited("over the limit")), "Test", 'test', wait_out_rate_limits=False)
+    assert client.breaker.state == 'half-open'
+    assert client._call(succeed, "Test", 'test') == 'ok'
+
+
+def test_cancelled_trial_leaves_breaker_half_open(client):
+    async def scenario():
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.sleep(60)
+
+        task = asyncio.create_task(client._acall(hang, "Test", 'test'))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        async def ok():
+            return 'ok'
+        return await client._acall(ok, "Test", 'test')
+
+    assert asyncio.run(scenario()) == 'ok'
+    assert client.breaker.state == 'closed'
+
+
+def test_failed_trial_reopens_breaker(client):
+    client.breaker.reset_seconds = 60
+    client.breaker.opened_at -= 60
+    # The retry after the failed trial finds the breaker open again
+    with pytest.raises(CircuitOpen):
+        client._call(fail_with(api_error(500)), "Test", 'test')
+    assert client.breaker.state == 'open'
@@ -0,0 +1,64 @@
+import io
+
+import pytest
+from fpdf import FPDF
+
+import pdf_generator
+from pdf_generator import get_fonts, render_summary_pdf
+
+
+@pytest.fixture
+def fonts():
+    fonts = get_fonts()
+    if not fonts.unicode:
+        pytest.skip("No Unicode font installed")
+    return fonts
+
+
+def test_fonts_are_parsed_once_per_process(fonts, monkeypatch):
+    monkeypatch.setattr(pdf_generator, '_parsed', {})
+    parsed = []
+    add_font = FPDF.add_font
+
+    def counting_add_font(self, *args, **kwargs):
+        parsed.append(args)
+        return add_font(self, *args, **kwargs)
+
+    monkeypatch.setattr(FPDF, 'add_font', counting_add_font)
+    documents = [render_summary_pdf(f'## Summary {i}\n- **Decision** {i}', 'Привет') for i in range(3)]
+    assert len(parsed) == (2 if fonts.bold else 1)
+    assert all(document.startswith(b'%PDF') for document in documents)
+
+
+def test_each_document_embeds_its_own_glyphs(fonts):
+    pypdf = pytest.importorskip('pypdf')
+    first = render_summary_pdf('## Hello\n- **bold** item', 'Привет мир')
+    second = render_summary_pdf('Another ζ document', None)
+
+    def text(document):
+        return '\n'.join(page.extract_text() for page in pypdf.PdfReader(io.BytesIO(document)).pages)
+
+    assert 'Hello' in text(first) and 'Привет мир' in text(first)
+    assert 'Another ζ document' in text(second)
+
+
+def test_summary_markdown_is_split_into_blocks():
+    text = '# **Decisions**\n- Ship in May\n  * Beta first\n2) Book the venue\n\nThe budget\nwas approved.'
+    assert pdf_generator.parse_blocks(text) == [
+        ('heading', 1, 'Decisions', None),
+        ('bullet', 0, 'Ship in May', None),
+        ('bullet', 1, 'Beta first', None),
+        ('bullet', 0, 'Book the venue', '2)'),
+        ('paragraph', 0, 'The budget was approved.', None),
+    ]
+
+
+def test_repeated_summaries_are_served_from_the_cache():
+    summary = '## Cached summary\n- rendered once'
+    before = pdf_generator.pdf_cache_stats()
+    first = pdf_generator.create_summary_pdf(summary, 'Resumen')
+    second = pdf_generator.create_summary_pdf(summary, 'Resumen')
+    other = pdf_generator.create_summary_pdf(summary, 'Résumé')
+    stats = pdf_generator.pdf_cache_stats()
+    assert first is second and other != first
+    assert (stats['hits'] - before['hits'], stats['misses'] - before['misses']) == (1, 2)
@@ -0,0 +1,35 @@
+import io
+
+import pytest
+
+from pdf_stream import iter_words, spool_summary_pdf, write_summary_pdf
+
+SUMMARY = '# Decisions\n- **Ship** in May\n\n# Actions\n1. Dana books the venue'
+
+
+def test_words_are_read_across_chunk_boundaries():
+    chunks = ['The bud', 'get was appro', 'ved.\n', '\nNext para', 'graph']
+    assert list(iter_words(chunks)) == ['The', 'budget', 'was', 'approved.', '\n', 'Next', 'paragraph']
+    assert list(iter_words(io.StringIO('one  two\n\n\nthree'))) == ['one', 'two', '\n', 'three']
+
+
+def test_document_is_a_valid_pdf_with_the_appendix_on_new_pages():
+    pypdf = pytest.importorskip('pypdf')
+    out = io.BytesIO()
+    transcript = (f"Paragraph {i} of the meeting transcript. " * 30 + '\n\n' for i in range(60))
+    pages = write_summary_pdf(out, SUMMARY, 'Decisiones y acciones', transcript)
+
+    reader = pypdf.PdfReader(io.BytesIO(out.getvalue()))
+    assert len(reader.pages) == pages > 3
+    first = reader.pages[0].extract_text()
+    assert 'Decisions' in first and 'Ship' in first and 'Dana books the venue' in first
+    assert 'Decisiones y acciones' in reader.pages[1].extract_text()
+    assert 'Transcript' in reader.pages[2].extract_text()
+    assert 'Paragraph 59' in reader.pages[-1].extract_text()
+
+
+def test_large_documents_spill_to_disk(monkeypatch):
+    monkeypatch.setattr('pdf_stream.PDF_SPOOL_BYTES', 1024)
+    with spool_summary_pdf(SUMMARY, transcript='A long transcript. ' * 5000) as spooled:
+        assert spooled._rolled
+        assert spooled.read(5) == b'%PDF-'
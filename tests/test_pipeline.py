@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+import pipeline
+from pipeline import Cancelled, Pipeline, Stage
+
+
+def test_vad_stage_events_reach_the_event_loop_at_once(monkeypatch, tmp_path):
+    monkeypatch.setattr(pipeline, 'VAD_ENABLED', True)
+    release = threading.Event()
+
+    def strip_silence(audio_path, output_path, profile=None):
+        # Voice detection runs until the test has seen the stage start
+        release.wait(5)
+        return {'applied': False}, None
+
+    monkeypatch.setattr(pipeline, 'strip_silence', strip_silence)
+
+    async def main():
+        # Like /transcribe/stream: stage events go into an asyncio.Queue read by the response
+        events = asyncio.Queue()
+
+        @contextmanager
+        def stage_events(name):
+            # Give the loop time to go idle waiting for the event, as it does in a real request
+            time.sleep(0.1)
+            events.put_nowait((name, 'started'))
+            yield
+            events.put_nowait((name, 'done'))
+
+        ctx = {'audio_path': str(tmp_path / 'audio.mp3')}
+        task = asyncio.create_task(Pipeline([pipeline.VAD]).arun(ctx, stage_context=stage_events))
+        start = time.monotonic()
+        try:
+            received = [await asyncio.wait_for(events.get(), 2)]
+            elapsed = time.monotonic() - start
+        finally:
+            release.set()
+        received.append(await asyncio.wait_for(events.get(), 5))
+        await task
+        return received, elapsed, ctx
+
+    received, elapsed, ctx = asyncio.run(main())
+    assert received == [('vad', 'started'), ('vad', 'done')]
+    assert elapsed < 1
+    assert ctx['vad'] == {'applied': False}
+
+
+def test_stages_run_in_order_and_skip_those_that_do_not_apply():
+    cleaned = []
+
+    def first(ctx):
+        ctx.setdefault('cleanup', []).append(lambda: cleaned.append('first'))
+        return {'steps': ['first']}
+
+    stages = [Stage('first', first), Stage('optional', lambda ctx: {'steps': ['optional']}, when=lambda ctx: False),
+              Stage('last', lambda ctx: {'steps': ctx['steps'] + ['last']})]
+    skipped = []
+    ctx = Pipeline(stages).run({}, on_skip=skipped.append)
+    assert ctx['steps'] == ['first', 'last']
+    assert skipped == ['optional']
+    assert set(ctx['timings_ms']) == {'first', 'last'}
+    assert cleaned == ['first'] and 'cleanup' not in ctx
+
+
+def test_cleanup_runs_when_a_stage_fails_or_the_client_is_gone():
+    cleaned = []
+
+    def first(ctx):
+        ctx.setdefault('cleanup', []).append(lambda: cleaned.append(True))
+
+    def broken(ctx):
+        raise ValueError('transcription failed')
+
+    with pytest.raises(ValueError):
+        Pipeline([Stage('first', first), Stage('broken', broken)]).run({})
+    cancelled = threading.Event()
+    cancelled.set()
+    with pytest.raises(Cancelled):
+        Pipeline([Stage('first', first)]).run({}, cancelled=cancelled)
+    assert cleaned == [True]
+
+
+def test_stage_concurrency_is_shared_by_threaded_and_async_runs():
+    inside = []
+    peak = []
+
+    def work():
+        inside.append(1)
+        peak.append(len(inside))
+        time.sleep(0.05)
+        inside.pop()
+
+    async def awork(ctx):
+        await asyncio.to_thread(work)
+
+    stage = Stage('capped', lambda ctx: work(), concurrency=2, afn=awork)
+    futures = [Pipeline([stage]).submit({}) for _ in range(3)]
+
+    async def main():
+        await asyncio.gather(*(Pipeline([stage]).arun({}) for _ in range(3)))
+
+    asyncio.run(main())
+    for future in futures:
+        future.result()
+    assert max(peak) == 2
+
+
+def test_stages_without_a_coroutine_version_run_off_the_event_loop():
+    async def main():
+        loop_thread = threading.get_ident()
+        ctx = await Pipeline([Stage('sync', lambda ctx: {'thread': threading.get_ident()})]).arun({})
+        return ctx['thread'] != loop_thread
+
+    assert asyncio.run(main())
+
+
+def test_transcription_pipeline_translates_the_streamed_summary(monkeypatch, tmp_path):
+    monkeypatch.setattr(pipeline, 'VAD_ENABLED', False)
+    monkeypatch.setattr(pipeline, 'observe_media', lambda audio_path: None)
+    monkeypatch.setattr(pipeline, 'transcribe_audio', lambda audio_path, **options: 'We ship in May.')
+
+    def generate_summary(transcript, on_delta=None):
+        for delta in ('# Decisions\n', '- Ship in May'):
+            on_delta(delta)
+        return '# Decisions\n- Ship in May'
+
+    monkeypatch.setattr(pipeline, 'generate_summary', generate_summary)
+    monkeypatch.setattr(pipeline, 'translate_text', lambda text, language: f"[{language}] {text}")
+    deltas = []
+    ctx = pipeline.TRANSCRIPTION.run({'audio_path': str(tmp_path / 'audio.mp3'), 'languages': ['es'],
+                                      'on_delta': deltas.append})
+    assert list(ctx['timings_ms']) == ['transcribe', 'summarize', 'translate']
+    assert ''.join(deltas) == ctx['summary']
+    assert ctx['translations'] == {'es': '[es] # Decisions\n- Ship in May'}
@@ -0,0 +1,91 @@
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import process_file
+from pipeline import Pipeline, Stage
+from process_file import BatchProcessor, find_inputs
+
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='needs ffmpeg')
+
+
+def tone(path, frequency):
+    subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-f', 'lavfi',
+                    '-i', f'sine=frequency={frequency}:duration=1', str(path)], check=True)
+    return str(path)
+
+
+@pytest.fixture
+def recordings(tmp_path):
+    """Two different recordings and a copy of the first under another name"""
+    inputs = tmp_path / 'inputs'
+    inputs.mkdir()
+    first = tone(inputs / 'standup.wav', 440)
+    tone(inputs / 'review.wav', 880)
+    shutil.copy(first, inputs / 'standup-copy.wav')
+    (inputs / 'notes.txt').write_text('not a recording')
+    return find_inputs([str(inputs)])
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Replace the API stages with ones that record the files they were called for"""
+    calls = {'transcribe': [], 'summarize': [], 'interrupt': False}
+
+    def transcribe(ctx):
+        assert os.path.getsize(ctx['audio_path']) > 0
+        calls['transcribe'].append(ctx['label'])
+        return {'transcript': f"transcript of {ctx['label']}"}
+
+    def summarize(ctx):
+        if calls['interrupt']:
+            raise KeyboardInterrupt
+        calls['summarize'].append(ctx['label'])
+        return {'summary': f"summary of {ctx['transcript']}"}
+
+    monkeypatch.setattr(process_file, 'TRANSCRIBE_ONLY', Pipeline([Stage('transcribe', transcribe)]))
+    monkeypatch.setattr(process_file, 'SUMMARIZE_ONLY', Pipeline([Stage('summarize', summarize)]))
+    return calls
+
+
+def run(output_dir, paths, **options):
+    return BatchProcessor(str(output_dir), extract_workers=1, api_workers=2, **options).run(paths)
+
+
+def test_batch_writes_results_and_skips_duplicate_content(recordings, calls, tmp_path):
+    output = tmp_path / 'output'
+    assert [os.path.basename(path) for path in recordings] == ['review.wav', 'standup-copy.wav', 'standup.wav']
+    assert run(output, recordings) == {'done': 2, 'skipped': 1, 'failed': 0}
+    assert len(calls['transcribe']) == 2
+
+    results = sorted(output.glob('*.json'))
+    assert len(results) == 2
+    result = json.loads(results[0].read_text())
+    assert result['summary'] == f"summary of {result['transcript']}"
+    assert set(result['timings_ms']) >= {'extract', 'transcribe', 'summarize'}
+    # Extracted audio does not outlive the run
+    assert not (output / '.work' / 'audio').exists()
+
+    # A second run finds everything in the manifest
+    assert run(output, recordings) == {'done': 0, 'skipped': 3, 'failed': 0}
+    assert len(calls['transcribe']) == 2
+    assert run(output, recordings[:1], force=True)['done'] == 1
+
+
+def test_interrupted_batch_resumes_from_the_saved_transcript(recordings, calls, tmp_path):
+    output = tmp_path / 'output'
+    calls['interrupt'] = True
+    with pytest.raises(KeyboardInterrupt):
+        run(output, recordings[:1])
+    assert calls['transcribe'] == ['review.wav']
+
+    calls['interrupt'] = False
+    assert run(output, recordings[:1]) == {'done': 1, 'skipped': 0, 'failed': 0}
+    # Only the summary was left to do
+    assert calls['transcribe'] == ['review.wav']
+    assert calls['summarize'] == ['review.wav']
+    entries = [json.loads(line)['status'] for line in (output / 'manifest.jsonl').read_text().splitlines()]
+    assert entries == ['transcribed', 'done']
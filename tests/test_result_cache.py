@@ -0,0 +1,53 @@
+import sqlite3
+
+import pytest
+
+import result_cache
+from result_cache import LRUCache, ResultCache, SQLiteCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(1024 * 1024, disk=SQLiteCache(str(tmp_path / 'results.sqlite3'), 1024 * 1024), ttl=3600)
+
+
+def stored(cache, column, key):
+    conn = sqlite3.connect(cache.disk.path)
+    try:
+        return conn.execute(f'SELECT {column} FROM entries WHERE key = ?', (key,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_disk_hit_keeps_the_stored_expiry(cache, monkeypatch):
+    cache.set('summary', 'k', 'value')
+    expires_at = stored(cache, 'expires_at', 'summary:k')
+    cache.memory = LRUCache(1024 * 1024)
+
+    later = expires_at - 10
+    monkeypatch.setattr(result_cache.time, 'time', lambda: later)
+    assert cache.get('summary', 'k') == 'value'
+    assert cache.memory._entries['summary:k'][2] == expires_at
+
+
+def test_reads_touch_accessed_at_in_batches(cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, 'time', lambda: now[0])
+    cache.disk._flushed_at = now[0]
+    cache.set('summary', 'k', 'value')
+    cache.memory = LRUCache(1024 * 1024)
+
+    now[0] += 5
+    assert cache.get('summary', 'k') == 'value'
+    assert stored(cache, 'accessed_at', 'summary:k') == 1000.0
+
+    # Written with the next set()
+    now[0] += 5
+    cache.set('summary', 'other', 'value')
+    assert stored(cache, 'accessed_at', 'summary:k') == 1005.0
+
+    # Or by a read once TOUCH_FLUSH_SECONDS have passed
+    cache.memory = LRUCache(1024 * 1024)
+    now[0] += result_cache.TOUCH_FLUSH_SECONDS
+    cache.get('summary', 'k')
+    assert stored(cache, 'accessed_at', 'summary:k') == now[0]
@@ -0,0 +1,95 @@
+import io
+import json
+import threading
+import time
+
+import pytest
+
+import server
+from pipeline import Pipeline, Stage
+
+
+def transcribe(ctx):
+    ctx['on_text']('We ship in May.')
+    return {'transcript': 'We ship in May.'}
+
+
+def summarize(ctx):
+    for delta in ('- Ship ', 'in May'):
+        ctx['on_delta'](delta)
+    return {'summary': '- Ship in May'}
+
+
+def events(body):
+    """(event, data) pairs of an SSE body, with keepalive comments as (None, None)"""
+    parsed = []
+    for block in body.split('\n\n'):
+        if block.startswith(':'):
+            parsed.append((None, None))
+        elif block:
+            event, data = block.split('\n')
+            parsed.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return parsed
+
+
+def post_recording(client, **options):
+    return client.post('/transcribe/stream?stream=0', data={'file': (io.BytesIO(b'audio'), 'meeting.mp3')},
+                       content_type='multipart/form-data', **options)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server, 'TRANSCRIPTION', Pipeline([Stage('transcribe', transcribe, concurrency=0),
+                                                           Stage('summarize', summarize, concurrency=0)]))
+    return server.app.test_client()
+
+
+def test_progress_and_partial_results_stream_in_order(client):
+    response = post_recording(client)
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    received = events(response.get_data(as_text=True))
+    assert [(event, data.get('stage'), data.get('status')) for event, data in received if event == 'stage'] == [
+        ('stage', 'transcribe', 'started'), ('stage', 'transcribe', 'done'),
+        ('stage', 'summarize', 'started'), ('stage', 'summarize', 'done')]
+    names = [event for event, _ in received]
+    assert names.index('transcript') < names.index('summary') < names.index('done') == len(names) - 1
+    assert ''.join(data['delta'] for event, data in received if event == 'summary') == '- Ship in May'
+    done = received[-1][1]
+    assert done['summary'] == '- Ship in May'
+    assert done['transcript_id']
+
+
+def test_idle_streams_send_keepalives(client, monkeypatch):
+    monkeypatch.setattr(server, 'SSE_KEEPALIVE_SECONDS', 0.05)
+
+    def slow_transcribe(ctx):
+        time.sleep(0.3)
+        return transcribe(ctx)
+
+    monkeypatch.setattr(server.TRANSCRIPTION.stages[0], 'fn', slow_transcribe)
+    received = events(post_recording(client).get_data(as_text=True))
+    assert (None, None) in received
+    assert received[-1][0] == 'done'
+
+
+def test_disconnecting_cancels_the_pipeline(client, monkeypatch):
+    stopped = threading.Event()
+
+    def wait_for_client(ctx):
+        ctx['on_text']('We ship')
+        time.sleep(0.2)
+        return {}
+
+    def never_reached(ctx):
+        stopped.set()
+        return {}
+
+    monkeypatch.setattr(server.TRANSCRIPTION, 'stages', [Stage('transcribe', wait_for_client, concurrency=0),
+                                                         Stage('summarize', never_reached, concurrency=0)])
+    response = post_recording(client, buffered=False)
+    next(response.response)
+    response.close()
+    time.sleep(0.5)
+    assert not stopped.is_set()
@@ -0,0 +1,86 @@
+import io
+
+import pytest
+
+import storage
+from storage import QuotaExceeded, StorageFull, StorageManager
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def root(tmp_path):
+    return str(tmp_path)
+
+
+def manager(root, hot_dir=''):
+    return StorageManager(root, quota=10 * MB, job_quota=10 * MB, min_free=0, hot_dir=hot_dir)
+
+
+def test_reservations_count_in_every_worker(root):
+    # Two managers on one root stand in for two worker processes
+    first, second = manager(root), manager(root)
+    work = first.admit(6 * MB)
+    assert second.used_bytes() >= 6 * MB
+    with pytest.raises(StorageFull):
+        second.admit(6 * MB)
+
+    # Released by the worker that admitted it, the space is free for the other
+    work.release()
+    second.admit(6 * MB).release()
+
+
+def test_hot_reservations_count_in_every_worker(root, tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'HOT_JOB_BYTES', MB)
+    hot_dir = str(tmp_path / 'hot')
+    first, second = manager(root, hot_dir), manager(root, hot_dir)
+    first.hot_quota = second.hot_quota = MB
+    assert first.admit(MB).hot
+    assert not second.admit(MB).hot
+    assert second.stats()['hot_jobs'] == 1
+
+
+def test_sweeper_leaves_the_admission_lock(root):
+    sweeper = manager(root)
+    sweeper.max_age = -1
+    manager(root).admit(MB)
+    assert sweeper.sweep() == 1
+    assert sweeper.used_bytes() == 0
+    manager(root).admit(MB)
+
+
+def test_charges_follow_writes_and_releases(root):
+    first, second = manager(root), manager(root)
+    work = first.admit(MB)
+    with open(work.file('audio.wav'), 'wb') as f:
+        f.write(b'\0' * 3 * MB)
+    # Usage is bookkept, not walked: files count once the job checks them in
+    assert second.used_bytes() == MB
+    work.check()
+    assert second.used_bytes() >= 3 * MB
+    work.release()
+    assert second.used_bytes() == 0
+
+
+def test_sweeper_reconciles_usage(root):
+    storage_manager = manager(root)
+    work = storage_manager.admit(MB)
+    with open(work.file('audio.wav'), 'wb') as f:
+        f.write(b'\0' * 2 * MB)
+    with open(f"{root}/stray", 'wb') as f:
+        f.write(b'\0' * MB)
+    assert storage_manager.sweep() == 0
+    assert storage_manager.used_bytes() >= 3 * MB
+    work.release()
+    assert MB <= storage_manager.used_bytes() < 2 * MB
+
+
+def test_uploads_without_length_stop_at_the_quota(root, monkeypatch):
+    monkeypatch.setattr(storage, 'DEFAULT_RESERVATION_BYTES', MB)
+    storage_manager = manager(root)
+    storage_manager.job_quota = MB
+    work = storage_manager.admit(None)
+    reader = storage.QuotaReader(io.BytesIO(b'\0' * 2 * MB), work)
+    reader.read(MB)
+    with pytest.raises(QuotaExceeded):
+        reader.read(MB)
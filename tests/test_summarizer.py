@@ -0,0 +1,71 @@
+import asyncio
+
+from summarizer import (CONTEXT_TOKENS, REDUCE_PROMPT, RESPONSE_TOKENS, SUMMARY_PROMPT, estimate_tokens, prompt_tokens,
+                        split_text, summarize_transcript, summarize_transcript_async)
+
+TRANSCRIPT = 'The budget for the launch was approved by Dana. ' * 2000
+
+
+def test_a_note_too_long_to_reduce_is_summarized_in_pieces():
+    prompts = []
+
+    def complete(messages):
+        prompts.append(prompt_tokens(messages))
+        if messages[1]['content'].startswith('This is part 1 of'):
+            # A part whose notes come back longer than the whole context window
+            return 'Dana approved the launch budget. ' * 4000
+        return 'Dana approved the launch budget.'
+
+    assert summarize_transcript(TRANSCRIPT, complete) == 'Dana approved the launch budget.'
+    assert max(prompts) + RESPONSE_TOKENS <= CONTEXT_TOKENS
+
+
+def test_short_transcripts_are_summarized_in_one_request():
+    requests = []
+
+    def complete(messages):
+        requests.append(messages)
+        return 'summary'
+
+    assert summarize_transcript('We agreed to ship in May.', complete) == 'summary'
+    assert len(requests) == 1
+    assert requests[0][1]['content'].startswith(SUMMARY_PROMPT)
+
+
+def test_long_transcripts_are_summarized_in_parts_and_merged():
+    parts = split_text(TRANSCRIPT, 6000)
+    requests = []
+    final = []
+
+    def complete(messages):
+        requests.append(messages[1]['content'])
+        return f"Notes {len(requests)}"
+
+    def final_fn(messages):
+        final.append(messages[1]['content'])
+        return 'summary'
+
+    assert summarize_transcript(TRANSCRIPT, complete, chunk_tokens=6000, final_fn=final_fn) == 'summary'
+    # One request per part, then only the final merge, which sees every part's notes in order
+    assert len(requests) == len(parts) > 1
+    assert all(f"part {i + 1} of {len(parts)}" in request for i, request in enumerate(requests))
+    assert final[0].startswith(REDUCE_PROMPT)
+    assert final[0].index('Notes 1') < final[0].index(f"Notes {len(parts)}")
+
+
+def test_async_summary_matches_the_threaded_one():
+    async def complete(messages):
+        await asyncio.sleep(0)
+        return 'Dana approved the launch budget.'
+
+    def complete_sync(messages):
+        return 'Dana approved the launch budget.'
+
+    expected = summarize_transcript(TRANSCRIPT, complete_sync)
+    assert asyncio.run(summarize_transcript_async(TRANSCRIPT, complete)) == expected
+
+
+def test_parts_stay_within_the_token_budget_and_keep_the_text():
+    parts = split_text(TRANSCRIPT, 1000)
+    assert all(estimate_tokens(part) <= 1000 for part in parts)
+    assert ' '.join(parts).split() == TRANSCRIPT.split()
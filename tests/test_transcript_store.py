@@ -0,0 +1,78 @@
+import pytest
+
+from transcript_store import QueryError, TranscriptStore, match_query, split_passages
+
+BUDGET = 'We went over the budget again. The marketing budget was approved for May. Dana books the venue.'
+HIRING = 'Hiring is slow this quarter. We agreed to open two roles. The budget can wait.'
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TranscriptStore(str(tmp_path / 'transcripts.db'))
+    yield store
+    store.flush(5)
+
+
+def add(store, transcript, **fields):
+    transcript_id = store.add({'transcript': transcript, **fields}, title=fields.pop('title', None))
+    assert store.flush(5)
+    return transcript_id
+
+
+def test_user_queries_become_safe_fts5_expressions():
+    assert match_query('budget May') == '"budget" "May"'
+    assert match_query('"marketing budget" appro*') == '"marketing budget" "appro"*'
+    # FTS5 operators and punctuation are searched as words
+    assert match_query('budget OR NOT (venue') == '"budget" "OR" "NOT" "venue"'
+    with pytest.raises(QueryError):
+        match_query(' "" * - ')
+
+
+def test_long_speech_is_split_into_passages_at_sentences():
+    text = ' '.join(f"Sentence {i} has five words." for i in range(30))
+    passages = split_passages(text, size=10)
+    assert all(passage.endswith('.') for _, passage in passages)
+    assert [first for first, _ in passages] == list(range(0, 150, 10))
+
+
+def test_search_ranks_transcripts_and_highlights_the_best_passage(store):
+    budget = add(store, BUDGET, title='Marketing sync', summary='- Budget approved')
+    hiring = add(store, HIRING, title='Hiring update', translations={'es': 'Contratación lenta este trimestre.'})
+
+    found = store.search('budget')
+    assert [result['transcript_id'] for result in found['results']] == [budget, hiring]
+    assert found['ranking'] == 'bm25' and not found['has_more']
+    assert '**budget**' in found['results'][0]['snippet'].lower()
+
+    assert [result['transcript_id'] for result in store.search('"marketing budget"')['results']] == [budget]
+    assert [result['transcript_id'] for result in store.search('hir*')['results']] == [hiring]
+    assert store.search('contratación')['results'][0]['field'] == 'translation:es'
+    assert store.search('budget', limit=1)['has_more']
+
+
+def test_common_terms_fall_back_to_frequency_ranking(tmp_path):
+    store = TranscriptStore(str(tmp_path / 'transcripts.db'), candidates=2)
+    transcript_ids = [add(store, BUDGET) for _ in range(3)]
+    found = store.search('budget')
+    # Too many matches to rank them all: only the newest candidates are
+    assert found['ranking'] == 'frequency'
+    assert [result['transcript_id'] for result in found['results']] == [transcript_ids[2], transcript_ids[1]]
+
+
+def test_passages_are_timed_from_the_vad_time_map(store):
+    # Two 50-word passages over 20 s of speech; after the first 5 s, VAD cut 95 s of silence
+    transcript = ' '.join((['word'] * 49 + ['end.']) * 2)
+    vad = {'original_seconds': 130, 'speech_seconds': 20, 'time_map': [[0, 0, 5], [5, 100, 115]]}
+    transcript_id = add(store, transcript, vad=vad)
+    segments = store.get(transcript_id)['segments']
+    assert [(segment['start'], segment['end']) for segment in segments] == [(0, 105), (105, 115)]
+    assert store.search('word')['results'][0]['duration_seconds'] == 130
+
+
+def test_deleted_transcripts_leave_the_index(store):
+    transcript_id = add(store, BUDGET)
+    assert store.delete(transcript_id)
+    assert store.search('budget')['results'] == []
+    assert store.get(transcript_id) is None
+    assert store.stats()['passages'] == 0
+    assert not store.delete(transcript_id)
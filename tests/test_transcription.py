@@ -0,0 +1,96 @@
+import asyncio
+import sys
+
+import pytest
+
+import metrics
+import pipeline
+import transcription
+from openai_client import CircuitOpen, RateLimited
+from transcription import BackendUnavailable, FallbackTranscriber, LocalWhisperTranscriber, get_transcriber
+
+
+class FakeTranscriber:
+    """A backend that fails with `error` if given one, and records how it was called"""
+
+    def __init__(self, name, error=None):
+        self.name = name
+        self.cache_id = f"{name}-model"
+        self.error = error
+        self.calls = []
+
+    def transcribe(self, audio_path, used=None, wait_out_rate_limits=True):
+        self.calls.append(wait_out_rate_limits)
+        if self.error is not None:
+            raise self.error
+        if used is not None:
+            used.append(self.name)
+        return f"{self.name} transcript"
+
+    async def atranscribe(self, audio_path, used=None, wait_out_rate_limits=True):
+        return self.transcribe(audio_path, used, wait_out_rate_limits)
+
+
+def fallbacks(reason):
+    return metrics.TRANSCRIBE_FALLBACKS.snapshot().get(f"local,{reason}", 0)
+
+
+def test_rate_limited_files_go_to_the_fallback_at_once():
+    primary, fallback = FakeTranscriber('openai', RateLimited('audio rate limit')), FakeTranscriber('local')
+    before = fallbacks('RateLimited')
+    used = []
+    assert FallbackTranscriber(primary, fallback).transcribe('meeting.mp3', used) == 'local transcript'
+    # The primary was asked not to wait out its rate limit
+    assert primary.calls == [False]
+    assert used == ['local']
+    assert fallbacks('RateLimited') == before + 1
+
+
+def test_async_calls_fall_back_while_the_breaker_is_open():
+    transcriber = FallbackTranscriber(FakeTranscriber('openai', CircuitOpen('breaker open')), FakeTranscriber('local'))
+    assert asyncio.run(transcriber.atranscribe('meeting.mp3')) == 'local transcript'
+
+
+def test_rejected_requests_do_not_fall_back():
+    fallback = FakeTranscriber('local')
+    transcriber = FallbackTranscriber(FakeTranscriber('openai', ValueError('Invalid file format')), fallback)
+    with pytest.raises(ValueError):
+        transcriber.transcribe('meeting.mp3')
+    assert fallback.calls == []
+
+
+def test_primary_is_used_while_it_is_available():
+    transcriber = FallbackTranscriber(FakeTranscriber('openai'), FakeTranscriber('local'))
+    used = []
+    assert transcriber.transcribe('meeting.mp3', used) == 'openai transcript'
+    # Results are cached under the primary's model whichever backend produced them
+    assert (transcriber.name, transcriber.cache_id, used) == ('openai', 'openai-model', ['openai'])
+
+
+def test_backends_are_chosen_by_name(monkeypatch):
+    monkeypatch.setattr(transcription, 'TRANSCRIBE_FALLBACK', '')
+    assert get_transcriber('openai') is get_transcriber('openai')
+    assert isinstance(get_transcriber('local'), LocalWhisperTranscriber)
+    with pytest.raises(ValueError, match='Available: openai, local'):
+        get_transcriber('nemo')
+
+    monkeypatch.setattr(transcription, 'TRANSCRIBE_FALLBACK', 'local')
+    transcriber = get_transcriber('openai')
+    assert isinstance(transcriber, FallbackTranscriber)
+    assert transcriber.fallback is get_transcriber('local')
+    # Falling back to itself would be pointless
+    assert isinstance(get_transcriber('local'), LocalWhisperTranscriber)
+
+
+def test_report_shows_which_backend_transcribed_each_chunk(monkeypatch):
+    monkeypatch.setattr(transcription, 'TRANSCRIBE_FALLBACK', 'local')
+    report = pipeline.transcription_report('openai', ['openai', 'local', 'local'])
+    assert report['transcribed_by'] == {'local': 2, 'openai': 1}
+    assert report['fell_back'] and not report['cached']
+    assert pipeline.transcription_report('openai', [])['cached']
+
+
+def test_local_backend_without_faster_whisper_is_unavailable(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'faster_whisper', None)
+    with pytest.raises(BackendUnavailable, match='pip install faster-whisper'):
+        LocalWhisperTranscriber().transcribe('meeting.mp3')
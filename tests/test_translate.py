@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from translate import MIN_SECTION_CHARS, AsyncSectionTranslator, SectionTranslator, parse_languages
+
+SUMMARY = '# Decisions\n- Ship in May\n\n# Actions\n- Dana books the venue\n\n# Budget\n- 40k approved'
+
+
+def test_saved_time_counts_parallel_translations_once():
+    def translate(section, language):
+        time.sleep(0.2)
+        return f"{language}: {section}"
+
+    translator = SectionTranslator(['es', 'fr', 'de'], translate)
+    try:
+        translator.feed('# Decisions\n- Ship in May\n# Actions\n')
+        # The rest of the summary takes a while to arrive; the first section is translated meanwhile
+        time.sleep(0.3)
+        translator.feed('- Dana books the venue')
+        translations, timing = translator.finish()
+    finally:
+        translator.close()
+
+    assert translations['fr'] == 'fr: # Decisions\n- Ship in May\n\nfr: # Actions\n- Dana books the venue'
+    assert timing['sections'] == 2
+    assert timing['translation_work_ms'] >= 1200
+    # Three languages at once for 200 ms kept 200 ms off the critical path, not 600
+    assert 150 <= timing['critical_path_saved_ms'] <= 300
+
+
+def stream(translator, text):
+    """Feed text the way a streamed summary arrives, a few characters at a time"""
+    for start in range(0, len(text), 7):
+        translator.feed(text[start:start + 7])
+
+
+def test_sections_are_translated_as_soon_as_they_are_complete():
+    started = []
+    first_done = threading.Event()
+
+    def translate(section, language):
+        started.append(section)
+        return section.upper()
+
+    translator = SectionTranslator(['es'], translate, on_section=lambda language, index, text: first_done.set())
+    try:
+        stream(translator, SUMMARY[:SUMMARY.index('# Actions') + 3])
+        # The first section went out before the summary was finished
+        assert first_done.wait(2)
+        assert started == ['# Decisions\n- Ship in May']
+        stream(translator, SUMMARY[SUMMARY.index('# Actions') + 3:])
+        translations, timing = translator.finish()
+    finally:
+        translator.close()
+    assert translations == {'es': SUMMARY.upper()}
+    assert timing['sections'] == 3
+
+
+def test_long_sections_are_also_cut_at_blank_lines():
+    paragraph = 'Dana walked through the launch plan in detail. ' * (MIN_SECTION_CHARS // 40)
+    text = f"{paragraph}\n\n{paragraph}\n\nShort closing note."
+    translator = SectionTranslator(['es'], lambda section, language: section)
+    try:
+        stream(translator, text)
+        translations, timing = translator.finish()
+    finally:
+        translator.close()
+    # Each paragraph is long enough to go on its own; the short tail goes out at finish()
+    assert timing['sections'] == 3
+    assert translations['es'] == '\n\n'.join([paragraph.strip(), paragraph.strip(), 'Short closing note.'])
+
+
+def test_sections_are_reassembled_in_order_when_they_finish_out_of_order():
+    def translate(section, language):
+        # The first section comes back last
+        time.sleep(0.1 if section.startswith('# Decisions') else 0)
+        return f"[{language}] {section}"
+
+    translator = SectionTranslator(['es', 'fr'], translate)
+    try:
+        stream(translator, SUMMARY)
+        translations, _ = translator.finish()
+    finally:
+        translator.close()
+    for language in ('es', 'fr'):
+        expected = [f"[{language}] {section}" for section in SUMMARY.split('\n\n')]
+        assert translations[language].split('\n\n') == expected
+
+
+def test_async_translator_matches_the_threaded_one():
+    async def translate(section, language):
+        await asyncio.sleep(0)
+        return section.upper()
+
+    async def main():
+        translator = AsyncSectionTranslator(['es'], translate)
+        stream(translator, SUMMARY)
+        return await translator.finish()
+
+    translations, timing = asyncio.run(main())
+    assert translations == {'es': SUMMARY.upper()}
+    assert timing['sections'] == 3
+
+
+def test_languages_are_deduplicated_and_capped(monkeypatch):
+    assert parse_languages('Spanish, french,spanish ,') == ['Spanish', 'french']
+    assert parse_languages(['German']) == ['German']
+    monkeypatch.setattr('translate.MAX_LANGUAGES', 1)
+    with pytest.raises(ValueError):
+        parse_languages('Spanish,French')
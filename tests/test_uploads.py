@@ -0,0 +1,62 @@
+import hashlib
+import io
+
+import pytest
+
+from uploads import OffsetMismatch, UploadStore
+
+DATA = bytes(range(256)) * 64
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return str(tmp_path)
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_chunk_in_flight_locks_out_other_workers(directory):
+    # Two stores on one directory stand in for two worker processes
+    first, second = UploadStore(directory), UploadStore(directory)
+    upload = first.create('a.mp3', len(DATA))
+    writer = first.begin_chunk(upload.id, 0)
+    writer.write(DATA[:1000])
+    with pytest.raises(OffsetMismatch):
+        second.begin_chunk(upload.id, 0)
+    writer.commit()
+
+    assert second.write_chunk(upload.id, 1000, io.BytesIO(DATA[1000:])).complete
+    assert first.finish(upload.id).content_sha256 == sha256(DATA)
+
+
+def test_offset_is_checked_again_under_the_lock(directory):
+    first, second = UploadStore(directory), UploadStore(directory)
+    upload = first.create('a.mp3', len(DATA))
+    first.write_chunk(upload.id, 0, io.BytesIO(DATA[:1000]))
+    with pytest.raises(OffsetMismatch) as raised:
+        second.write_chunk(upload.id, 0, io.BytesIO(DATA[:1000]))
+    assert raised.value.offset == 1000
+
+
+def test_abort_keeps_committed_chunks(directory):
+    first, second = UploadStore(directory), UploadStore(directory)
+    upload = first.create('a.mp3', len(DATA))
+    first.write_chunk(upload.id, 0, io.BytesIO(DATA[:1000]))
+    writer = second.begin_chunk(upload.id, 1000)
+    writer.write(b'garbage')
+    writer.abort()
+
+    first.write_chunk(upload.id, 1000, io.BytesIO(DATA[1000:]))
+    assert second.finish(upload.id).content_sha256 == sha256(DATA)
+
+
+def test_finish_rehashes_a_spool_file_changed_since_the_last_commit(directory):
+    store = UploadStore(directory)
+    upload = store.create('a.mp3', len(DATA))
+    store.write_chunk(upload.id, 0, io.BytesIO(DATA))
+    changed = b'x' + DATA[1:]
+    with open(store.spool_path(upload.id), 'r+b') as f:
+        f.write(b'x')
+    assert store.finish(upload.id).content_sha256 == sha256(changed)
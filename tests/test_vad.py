@@ -0,0 +1,79 @@
+import os
+import shutil
+import wave
+
+import numpy as np
+import pytest
+
+import vad
+from test_audio import probe
+from vad import FRAME_SECONDS, SAMPLE_RATE, TimeMap, detect_speech, speech_segments, strip_silence
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='needs ffmpeg')
+
+
+def write_wav(path, parts):
+    """A 16 kHz mono WAV of (seconds, is_tone) parts: a 300 Hz tone for speech, faint noise for silence"""
+    rng = np.random.default_rng(0)
+    samples = []
+    for seconds, is_tone in parts:
+        t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+        samples.append(0.5 * np.sin(2 * np.pi * 300 * t) if is_tone else rng.normal(0, 0.001, len(t)))
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes((np.concatenate(samples) * 32767).astype('<i2').tobytes())
+    return str(path)
+
+
+def frames(pattern):
+    """Speech mask from a string of '#' (speech) and '.' (silence) frames"""
+    return np.array([c == '#' for c in pattern])
+
+
+def test_short_gaps_are_kept_and_long_ones_cut(monkeypatch):
+    monkeypatch.setattr(vad, 'PAD_SECONDS', 0.0)
+    monkeypatch.setattr(vad, 'MIN_SILENCE_SECONDS', 0.3)
+    # 10-frame runs of speech; the 5-frame (0.15 s) gap stays, the 20-frame (0.6 s) one is cut
+    pattern = '#' * 10 + '.' * 5 + '#' * 10 + '.' * 20 + '#' * 10 + '##.'
+    segments = speech_segments(frames(pattern), len(pattern) * FRAME_SECONDS)
+    assert segments == [pytest.approx((0, 25 * FRAME_SECONDS)), pytest.approx((45 * FRAME_SECONDS, 57 * FRAME_SECONDS))]
+    # A blip shorter than MIN_SPEECH_SECONDS is not speech
+    assert speech_segments(frames('..#..'), 5 * FRAME_SECONDS) == []
+
+
+def test_condensed_times_map_back_to_the_recording():
+    time_map = TimeMap([(1.0, 3.0), (10.0, 12.5)])
+    assert time_map.duration == 4.5
+    assert [time_map.to_original(t) for t in (0, 1.5, 2.0, 4.0)] == [1.0, 2.5, 10.0, 12.0]
+    assert TimeMap.from_list(time_map.to_list()).segments == time_map.segments
+    assert TimeMap([]).to_original(7.0) == 7.0
+
+
+@needs_ffmpeg
+def test_long_silence_is_removed(tmp_path):
+    audio = write_wav(tmp_path / 'meeting.wav', [(2, True), (10, False), (2, True), (1, False)])
+    segments, duration = detect_speech(audio)
+    assert duration == pytest.approx(15)
+    assert len(segments) == 2
+    assert segments[1][0] == pytest.approx(12 - vad.PAD_SECONDS, abs=0.05)
+
+    output = str(tmp_path / 'speech.mp3')
+    report, time_map = strip_silence(audio, output, 'speech-mp3')
+    assert report['applied'] and report['segments'] == 2
+    assert report['speech_seconds'] == pytest.approx(4 + 3 * vad.PAD_SECONDS, abs=0.1)
+    assert report['removed_seconds'] == pytest.approx(15 - report['speech_seconds'], abs=0.01)
+    assert probe(output)[0] == pytest.approx(report['speech_seconds'], abs=0.1)
+    # The second tone starts right after the first segment in the condensed audio
+    assert time_map.to_original(2 + vad.PAD_SECONDS + 0.5) == pytest.approx(12.2, abs=0.05)
+
+
+@needs_ffmpeg
+def test_audio_without_enough_silence_is_left_alone(tmp_path):
+    audio = write_wav(tmp_path / 'meeting.wav', [(2, True), (3, False), (2, True)])
+    output = str(tmp_path / 'speech.mp3')
+    report, time_map = strip_silence(audio, output, 'speech-mp3')
+    assert not report['applied'] and time_map is None
+    assert report['removed_seconds'] == 0
+    assert not os.path.exists(output)
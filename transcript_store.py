@@ -0,0 +1,493 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+import metrics
+from vad import TimeMap
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Finished transcriptions are kept in SQLite: one row per transcript, and its
+# title, summary, translations and transcript cut into passages of a few
+# sentences, indexed with FTS5. Passages carry the time range they cover in
+# the original media, so a search hit says where in the meeting it was said.
+# Whisper returns plain text, so those times are estimated from where the
+# passage's words fall in the speech the VAD stage found.
+TRANSCRIPT_STORE = os.getenv('TRANSCRIPT_STORE', 'sqlite')
+TRANSCRIPT_DB = os.getenv('TRANSCRIPT_DB', os.path.join(os.getcwd(), 'transcripts.sqlite3'))
+# A passage ends at the first sentence end after this many words (or at twice as many without one)
+PASSAGE_WORDS = 50
+# Searches rank at most this many of the newest matching passages, so a query
+# for a word in every meeting costs no more than one for a rare word
+SEARCH_CANDIDATES = int(os.getenv('TRANSCRIPT_SEARCH_CANDIDATES', '1000'))
+MAX_PAGE_SIZE = 100
+# Transcripts waiting for the writer thread; beyond this new ones are dropped rather than block a request
+WRITE_QUEUE_MAXSIZE = int(os.getenv('TRANSCRIPT_WRITE_QUEUE_MAXSIZE', '1000'))
+# Transcripts written per transaction when the writer has a backlog
+WRITE_BATCH = 100
+# How long an exiting process waits for queued transcripts to be written
+EXIT_FLUSH_SECONDS = 30
+# Passage rowids encode which transcript and field a passage belongs to (the
+# transcript's rowid, then FIELD_BITS for the field, then POSITION_BITS for
+# its position), so search groups and weighs hits straight from the index
+# instead of looking up every matching passage
+FIELD_BITS = 6
+POSITION_BITS = 14
+# Fields in the order of their number in passage rowids; translations follow
+FIELDS = ['title', 'summary', 'transcript']
+# Hits in a title or summary outrank the same hit in the middle of a transcript
+FIELD_WEIGHTS = {'title': 3.0, 'summary': 1.5}
+HIGHLIGHT = ('**', '**')
+SNIPPET_TOKENS = 24
+PREVIEW_CHARS = 300
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+_WORD = re.compile(r'\w+')
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS transcripts ('
+    ' id INTEGER PRIMARY KEY, transcript_id TEXT UNIQUE NOT NULL, title TEXT, source TEXT,'
+    ' created_at REAL NOT NULL, duration_seconds REAL, content_sha256 TEXT, profile TEXT,'
+    ' transcript TEXT NOT NULL, summary TEXT, translations TEXT, vad TEXT)',
+    'CREATE INDEX IF NOT EXISTS transcripts_sha256 ON transcripts (content_sha256)',
+    'CREATE TABLE IF NOT EXISTS passages ('
+    ' id INTEGER PRIMARY KEY, transcript INTEGER NOT NULL, field TEXT NOT NULL, position INTEGER NOT NULL,'
+    ' start REAL, end REAL, text TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS passages_transcript ON passages (transcript, field, position)',
+    # External content: the index stores no second copy of the text, snippets read it from passages
+    "CREATE VIRTUAL TABLE IF NOT EXISTS passages_fts USING fts5("
+    " text, content='passages', content_rowid='id', tokenize='porter unicode61 remove_diacritics 2')",
+]
+
+_TRANSCRIPT_SQL = f'(rowid >> {FIELD_BITS + POSITION_BITS})'
+_WEIGHT_SQL = f'CASE (rowid >> {POSITION_BITS}) & {2 ** FIELD_BITS - 1} ' + ' '.join(
+    f"WHEN {FIELDS.index(field)} THEN {weight}" for field, weight in FIELD_WEIGHTS.items()) + ' ELSE 1.0 END'
+
+# Matches are found newest first, so the work per query is bounded by the
+# candidate limit. bm25() is lower for better matches; the best passage of
+# each transcript represents it (SQLite takes the bare columns of a MIN()
+# aggregate from the row that has the minimum).
+RANKED_SQL = f'''
+WITH hits AS (
+    SELECT rowid AS passage, {_TRANSCRIPT_SQL} AS transcript, bm25(passages_fts) * {_WEIGHT_SQL} AS score
+    FROM passages_fts WHERE passages_fts MATCH ? ORDER BY rowid DESC LIMIT ?
+), best AS (
+    SELECT transcript, passage, MIN(score) AS score, COUNT(*) AS hits FROM hits
+    GROUP BY transcript ORDER BY score LIMIT ? OFFSET ?
+)
+SELECT t.transcript_id, t.title, t.source, t.created_at, t.duration_seconds,
+       best.passage, p.field, p.start, p.end, -best.score, best.hits
+FROM best JOIN transcripts t ON t.id = best.transcript JOIN passages p ON p.id = best.passage
+ORDER BY best.score
+'''
+
+# For terms in more passages than the candidate limit, bm25() would first
+# count every match to weigh the terms, a scan that grows with the archive.
+# Such terms say little about relevance anyway, so the newest candidates are
+# ranked by how many of each transcript's passages match, weighted by field.
+FREQUENT_SQL = f'''
+WITH hits AS (
+    SELECT rowid AS passage, {_TRANSCRIPT_SQL} AS transcript, {_WEIGHT_SQL} AS weight
+    FROM passages_fts WHERE passages_fts MATCH ? ORDER BY rowid DESC LIMIT ?
+), best AS (
+    SELECT transcript, passage, MAX(weight), SUM(weight) AS score, COUNT(*) AS hits FROM hits
+    GROUP BY transcript ORDER BY score DESC, transcript DESC LIMIT ? OFFSET ?
+)
+SELECT t.transcript_id, t.title, t.source, t.created_at, t.duration_seconds,
+       best.passage, p.field, p.start, p.end, best.score, best.hits
+FROM best JOIN transcripts t ON t.id = best.transcript JOIN passages p ON p.id = best.passage
+ORDER BY best.score DESC, best.transcript DESC
+'''
+
+
+class QueryError(ValueError):
+    """A search query with nothing to search for"""
+
+
+def match_query(text):
+    """
+    FTS5 query for what a user typed: every word must appear, "quoted words"
+    must appear as a phrase and a trailing * matches any word with that prefix.
+    Everything else that FTS5 would read as syntax is treated as text.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"?|(\S+)', text or ''):
+        words = _WORD.findall(phrase or word)
+        if not words:
+            continue
+        if phrase:
+            terms.append('"' + ' '.join(words) + '"')
+        else:
+            terms.extend(f'"{w}"' for w in words)
+            if word.endswith('*'):
+                terms[-1] += '*'
+    if not terms:
+        raise QueryError("Search query has no words to search for")
+    return ' '.join(terms)
+
+
+def split_passages(text, size=PASSAGE_WORDS):
+    """(index of first word, passage text) for each passage of text"""
+    passages = []
+    current = []
+    first = 0
+    for sentence in _SENTENCE_END.split(text.strip()):
+        for word in sentence.split():
+            current.append(word)
+            if len(current) >= 2 * size:
+                # Unpunctuated speech: cut at a word boundary
+                passages.append((first, ' '.join(current)))
+                first += len(current)
+                current = []
+        if len(current) >= size:
+            passages.append((first, ' '.join(current)))
+            first += len(current)
+            current = []
+    if current:
+        passages.append((first, ' '.join(current)))
+    return passages
+
+
+def passage_times(passages, total_words, vad):
+    """
+    Estimated (start, end) seconds in the original media of each passage,
+    assuming speech runs at an even pace through the audio Whisper heard.
+    (None, None) when the media duration is not known.
+    """
+    if not vad or not vad.get('speech_seconds') or not total_words:
+        return [(None, None)] * len(passages)
+    speech_seconds = vad['speech_seconds']
+    time_map = TimeMap.from_list(vad['time_map']) if vad.get('time_map') else None
+    times = []
+    bounds = [first for first, _ in passages] + [total_words]
+    for first, last in zip(bounds, bounds[1:]):
+        start, end = first / total_words * speech_seconds, last / total_words * speech_seconds
+        if time_map is not None:
+            start, end = time_map.to_original(start), time_map.to_original(end)
+        times.append((round(start, 1), round(end, 1)))
+    return times
+
+
+def passage_id(transcript_rowid, field_number, position):
+    return (transcript_rowid << (FIELD_BITS + POSITION_BITS)) | (field_number << POSITION_BITS) | position
+
+
+def record_passages(record):
+    """(field number, field, position, start, end, text) rows to index for a transcript record"""
+    fields = {'title': [(None, None, record['title'])] if record.get('title') else []}
+    if record.get('summary'):
+        fields['summary'] = [(None, None, text) for _, text in split_passages(record['summary'])]
+    passages = split_passages(record['transcript'])
+    times = passage_times(passages, len(record['transcript'].split()), record.get('vad'))
+    fields['transcript'] = [(start, end, text) for (_, text), (start, end) in zip(passages, times)]
+    languages = sorted(language for language, text in (record.get('translations') or {}).items() if text)
+    for language in languages:
+        fields[f'translation:{language}'] = [(None, None, text)
+                                             for _, text in split_passages(record['translations'][language])]
+    rows = []
+    names = FIELDS + [f'translation:{language}' for language in languages]
+    for number, name in enumerate(names[:2 ** FIELD_BITS]):
+        passages = fields.get(name) or []
+        if len(passages) > 2 ** POSITION_BITS:
+            # Beyond what a rowid can number: the rest of the text goes in the last passage
+            tail = passages[2 ** POSITION_BITS - 1:]
+            passages = passages[:2 ** POSITION_BITS - 1] + [
+                (tail[0][0], tail[-1][1], ' '.join(text for _, _, text in tail))]
+        rows.extend((number, name, position, start, end, text)
+                    for position, (start, end, text) in enumerate(passages))
+    return rows
+
+
+class TranscriptStore:
+    """
+    SQLite transcript archive with full-text search.
+
+    add() only queues the transcript; a writer thread splits and indexes it
+    off the request path, batching whatever has queued up into one
+    transaction. Reads use one connection per thread.
+    """
+
+    def __init__(self, path=TRANSCRIPT_DB, candidates=SEARCH_CANDIDATES, maxsize=WRITE_QUEUE_MAXSIZE):
+        self.path = path
+        self.candidates = candidates
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._initialized = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writer = None
+
+    def _connection(self):
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                    conn = sqlite3.connect(self.path, timeout=30)
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    for statement in SCHEMA:
+                        conn.execute(statement)
+                    conn.commit()
+                    conn.close()
+                    self._initialized = True
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def add(self, result, title=None, source=None, content_sha256=None, profile=None):
+        """
+        Queue a pipeline result (see pipeline.transcription_result) for storage.
+
+        Returns the transcript's ID, under which it can be read once the
+        writer has caught up, or None if the result has no transcript or the
+        write queue is full.
+        """
+        if not result.get('transcript'):
+            return None
+        record = {
+            'transcript_id': uuid.uuid4().hex,
+            'created_at': time.time(),
+            'title': title,
+            'source': source,
+            'content_sha256': content_sha256,
+            'profile': profile,
+            'transcript': result['transcript'],
+            'summary': result.get('summary'),
+            'translations': result.get('translations') or {},
+            'vad': result.get('vad'),
+        }
+        self._start_writer()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            logger.error(f"Transcript store write queue is full; not storing {title or record['transcript_id']}")
+            metrics.TRANSCRIPTS_STORED.inc(outcome='dropped')
+            return None
+        return record['transcript_id']
+
+    def _start_writer(self):
+        if self._writer is not None:
+            return
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='transcript-store', daemon=True)
+                self._writer.start()
+                atexit.register(self.flush, EXIT_FLUSH_SECONDS)
+
+    def _write_loop(self):
+        while True:
+            items = [self._queue.get()]
+            while len(items) < WRITE_BATCH:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [item for item in items if isinstance(item, dict)]
+            if records:
+                try:
+                    self._write(records)
+                    metrics.TRANSCRIPTS_STORED.inc(len(records), outcome='stored')
+                except Exception as e:
+                    logger.error(f"Could not store {len(records)} transcripts: {str(e)}")
+                    metrics.TRANSCRIPTS_STORED.inc(len(records), outcome='failed')
+            # flush() markers: everything queued before them is now written
+            for item in items:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _write(self, records):
+        conn = self._connection()
+        with conn:
+            for record in records:
+                rowid = conn.execute(
+                    'INSERT INTO transcripts (transcript_id, title, source, created_at, duration_seconds,'
+                    ' content_sha256, profile, transcript, summary, translations, vad)'
+                    ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (record['transcript_id'], record['title'], record['source'], record['created_at'],
+                     (record['vad'] or {}).get('original_seconds'), record['content_sha256'], record['profile'],
+                     record['transcript'], record['summary'], json.dumps(record['translations']),
+                     json.dumps(record['vad']) if record['vad'] else None)
+                ).lastrowid
+                rows = [(passage_id(rowid, number, position), rowid, field, position, start, end, text)
+                        for number, field, position, start, end, text in record_passages(record)]
+                conn.executemany('INSERT INTO passages (id, transcript, field, position, start, end, text)'
+                                 ' VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                conn.executemany('INSERT INTO passages_fts (rowid, text) VALUES (?, ?)',
+                                 [(row[0], row[-1]) for row in rows])
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is written; returns False on timeout"""
+        if self._writer is None:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def search(self, query, limit=10, offset=0):
+        """
+        Transcripts matching query, best first, each with the snippet and time
+        range of its best passage.
+
+        Returns a dict with the page of results, whether there are more, and
+        the ranking used: "bm25" when every match was ranked, "frequency" when
+        the terms are too common for that and the newest matches were ranked.
+        """
+        expression = match_query(query)
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        offset = max(0, int(offset))
+        start_time = time.time()
+        conn = self._connection()
+        matches = conn.execute(
+            'SELECT COUNT(*) FROM (SELECT rowid FROM passages_fts WHERE passages_fts MATCH ? LIMIT ?)',
+            (expression, self.candidates + 1)
+        ).fetchone()[0]
+        ranked = self.candidates < 0 or matches <= self.candidates
+        rows = conn.execute(RANKED_SQL if ranked else FREQUENT_SQL,
+                            (expression, self.candidates, limit + 1, offset)).fetchall()
+        results = []
+        for (transcript_id, title, source, created_at, duration, passage, field, start, end,
+             score, count) in rows[:limit]:
+            # snippet() needs the match; looking the passage up by rowid keeps it to one row
+            snippet = conn.execute(
+                'SELECT snippet(passages_fts, 0, ?, ?, ?, ?) FROM passages_fts'
+                ' WHERE passages_fts MATCH ? AND rowid = ?',
+                (HIGHLIGHT[0], HIGHLIGHT[1], '…', SNIPPET_TOKENS, expression, passage)
+            ).fetchone()
+            results.append({
+                "transcript_id": transcript_id,
+                "title": title,
+                "source": source,
+                "created_at": created_at,
+                "duration_seconds": duration,
+                "field": field,
+                "start": start,
+                "end": end,
+                "snippet": snippet[0] if snippet else None,
+                "score": round(score, 3),
+                "matching_passages": count,
+                "url": f"/transcripts/{transcript_id}",
+            })
+        metrics.TRANSCRIPT_SEARCH_SECONDS.observe(time.time() - start_time)
+        return {"results": results, "has_more": len(rows) > limit, "ranking": "bm25" if ranked else "frequency"}
+
+    def list(self, limit=20, cursor=None):
+        """Newest transcripts first, without their full text. Returns (items, cursor of the next page or None)"""
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        before = int(cursor) if cursor else None
+        rows = self._connection().execute(
+            'SELECT id, transcript_id, title, source, created_at, duration_seconds, substr(summary, 1, ?)'
+            ' FROM transcripts WHERE id < ? ORDER BY id DESC LIMIT ?',
+            (PREVIEW_CHARS, before if before is not None else 2 ** 63 - 1, limit + 1)
+        ).fetchall()
+        items = [{
+            "transcript_id": transcript_id,
+            "title": title,
+            "source": source,
+            "created_at": created_at,
+            "duration_seconds": duration,
+            "summary_preview": preview,
+            "url": f"/transcripts/{transcript_id}",
+        } for _, transcript_id, title, source, created_at, duration, preview in rows[:limit]]
+        next_cursor = str(rows[limit - 1][0]) if len(rows) > limit else None
+        return items, next_cursor
+
+    def get(self, transcript_id):
+        """The whole stored transcript with its timed segments, or None"""
+        conn = self._connection()
+        row = conn.execute(
+            'SELECT id, title, source, created_at, duration_seconds, content_sha256, profile, transcript, summary,'
+            ' translations, vad FROM transcripts WHERE transcript_id = ?', (transcript_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        rowid, title, source, created_at, duration, content_sha256, profile, transcript, summary, translations, \
+            vad = row
+        segments = conn.execute(
+            "SELECT start, end, text FROM passages WHERE transcript = ? AND field = 'transcript' ORDER BY position",
+            (rowid,)
+        ).fetchall()
+        return {
+            "transcript_id": transcript_id,
+            "title": title,
+            "source": source,
+            "created_at": created_at,
+            "duration_seconds": duration,
+            "content_sha256": content_sha256,
+            "profile": profile,
+            "transcript": transcript,
+            "summary": summary,
+            "translations": json.loads(translations) if translations else {},
+            "vad": json.loads(vad) if vad else None,
+            # Estimated from the VAD time map, not reported by the model
+            "segments": [{"start": start, "end": end, "text": text} for start, end, text in segments],
+        }
+
+    def delete(self, transcript_id):
+        """Remove a transcript and its index entries; returns False if there was none"""
+        conn = self._connection()
+        with conn:
+            row = conn.execute('SELECT id FROM transcripts WHERE transcript_id = ?', (transcript_id,)).fetchone()
+            if row is None:
+                return False
+            passages = conn.execute('SELECT id, text FROM passages WHERE transcript = ?', (row[0],)).fetchall()
+            # External-content index: entries are removed by handing back the text they were built from
+            conn.executemany("INSERT INTO passages_fts (passages_fts, rowid, text) VALUES ('delete', ?, ?)",
+                             passages)
+            conn.execute('DELETE FROM passages WHERE transcript = ?', (row[0],))
+            conn.execute('DELETE FROM transcripts WHERE id = ?', (row[0],))
+        return True
+
+    def stats(self):
+        conn = self._connection()
+        return {
+            'transcripts': conn.execute('SELECT COUNT(*) FROM transcripts').fetchone()[0],
+            'passages': conn.execute('SELECT COUNT(*) FROM passages').fetchone()[0],
+            'pending_writes': self._queue.qsize(),
+        }
+
+
+class NullTranscriptStore:
+    """Drop-in replacement used when the transcript store is disabled"""
+
+    def add(self, result, title=None, source=None, content_sha256=None, profile=None):
+        return None
+
+    def flush(self, timeout=None):
+        return True
+
+    def search(self, query, limit=10, offset=0):
+        match_query(query)
+        return {"results": [], "has_more": False, "ranking": "bm25"}
+
+    def list(self, limit=20, cursor=None):
+        return [], None
+
+    def get(self, transcript_id):
+        return None
+
+    def delete(self, transcript_id):
+        return False
+
+    def stats(self):
+        return {'enabled': False}
+
+
+def create_transcript_store():
+    """Build the shared store from TRANSCRIPT_* environment variables"""
+    if TRANSCRIPT_STORE == 'off':
+        return NullTranscriptStore()
+    if TRANSCRIPT_STORE != 'sqlite':
+        raise ValueError(f"Unknown transcript store '{TRANSCRIPT_STORE}'")
+    return TranscriptStore()
+
+
+# Shared by the server modules and process_file.py, like result_cache
+transcript_store = create_transcript_store()
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import metrics
+from openai_client import is_unavailable, openai_client
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Transcription backends: Whisper through the OpenAI API, or Whisper on this
+# machine's CPU through faster-whisper (an optional dependency), e.g. to run
+# air-gapped or to keep going while the API is rate limiting us.
+TRANSCRIBE_BACKEND = os.getenv('TRANSCRIBE_BACKEND', 'openai')
+# Backend to switch to, file by file, while the OpenAI one is rate limited or down ('' for none)
+TRANSCRIBE_FALLBACK = os.getenv('TRANSCRIBE_FALLBACK', '')
+OPENAI_TRANSCRIBE_MODEL = "whisper-1"
+
+# A faster-whisper model size (tiny, base, small, medium, large-v3, ...) or the path of a converted
+# model directory; sizes are downloaded from the Hugging Face hub on first use unless HF_HUB_OFFLINE=1
+LOCAL_WHISPER_MODEL = os.getenv('LOCAL_WHISPER_MODEL', 'small')
+LOCAL_WHISPER_DIR = os.getenv('LOCAL_WHISPER_DIR', '') or None
+# int8 weights take a quarter of the memory of float32 and decode faster on CPU, at a small cost in accuracy
+LOCAL_WHISPER_COMPUTE_TYPE = os.getenv('LOCAL_WHISPER_COMPUTE_TYPE', 'int8')
+# Files decoded at once per process
+LOCAL_WHISPER_WORKERS = int(os.getenv('LOCAL_WHISPER_WORKERS', '1'))
+# CPU threads per decode; by default the cores are split evenly between the workers
+LOCAL_WHISPER_THREADS = int(os.getenv('LOCAL_WHISPER_THREADS', '0')) or max(1, os.cpu_count() // LOCAL_WHISPER_WORKERS)
+# 30-second windows of one file decoded together as a batch (1 decodes them one after another)
+LOCAL_WHISPER_BATCH_SIZE = int(os.getenv('LOCAL_WHISPER_BATCH_SIZE', '8'))
+# Greedy decoding; beam search (5 is Whisper's default) costs several times the CPU for a small WER gain
+LOCAL_WHISPER_BEAM_SIZE = int(os.getenv('LOCAL_WHISPER_BEAM_SIZE', '1'))
+# Skips language detection when set, e.g. 'en'
+LOCAL_WHISPER_LANGUAGE = os.getenv('LOCAL_WHISPER_LANGUAGE', '') or None
+
+
+class BackendUnavailable(Exception):
+    """Raised when a backend cannot run here, e.g. its optional package is not installed"""
+
+
+class OpenAITranscriber:
+    """Whisper through the OpenAI API, with the shared client's rate limits, retries and breaker"""
+
+    name = 'openai'
+
+    def __init__(self, model=OPENAI_TRANSCRIBE_MODEL):
+        self.model = model
+        # Cache keys stay what they were before there was a choice of backend
+        self.cache_id = model
+
+    def transcribe(self, audio_path, used=None, wait_out_rate_limits=True):
+        with open(audio_path, "rb") as audio_file:
+            transcript = openai_client.transcribe(audio_file, self.model, wait_out_rate_limits=wait_out_rate_limits)
+        if used is not None:
+            used.append(self.name)
+        logger.debug(f"Transcribed {audio_path}: {len(transcript)} characters")
+        return transcript
+
+    async def atranscribe(self, audio_path, used=None, wait_out_rate_limits=True):
+        with open(audio_path, "rb") as audio_file:
+            transcript = await openai_client.atranscribe(audio_file, self.model,
+                                                         wait_out_rate_limits=wait_out_rate_limits)
+        if used is not None:
+            used.append(self.name)
+        logger.debug(f"Transcribed {audio_path}: {len(transcript)} characters")
+        return transcript
+
+
+class LocalWhisperTranscriber:
+    """
+    Whisper on the CPU through faster-whisper (CTranslate2), int8 by default.
+
+    The model is loaded once per process, on first use. Each file is cut into
+    30-second windows at pauses (faster-whisper's Silero VAD) and the windows
+    are decoded in batches of batch_size, which keeps every core busy on a
+    single file. Up to `workers` files are decoded at once, with the cores
+    split between them; further calls wait their turn.
+    """
+
+    name = 'local'
+
+    def __init__(self, model=LOCAL_WHISPER_MODEL, compute_type=LOCAL_WHISPER_COMPUTE_TYPE,
+                 workers=LOCAL_WHISPER_WORKERS, threads=LOCAL_WHISPER_THREADS, batch_size=LOCAL_WHISPER_BATCH_SIZE,
+                 beam_size=LOCAL_WHISPER_BEAM_SIZE, language=LOCAL_WHISPER_LANGUAGE, download_root=LOCAL_WHISPER_DIR):
+        self.model = model
+        self.compute_type = compute_type
+        self.workers = workers
+        self.threads = threads
+        self.batch_size = batch_size
+        self.beam_size = beam_size
+        self.language = language
+        self.download_root = download_root
+        self.cache_id = f"local:{os.path.basename(model.rstrip(os.sep))}:{compute_type}:beam{beam_size}"
+        self._engine = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(workers)
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self._lock:
+                if self._engine is None:
+                    self._engine = self._load()
+        return self._engine
+
+    def _load(self):
+        try:
+            from faster_whisper import BatchedInferencePipeline, WhisperModel
+        except ImportError:
+            raise BackendUnavailable("The local transcription backend needs faster-whisper "
+                                     "(pip install faster-whisper)")
+        start_time = time.time()
+        model = WhisperModel(self.model, device='cpu', compute_type=self.compute_type, cpu_threads=self.threads,
+                             num_workers=self.workers, download_root=self.download_root)
+        logger.info(f"Loaded Whisper model {self.model} ({self.compute_type}, {self.workers} x {self.threads} "
+                    f"threads) in {(time.time() - start_time):.1f}s")
+        return BatchedInferencePipeline(model) if self.batch_size > 1 else model
+
+    def transcribe(self, audio_path, used=None, wait_out_rate_limits=True):
+        engine = self.engine
+        options = {'beam_size': self.beam_size, 'language': self.language}
+        if self.batch_size > 1:
+            options['batch_size'] = self.batch_size
+        with self._slots:
+            start_time = time.time()
+            segments, info = engine.transcribe(audio_path, **options)
+            # segments is lazy; the decoding happens while it is consumed
+            transcript = ' '.join(segment.text.strip() for segment in segments)
+            elapsed = time.time() - start_time
+        if used is not None:
+            used.append(self.name)
+        logger.info(f"Transcribed {info.duration:.1f}s of audio locally in {elapsed:.1f}s "
+                    f"(real-time factor {elapsed / max(info.duration, 0.001):.3f})")
+        return transcript
+
+    async def atranscribe(self, audio_path, used=None, wait_out_rate_limits=True):
+        # CPU-bound; decoding releases the GIL, so the loop keeps serving
+        return await asyncio.to_thread(self.transcribe, audio_path, used)
+
+
+class FallbackTranscriber:
+    """
+    primary, and fallback for each file primary cannot take right now.
+
+    Calls go to primary without waiting out rate limits, so a file that would
+    wait for the OpenAI audio rate limit, or that the API answers with 429,
+    goes to fallback straight away. So does one that fails after its retries
+    because the API is down, or while the circuit breaker is open. Requests
+    the API rejects (a bad file, say) fail as they would without a fallback.
+    """
+
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = primary.name
+        self.cache_id = primary.cache_id
+
+    def _falling_back(self, audio_path, error):
+        logger.warning(f"Transcribing {os.path.basename(audio_path)} with {self.fallback.name} instead of "
+                       f"{self.primary.name}: {str(error)}")
+        metrics.TRANSCRIBE_FALLBACKS.inc(backend=self.fallback.name, reason=type(error).__name__)
+
+    def transcribe(self, audio_path, used=None, wait_out_rate_limits=True):
+        try:
+            return self.primary.transcribe(audio_path, used, wait_out_rate_limits=False)
+        except Exception as e:
+            if not is_unavailable(e):
+                raise
+            self._falling_back(audio_path, e)
+        return self.fallback.transcribe(audio_path, used)
+
+    async def atranscribe(self, audio_path, used=None, wait_out_rate_limits=True):
+        try:
+            return await self.primary.atranscribe(audio_path, used, wait_out_rate_limits=False)
+        except Exception as e:
+            if not is_unavailable(e):
+                raise
+            self._falling_back(audio_path, e)
+        return await self.fallback.atranscribe(audio_path, used)
+
+
+BACKENDS = {
+    'openai': OpenAITranscriber,
+    'local': LocalWhisperTranscriber,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def _backend(name):
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = BACKENDS[name]()
+        return _backends[name]
+
+
+def get_transcriber(name=None):
+    """
+    The process-wide transcriber for backend name (TRANSCRIBE_BACKEND if
+    None), wrapped with TRANSCRIBE_FALLBACK when that is set. Cheap: models
+    load on first use. Raises ValueError for an unknown name.
+    """
+    name = name or TRANSCRIBE_BACKEND
+    for backend in (name, TRANSCRIBE_FALLBACK):
+        if backend and backend not in BACKENDS:
+            raise ValueError(f"Unknown transcription backend '{backend}'. Available: {', '.join(BACKENDS)}")
+    if TRANSCRIBE_FALLBACK and TRANSCRIBE_FALLBACK != name:
+        return FallbackTranscriber(_backend(name), _backend(TRANSCRIBE_FALLBACK))
+    return _backend(name)
@@ -1,30 +1,234 @@
-import openai
+import asyncio
 import os
-from dotenv import load_dotenv
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 import logging
+from openai_client import openai_client
+from result_cache import result_cache, hash_text, make_key
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+CHAT_MODEL = "gpt-3.5-turbo"
+# Bump when the prompt changes so cached translations from the old prompt are not reused
+TRANSLATE_PROMPT_VERSION = 1
+
+# Languages translated when a request does not ask for any (comma-separated; empty means none)
+DEFAULT_LANGUAGES = os.getenv('DEFAULT_TRANSLATION_LANGUAGES', '')
+MAX_LANGUAGES = int(os.getenv('MAX_TRANSLATION_LANGUAGES', '5'))
+TRANSLATION_CONCURRENCY = int(os.getenv('TRANSLATION_CONCURRENCY', '4'))
+# Sections shorter than this are only cut at headings, to avoid many tiny requests
+MIN_SECTION_CHARS = 400
+
+_HEADING_START = re.compile(r'\n(?=#)')
+_BLANK_LINE = re.compile(r'\n[ \t]*\n(?=\S)')
+
+def translation_cache_key(text, target_language):
+    """Result cache key for a translation; shared with the packed requests of batch_translate"""
+    return make_key(hash_text(text), target_language.strip().lower(), CHAT_MODEL, TRANSLATE_PROMPT_VERSION)
+
+def translation_messages(text, target_language):
+    return [
+        {"role": "system", "content": f"You are a helpful translator. Translate the following text to {target_language}. Maintain the same formatting including markdown and bullet points."},
+        {"role": "user", "content": text}
+    ]
 
 def translate_text(text, target_language):
     """Translate text using GPT-3.5"""
+    def complete():
+        return openai_client.chat(translation_messages(text, target_language), model=CHAT_MODEL)
+
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": f"You are a helpful translator. Translate the following text to {target_language}. Maintain the same formatting including markdown and bullet points."},
-                {"role": "user", "content": text}
-            ]
-        )
-        return response.choices[0].message.content
+        return result_cache.get_or_compute('translate', translation_cache_key(text, target_language), complete)
     except Exception as e:
         logger.error(f"Translation error: {str(e)}")
         raise Exception(f"Error translating text: {str(e)}")
 
+async def translate_text_async(text, target_language):
+    """translate_text() for the asyncio server"""
+    async def complete():
+        return await openai_client.achat(translation_messages(text, target_language), model=CHAT_MODEL)
+
+    try:
+        return await result_cache.aget_or_compute('translate', translation_cache_key(text, target_language), complete)
+    except Exception as e:
+        logger.error(f"Translation error: {str(e)}")
+        raise Exception(f"Error translating text: {str(e)}")
+
+def parse_languages(value):
+    """Turn a comma-separated string or list of languages into a de-duplicated list"""
+    if value is None:
+        value = DEFAULT_LANGUAGES
+    if isinstance(value, str):
+        value = value.split(',')
+    languages = []
+    for language in value:
+        language = language.strip()
+        if language and language.lower() not in [l.lower() for l in languages]:
+            languages.append(language)
+    if len(languages) > MAX_LANGUAGES:
+        raise ValueError(f"At most {MAX_LANGUAGES} target languages can be requested")
+    return languages
+
+def _busy_seconds(spans, until):
+    """
+    Wall time before until during which at least one of the (start, end) spans
+    was running. Concurrent sections count once, and each counts for the time
+    it measurably took (a cache hit for almost none), not as a whole request.
+    """
+    busy = 0
+    covered = None
+    for start, end in sorted(spans):
+        end = min(end, until)
+        if covered is not None:
+            start = max(start, covered)
+        if end > start:
+            busy += end - start
+            covered = end
+    return busy
+
+class SectionTranslator:
+    """
+    Translate a summary into several languages while it is still being generated.
+
+    feed() receives the summary text as it streams in. Each time a section is
+    complete (a new Markdown heading starts, or a blank line follows a long
+    enough section) it is submitted for translation into every language on a
+    shared thread pool. finish() flushes the last section and waits for the
+    rest, so only the tail of the translation work sits on the critical path.
+    """
+
+    def __init__(self, languages, translate_fn=None, max_workers=TRANSLATION_CONCURRENCY, on_section=None):
+        self.languages = languages
+        self.translate_fn = translate_fn or translate_text
+        self.on_section = on_section
+        self.max_workers = max_workers
+        self._executor = None
+        self._buffer = ''
+        self._sections = 0
+        self._futures = {language: [] for language in languages}
+        # (start, end) of every section translation, for the timing report
+        self._spans = []
+
+    def feed(self, delta):
+        self._buffer += delta
+        while True:
+            cut = self._boundary()
+            if cut is None:
+                return
+            section, self._buffer = self._buffer[:cut], self._buffer[cut:]
+            self._submit(section)
+
+    def _boundary(self):
+        for match in _HEADING_START.finditer(self._buffer):
+            if self._buffer[:match.start()].strip():
+                return match.end()
+        if len(self._buffer) >= MIN_SECTION_CHARS:
+            for match in _BLANK_LINE.finditer(self._buffer):
+                if match.start() >= MIN_SECTION_CHARS:
+                    return match.end()
+        return None
+
+    def _submit(self, section):
+        section = section.strip()
+        if not section:
+            return
+        index = self._sections
+        self._sections += 1
+        for language in self.languages:
+            self._futures[language].append(self._schedule(index, section, language))
+
+    def _schedule(self, index, section, language):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='translate')
+        return self._executor.submit(self._translate, index, section, language)
+
+    def _translate(self, index, section, language):
+        start = time.time()
+        translated = self.translate_fn(section, language)
+        self._spans.append((start, time.time()))
+        if self.on_section:
+            self.on_section(language, index, translated)
+        return translated
+
+    def finish(self):
+        """
+        Translate whatever is left and wait for every section.
+
+        Returns ({language: translated text}, timing), where timing compares the
+        total translation work with the time actually spent waiting after the
+        summary was complete, and reports how long translations were running
+        before it was, i.e. kept off the critical path.
+        """
+        wait_start = time.time()
+        self._flush()
+        translations = {
+            language: '\n\n'.join(future.result() for future in futures)
+            for language, futures in self._futures.items()
+        }
+        return translations, self._timing(wait_start)
+
+    def _flush(self):
+        self.feed('')
+        self._submit(self._buffer)
+        self._buffer = ''
+
+    def _timing(self, wait_start):
+        wait_ms = int((time.time() - wait_start) * 1000)
+        work_ms = int(sum(end - start for start, end in self._spans) * 1000)
+        return {
+            "languages": self.languages,
+            "sections": self._sections,
+            "translation_work_ms": work_ms,
+            "critical_path_ms": wait_ms,
+            "critical_path_saved_ms": int(_busy_seconds(self._spans, wait_start) * 1000),
+        }
+
+    def close(self):
+        """Release the thread pool, dropping translations that have not started"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+class AsyncSectionTranslator(SectionTranslator):
+    """
+    SectionTranslator for the asyncio server.
+
+    Sections are translated by tasks on the running event loop, at most
+    max_workers at a time, with translate_fn a coroutine function; feed()
+    must be called from the loop and finish() is awaited.
+    """
+
+    def __init__(self, languages, translate_fn=None, max_workers=TRANSLATION_CONCURRENCY, on_section=None):
+        super().__init__(languages, translate_fn or translate_text_async, max_workers, on_section)
+        self._slots = asyncio.Semaphore(max_workers)
+
+    def _schedule(self, index, section, language):
+        return asyncio.ensure_future(self._translate_async(index, section, language))
+
+    async def _translate_async(self, index, section, language):
+        async with self._slots:
+            start = time.time()
+            translated = await self.translate_fn(section, language)
+        self._spans.append((start, time.time()))
+        if self.on_section:
+            self.on_section(language, index, translated)
+        return translated
+
+    async def finish(self):
+        wait_start = time.time()
+        self._flush()
+        translations = {}
+        for language, futures in self._futures.items():
+            translations[language] = '\n\n'.join(await asyncio.gather(*futures))
+        return translations, self._timing(wait_start)
+
+    def close(self):
+        """Cancel translations that are still running"""
+        for futures in self._futures.values():
+            for future in futures:
+                future.cancel()
+
 if __name__ == "__main__":
     # Test the translation function
     test_text = "# Meeting Summary\n\n## Key Decisions\n- Decision 1\n- Decision 2\n\n## Action Items\n- Action 1\n- Action 2"
@@ -0,0 +1,350 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from result_cache import make_key
+from storage import STORAGE_ROOT
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Resumable uploads: the client creates an upload, PUTs the file in chunks at
+# explicit offsets (resuming from GET's offset after a dropped connection) and
+# finalizes it. Each upload spools to its own file named by its ID, next to a
+# JSON state file, so state survives restarts and is shared between workers.
+# A worker receiving a chunk holds an flock on the spool file until the chunk
+# is committed or discarded, which keeps other worker processes off it.
+UPLOAD_DIR = os.getenv('RESUMABLE_UPLOAD_DIR', os.path.join(STORAGE_ROOT, 'resumable'))
+# Chunk size suggested to clients, and the largest chunk accepted
+CHUNK_BYTES = int(os.getenv('UPLOAD_CHUNK_BYTES', str(8 * 1024 * 1024)))
+MAX_CHUNK_BYTES = int(os.getenv('UPLOAD_MAX_CHUNK_BYTES', str(64 * 1024 * 1024)))
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', str(4 * 1024 ** 3)))
+# Unfinished uploads idle for longer than this are deleted
+UPLOAD_TTL_SECONDS = int(os.getenv('UPLOAD_TTL_SECONDS', str(24 * 3600)))
+# Bump when the pipeline's output changes so results cached for an upload hash are not reused
+MEDIA_RESULT_VERSION = 1
+
+BLOCK_SIZE = 1024 * 1024
+
+
+class UploadError(Exception):
+    """A resumable upload request that cannot be honoured; status is the HTTP status to answer with"""
+    status = 400
+
+
+class UploadNotFound(UploadError):
+    status = 404
+
+
+class OffsetMismatch(UploadError):
+    """The chunk does not start where the upload currently ends; offset is where it does"""
+    status = 409
+
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+
+class ChecksumMismatch(UploadError):
+    status = 422
+
+
+class UploadTooLarge(UploadError):
+    status = 413
+
+
+def media_result_key(content_sha256, profile, languages, backend):
+    """Result cache key for the pipeline result of an uploaded file, processed with these options"""
+    languages = ','.join(sorted(language.lower() for language in languages or []))
+    return make_key(content_sha256, profile or '', languages, backend, MEDIA_RESULT_VERSION)
+
+
+class Upload:
+    """State of one resumable upload"""
+
+    def __init__(self, upload_id, filename, size, sha256=None, content_sha256=None,
+                 created_at=None, updated_at=None, offset=0):
+        self.id = upload_id
+        self.filename = filename
+        self.size = size
+        # Whole-file hash declared by the client, checked on finalize
+        self.sha256 = sha256
+        # Hash of the received bytes, known once the upload is complete
+        self.content_sha256 = content_sha256
+        self.created_at = created_at or time.time()
+        self.updated_at = updated_at or self.created_at
+        self.offset = offset
+
+    @property
+    def complete(self):
+        return self.offset == self.size
+
+    def to_dict(self):
+        return {
+            "upload_id": self.id,
+            "filename": self.filename,
+            "size": self.size,
+            "offset": self.offset,
+            "complete": self.complete,
+            "content_sha256": self.content_sha256,
+            "chunk_size": CHUNK_BYTES,
+            "upload_url": f"/uploads/{self.id}",
+        }
+
+    def state(self):
+        return {
+            "filename": self.filename, "size": self.size, "offset": self.offset, "sha256": self.sha256,
+            "content_sha256": self.content_sha256, "created_at": self.created_at, "updated_at": self.updated_at,
+        }
+
+
+def _file_stamp(f):
+    """What changes whenever any process rewrites, truncates or replaces the open file"""
+    st = os.fstat(f.fileno())
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class ChunkWriter:
+    """
+    Receives one PUT chunk into the locked spool file. write() appends blocks
+    as they arrive; commit() checks the chunk checksum and makes the chunk
+    part of the upload, abort() cuts the spool file back to where the chunk
+    started. Either one releases the lock.
+    """
+
+    def __init__(self, store, upload, spool, digest, checksum=None):
+        self.store = store
+        self.upload = upload
+        self.offset = upload.offset
+        self.length = 0
+        self.checksum = checksum.lower() if checksum else None
+        self._chunk_digest = hashlib.sha256()
+        # The running content hash only takes in the chunk once it is verified
+        self._digest = digest.copy()
+        self._file = spool
+        # Drop anything left past the offset by a chunk that never committed
+        if os.fstat(spool.fileno()).st_size != self.offset:
+            self._file.truncate(self.offset)
+        self._file.seek(self.offset)
+
+    def write(self, block):
+        self.length += len(block)
+        if self.length > MAX_CHUNK_BYTES:
+            raise UploadTooLarge(f"Chunks can be at most {MAX_CHUNK_BYTES} bytes")
+        if self.offset + self.length > self.upload.size:
+            raise UploadTooLarge(f"Chunk runs past the declared upload size of {self.upload.size} bytes")
+        self._file.write(block)
+        self._chunk_digest.update(block)
+        self._digest.update(block)
+
+    def commit(self):
+        """Verify the chunk and advance the upload; returns the updated Upload"""
+        try:
+            if self.checksum and self._chunk_digest.hexdigest() != self.checksum:
+                raise ChecksumMismatch(f"Chunk at offset {self.offset} does not match its SHA-256")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            return self.store._committed(self.upload, self.offset + self.length, self._digest, self._file)
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            # Unlocks only now that the new offset is saved for the next chunk to see
+            self._file.close()
+
+    def abort(self):
+        # Still locked, so nothing past the offset can be another worker's chunk
+        if not self._file.closed:
+            self._file.truncate(self.offset)
+            self._file.close()
+
+
+class UploadStore:
+    """Spool files and state of the resumable uploads in one directory"""
+
+    def __init__(self, directory=UPLOAD_DIR, ttl=UPLOAD_TTL_SECONDS):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+        # Running content hash per upload as (offset, file stamp, digest), so finalize does not reread the file
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def spool_path(self, upload_id):
+        return os.path.join(self.directory, upload_id)
+
+    def _state_path(self, upload_id):
+        return os.path.join(self.directory, f"{upload_id}.json")
+
+    def create(self, filename, size, sha256=None):
+        if not isinstance(size, int) or size <= 0:
+            raise UploadError("size must be a positive number of bytes")
+        if size > MAX_UPLOAD_BYTES:
+            raise UploadTooLarge(f"Uploads can be at most {MAX_UPLOAD_BYTES} bytes")
+        self.expire()
+        upload = Upload(uuid.uuid4().hex, filename or 'upload', size, sha256=sha256.lower() if sha256 else None)
+        open(self.spool_path(upload.id), 'wb').close()
+        self._save(upload)
+        logger.info(f"Created upload {upload.id} for {upload.filename} ({size} bytes)")
+        return upload
+
+    def _check_id(self, upload_id):
+        # IDs come from URLs; only accept what create() hands out
+        if not (len(upload_id) == 32 and all(c in '0123456789abcdef' for c in upload_id)):
+            raise UploadNotFound("Upload not found")
+
+    def get(self, upload_id):
+        """The upload with this ID; its offset only counts verified chunks"""
+        self._check_id(upload_id)
+        try:
+            with open(self._state_path(upload_id)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            raise UploadNotFound("Upload not found")
+        return Upload(upload_id, **state)
+
+    def _lock_spool(self, upload_id, wait=False):
+        """
+        The upload's spool file, open for writing and exclusively locked. The
+        lock is an flock, so it holds between processes as well as threads.
+        Without wait, raises OffsetMismatch if another chunk holds it.
+        """
+        self._check_id(upload_id)
+        try:
+            spool = open(self.spool_path(upload_id), 'r+b')
+        except FileNotFoundError:
+            raise UploadNotFound("Upload not found")
+        try:
+            fcntl.flock(spool, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            spool.close()
+            raise OffsetMismatch("Another chunk of this upload is still being received", self.get(upload_id).offset)
+        return spool
+
+    def begin_chunk(self, upload_id, offset, checksum=None):
+        """Start receiving the chunk that begins at offset; one chunk per upload at a time"""
+        spool = self._lock_spool(upload_id)
+        try:
+            # Read under the lock: the chunk before may have been committed by another worker
+            upload = self.get(upload_id)
+            if upload.content_sha256:
+                raise OffsetMismatch("Upload is already finalized", upload.offset)
+            if offset != upload.offset:
+                raise OffsetMismatch(f"Chunk starts at {offset} but the upload ends at {upload.offset}",
+                                     upload.offset)
+            return ChunkWriter(self, upload, spool, self._digest(upload, spool), checksum)
+        except BaseException:
+            spool.close()
+            raise
+
+    def write_chunk(self, upload_id, offset, stream, checksum=None):
+        """Receive a whole chunk from a file-like stream; returns the updated Upload"""
+        writer = self.begin_chunk(upload_id, offset, checksum)
+        try:
+            for block in iter(lambda: stream.read(BLOCK_SIZE), b''):
+                writer.write(block)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.commit()
+
+    def _digest(self, upload, spool):
+        """Content hash of the upload's verified bytes in the locked spool file"""
+        with self._lock:
+            found = self._digests.get(upload.id)
+        # Kept only for the file exactly as this process committed it
+        if found is not None and found[0] == upload.offset and found[1] == _file_stamp(spool):
+            return found[2]
+        # Written by another worker, before a restart, or changed since: hash the verified part on disk
+        digest = hashlib.sha256()
+        remaining = upload.offset
+        spool.seek(0)
+        while remaining:
+            block = spool.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                raise UploadError("Upload spool file is shorter than its offset")
+            digest.update(block)
+            remaining -= len(block)
+        return digest
+
+    def _committed(self, upload, offset, digest, spool):
+        upload.offset = offset
+        upload.updated_at = time.time()
+        self._save(upload)
+        with self._lock:
+            self._digests[upload.id] = (offset, _file_stamp(spool), digest)
+        return upload
+
+    def finish(self, upload_id):
+        """Check a complete upload against its declared hash and record its content hash"""
+        # Waits for a chunk in flight, so the state and the file are read as they end up
+        with self._lock_spool(upload_id, wait=True) as spool:
+            upload = self.get(upload_id)
+            if upload.content_sha256:
+                return upload
+            if not upload.complete:
+                raise OffsetMismatch(f"Upload has {upload.offset} of {upload.size} bytes", upload.offset)
+            content_sha256 = self._digest(upload, spool).hexdigest()
+            if upload.sha256 and upload.sha256 != content_sha256:
+                self.delete(upload_id)
+                raise ChecksumMismatch("Uploaded file does not match its SHA-256; start the upload again")
+            upload.content_sha256 = content_sha256
+            self._save(upload)
+            return upload
+
+    def claim(self, upload_id, path):
+        """Move a finished upload's file to path for processing and forget the upload"""
+        try:
+            shutil.move(self.spool_path(upload_id), path)
+        except FileNotFoundError:
+            # Claimed by a concurrent finalize
+            raise UploadNotFound("Upload not found")
+        self.delete(upload_id)
+
+    def delete(self, upload_id):
+        for path in (self.spool_path(upload_id), self._state_path(upload_id)):
+            if os.path.exists(path):
+                os.remove(path)
+        with self._lock:
+            self._digests.pop(upload_id, None)
+
+    def expire(self):
+        """Delete uploads nobody has written to for ttl seconds"""
+        if not self.ttl:
+            return
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            upload_id = name[:-len('.json')]
+            try:
+                expired = os.path.getmtime(os.path.join(self.directory, name)) < cutoff
+            except OSError:
+                continue
+            if not expired:
+                continue
+            try:
+                spool = self._lock_spool(upload_id)
+            except OffsetMismatch:
+                # A chunk is arriving after all
+                continue
+            except UploadNotFound:
+                spool = None
+            logger.info(f"Removing abandoned upload {upload_id}")
+            try:
+                self.delete(upload_id)
+            finally:
+                if spool is not None:
+                    spool.close()
+
+    def _save(self, upload):
+        path = self._state_path(upload.id)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(upload.state(), f)
+        os.replace(f"{path}.tmp", path)
@@ -0,0 +1,211 @@
+import bisect
+import logging
+import os
+import subprocess
+import time
+
+import numpy as np
+
+from audio import get_profile
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Voice-activity pre-pass: find the speech in extracted audio from frame energy
+# and zero-crossing rate, and send Whisper only that, with long silences, dead
+# air and noise cut out. Short pauses stay, so sentences keep their rhythm.
+VAD_ENABLED = os.getenv('VAD_ENABLED', '1').lower() not in ('0', 'false', 'no')
+SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.03
+FRAME_SAMPLES = int(SAMPLE_RATE * FRAME_SECONDS)
+# Non-speech shorter than this is a pause within speech and is kept
+MIN_SILENCE_SECONDS = float(os.getenv('VAD_MIN_SILENCE_SECONDS', '2.0'))
+# Kept either side of speech so word onsets and trailing consonants are not clipped
+PAD_SECONDS = float(os.getenv('VAD_PAD_SECONDS', '0.3'))
+# Louder-than-floor blips shorter than this (clicks, bumps) are not speech
+MIN_SPEECH_SECONDS = 0.15
+# How far above the recording's noise floor a frame must be to count as speech
+THRESHOLD_DB = float(os.getenv('VAD_THRESHOLD_DB', '12'))
+# Frames quieter than this are silence however quiet the recording is
+SILENCE_DBFS = -55.0
+# Broadband noise (hiss, static) crosses zero on about every other sample; speech far less
+NOISE_ZCR = 0.45
+# Skip rewriting the audio when less than this would be cut
+MIN_SAVED_SECONDS = float(os.getenv('VAD_MIN_SAVED_SECONDS', '5'))
+# PCM decoded and analysed per read (30 s of 16 kHz 16-bit mono is ~1 MB)
+READ_FRAMES = 1000
+
+
+def decode_command(path):
+    """FFmpeg command decoding any audio to 16 kHz mono 16-bit PCM on stdout"""
+    return ['ffmpeg', '-v', 'error', '-i', path, '-vn', '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 's16le', 'pipe:1']
+
+
+def pcm_blocks(path, frames=READ_FRAMES):
+    """Decode path and yield float32 sample blocks of whole frames (the last may be shorter)"""
+    process = subprocess.Popen(decode_command(path), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    block_bytes = frames * FRAME_SAMPLES * 2
+    pending = b''
+    try:
+        while True:
+            data = process.stdout.read(block_bytes - len(pending))
+            if not data:
+                break
+            pending += data
+            if len(pending) == block_bytes:
+                yield np.frombuffer(pending, dtype='<i2').astype(np.float32) / 32768.0
+                pending = b''
+        if len(pending) >= 2:
+            yield np.frombuffer(pending[:len(pending) // 2 * 2], dtype='<i2').astype(np.float32) / 32768.0
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        process.stdout.close()
+    stderr = process.stderr.read().decode('utf-8', 'replace')
+    if process.wait() != 0:
+        raise Exception(f"Error decoding audio for voice detection: {' '.join(stderr.splitlines()[-3:])}")
+
+
+def frame_features(samples):
+    """Energy (dBFS) and zero-crossing rate of each whole frame in samples"""
+    usable = len(samples) // FRAME_SAMPLES * FRAME_SAMPLES
+    frames = samples[:usable].reshape(-1, FRAME_SAMPLES)
+    energy_db = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (FRAME_SAMPLES - 1)
+    return energy_db, zcr
+
+
+def speech_frames(energy_db, zcr):
+    """Boolean mask of the frames that look like speech"""
+    if not len(energy_db):
+        return np.zeros(0, dtype=bool)
+    # The quietest tenth of a recording is its background
+    floor = np.percentile(energy_db, 10)
+    threshold = max(floor + THRESHOLD_DB, SILENCE_DBFS)
+    # Noise-like frames only count when they stand well clear of the threshold (sibilants in loud speech)
+    return (energy_db > threshold) & ((zcr < NOISE_ZCR) | (energy_db > threshold + 10))
+
+
+def speech_segments(is_speech, duration):
+    """Merge speech frames into padded (start, end) spans in seconds, keeping gaps under MIN_SILENCE_SECONDS"""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], is_speech.astype(np.int8), [0]))))
+    starts, ends = edges[0::2] * FRAME_SECONDS, edges[1::2] * FRAME_SECONDS
+    long_enough = ends - starts >= MIN_SPEECH_SECONDS
+    starts, ends = starts[long_enough], ends[long_enough]
+    if not len(starts):
+        return []
+    starts = np.maximum(starts - PAD_SECONDS, 0.0)
+    ends = np.minimum(ends + PAD_SECONDS, duration)
+    # A gap long enough to cut starts a new segment; shorter gaps are absorbed
+    breaks = np.flatnonzero(starts[1:] - ends[:-1] >= MIN_SILENCE_SECONDS)
+    merged_starts = starts[np.concatenate(([0], breaks + 1))]
+    merged_ends = ends[np.concatenate((breaks, [len(ends) - 1]))]
+    return [(float(start), float(end)) for start, end in zip(merged_starts, merged_ends)]
+
+
+class TimeMap:
+    """Maps times in the condensed (speech-only) audio back to the original recording"""
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.condensed_starts = []
+        position = 0.0
+        for start, end in segments:
+            self.condensed_starts.append(position)
+            position += end - start
+        self.duration = position
+
+    @classmethod
+    def from_list(cls, rows):
+        """Rebuild a TimeMap from to_list() output, e.g. the time_map of a stored VAD report"""
+        return cls([(start, end) for _, start, end in rows])
+
+    def to_original(self, seconds):
+        if not self.segments:
+            return seconds
+        i = max(bisect.bisect_right(self.condensed_starts, seconds) - 1, 0)
+        start, end = self.segments[i]
+        return min(start + seconds - self.condensed_starts[i], end)
+
+    def to_list(self):
+        """[condensed start, original start, original end] per kept segment"""
+        return [[round(condensed, 3), round(start, 3), round(end, 3)]
+                for condensed, (start, end) in zip(self.condensed_starts, self.segments)]
+
+
+def detect_speech(audio_path):
+    """Analyse audio_path in blocks; returns (speech segments in seconds, duration in seconds)"""
+    energy, zcr = [], []
+    total_samples = 0
+    for samples in pcm_blocks(audio_path):
+        total_samples += len(samples)
+        block_energy, block_zcr = frame_features(samples)
+        energy.append(block_energy)
+        zcr.append(block_zcr)
+    duration = total_samples / SAMPLE_RATE
+    if not energy:
+        return [], duration
+    is_speech = speech_frames(np.concatenate(energy), np.concatenate(zcr))
+    return speech_segments(is_speech, duration), duration
+
+
+def write_segments(audio_path, segments, output_path, profile=None):
+    """Decode audio_path again and encode only the samples inside segments to output_path"""
+    bounds = [(int(start * SAMPLE_RATE), int(end * SAMPLE_RATE)) for start, end in segments]
+    encoder = subprocess.Popen(
+        ['ffmpeg', '-v', 'error', '-f', 's16le', '-ar', str(SAMPLE_RATE), '-ac', '1', '-i', 'pipe:0',
+         *get_profile(profile)['args'], '-y', output_path],
+        stdin=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    offset = 0
+    try:
+        for samples in pcm_blocks(audio_path):
+            block_end = offset + len(samples)
+            for start, end in bounds:
+                if end <= offset or start >= block_end:
+                    continue
+                kept = samples[max(start - offset, 0):min(end, block_end) - offset]
+                encoder.stdin.write((kept * 32768.0).astype('<i2').tobytes())
+            offset = block_end
+        encoder.stdin.close()
+    except BaseException:
+        encoder.kill()
+        encoder.wait()
+        raise
+    stderr = encoder.stderr.read().decode('utf-8', 'replace')
+    if encoder.wait() != 0:
+        raise Exception(f"Error writing speech-only audio: {' '.join(stderr.splitlines()[-3:])}")
+
+
+def strip_silence(audio_path, output_path, profile=None):
+    """
+    Write the speech in audio_path to output_path, leaving out non-speech
+    stretches of MIN_SILENCE_SECONDS or more.
+
+    Returns a report: original and speech seconds, how much was removed and
+    the TimeMap that turns condensed times back into original ones. If less
+    than MIN_SAVED_SECONDS would be removed nothing is written and
+    report['applied'] is False; transcribe the original instead.
+    """
+    start_time = time.time()
+    segments, duration = detect_speech(audio_path)
+    time_map = TimeMap(segments)
+    removed = max(duration - time_map.duration, 0.0)
+    applied = bool(segments) and removed >= MIN_SAVED_SECONDS
+    if applied:
+        write_segments(audio_path, segments, output_path, profile)
+    report = {
+        "applied": applied,
+        "original_seconds": round(duration, 2),
+        "speech_seconds": round(time_map.duration if applied else duration, 2),
+        "removed_seconds": round(removed if applied else 0.0, 2),
+        "removed_percent": round(100 * removed / duration, 1) if applied and duration else 0.0,
+        "segments": len(segments),
+        "vad_ms": int((time.time() - start_time) * 1000),
+    }
+    logger.info(f"Voice detection kept {report['speech_seconds']:.1f}s of {duration:.1f}s "
+                f"in {len(segments)} segments ({report['vad_ms']}ms)")
+    return report, time_map if applied else None